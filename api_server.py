@@ -16,16 +16,23 @@ import uuid
 import mimetypes
 import hashlib
 import hmac
-from typing import List, Union, Any
+import math
+import secrets
+from typing import List, Union, Any, NamedTuple
 
 import json
-from collections import OrderedDict
+from collections import OrderedDict, deque
 from datetime import datetime, timezone
 from email.utils import parsedate_to_datetime, format_datetime
+from urllib.parse import quote
 import time
 from contextlib import asynccontextmanager
 import random
 import asyncio
+import contextvars
+import fcntl
+import threading
+import weakref
 from concurrent.futures import ThreadPoolExecutor
 import uvloop
 asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
@@ -36,15 +43,18 @@ from pyrogram import errors
 from pyrogram.types import Message
 from pyrogram.enums import MessageMediaType
 from fastapi import FastAPI, HTTPException, Response, Request
-from fastapi.responses import HTMLResponse, FileResponse, JSONResponse
+from fastapi.responses import HTMLResponse, FileResponse, JSONResponse, StreamingResponse
 from telegram_client import (
     TelegramClient,
+    STREAM_CHUNK_SIZE,
     safe_get_rich_message,
     get_rich_part_fetch_attempt_count,
     get_rich_part_fetch_failed_count,
 )
+from tg_file_id import file_dc_id
 from config import get_settings, setup_logging
-from rss_generator import generate_channel_rss, generate_channel_html, get_render_failed_count
+from rss_generator import (generate_channel_rss, generate_channel_html, get_render_failed_count, get_fragment_cache_stats,
+                           feed_history_limit, render_fingerprint, shutdown_render_pool)
 import rich_tree
 from kurigram_compat import (
     get_rich_msg_parse_failed_count,
@@ -52,18 +62,32 @@ from kurigram_compat import (
     get_rich_part_seen_count,
     has_parse_failures,
 )
-from post_parser import PostParser
+from post_parser import PostParser, set_new_media_callback
 from url_signer import verify_media_digest
-from file_io import (DB_PATH, init_db_sync, get_all_media_file_ids_sync,
-                     update_media_file_access_sync, update_media_file_access_bulk_sync,
-                     remove_media_file_ids_sync, remove_media_file_ids_if_unchanged_sync,
-                     get_mime_type_sync, set_mime_type_sync)
-from tg_cache import cleanup_legacy_cache_files, sweep_tgcache
+from file_io import (DB_PATH, init_db_sync, write_async, submit_write,
+                     get_expired_media_file_ids_sync, get_pending_media_file_ids_sync,
+                     get_stale_cache_files_sync, get_cache_stats_sync,
+                     get_budget_cache_files_sync, rebuild_cache_index_sync,
+                     record_cache_files_sync, _op_record_cache_files,
+                     update_media_file_access_sync, _op_update_media_file_access_bulk,
+                     remove_media_file_ids_if_unchanged_sync, _op_remove_media_file_ids,
+                     _op_remove_media_file_ids_if_unchanged, _op_set_media_on_disk_bulk,
+                     get_mime_type_sync, _op_set_mime_type,
+                     _op_save_download_failures, load_download_failures_sync,
+                     get_media_file_ref_sync, get_media_dc_ids_sync, _op_set_media_file_ref,
+                     _op_enqueue_downloads, get_download_queue_sync, _op_dequeue_downloads,
+                     _op_prune_download_queue)
+from tg_cache import cleanup_legacy_cache_files, sweep_tgcache, history_snapshot_token
 from channel_key import canonical_channel_key
+import media_chunks
+import media_preview
+import tg_bandwidth
 from migrate_channel_keys import migrate_channel_keys_sync
 
 # Global python-magic instance for MIME type detection
 magic_mime = magic.Magic(mime=True)
+# Bytes of a finished download handed to python-magic (matches the tee head buffer).
+_MIME_SNIFF_BYTES = 8192
 
 # Media cache on-disk layout. Resolved once at import so every producer/consumer of the
 # cache agrees on the exact same absolute path format instead of re-deriving it inline.
@@ -82,10 +106,214 @@ def media_cache_path(channel: str, post_id: int, file_unique_id: str | None = No
     return path
 
 
+# Content-addressed blob store (MEDIA_BLOB_STORE). file_unique_id is globally unique in
+# Telegram, so the per-post cache files of a reposted / cross-posted file are all hardlinks
+# of ONE blob: a new location is linked from the blob instead of downloaded again, and the
+# bytes stay on disk exactly once. The blob root sits next to the cache root (not inside
+# it), so the cache walks and the on-disk file index never see the blobs themselves.
+_BLOB_KEY_RE = re.compile(r"[A-Za-z0-9_-]+")
+
+
+def media_blob_path(file_unique_id: str) -> str | None:
+    """<blobs>/<fid[:2]>/<fid>, or None for an id that is not a plain Telegram unique id."""
+    if not _BLOB_KEY_RE.fullmatch(file_unique_id or ""):
+        return None
+    return os.path.join(os.path.dirname(MEDIA_CACHE_DIR), "blobs", file_unique_id[:2], file_unique_id)
+
+
+def _link_from_blob_sync(file_unique_id: str, cache_path: str) -> bool:
+    """Materialise `cache_path` as a hardlink of the file's blob. False if there is no usable blob."""
+    blob = media_blob_path(file_unique_id)
+    if blob is None:
+        return False
+    size = _stat_size_or_none(blob)
+    if not size:
+        return False
+    os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+    try:
+        os.link(blob, cache_path)
+    except FileExistsError:
+        # A concurrent download/link published it first: just as good — unless it is a
+        # zero-size leftover, which the regular path below cleans up and re-fetches.
+        return bool(_stat_size_or_none(cache_path))
+    except OSError as e:
+        logger.warning(f"blob_link_failed: {blob} -> {cache_path}: {e}")
+        return False
+    return True
+
+
+def _publish_blob_sync(file_unique_id: str, cache_path: str) -> None:
+    """Register a freshly downloaded cache file in the blob store (best-effort)."""
+    blob = media_blob_path(file_unique_id)
+    if blob is None or os.path.exists(blob):
+        return
+    try:
+        os.makedirs(os.path.dirname(blob), exist_ok=True)
+        os.link(cache_path, blob)
+    except FileExistsError:
+        pass
+    except OSError as e:
+        logger.warning(f"blob_publish_failed: {cache_path} -> {blob}: {e}")
+
+
+def _sweep_orphan_blobs_sync() -> int:
+    """Remove blobs no cache path links to any more (link count 1) and empty prefix dirs."""
+    blob_root = os.path.join(os.path.dirname(MEDIA_CACHE_DIR), "blobs")
+    removed = 0
+    for root, _dirs, files in os.walk(blob_root, topdown=False):
+        for name in files:
+            path = os.path.join(root, name)
+            try:
+                if os.stat(path).st_nlink <= 1:
+                    os.remove(path)
+                    removed += 1
+            except OSError as e:
+                logger.debug(f"blob_sweep: skipping {path}: {e}")
+        if os.path.abspath(root) != os.path.abspath(blob_root):
+            try:
+                if not os.listdir(root):
+                    os.rmdir(root)
+            except OSError:
+                pass
+    if removed:
+        logger.info(f"blob_sweep: removed {removed} unreferenced blobs")
+    return removed
+
+
+def _drop_orphan_blob_sync(file_unique_id: str) -> int:
+    """Remove the blob of a just-removed cache file if nothing links to it any more."""
+    blob = media_blob_path(file_unique_id)
+    if blob is None:
+        return 0
+    try:
+        if os.stat(blob).st_nlink > 1:
+            return 0
+        os.remove(blob)
+    except OSError:
+        return 0
+    try:
+        os.rmdir(os.path.dirname(blob))
+    except OSError:
+        pass  # other blobs share the prefix dir
+    return 1
+
+
+# On-disk file index (SQLite cache_files, see file_io._init_cache_index). Every file under
+# the cache dir is recorded with its kind, size and inode when it is published and dropped
+# when it is removed, so /health reads trigger-maintained aggregates and the sweeper finds
+# stale temp/partial files by query instead of walking the tree. Index writes are
+# best-effort: a failed one only skews the stats until the next startup reconcile walk.
+_PARTIAL_NAME_RE = re.compile(r'^.+\.(part|tmp)\.[0-9a-f]{32}$')
+
+
+def _cache_file_kind(name: str) -> str:
+    """Classify a cache file name: final / temp / part / resume / chunks / preview / lock."""
+    if RESUME_SUFFIX in name:
+        return "resume"  # resumable large-video partial or its sidecar
+    if name.startswith(media_chunks.CHUNK_FILE_PREFIX):
+        return "chunks"  # Range part cache: data file, bitmap, bitmap replace temps
+    # The partial-download suffixes: `.part.{32 hex}` and the legacy `.tmp.{32 hex}`.
+    if _PARTIAL_NAME_RE.match(name):
+        return "part"
+    if name.startswith("temp_"):
+        return "temp"
+    if media_preview.is_preview_name(name):
+        return "preview"  # resized derivative, see get_media_preview
+    if name.endswith(DOWNLOAD_LOCK_SUFFIX):
+        return "lock"  # cross-process download lock, see _download_single_flight
+    return "final"
+
+
+def _cache_index_entry(cache_dir: str, path: str, st: os.stat_result | None = None) -> tuple | None:
+    """(path, channel, kind, size, inode, mtime) index row for a cache file; None if it is gone."""
+    try:
+        st = st or os.stat(path)
+    except OSError:
+        return None
+    rel = os.path.relpath(path, cache_dir)
+    return (rel, rel.split(os.sep, 1)[0], _cache_file_kind(os.path.basename(path)),
+            st.st_size, f"{st.st_dev}:{st.st_ino}", st.st_mtime)
+
+
+def _update_cache_index_sync(add_paths=(), remove_paths=(), cache_dir: str | None = None,
+                             wait: bool = True) -> None:
+    """Record published files in / drop removed files from the on-disk index (best-effort).
+
+    Every publish and removal passes through here, so the hot metadata index (_media_meta)
+    is kept in step too: removed files are forgotten first, published ones remembered.
+    With wait=False the index write is queued on the writer thread without waiting for its
+    commit (for the rare caller on the event loop).
+    """
+    cache_dir = cache_dir or MEDIA_CACHE_DIR
+    _forget_media_meta(_media_meta_key(cache_dir, p) for p in remove_paths)
+    epoch = _media_meta_epoch
+    try:
+        add = []
+        for path in add_paths:
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            add.append(_cache_index_entry(cache_dir, path, st))
+            key = _media_meta_key(cache_dir, path)
+            if key is not None:
+                _remember_media_meta(key, path, st, _mime_types.get(key), epoch)
+        remove = [os.path.relpath(p, cache_dir) for p in remove_paths]
+        if wait:
+            record_cache_files_sync(DB_PATH, add, remove)
+        else:
+            def _report(fut) -> None:
+                if fut.exception() is not None:
+                    logger.warning(f"cache_index: update failed: {fut.exception()}")
+            submit_write(DB_PATH, _op_record_cache_files, add, remove).add_done_callback(_report)
+    except Exception as e:
+        logger.warning(f"cache_index: update failed: {e}")
+
+
+def reconcile_cache_index_sync(cache_dir: str) -> int:
+    """Walk the cache dir once and reconcile the on-disk index with what is really there.
+
+    Run at startup: it records files left by a previous process (crash leftovers, caches
+    older than the index) and heals any drift, then removes empty dirs and orphan blobs.
+    Returns the number of files indexed.
+    """
+    started = time.time()
+    entries = []
+    for root, _dirs, files in os.walk(cache_dir):
+        for name in files:
+            entry = _cache_index_entry(cache_dir, os.path.join(root, name))
+            if entry is not None:
+                entries.append(entry)
+    rebuild_cache_index_sync(DB_PATH, entries, started)
+    _remove_empty_dirs_sync(cache_dir)
+    _sweep_orphan_blobs_sync()
+    return len(entries)
+
+
 # MIME types are immutable per file_unique_id, so a process-lifetime dict in front of
-# SQLite removes a to_thread + connect from every cache-hit response.
-_mime_types: dict[tuple[str, int, str], str] = {}
-_MIME_CACHE_MAX = 50_000  # crude bound; clear-all on overflow is fine at this size
+# SQLite removes a to_thread + connect from every cache-hit response. LRU-bounded: an
+# overflow evicts the coldest key instead of wiping the hot working set.
+_mime_types: "OrderedDict[tuple[str, int, str], str]" = OrderedDict()
+_MIME_CACHE_MAX = 50_000
+
+
+def _remember_mime(media_key: tuple[str, int, str], media_type: str) -> None:
+    _mime_types[media_key] = media_type
+    _mime_types.move_to_end(media_key)
+    while len(_mime_types) > _MIME_CACHE_MAX:
+        _mime_types.popitem(last=False)
+
+# Headers of every media body we serve (200 and 206, file or pass-through stream).
+#   - X-Content-Type-Options: nosniff makes our declared content type authoritative so the
+#     browser won't re-sniff an octet-stream/image body as HTML.
+#   - Content-Security-Policy sandboxes the response as defense-in-depth.
+# Files are addressed by file_unique_id which is immutable in Telegram, so it is safe to
+# cache them aggressively on the client side.
+_MEDIA_RESPONSE_HEADERS = {
+    "Cache-Control": "public, max-age=86400, immutable",
+    "X-Content-Type-Options": "nosniff",
+    "Content-Security-Policy": "sandbox; default-src 'none'",
+}
 
 # Content types safe to serve INLINE from our own origin. The media URL carries the feed's
 # TOKEN, so serving active content (HTML/SVG/etc.) inline here would be stored XSS with
@@ -168,16 +396,10 @@ if not logger.handlers: pass
 client = TelegramClient()
 Config = get_settings()
 HTTP_DOWNLOAD_SEMAPHORE = asyncio.Semaphore(3)  # semaphore for live HTTP media requests
-BACKGROUND_DOWNLOAD_SEMAPHORE = asyncio.Semaphore(2)  # semaphore for background cache worker
-download_queue = asyncio.Queue(maxsize=100)
-# Keys currently enqueued for (or being processed by) the background download worker.
-# download_new_files re-scans the whole media table every sweep and, under a FloodWait,
-# the worker drains slowly — without this guard the SAME not-yet-downloaded file gets
-# re-enqueued on every pass, flooding the queue with duplicates. The event loop is
-# single-threaded and every check/mutation below runs with no await in between, so a plain
-# set is race-free: download_new_files adds the key before put_nowait; the worker discards
-# it in its finally alongside task_done().
-_queued_media: set[tuple[str, int, str]] = set()
+BACKGROUND_DOWNLOAD_CONCURRENCY = 2  # initial background slots (see _AdaptiveDownloadSlots)
+# Set whenever downloads are queued; the background worker waits on it once the persistent
+# download queue (SQLite download_queue table) is drained.
+_download_queue_ready = asyncio.Event()
 def _env_int(name: str, default: int, minimum: int = 0) -> int:
     """Parse an int env var for a module-level tunable; fall back to default on absence/garbage."""
     raw = os.getenv(name)
@@ -189,6 +411,245 @@ def _env_int(name: str, default: int, minimum: int = 0) -> int:
         logger.warning(f"{name} must be an integer, got {raw!r}; using default {default}")
         return default
 
+# --- Adaptive background download slots ---------------------------------------
+# The background worker's download concurrency used to be a hand-picked constant, paced by
+# a fixed 2s pause. It is now sized by AIMD from what every download (live or background)
+# observes on the media DC: a transfer that keeps up with the running per-download rate
+# adds 1/slots of a slot (one slot per window of good transfers), a download timeout halves
+# the slots and a FloodWait drops them to one. Caching thus speeds up while the DC is
+# healthy and backs off at the first timeout, well before a note_download_timeout streak
+# forces a restart. The ceiling keeps MEDIA_BG_INTERACTIVE_RESERVE of Pyrogram's
+# tg_max_concurrent_transmissions free for readers' /media downloads.
+_BG_INTERACTIVE_RESERVE = Config["media_bg_interactive_reserve"]
+_BG_SLOTS_MAX = max(1, Config["tg_max_concurrent_transmissions"] - _BG_INTERACTIVE_RESERVE)
+_AIMD_RATE_MIN_BYTES = 256 * 1024  # smaller transfers are latency-bound: no rate sample
+_AIMD_RATE_ALPHA = 0.2             # EWMA weight of a new per-download rate sample
+_AIMD_SLOW_FRACTION = 0.5          # a transfer below this share of the EWMA rate adds nothing
+_BG_PAUSE_MIN, _BG_PAUSE_MAX = 0.5, 2.0  # worker pause between batches, at the ceiling / at one slot
+
+
+class _AdaptiveDownloadSlots:
+    """AIMD-sized permits for background downloads, usable like the asyncio.Semaphore it replaces.
+
+    `limit` moves between 1 and `ceiling`; a lower limit takes effect as running downloads
+    release their permits. Loop-thread only, no lock. Waiter futures are created on the
+    running loop at acquire time, so the module-level instance is not bound to one loop.
+    """
+
+    def __init__(self, initial: int, ceiling: int):
+        self.ceiling = max(1, ceiling)
+        self.limit = float(min(max(1, initial), self.ceiling))
+        self.active = 0
+        self.rate: float | None = None  # EWMA of per-download bytes/s
+        self._waiters: "deque[asyncio.Future]" = deque()
+
+    @property
+    def slots(self) -> int:
+        return int(self.limit)
+
+    async def acquire(self) -> bool:
+        if not self._waiters and self.active < self.slots:
+            self.active += 1
+            return True
+        fut = asyncio.get_running_loop().create_future()
+        self._waiters.append(fut)
+        try:
+            await fut
+        except asyncio.CancelledError:
+            if fut.done() and not fut.cancelled():
+                self.release()  # the permit was granted just as the waiter gave up
+            raise
+        finally:
+            if fut in self._waiters:
+                self._waiters.remove(fut)
+        return True
+
+    def release(self) -> None:
+        self.active -= 1
+        self._wake()
+
+    def _wake(self) -> None:
+        while self._waiters and self.active < self.slots:
+            fut = self._waiters.popleft()
+            if not fut.done():
+                self.active += 1
+                fut.set_result(True)
+
+    def _set_limit(self, limit: float, reason: str) -> None:
+        old = self.slots
+        self.limit = min(max(1.0, limit), float(self.ceiling))
+        if self.slots != old:
+            logger.info(f"bg_download_slots: {old} -> {self.slots} ({reason})")
+            self._wake()
+
+    def on_transfer(self, nbytes: int, elapsed: float) -> None:
+        """A download finished: grow additively unless its throughput fell behind."""
+        if nbytes >= _AIMD_RATE_MIN_BYTES and elapsed > 0:
+            sample = nbytes / elapsed
+            slow = self.rate is not None and sample < self.rate * _AIMD_SLOW_FRACTION
+            self.rate = sample if self.rate is None else self.rate + _AIMD_RATE_ALPHA * (sample - self.rate)
+            if slow:
+                return  # more parallel downloads no longer add throughput: hold
+        self._set_limit(self.limit + 1.0 / self.limit, "transfers healthy")
+
+    def on_timeout(self) -> None:
+        self._set_limit(self.limit / 2, "download timeout")
+
+    def on_flood_wait(self) -> None:
+        self._set_limit(1.0, "flood wait")
+
+    def pause(self) -> float:
+        """Worker pause between batches: the full 2s at one slot, shorter as slots grow."""
+        if self.ceiling <= 1:
+            return _BG_PAUSE_MAX
+        health = (self.limit - 1.0) / (self.ceiling - 1)
+        return _BG_PAUSE_MAX - (_BG_PAUSE_MAX - _BG_PAUSE_MIN) * health
+
+
+# Background downloads take their permit here (the name predates the adaptive sizing).
+BACKGROUND_DOWNLOAD_SEMAPHORE = _AdaptiveDownloadSlots(BACKGROUND_DOWNLOAD_CONCURRENCY, _BG_SLOTS_MAX)
+
+# --- Hot media metadata index -------------------------------------------------
+# A repeat /media hit used to pay a stat in get_media, another in prepare_file_response
+# and a MIME lookup before FileResponse could start. This LRU keeps, per
+# (channel, post_id, file_unique_id), the published path with its stat (size, mtime — what
+# FileResponse derives Content-Length/ETag/Last-Modified from) and the resolved MIME type,
+# so a hot hit is answered with no thread-pool hop at all. Entries are remembered when a
+# file is published (via _update_cache_index_sync) and on the first serve, and forgotten by
+# every removal path, which all go through _update_cache_index_sync as well. Sweeper
+# threads mutate it, hence the lock. Config media_meta_cache_entries (MEDIA_META_CACHE_ENTRIES);
+# 0 disables.
+class _MediaMeta(NamedTuple):
+    path: str
+    stat: os.stat_result
+    mime: str | None
+
+
+_MEDIA_META_MAX = Config["media_meta_cache_entries"]
+_media_meta: "OrderedDict[tuple[str, int, str], _MediaMeta]" = OrderedDict()
+_media_meta_lock = threading.Lock()
+# Bumped by every forget. A stat taken before a concurrent removal must not be remembered
+# after it, so writers capture the epoch before their stat and drop the entry if it moved.
+_media_meta_epoch = 0
+
+
+def _media_meta_key(cache_dir: str, path: str) -> tuple[str, int, str] | None:
+    """The media key of a final or temp_ cache file path; None for anything else."""
+    parts = os.path.relpath(path, cache_dir).split(os.sep)
+    if len(parts) != 3 or not parts[1].isdigit():
+        return None
+    kind = _cache_file_kind(parts[2])
+    if kind == "final":
+        return parts[0], int(parts[1]), parts[2]
+    if kind == "temp":
+        return parts[0], int(parts[1]), parts[2][5:]  # strip 'temp_'
+    return None
+
+
+def _media_meta_lookup(media_key: tuple[str, int, str], path: str | None = None) -> _MediaMeta | None:
+    """The indexed metadata for media_key (at `path`, if given), or None to take the slow path."""
+    with _media_meta_lock:
+        meta = _media_meta.get(media_key)
+        if meta is None or (path is not None and meta.path != path):
+            return None
+        _media_meta.move_to_end(media_key)
+    # A viewed temp_* file is due for its keepalive touch: let prepare_file_response do it.
+    if (os.path.basename(meta.path).startswith("temp_")
+            and time.time() - meta.stat.st_mtime > TEMP_MTIME_REFRESH_INTERVAL):
+        return None
+    return meta
+
+
+def _remember_media_meta(media_key: tuple[str, int, str], path: str, st: os.stat_result,
+                         mime: str | None, epoch: int) -> None:
+    if _MEDIA_META_MAX <= 0 or st.st_size <= 0:
+        return
+    with _media_meta_lock:
+        if epoch != _media_meta_epoch:
+            return  # something was removed since the stat; it may have been this file
+        _media_meta[media_key] = _MediaMeta(path, st, mime)
+        _media_meta.move_to_end(media_key)
+        while len(_media_meta) > _MEDIA_META_MAX:
+            _media_meta.popitem(last=False)
+
+
+def _forget_media_meta(media_keys) -> None:
+    global _media_meta_epoch
+    media_keys = [k for k in media_keys if k is not None]
+    if not media_keys:
+        return
+    with _media_meta_lock:
+        _media_meta_epoch += 1
+        for media_key in media_keys:
+            _media_meta.pop(media_key, None)
+            _drop_media_bytes_locked(media_key)
+
+
+# --- RAM tier for small hot media ---------------------------------------------
+# Most /media hits are small files (sticker webp, small photos) requested again and again
+# per feed load. Their bytes are kept in a byte-budgeted LRU next to the metadata index, so
+# a hit sends them from memory: no open/read/close, and FileResponse's own header, ETag and
+# Range logic (see _MemoryFileResponse). A file is loaded by an executor job scheduled from
+# its first hot hit (that hit still reads the file), and dropped by _forget_media_meta with
+# its metadata, i.e. by every sweeper/removal path. An entry only answers while it matches
+# the indexed path and mtime. Guarded by _media_meta_lock. Config media_ram_tier_file_kb
+# and media_ram_tier_mb; 0 disables either way.
+_MEDIA_RAM_FILE_MAX = Config["media_ram_tier_file_kb"] * 1024
+_MEDIA_RAM_BUDGET = Config["media_ram_tier_mb"] * 1024 * 1024
+_media_bytes: "OrderedDict[tuple[str, int, str], tuple[str, float, bytes]]" = OrderedDict()
+_media_bytes_size = 0
+_media_bytes_loading: set = set()
+
+
+def _drop_media_bytes_locked(media_key: tuple[str, int, str]) -> None:
+    global _media_bytes_size
+    entry = _media_bytes.pop(media_key, None)
+    if entry is not None:
+        _media_bytes_size -= len(entry[2])
+
+
+def _media_bytes_lookup(media_key: tuple[str, int, str], meta: _MediaMeta) -> bytes | None:
+    """The resident bytes of an indexed file, or None (scheduling a load if it qualifies)."""
+    if _MEDIA_RAM_BUDGET <= 0 or not 0 < meta.stat.st_size <= _MEDIA_RAM_FILE_MAX:
+        return None
+    with _media_meta_lock:
+        entry = _media_bytes.get(media_key)
+        if entry is not None and entry[0] == meta.path and entry[1] == meta.stat.st_mtime:
+            _media_bytes.move_to_end(media_key)
+            return entry[2]
+        if media_key in _media_bytes_loading:
+            return None
+        _media_bytes_loading.add(media_key)
+        epoch = _media_meta_epoch
+    try:
+        asyncio.get_running_loop().run_in_executor(None, _load_media_bytes_sync, media_key, meta, epoch)
+    except RuntimeError:
+        with _media_meta_lock:
+            _media_bytes_loading.discard(media_key)
+    return None
+
+
+def _load_media_bytes_sync(media_key: tuple[str, int, str], meta: _MediaMeta, epoch: int) -> None:
+    global _media_bytes_size
+    try:
+        with open(meta.path, "rb") as f:
+            data = f.read(_MEDIA_RAM_FILE_MAX + 1)
+    except OSError:
+        data = None
+    with _media_meta_lock:
+        _media_bytes_loading.discard(media_key)
+        # A removal since the lookup may have been this file; a size mismatch means the
+        # file is not the one that was indexed.
+        if data is None or epoch != _media_meta_epoch or len(data) != meta.stat.st_size:
+            return
+        _drop_media_bytes_locked(media_key)
+        _media_bytes[media_key] = (meta.path, meta.stat.st_mtime, data)
+        _media_bytes_size += len(data)
+        while _media_bytes_size > _MEDIA_RAM_BUDGET:
+            _key, (_path, _mtime, evicted) = _media_bytes.popitem(last=False)
+            _media_bytes_size -= len(evicted)
+
+
 # --- Failing-download backoff (negative cache) --------------------------------
 # A media file whose download keeps failing (hang/timeout/not-found) must not be
 # retried on every cache sweep (cache_sweep_interval, default 900s), nor keep
@@ -218,6 +679,24 @@ _DOWNLOAD_BACKOFF_MAX = float(max(
 # survives until success/restart, so a recreated-then-refailing row is dropped again
 # quickly. See _drop_media_row.
 _DOWNLOAD_FAILURES_DROP_ROW = _env_int("MEDIA_FAILURES_DROP_ROW", 15, minimum=1)
+# Cached media unused (media_file_ids.added) for longer than this is evicted by the sweeper.
+MEDIA_CACHE_MAX_AGE_DAYS = 20
+# Rows per SQLite page in the incremental sweep (expired rows, not-yet-on-disk rows).
+_SWEEP_BATCH_ROWS = Config["media_sweep_batch_rows"]
+# Queue items the background worker drains per batch (one get_messages per channel in it;
+# Telegram resolves at most 100 message ids per call).
+_BG_BATCH_MAX = Config["media_bg_batch_max"]
+# Rows kept in the persistent download queue; the lowest-priority ones beyond it are dropped.
+_DOWNLOAD_QUEUE_MAX = Config["media_download_queue_max"]
+# Priority bonus, in seconds of post recency, per doubling of a channel's feed poll count
+# (see _download_priority): a feed polled every 10 minutes outranks a day-newer post of a
+# channel nobody reads.
+_FEED_POPULARITY_WEIGHT = Config["media_queue_popularity_weight"]
+# Feed polls decay with this half-life, so popularity follows what readers poll now.
+_FEED_POLL_HALF_LIFE = 86400
+_FEED_POLLS_MAX = 10000
+# canonical channel -> (decayed poll count, monotonic time of the last poll)
+_feed_polls: "OrderedDict[str, tuple[float, float]]" = OrderedDict()
 # LRU cap on the negative cache. Permanently-404 / deleted files would otherwise leave
 # eternal entries and slowly leak memory on a long-uptime process. We keep at most this
 # many most-recently-failed keys and evict the oldest. Eviction is harmless: a dropped
@@ -230,6 +709,12 @@ _DOWNLOAD_FAILURES_MAX = 10000
 # retrying) or 'transient' (throttle/timeout/DC issue -> 503 + Retry-After). OrderedDict so
 # we can evict in least-recently-updated order once the LRU cap is exceeded.
 _download_failures: "OrderedDict[tuple[str, int, str], tuple[int, float, str]]" = OrderedDict()
+# Write-behind to SQLite (table download_failures) so a deploy or crash does not forget
+# which files are dead and re-attempt every one of them. Keys changed since the last flush
+# (recorded, cleared, or LRU-evicted) and a pending clear-all; flushed by _access_flush_loop
+# and on shutdown, reloaded in lifespan before the background workers start.
+_failures_dirty: set[tuple[str, int, str]] = set()
+_failures_clear_pending = False
 
 def _download_backoff_remaining(key: tuple[str, int, str]) -> float:
     """Seconds until `key` may be retried; 0.0 if allowed now (or never failed)."""
@@ -256,12 +741,15 @@ def _record_download_failure(key: tuple[str, int, str], kind: str = "transient")
     backoff = min(_DOWNLOAD_BACKOFF_MAX, _DOWNLOAD_BACKOFF_BASE * (2 ** (fails - 1)))
     _download_failures[key] = (fails, time.monotonic() + backoff, kind)
     _download_failures.move_to_end(key)  # mark as most-recently-updated for LRU eviction
+    _failures_dirty.add(key)
     # Bound memory (see _DOWNLOAD_FAILURES_MAX): evict the oldest entries beyond the cap.
     while len(_download_failures) > _DOWNLOAD_FAILURES_MAX:
-        _download_failures.popitem(last=False)
+        evicted, _ = _download_failures.popitem(last=False)
+        _failures_dirty.add(evicted)  # dropped from SQLite too on the next flush
     logger.warning(f"download_backoff_armed: {key[0]}/{key[1]}/{key[2]} failed {fails}x, next retry in {backoff:.0f}s")
     # Drop a persistently-dead row from SQLite so the sweeper stops re-queueing it forever.
-    if fails >= _DOWNLOAD_FAILURES_DROP_ROW:
+    # A poster's backoff (keyed by its preview name, see _render_poster) has no row.
+    if fails >= _DOWNLOAD_FAILURES_DROP_ROW and not media_preview.is_preview_name(key[2]):
         _drop_media_row(key)
 
 # Strong refs to fire-and-forget row-drop tasks so they are not GC'd mid-flight.
@@ -270,8 +758,8 @@ _drop_row_tasks: set[asyncio.Task] = set()
 def _drop_media_row(key: tuple[str, int, str]) -> None:
     """Fire-and-forget removal of a persistently-failing media row from SQLite.
 
-    _record_download_failure runs synchronously on the event loop; remove_media_file_ids_sync
-    is a blocking sqlite call, so we schedule it via to_thread and do NOT await it (strict
+    _record_download_failure runs synchronously on the event loop, so the remove_media_file_ids
+    write is scheduled as a task through write_async and NOT awaited (strict
     durability is unnecessary — the counter in _download_failures survives, so a re-added row
     that keeps failing is dropped again). Skipped when no loop is running (a sync unit test),
     where there is nothing to schedule onto."""
@@ -283,8 +771,8 @@ def _drop_media_row(key: tuple[str, int, str]) -> None:
 
     async def _do():
         try:
-            await asyncio.to_thread(
-                remove_media_file_ids_sync, DB_PATH, [(channel, post_id, file_unique_id)]
+            await write_async(
+                _op_remove_media_file_ids, DB_PATH, [(channel, post_id, file_unique_id)]
             )
             logger.warning(
                 f"download_row_dropped: {channel}/{post_id}/{file_unique_id} removed from SQLite "
@@ -300,6 +788,7 @@ def _drop_media_row(key: tuple[str, int, str]) -> None:
 def _clear_download_failure(key: tuple[str, int, str]) -> None:
     """Forget any recorded failure for `key` after a successful download."""
     if _download_failures.pop(key, None) is not None:
+        _failures_dirty.add(key)
         logger.info(f"download_backoff_cleared: {key[0]}/{key[1]}/{key[2]} recovered")
 
 def _clear_all_download_failures() -> None:
@@ -312,11 +801,55 @@ def _clear_all_download_failures() -> None:
     it could not self-heal until the backoff expired — defeating the self-heal's purpose.
     The retry-storm risk if the restart did not actually help is bounded: each re-download is
     timeout-bounded and simply re-arms its backoff."""
+    global _failures_clear_pending
     n = len(_download_failures)
     _download_failures.clear()
+    _failures_dirty.clear()
+    _failures_clear_pending = True  # the persisted copy is dropped on the next flush
     if n:
         logger.warning(f"download_backoff_cleared_all: dropped {n} entries after verified self-heal restart")
 
+async def _flush_download_failures() -> None:
+    """Write the negative-cache changes since the last flush to SQLite in one batch.
+
+    Snapshot-then-clear on the loop, like _flush_access_updates. Deadlines are monotonic in
+    memory and stored as wall-clock time, so they survive a restart. On failure the batch is
+    re-queued (a key re-dirtied meanwhile is simply written with its fresher state).
+    """
+    global _failures_dirty, _failures_clear_pending
+    if not _failures_dirty and not _failures_clear_pending:
+        return
+    dirty, clear = _failures_dirty, _failures_clear_pending
+    _failures_dirty, _failures_clear_pending = set(), False
+    now_wall, now_mono = time.time(), time.monotonic()
+    removes = [key for key in dirty if key not in _download_failures]
+    # Walk in LRU order; a microsecond step keeps that order within one batch, so the
+    # reload (ordered by `updated`) evicts the same keys this process would have.
+    upserts = []
+    for key, (fails, retry_not_before, kind) in _download_failures.items():
+        if key in dirty:
+            upserts.append((*key, fails, now_wall + retry_not_before - now_mono, kind,
+                            now_wall + len(upserts) * 1e-6))
+    try:
+        await write_async(_op_save_download_failures, DB_PATH, upserts, removes, clear)
+    except Exception:
+        _failures_dirty |= dirty
+        _failures_clear_pending = _failures_clear_pending or clear
+        raise
+
+
+async def _load_download_failures() -> int:
+    """Restore the persisted negative cache (most recent _DOWNLOAD_FAILURES_MAX entries)."""
+    rows = await asyncio.to_thread(load_download_failures_sync, DB_PATH, _DOWNLOAD_FAILURES_MAX)
+    now_wall, now_mono = time.time(), time.monotonic()
+    for row in rows:
+        key = (str(row['channel']), int(row['post_id']), str(row['file_unique_id']))
+        _download_failures[key] = (int(row['fails']), now_mono + row['retry_at'] - now_wall, row['kind'])
+        _download_failures.move_to_end(key)
+    if rows:
+        logger.info(f"download_backoff_restored: {len(rows)} entries from SQLite")
+    return len(rows)
+
 # --------------------------------------------------------------------------- #
 # Rich part=True re-fetch memo for the /media download cascade (#86).
 # --------------------------------------------------------------------------- #
@@ -397,6 +930,56 @@ _inflight: dict[tuple[str, int, str], asyncio.Future] = {}
 # Strong refs to detached download tasks so they are not garbage-collected mid-flight.
 _inflight_tasks: set[asyncio.Task] = set()
 
+
+class _TeeDownload:
+    """Progress of one pass-through (tee) download, shared by every reader of its key.
+
+    The downloader appends chunks to `part_path` and bumps `written` only AFTER the bytes
+    were flushed to the OS, so any reader may read [0, written) from its own fd. `finish()`
+    marks the end (with the error, if any) and wakes everyone. Loop-thread only, no lock.
+    """
+
+    def __init__(self, final_path: str | None = None):
+        self.final_path = final_path
+        self.part_path: str | None = None
+        self.written = 0
+        self.head = b""            # first chunk, for MIME sniffing before the file is complete
+        self.finished = False
+        self.error: BaseException | None = None
+        self._changed = asyncio.Event()
+
+    def _notify(self) -> None:
+        changed, self._changed = self._changed, asyncio.Event()
+        changed.set()
+
+    def feed(self, chunk: bytes) -> None:
+        if not self.head:
+            self.head = bytes(chunk[:_MIME_SNIFF_BYTES])
+        self.written += len(chunk)
+        self._notify()
+
+    def finish(self, error: BaseException | None = None) -> None:
+        self.finished = True
+        self.error = error
+        self._notify()
+
+    async def wait_changed(self, timeout: float) -> None:
+        await asyncio.wait_for(self._changed.wait(), timeout=timeout)
+
+
+# Pass-through downloads by dedup key; present only while the key's runner is alive and was
+# started in tee mode (MEDIA_STREAM_PASSTHROUGH, non-Range request). The runner publishes its
+# tee through _current_tee so _download_atomic picks it up without widening every signature
+# between them.
+_inflight_tees: dict[tuple[str, int, str], _TeeDownload] = {}
+_current_tee: "contextvars.ContextVar[_TeeDownload | None]" = contextvars.ContextVar("_current_tee", default=None)
+# Bandwidth class of each running download (see tg_bandwidth). Starts as background for a
+# BACKGROUND_DOWNLOAD_SEMAPHORE download; a reader joining it promotes it in place.
+_inflight_priority: dict[tuple[str, int, str], tg_bandwidth.DownloadPriority] = {}
+# Messages resolved in bulk by background_download_worker for its current channel batch,
+# keyed (channel, post_id); download_media_file uses one instead of its own get_messages.
+_prefetched_messages: "contextvars.ContextVar[dict | None]" = contextvars.ContextVar("_prefetched_messages", default=None)
+
 async def _supervised(factory, name: str, min_restart_interval: float = 60.0):
     """Run factory() forever, restarting it if it dies with a non-cancellation error.
 
@@ -457,7 +1040,7 @@ async def _flush_access_updates() -> None:
     entries = [(channel, post_id, file_unique_id, added)
                for (channel, post_id, file_unique_id), added in pending.items()]
     try:
-        await asyncio.to_thread(update_media_file_access_bulk_sync, DB_PATH, entries)
+        await write_async(_op_update_media_file_access_bulk, DB_PATH, entries)
     except Exception:
         # Bulk write failed: re-queue this batch so the access-times are not lost (a lost
         # timestamp would eventually evict a still-used file from the 20-day cache). Use
@@ -470,7 +1053,7 @@ async def _flush_access_updates() -> None:
 
 
 async def _access_flush_loop() -> None:
-    """Periodically flush the access-time accumulator (runs under _supervised)."""
+    """Periodically flush the access-time accumulator and the negative cache (runs under _supervised)."""
     while True:
         await asyncio.sleep(ACCESS_FLUSH_INTERVAL)
         try:
@@ -479,6 +1062,10 @@ async def _access_flush_loop() -> None:
             # Log and keep looping: a transient SQLite error must not drop the batch's
             # successors. (_supervised still restarts us if this ever raises out.)
             logger.error(f"access_flush_error: {e}")
+        try:
+            await _flush_download_failures()
+        except Exception as e:
+            logger.error(f"download_failures_flush_error: {e}")
 
 
 @asynccontextmanager
@@ -516,11 +1103,28 @@ async def lifespan(_: FastAPI):
         except OSError as e:
             logger.warning(f"legacy_media_file_ids_remove_error: {e}")
 
+    # Restore the download negative cache BEFORE the sweeper and the worker start, so dead
+    # files stay in backoff across a deploy instead of all being re-attempted at once.
+    try:
+        await _load_download_failures()
+    except Exception as e:
+        logger.warning(f"download_backoff_restore_error: {e}")
+
     # Wire the self-heal restart -> negative-cache clear hook. telegram_client owns the
     # restart; the negative cache lives here. Registering a plain callback (rather than
     # importing api_server from telegram_client) keeps the dependency one-way and avoids a
     # circular import. The hook fires ONLY on a verified restart — see _restart_client.
     client.set_restart_callback(_clear_all_download_failures)
+    # Same one-way hook for renders: media a feed shows for the first time is queued for
+    # download right away instead of on the next sweep.
+    set_new_media_callback(_queue_rendered_media)
+
+    # Seed the media keep-alive with the DCs of the stored file references, so its first
+    # pass already covers them rather than waiting for a download to re-learn them.
+    try:
+        client.note_media_dcs(await asyncio.to_thread(get_media_dc_ids_sync, DB_PATH))
+    except Exception as e:
+        logger.warning(f"media_keepalive: failed to load stored media DCs: {e}")
 
     await client.start()
     # Supervise the background tasks: if either dies (not via cancellation) it is logged
@@ -551,9 +1155,14 @@ async def lifespan(_: FastAPI):
         await _flush_access_updates()
     except Exception as e:
         logger.error(f"access_flush_shutdown_error: {e}")
+    try:
+        await _flush_download_failures()
+    except Exception as e:
+        logger.error(f"download_failures_flush_shutdown_error: {e}")
     await client.stop()
     # Shut the io threadpool down so its threads don't linger past a reload/restart.
     io_executor.shutdown(wait=False)
+    shutdown_render_pool()
 
 app = FastAPI(title="Pyrogram Bridge", lifespan=lifespan)
 app.add_middleware(RequestLoggingMiddleware)
@@ -568,6 +1177,12 @@ def mask_sensitive_value(input_str: str) -> str:
 
 if __name__ == "__main__":
     import uvicorn
+
+    # uvicorn imports this file again as the `api_server` module below; this __main__ copy
+    # only launches it. Without a __file__, multiprocessing no longer re-runs the script in
+    # every render-pool worker while preparing it (the forkserver preloads rss_generator,
+    # all a worker needs), so workers never build a second app and TelegramClient.
+    del __file__
     
     setup_logging(Config["log_level"])
     
@@ -730,6 +1345,25 @@ def _stat_size_or_none(path: str) -> int | None:
     return st.st_size
 
 
+def _stat_and_sniff_sync(path: str, head: bytes | None = None) -> tuple[int | None, str | None]:
+    """Size of a finished download partial and the MIME type sniffed from its first bytes.
+
+    `head` is the already-buffered first chunk of a streamed download; otherwise the head is
+    read from the file. A sniffing failure only costs the lazy detection on first serve.
+    """
+    size = _stat_size_or_none(path)
+    if not size:
+        return size, None
+    try:
+        if not head:
+            with open(path, "rb") as f:
+                head = f.read(_MIME_SNIFF_BYTES)
+        return size, magic_mime.from_buffer(head)
+    except Exception as e:
+        logger.warning(f"Failed to determine MIME type of {path} using python-magic: {str(e)}")
+        return size, None
+
+
 async def prepare_file_response(file_path: str, request: Request,
                                 media_key: tuple[str, int, str] | None = None) -> Response:
     """Serve a cached media file via Starlette's FileResponse.
@@ -742,6 +1376,14 @@ async def prepare_file_response(file_path: str, request: Request,
     # `request` is unused now that FileResponse parses the Range header itself, but the
     # signature is kept for call-site compatibility (and future needs).
 
+    # Hot path: the metadata index already holds this file's stat and MIME type, so the
+    # response is built with no thread-pool hop. It only answers for a file it saw published
+    # or served at this very path, and every removal path forgets the entry first.
+    meta = _media_meta_lookup(media_key, file_path) if media_key is not None else None
+    if meta is not None and meta.mime:
+        return _cached_file_response(file_path, meta.stat, meta.mime, _media_bytes_lookup(media_key, meta))
+    epoch = _media_meta_epoch
+
     # Keep an actively-viewed large-video temp file alive: refresh its mtime so the 1h
     # sweeper (which deletes temp_* by mtime) won't remove it out from under a viewer.
     # DEBOUNCED: FileResponse derives ETag/Last-Modified from mtime, so touching on EVERY
@@ -749,7 +1391,7 @@ async def prepare_file_response(file_path: str, request: Request,
     # already older than TEMP_MTIME_REFRESH_INTERVAL — far below the 1h sweeper window, so
     # the file stays alive, and the ETag is stable within any such window (a view running
     # longer than one interval costs at most one safe 200 If-Range restart per interval).
-    if os.path.basename(file_path).startswith("temp_"):
+    if meta is None and os.path.basename(file_path).startswith("temp_"):
         try:
             age = time.time() - await asyncio.to_thread(os.path.getmtime, file_path)
             if age > TEMP_MTIME_REFRESH_INTERVAL:
@@ -767,10 +1409,13 @@ async def prepare_file_response(file_path: str, request: Request,
     # ACCEPTED RISK: this stat->open race window is very narrow, and for temp_* files it is
     # further mitigated by the mtime keepalive touch above (an actively-viewed large video is
     # refreshed away from the 1h sweeper's deletion window). Deliberately not fixed.
-    try:
-        stat_result = await asyncio.to_thread(os.stat, file_path)
-    except FileNotFoundError:
-        raise HTTPException(status_code=404, detail="File not found")
+    if meta is not None:
+        stat_result = meta.stat  # indexed at publish; only the MIME type is still unknown
+    else:
+        try:
+            stat_result = await asyncio.to_thread(os.stat, file_path)
+        except FileNotFoundError:
+            raise HTTPException(status_code=404, detail="File not found")
 
     media_type: str | None = None
 
@@ -779,14 +1424,14 @@ async def prepare_file_response(file_path: str, request: Request,
         # hit here serves the response with no to_thread hop and no SQLite connection at all.
         channel_key, post_id_key, file_unique_id_key = media_key
         media_type = _mime_types.get(media_key)
-        if not media_type:
+        if media_type:
+            _mime_types.move_to_end(media_key)
+        else:
             # Dict miss — consult the SQLite type cache (still avoids python-magic I/O).
             media_type = await asyncio.to_thread(get_mime_type_sync, DB_PATH, channel_key, post_id_key, file_unique_id_key)
             if media_type:
                 # Populate the dict so the next request skips the to_thread + connect.
-                if len(_mime_types) >= _MIME_CACHE_MAX:
-                    _mime_types.clear()
-                _mime_types[media_key] = media_type
+                _remember_mime(media_key, media_type)
 
     if not media_type:
         # Cache miss or no media_key — detect with python-magic in a thread to avoid blocking the event loop
@@ -799,29 +1444,46 @@ async def prepare_file_response(file_path: str, request: Request,
         # Persist the detected MIME type so the next request can skip python-magic — into
         # BOTH the SQLite type cache and the in-memory dict.
         if media_type and media_key is not None:
-            await asyncio.to_thread(set_mime_type_sync, DB_PATH, channel_key, post_id_key, file_unique_id_key, media_type)
-            if len(_mime_types) >= _MIME_CACHE_MAX:
-                _mime_types.clear()
-            _mime_types[media_key] = media_type
+            await write_async(_op_set_mime_type, DB_PATH, channel_key, post_id_key, file_unique_id_key, media_type)
+            _remember_mime(media_key, media_type)
 
     if not media_type: media_type, _ = mimetypes.guess_type(file_path)  # Fallback to mimetypes if python-magic failed
     if not media_type: media_type = "application/octet-stream"  # Final fallback to octet-stream
 
     logger.debug(f"Determined media type for {os.path.basename(file_path)}: {media_type}")
+    if media_key is not None:
+        _remember_media_meta(media_key, file_path, stat_result, media_type, epoch)
+    return _cached_file_response(file_path, stat_result, media_type)
+
+
+def _cached_file_response(file_path: str, stat_result: os.stat_result, media_type: str,
+                          body: bytes | None = None) -> Response:
+    """Build the FileResponse for a cached file from its stat and resolved MIME type.
 
+    `body` is the file's content from the RAM tier: it is then sent from memory.
+    """
     # SECURITY: decide the RESPONSE content type from an allowlist, NOT from the sniffed
-    # `media_type` above (which stays as the value persisted to the MIME cache). If magic
+    # `media_type` (which stays as the value persisted to the MIME cache). If magic
     # sniffed attacker-influenced bytes as text/html or image/svg+xml, echoing that type
     # inline from our own origin — the origin whose URL carries the feed TOKEN — is stored
     # XSS. So: an allowlisted passive type is served inline with that exact type; anything
     # else (text/html, image/svg+xml, application/*, anything script-capable) is served as
     # a neutralized download instead of being refused, since media must stay retrievable.
-    if media_type in _INLINE_SAFE_CONTENT_TYPES:
-        response_media_type = media_type
-        disposition = "inline"
-    else:
-        response_media_type = "application/octet-stream"
-        disposition = "attachment"
+    response_media_type, disposition = _response_content_type(media_type)
+    if body is not None:
+        return _MemoryFileResponse(
+            body,
+            file_path,
+            media_type=response_media_type,
+            filename=os.path.basename(file_path),
+            content_disposition_type=disposition,
+            stat_result=stat_result,
+            headers=dict(_MEDIA_RESPONSE_HEADERS),
+        )
+    if Config["media_accel_redirect"]:
+        accel = _accel_redirect_response(file_path, response_media_type, disposition)
+        if accel is not None:
+            return accel
 
     # FileResponse handles Range/If-Range/206/416/multipart and sets
     # Accept-Ranges/ETag/Last-Modified itself (from the stat_result we pass). Do NOT
@@ -835,26 +1497,328 @@ async def prepare_file_response(file_path: str, request: Request,
     # this headers= dict) on both the 200 start and every 206 start, only overriding
     # content-range/content-length. (The 400 malformed-range and 416 unsatisfiable paths
     # build a fresh PlainTextResponse WITHOUT these headers, but neither serves a body, so
-    # there is no sniffable content to protect there.)
-    #   - X-Content-Type-Options: nosniff makes our declared content type authoritative so
-    #     the browser won't re-sniff an octet-stream/image body as HTML.
-    #   - Content-Security-Policy sandboxes the response as defense-in-depth.
-    #
-    # Files are addressed by file_unique_id which is immutable in Telegram, so it is safe
-    # to cache them aggressively on the client side.
+    # there is no sniffable content to protect there.) See _MEDIA_RESPONSE_HEADERS.
     return FileResponse(
         file_path,
         media_type=response_media_type,
         filename=os.path.basename(file_path),
         content_disposition_type=disposition,
         stat_result=stat_result,
-        headers={
-            "Cache-Control": "public, max-age=86400, immutable",
-            "X-Content-Type-Options": "nosniff",
-            "Content-Security-Policy": "sandbox; default-src 'none'",
-        },
+        headers=dict(_MEDIA_RESPONSE_HEADERS),
     )
 
+
+class _MemoryFileResponse(FileResponse):
+    """A FileResponse whose content is already in memory (the RAM tier).
+
+    Headers, ETag/Last-Modified, If-Range and Range parsing are FileResponse's own, from
+    the same stat_result, so a resident file answers byte- and header-identically to one
+    read from disk; only the three send paths below take their bytes from `data`.
+    """
+
+    def __init__(self, data: bytes, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.data = data
+
+    async def _handle_simple(self, send, send_header_only: bool) -> None:
+        await send({"type": "http.response.start", "status": self.status_code, "headers": self.raw_headers})
+        await send({"type": "http.response.body", "body": b"" if send_header_only else self.data, "more_body": False})
+
+    async def _handle_single_range(self, send, start: int, end: int, file_size: int, send_header_only: bool) -> None:
+        self.headers["content-range"] = f"bytes {start}-{end - 1}/{file_size}"
+        self.headers["content-length"] = str(end - start)
+        await send({"type": "http.response.start", "status": 206, "headers": self.raw_headers})
+        await send({"type": "http.response.body", "body": b"" if send_header_only else self.data[start:end], "more_body": False})
+
+    async def _handle_multiple_ranges(self, send, ranges: list[tuple[int, int]], file_size: int,
+                                      send_header_only: bool) -> None:
+        boundary = secrets.token_hex(13)
+        content_length, header_generator = self.generate_multipart(
+            ranges, boundary, file_size, self.headers["content-type"])
+        self.headers["content-range"] = f"multipart/byteranges; boundary={boundary}"
+        self.headers["content-length"] = str(content_length)
+        await send({"type": "http.response.start", "status": 206, "headers": self.raw_headers})
+        if send_header_only:
+            await send({"type": "http.response.body", "body": b"", "more_body": False})
+            return
+        parts = [header_generator(start, end) + self.data[start:end] + b"\n" for start, end in ranges]
+        parts.append(f"\n--{boundary}--\n".encode("latin-1"))
+        await send({"type": "http.response.body", "body": b"".join(parts), "more_body": False})
+
+
+def _accel_redirect_response(file_path: str, media_type: str, disposition: str) -> Response | None:
+    """Hand the body of a cached file to the reverse proxy (MEDIA_ACCEL_REDIRECT).
+
+    Everything up to here ran as usual (digest, backoff, MIME allowlist); only the bytes
+    move out of the event loop. The proxy serves the file from disk and does its own
+    Range/ETag/Last-Modified handling. nginx gets an internal URI under MEDIA_ACCEL_PREFIX,
+    "sendfile" proxies the absolute path. Returns None for a file outside the cache dir,
+    which is then served by FileResponse as before.
+    """
+    filename = os.path.basename(file_path)
+    # Same Content-Disposition form FileResponse would build (RFC 5987 for non-ASCII).
+    quoted_name = quote(filename)
+    if quoted_name != filename:
+        content_disposition = f"{disposition}; filename*=utf-8''{quoted_name}"
+    else:
+        content_disposition = f'{disposition}; filename="{filename}"'
+    headers = {**_MEDIA_RESPONSE_HEADERS, "Content-Disposition": content_disposition}
+    if Config["media_accel_redirect"] == "nginx":
+        rel = os.path.relpath(file_path, MEDIA_CACHE_DIR)
+        if rel == os.curdir or rel.startswith(os.pardir):
+            return None
+        prefix = Config["media_accel_prefix"].rstrip("/")
+        headers["X-Accel-Redirect"] = f"{prefix}/{quote(rel.replace(os.sep, '/'))}"
+    else:
+        headers["X-Sendfile"] = os.path.abspath(file_path)
+    return Response(media_type=media_type, headers=headers)
+
+
+def _response_content_type(media_type: str) -> tuple[str, str]:
+    """Map a sniffed MIME type to the (response content type, disposition) actually served.
+
+    Allowlisted passive types go out inline as-is; everything else is neutralized to an
+    octet-stream attachment (see the SECURITY note in prepare_file_response).
+    """
+    if media_type in _INLINE_SAFE_CONTENT_TYPES:
+        return media_type, "inline"
+    return "application/octet-stream", "attachment"
+
+
+async def _tee_body(tee: _TeeDownload, waiter_timeout: float):
+    """Yield the bytes of a pass-through download as they land on disk.
+
+    The partial is opened once; if the download already renamed it away, the published
+    final file (identical bytes) is read instead. An open fd survives the rename and the
+    race-loser unlink, so the reader never loses its file mid-stream. A failed download
+    raises here, which aborts the chunked response — the reader sees a truncated transfer,
+    never a short "complete" file.
+    """
+    def _open():
+        try:
+            return open(tee.part_path, "rb")
+        except FileNotFoundError:
+            return open(tee.final_path, "rb")
+
+    f = await asyncio.to_thread(_open)
+    sent = 0
+    try:
+        while True:
+            if sent < tee.written:
+                data = await asyncio.to_thread(f.read, tee.written - sent)
+                if not data:
+                    raise OSError(f"pass-through source {tee.part_path} shrank at byte {sent}")
+                sent += len(data)
+                yield data
+                continue
+            if tee.finished:
+                if tee.error is not None:
+                    raise tee.error
+                return
+            await tee.wait_changed(waiter_timeout)
+    finally:
+        await asyncio.to_thread(f.close)
+
+
+async def _passthrough_response(tee: _TeeDownload, media_key: tuple[str, int, str]) -> Response | None:
+    """Start streaming a still-running tee download, or None to fall back to the full file.
+
+    Waits for the first chunk. If the download finished (or failed) before any byte could be
+    streamed, the caller awaits the shared Future as usual: a complete file is better served
+    by FileResponse (Content-Length, ranges), and failures keep their normal status mapping.
+    """
+    waiter_timeout = _media_waiter_timeout()
+    while tee.written == 0 and not tee.finished:
+        await tee.wait_changed(waiter_timeout)
+    if tee.finished:
+        return None
+    media_type = _mime_types.get(media_key)
+    if not media_type:
+        try:
+            media_type = await asyncio.to_thread(magic_mime.from_buffer, tee.head)
+        except Exception as e:
+            logger.warning(f"Failed to determine MIME type of the stream head using python-magic: {str(e)}")
+    if not media_type: media_type = "application/octet-stream"
+    response_media_type, disposition = _response_content_type(media_type)
+    headers = dict(_MEDIA_RESPONSE_HEADERS)
+    headers["Content-Disposition"] = f'{disposition}; filename="{os.path.basename(tee.final_path)}"'
+    logger.info(f"media_passthrough: streaming {media_key[0]}/{media_key[1]}/{media_key[2]} while downloading ({response_media_type})")
+    return StreamingResponse(_tee_body(tee, waiter_timeout), media_type=response_media_type, headers=headers)
+
+
+# --------------------------------------------------------------------------- #
+# Range-on-demand for large videos (MEDIA_LARGE_VIDEO_RANGES)
+#
+# A >100MB video is otherwise downloaded whole into temp_<fid> before any Range request can
+# be answered. In this mode a single-range request is mapped onto Telegram's 1 MiB file
+# parts and only the covered parts are fetched, into a sparse media_chunks.ChunkStore next
+# to where temp_<fid> would live. The sweeper expires chunks_* like temp_* (1h idle).
+# --------------------------------------------------------------------------- #
+# Parts fetched per Telegram round-trip when a requested part is missing (readahead for
+# the sequential reads a playing video makes).
+_RANGE_FETCH_CHUNKS = Config["media_range_fetch_chunks"]
+# (file_id, size, mime) per key, so seeks don't re-fetch the message. file_id carries a
+# file_reference that Telegram expires, hence the TTL. Loop-thread only.
+_LARGE_VIDEO_META_TTL = 1800.0
+_LARGE_VIDEO_META_MAX = 1024
+_large_video_meta: "OrderedDict[tuple[str, int, str], tuple[float, tuple[str, int, str | None] | None]]" = OrderedDict()
+# One fetch at a time per video; entries vanish with their last user.
+_range_locks: "weakref.WeakValueDictionary[tuple[str, int, str], asyncio.Lock]" = weakref.WeakValueDictionary()
+
+
+def _large_video_info(message: Message, file_unique_id: str) -> tuple[int, str | None] | None:
+    """(file_size, mime_type) if download_media_file would take the temp_ large-video path."""
+    video = message.video
+    if video:
+        size = getattr(video, 'file_size', None)
+        if isinstance(size, int) and size > 100 * 1024 * 1024:
+            return size, getattr(video, 'mime_type', None)
+        return None
+    size = _rich_large_video_size(message, file_unique_id)
+    if size is None:
+        return None
+    mime = next((getattr(o, 'mime_type', None) for o in rich_tree.iter_media_objects(message.rich_message)
+                 if getattr(o, 'file_unique_id', None) == file_unique_id), None)
+    return size, mime
+
+
+async def _resolve_large_video(channel: str, post_id: int, file_unique_id: str) -> tuple[str, int, str | None] | None:
+    """(file_id, size, mime) of a large video, or None when the media is not one.
+
+    A deleted post / unknown fid also yields None: the normal download path then produces
+    its usual 404 (and row cleanup), so the error handling lives in one place. Media with a
+    stored file reference is answered without the message RPC: the renderer only records
+    media <=100MB, so it is never a large video.
+    """
+    key = (channel, post_id, file_unique_id)
+    hit = _large_video_meta.get(key)
+    if hit is not None and hit[0] > time.monotonic():
+        _large_video_meta.move_to_end(key)
+        return hit[1]
+    try:
+        stored_file_id = await asyncio.to_thread(get_media_file_ref_sync, DB_PATH, channel, post_id, file_unique_id)
+    except Exception as e:
+        logger.warning(f"file_ref_lookup_failed: {channel}/{post_id}/{file_unique_id}: {e}")
+        stored_file_id = None
+    meta = None
+    message = None
+    if not stored_file_id:
+        channel_id: Union[str, int] = int(channel) if channel.startswith('-100') else channel
+        message = await client.safe_get_messages(channel_id, post_id)
+    if message and not getattr(message, 'empty', False):
+        info = _large_video_info(message, file_unique_id)
+        if info is not None:
+            file_id = await find_file_id_in_message(message, file_unique_id)
+            if file_id:
+                meta = (file_id, info[0], info[1])
+    _large_video_meta[key] = (time.monotonic() + _LARGE_VIDEO_META_TTL, meta)
+    _large_video_meta.move_to_end(key)
+    while len(_large_video_meta) > _LARGE_VIDEO_META_MAX:
+        _large_video_meta.popitem(last=False)
+    return meta
+
+
+def _open_chunk_store(channel: str, post_id: int, file_unique_id: str, size: int) -> media_chunks.ChunkStore:
+    store = media_chunks.ChunkStore(media_cache_path(channel, post_id), file_unique_id, size).load()
+    store.touch()  # keep a video that is being watched away from the 1h sweeper
+    return store
+
+
+async def _fetch_range_parts(key: tuple[str, int, str], file_id: str, index: int, run: int) -> list:
+    """safe_get_chunks for `run` parts from `index`, re-resolving an expired file reference once.
+
+    The cached (file_id, size, mime) outlives the file_reference inside file_id whenever
+    Telegram expires it before _LARGE_VIDEO_META_TTL; drop it and fetch the message again
+    instead of failing every seek until the entry ages out.
+    """
+    timeout = _media_download_timeout(run * media_chunks.CHUNK_SIZE)
+    hit = _large_video_meta.get(key)
+    if hit is not None and hit[1] is not None:
+        file_id = hit[1][0]  # a body that started streaming before a re-resolve
+    try:
+        return await client.safe_get_chunks(file_id, index, run, timeout=timeout)
+    except _FILE_REFERENCE_ERRORS as e:
+        logger.info(f"file_reference_expired: {key[0]}/{key[1]}/{key[2]} ({type(e).__name__}), re-fetching the message")
+        _large_video_meta.pop(key, None)
+        meta = await _resolve_large_video(*key)
+        if meta is None:
+            raise
+    return await client.safe_get_chunks(meta[0], index, run, timeout=timeout)
+
+
+async def _range_part(store: media_chunks.ChunkStore, key: tuple[str, int, str], file_id: str, index: int) -> None:
+    """Make sure part `index` is on disk, fetching it (plus readahead) if it is missing."""
+    if store.has(index):
+        return
+    lock = _range_locks.get(key)
+    if lock is None:
+        lock = _range_locks[key] = asyncio.Lock()
+    async with lock:
+        await asyncio.to_thread(store.load)  # another request may have fetched it meanwhile
+        run = store.missing_run(index, _RANGE_FETCH_CHUNKS)
+        if run == 0:
+            return
+        try:
+            await asyncio.wait_for(HTTP_DOWNLOAD_SEMAPHORE.acquire(), timeout=30)
+        except asyncio.TimeoutError:
+            raise DownloadAdmissionTimeout("download admission timed out")
+        try:
+            parts = await _fetch_range_parts(key, file_id, index, run)
+        finally:
+            HTTP_DOWNLOAD_SEMAPHORE.release()
+        if not parts:
+            raise ZeroSizeFileError(f"No data for part {index} of {key[0]}/{key[1]}/{key[2]}")
+        for offset, data in enumerate(parts):
+            await asyncio.to_thread(store.write, index + offset, data)
+        await asyncio.to_thread(_update_cache_index_sync, [store.data_path, store.map_path])
+        logger.info(f"media_range_fetch: {key[0]}/{key[1]}/{key[2]} parts {index}..{index + len(parts) - 1}")
+
+
+async def _range_slice(store, key, file_id, index: int, start: int, end: int) -> bytes:
+    """Bytes [start, end] (inclusive, absolute offsets) that fall into part `index`."""
+    await _range_part(store, key, file_id, index)
+    part_start = index * media_chunks.CHUNK_SIZE
+    lo = max(start, part_start) - part_start
+    hi = min(end + 1, part_start + media_chunks.CHUNK_SIZE) - part_start
+    return await asyncio.to_thread(store.read, index, lo, hi)
+
+
+async def _range_body(store, key, file_id, start: int, end: int, first: bytes):
+    yield first
+    for index in range(start // media_chunks.CHUNK_SIZE + 1, end // media_chunks.CHUNK_SIZE + 1):
+        yield await _range_slice(store, key, file_id, index, start, end)
+
+
+async def _large_video_range_response(channel: str, post_id: int, file_unique_id: str,
+                                      range_header: str) -> Response | None:
+    """206 for a single Range on a large video from the part cache, or None to use the normal path.
+
+    The FIRST part is fetched before the response starts, so Telegram errors (FloodWait,
+    RPC, timeout) still map to proper status codes in get_media; later parts are fetched
+    lazily while the body streams — a player that seeks away simply disconnects.
+    """
+    meta = await _resolve_large_video(channel, post_id, file_unique_id)
+    if meta is None:
+        return None
+    file_id, size, mime = meta
+    byte_range = media_chunks.parse_range(range_header, size)
+    if byte_range is None:
+        return None
+    start, end = byte_range
+    key = (channel, post_id, file_unique_id)
+    store = await asyncio.to_thread(_open_chunk_store, channel, post_id, file_unique_id, size)
+    first = await _range_slice(store, key, file_id, start // media_chunks.CHUNK_SIZE, start, end)
+    response_media_type, disposition = _response_content_type(mime or "application/octet-stream")
+    headers = dict(_MEDIA_RESPONSE_HEADERS)
+    headers.update({
+        "Accept-Ranges": "bytes",
+        "Content-Range": f"bytes {start}-{end}/{size}",
+        "Content-Length": str(end - start + 1),
+        "Content-Disposition": f'{disposition}; filename="temp_{file_unique_id}"',
+    })
+    return StreamingResponse(_range_body(store, key, file_id, start, end, first), status_code=206,
+                             media_type=response_media_type, headers=headers)
+
 def _media_download_timeout(file_size: int) -> float:
     """Scale the download timeout with file size.
 
@@ -879,29 +1843,46 @@ async def _download_atomic(file_id: str, final_path: str, timeout: float) -> str
     os.rename (atomic on POSIX). The finally block ALWAYS removes our partial (on timeout,
     cancel, zero-size, or losing a rename race), so no stub is ever served or left behind.
 
+    In tee mode (a _TeeDownload is bound to this task via _current_tee) the bytes are
+    streamed into the same partial with safe_stream_media and announced chunk by chunk, so
+    readers serve them before the rename; the publish/cleanup rules are unchanged.
+
     Raises ZeroSizeFileError if the download produced a missing/zero-size file.
     """
     part_path = f"{final_path}.part.{uuid.uuid4().hex}"
+    tee = _current_tee.get()
     # Create the cache dir here, immediately before writing the partial — NOT up-front in
     # download_media_file / download_new_files. That way an item that never actually
     # downloads (permanently-dead file) never leaves an empty dir behind for the sweeper's
     # os.walk to trip over, and this self-heals a race with the sweeper's empty-dir rmdir
     # (which could run between an earlier makedirs and this open).
     await asyncio.to_thread(os.makedirs, os.path.dirname(part_path), exist_ok=True)
+    started = time.monotonic()
     try:
-        await client.safe_download_media(file_id, part_path, timeout=timeout)
+        if tee is not None:
+            tee.final_path = final_path
+            tee.part_path = part_path
+            await client.safe_stream_media(file_id, part_path, tee.feed, timeout=timeout)
+        else:
+            await client.safe_download_media(file_id, part_path, timeout=timeout)
         # Single off-loop stat: missing OR zero-size is a failed download (semantics kept).
-        part_size = await asyncio.to_thread(_stat_size_or_none, part_path)
+        # The same hop sniffs the MIME type from the first bytes (the tee's buffered head
+        # when streaming), so the first serve needs neither libmagic nor a type-cache write.
+        part_size, media_type = await asyncio.to_thread(
+            _stat_and_sniff_sync, part_path, tee.head if tee is not None else None)
         if part_size is None or part_size == 0:
             raise ZeroSizeFileError(
                 f"Downloaded file for {final_path} is zero size or missing after download attempt."
             )
+        BACKGROUND_DOWNLOAD_SEMAPHORE.on_transfer(part_size, time.monotonic() - started)
         # Publish atomically, but only if nobody else already produced the final file
         # (a concurrent request that won the race). rename is atomic on POSIX. The
         # rename-only-if-final-absent guard is preserved exactly; only its stat + rename
         # now run off the event loop.
         if not await asyncio.to_thread(os.path.exists, final_path):
             await asyncio.to_thread(os.rename, part_path, final_path)
+            await _record_download_mime(final_path, media_type)
+            await asyncio.to_thread(_update_cache_index_sync, [final_path])
         return final_path
     finally:
         # Always clean up our partial: timeout, cancellation, zero-size, or race loser
@@ -913,59 +1894,326 @@ async def _download_atomic(file_id: str, final_path: str, timeout: float) -> str
                 logger.warning(f"cleanup_error: Failed to remove partial file {part_path}: {e}")
 
 
-async def _download_deduped(channel: Union[str, int], post_id: int, file_unique_id: str,
-                            semaphore: asyncio.Semaphore) -> Union[str, None]:
-    """Deduplicate concurrent downloads of the same media by (channel, post_id, fid).
+async def _record_download_mime(final_path: str, media_type: str | None) -> None:
+    """Cache and persist the MIME type sniffed at download time (best-effort).
 
-    The first request for a key runs download_media_file in a DETACHED task and shares its
-    Future; concurrent requests await the same Future (bounded by wait_for). The detached
-    task sets the Future's result/exception (on success/failure) and its finally ALWAYS
-    pops the key — so both happen before the task ends: a completed Future never leaves the
-    key stuck, and a client disconnect (cancelling only the awaiting request coroutine) can
-    neither cancel the download nor hang other waiters.
+    Runs before the publish is indexed, so the hot metadata entry is complete from the
+    start. A missing media row (never rendered) simply leaves the UPDATE a no-op.
+    """
+    media_key = _media_meta_key(MEDIA_CACHE_DIR, final_path) if media_type else None
+    if media_key is None:
+        return
+    _remember_mime(media_key, media_type)
+    try:
+        await write_async(_op_set_mime_type, DB_PATH, *media_key, media_type)
+    except Exception as e:
+        logger.warning(f"Failed to persist MIME type for {final_path}: {str(e)}")
 
-    The live-download permit (`semaphore`) is acquired INSIDE the detached runner, so ONE
-    live download holds exactly ONE permit regardless of how many requests wait on the
-    shared Future — N concurrent requests for the same file no longer burn N permits. The
-    acquire is bounded (30s): on saturation the runner resolves the Future with a
-    DownloadAdmissionTimeout (server-busy, mapped to 503 by the caller) instead of hanging.
-    An admission timeout is NOT a download failure, so it must NOT arm the backoff.
+
+# Resumable large-video partials: temp_<fid>.resume holds the bytes, temp_<fid>.resume.json
+# the identity + committed byte count. Kept across failures; the sweeper drops them only
+# after RESUME_PARTIAL_MAX_AGE without progress (far beyond the 1h temp_* window, so a
+# download in backoff keeps its progress).
+RESUME_SUFFIX = ".resume"
+RESUME_META_SUFFIX = ".resume.json"
+RESUME_PARTIAL_MAX_AGE = 24 * 3600
+# The sidecar is checkpointed every this many bytes while the partial streams in, so a
+# process that is killed outright (OOM, SIGKILL, container stop) loses at most this much.
+RESUME_CHECKPOINT_BYTES = 16 * STREAM_CHUNK_SIZE
+_resume_locks: "weakref.WeakValueDictionary[str, asyncio.Lock]" = weakref.WeakValueDictionary()
+
+
+def _resume_offset_sync(part_path: str, meta_path: str, file_unique_id: str, file_size: int) -> int:
+    """Bytes of a previous attempt that can be kept, floored to a whole part; 0 if unusable.
+
+    The sidecar is checkpointed only after the bytes it counts were written, so it may lag
+    the data file (by up to RESUME_CHECKPOINT_BYTES after a hard kill) but never lead it:
+    trusting the smaller of the two is always safe.
+    """
+    try:
+        with open(meta_path, "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        committed = int(meta.get("bytes", 0))
+    except (OSError, ValueError, TypeError, AttributeError):
+        return 0
+    if meta.get("file_unique_id") != file_unique_id or meta.get("size") != file_size:
+        return 0
+    done = min(committed, _stat_size_or_none(part_path) or 0)
+    return done - done % STREAM_CHUNK_SIZE
+
+
+def _write_resume_meta_sync(meta_path: str, file_unique_id: str, file_size: int, done: int) -> None:
+    tmp = f"{meta_path}.{uuid.uuid4().hex}"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump({"file_unique_id": file_unique_id, "size": file_size, "bytes": done}, f)
+    os.replace(tmp, meta_path)
+
+
+def _remove_quietly(*paths: str) -> None:
+    for path in paths:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            logger.warning(f"cleanup_error: Failed to remove {path}: {e}")
+
+
+async def _download_resumable(file_id: str, final_path: str, timeout: float,
+                              file_unique_id: str, file_size: int) -> str:
+    """Large-video variant of _download_atomic that keeps its progress across attempts.
+
+    The partial has a STABLE key-derived name, so an attempt that timed out, hit a restart
+    or died with the process is continued by the next one from the last complete 1 MiB part
+    (Telegram serves parts by offset). The publish rule is unchanged: the final name only
+    ever appears via os.rename of a complete file. Attempts on the same file are serialised
+    by a lock; a waiter that finds the file published simply returns it.
+
+    Raises ZeroSizeFileError if the finished partial is empty or not `file_size` bytes
+    (the partial is discarded so the next attempt starts clean).
+    """
+    part_path = final_path + RESUME_SUFFIX
+    meta_path = final_path + RESUME_META_SUFFIX
+    lock = _resume_locks.get(final_path)
+    if lock is None:
+        lock = _resume_locks[final_path] = asyncio.Lock()
+    async with lock:
+        final_size = await asyncio.to_thread(_stat_size_or_none, final_path)
+        if final_size:
+            return final_path
+        await asyncio.to_thread(os.makedirs, os.path.dirname(part_path), exist_ok=True)
+        resume_from = await asyncio.to_thread(_resume_offset_sync, part_path, meta_path, file_unique_id, file_size)
+        if resume_from:
+            logger.info(f"media_resume: {os.path.basename(final_path)} resuming at {resume_from}/{file_size} bytes")
+        done = resume_from
+        tee = _current_tee.get()
+        if tee is not None:
+            tee.final_path = final_path
+            tee.part_path = part_path
+            if resume_from:
+                def _read_head():
+                    with open(part_path, "rb") as f:
+                        return f.read(8192)
+                tee.head = await asyncio.to_thread(_read_head)
+                tee.written = resume_from
+
+        checkpointed = done
+        checkpoint: asyncio.Future | None = None  # the sidecar write in flight, at most one
+
+        def _on_chunk(chunk: bytes) -> None:
+            # Called on the loop after the chunk was written and flushed to the partial.
+            nonlocal done, checkpointed, checkpoint
+            done += len(chunk)
+            if tee is not None:
+                tee.feed(chunk)
+            if done - checkpointed >= RESUME_CHECKPOINT_BYTES and (checkpoint is None or checkpoint.done()):
+                checkpointed = done
+                checkpoint = asyncio.ensure_future(
+                    asyncio.to_thread(_write_resume_meta_sync, meta_path, file_unique_id, file_size, done))
+                checkpoint.add_done_callback(lambda f: f.cancelled() or f.exception())
+
+        started = time.monotonic()
+        try:
+            await client.safe_stream_media(file_id, part_path, _on_chunk, timeout=timeout, resume_from=resume_from)
+        except BaseException:
+            # Record how far we got (synchronously: this also runs on cancellation). A
+            # checkpoint still in flight can only replace it with a smaller count, which
+            # costs re-fetching a few parts, never a corrupt resume.
+            try:
+                _write_resume_meta_sync(meta_path, file_unique_id, file_size, done)
+                logger.info(f"media_resume: {os.path.basename(final_path)} kept {done}/{file_size} bytes for the next attempt")
+            except OSError as e:
+                logger.warning(f"media_resume: failed to record progress for {part_path}: {e}")
+            # Kept on disk for the next attempt: index it so the sweeper can age it out.
+            # Queued without waiting for the commit, which must not stall the loop here.
+            _update_cache_index_sync([part_path, meta_path], wait=False)
+            raise
+        if checkpoint is not None:
+            # Let the last checkpoint land before the sidecar is removed below.
+            await asyncio.wait([checkpoint])
+        part_size, media_type = await asyncio.to_thread(
+            _stat_and_sniff_sync, part_path, tee.head if tee is not None else None)
+        if not part_size or (file_size and part_size != file_size):
+            await asyncio.to_thread(_remove_quietly, part_path, meta_path)
+            await asyncio.to_thread(_update_cache_index_sync, (), [part_path, meta_path])
+            raise ZeroSizeFileError(
+                f"Downloaded file for {final_path} is {part_size or 0} bytes, expected {file_size}."
+            )
+        BACKGROUND_DOWNLOAD_SEMAPHORE.on_transfer(part_size - resume_from, time.monotonic() - started)
+        if not await asyncio.to_thread(os.path.exists, final_path):
+            await asyncio.to_thread(os.rename, part_path, final_path)
+        await asyncio.to_thread(_remove_quietly, part_path, meta_path)
+        await _record_download_mime(final_path, media_type)
+        await asyncio.to_thread(_update_cache_index_sync, [final_path], [part_path, meta_path])
+        return final_path
+
+
+# --- Cross-process download single-flight ---------------------------------------------
+# _inflight dedupes downloads within ONE process. Several bridge processes over one cache
+# dir (two instances, or uvicorn workers, on a shared data volume) additionally take an
+# fcntl.flock on <post_dir>/<fid>.lock around the Telegram download: whoever holds it
+# downloads, the others watch for the published file instead of downloading it again, and
+# take over only if the holder gives up without publishing. The kernel drops a flock with
+# its process, so a crashed holder never blocks anyone. The holder unlinks the lock file on
+# release; a lock taken on an already-unlinked inode is detected and retried.
+DOWNLOAD_LOCK_SUFFIX = ".lock"
+_DOWNLOAD_LOCK_POLL = 0.25  # seconds between checks while another process downloads
+
+
+def _try_download_lock_sync(lock_path: str) -> int | None:
+    """Take the download lock without blocking: the locked fd, or None if it is held."""
+    for _attempt in range(3):
+        os.makedirs(os.path.dirname(lock_path), exist_ok=True)
+        try:
+            fd = os.open(lock_path, os.O_RDWR | os.O_CREAT, 0o644)
+        except FileNotFoundError:
+            continue  # the sweeper removed the (empty) post dir in between
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            os.close(fd)
+            return None
+        try:
+            current = os.stat(lock_path).st_ino
+        except FileNotFoundError:
+            current = None
+        if current == os.fstat(fd).st_ino:
+            return fd
+        os.close(fd)  # locked an inode its holder had just unlinked: start over
+    return None
+
+
+def _release_download_lock_sync(lock_path: str, fd: int) -> None:
+    """Unlink the lock file, then drop the lock (unlinking first keeps the inode check sound).
+
+    A post dir emptied by a failed download is left to the sweeper's empty-dir pass, as
+    for a failed _download_atomic: removing it here would race another process's makedirs.
+    """
+    try:
+        _remove_quietly(lock_path)
+    finally:
+        os.close(fd)
+
+
+def _published_download_sync(channel: str, post_id: int, file_unique_id: str) -> str | None:
+    """Path of a complete cached file for the key (regular or large-video temp_), or None."""
+    for name in (file_unique_id, f"temp_{file_unique_id}"):
+        path = media_cache_path(channel, post_id, name)
+        if _stat_size_or_none(path):
+            return path
+    return None
+
+
+async def _wait_download_lock(lock_path: str, key: tuple) -> tuple[int | None, str | None]:
+    """Take the download lock of `key`, holding no download permit while waiting for it.
+
+    Returns (fd, None) once the lock is held, or (None, path) if another process published
+    the file in the meantime. The wait is capped at the longest download timeout (the size,
+    and so the holder's own timeout, is unknown here): a holder past it is presumed stuck
+    and (None, None) is returned, so this process downloads without the lock.
+    """
+    channel, post_id, file_unique_id = key
+    deadline = time.monotonic() + float(Config["media_download_timeout_max"])
+    waited = False
+    while True:
+        fd = await asyncio.to_thread(_try_download_lock_sync, lock_path)
+        if fd is not None:
+            # Another process may have published it while we waited for the lock.
+            published = await asyncio.to_thread(_published_download_sync, channel, post_id, file_unique_id)
+            if published is not None:
+                await asyncio.to_thread(_release_download_lock_sync, lock_path, fd)
+                return None, published
+            return fd, None
+        if time.monotonic() >= deadline:
+            logger.warning(f"download_lock_wait_expired: {channel}/{post_id}/{file_unique_id} still locked by another process, downloading without the lock")
+            return None, None
+        if not waited:
+            waited = True
+            logger.info(f"download_lock_wait: {channel}/{post_id}/{file_unique_id} is being downloaded by another process")
+        await asyncio.sleep(_DOWNLOAD_LOCK_POLL)
+        published = await asyncio.to_thread(_published_download_sync, channel, post_id, file_unique_id)
+        if published is not None:
+            logger.info(f"download_lock_joined: {channel}/{post_id}/{file_unique_id} published by another process")
+            return None, published
+
+
+async def _download_single_flight(channel: Union[str, int], post_id: int, file_unique_id: str,
+                                  semaphore: asyncio.Semaphore) -> Union[str, None]:
+    """download_media_file under the cross-process download lock of its key and a permit.
+
+    The lock comes first: a process watching another one's download never sits on a scarce
+    download permit. Acquiring the permit is bounded so a saturated semaphore fast-rejects
+    (DownloadAdmissionTimeout) rather than hangs; the permit is held around the actual
+    download only.
+    """
+    key = (str(channel), post_id, file_unique_id)
+    lock_path = media_cache_path(key[0], post_id, f"{file_unique_id}{DOWNLOAD_LOCK_SUFFIX}")
+    fd, published = await _wait_download_lock(lock_path, key)
+    try:
+        if published is not None:
+            return published
+        _sem_wait_start = time.monotonic()
+        try:
+            await asyncio.wait_for(semaphore.acquire(), timeout=30)
+        except asyncio.TimeoutError:
+            logger.warning(f"http_semaphore_timeout: {key[0]}/{key[1]}/{key[2]} waited >30s for a download permit")
+            raise DownloadAdmissionTimeout("download admission timed out")
+        _sem_wait = time.monotonic() - _sem_wait_start
+        if _sem_wait > 0.5:
+            logger.warning(f"diag_semaphore_wait: {key[0]}/{key[1]}/{key[2]} waited {_sem_wait:.3f}s for a download permit")
+        try:
+            _dl_start = time.monotonic()
+            result = await download_media_file(channel, post_id, file_unique_id)
+            _dl_elapsed = time.monotonic() - _dl_start
+            logger.info(f"diag_download_timing: {key[0]}/{key[1]}/{key[2]} download_media_file took {_dl_elapsed:.3f}s (semaphore_wait={_sem_wait:.3f}s)")
+            return result
+        finally:
+            semaphore.release()
+    finally:
+        if fd is not None:
+            await asyncio.to_thread(_release_download_lock_sync, lock_path, fd)
+
+
+def _ensure_download(channel: Union[str, int], post_id: int, file_unique_id: str,
+                     semaphore: asyncio.Semaphore, tee: bool = False) -> asyncio.Future:
+    """Return the shared Future of the download for (channel, post_id, fid), starting it if needed.
+
+    See _download_deduped for the dedup/permit contract. With `tee=True` a NEW download is
+    started in pass-through mode (its _TeeDownload is registered in _inflight_tees before
+    this returns); joining an already-running download never changes its mode. A download
+    is shaped as background while only the background worker waits on it; a live request
+    (any other semaphore) starting or joining it makes it interactive.
     """
     key = (str(channel), post_id, file_unique_id)
+    interactive = semaphore is not BACKGROUND_DOWNLOAD_SEMAPHORE
     fut = _inflight.get(key)
     if fut is None:
         loop = asyncio.get_running_loop()
         fut = loop.create_future()
         _inflight[key] = fut
+        tee_state = None
+        if tee:
+            tee_state = _inflight_tees[key] = _TeeDownload()
+        priority = _inflight_priority[key] = tg_bandwidth.DownloadPriority(interactive)
 
         async def _runner():
+            tee_error = None
+            if tee_state is not None:
+                _current_tee.set(tee_state)  # task-local: the runner runs in its own context
+            tg_bandwidth.current_priority.set(priority)
             try:
-                # Acquire a live-download permit for the duration of this ONE download.
-                # Bounded so a saturated semaphore fast-rejects rather than hangs; a
-                # timed-out acquire never held a permit (nothing to release) and is a
-                # server-load signal, not a file failure, so backoff is NOT armed.
-                _sem_wait_start = time.monotonic()
+                # One download permit for the duration of this ONE download. A timed-out
+                # acquire never held a permit (nothing to release) and is a server-load
+                # signal, not a file failure, so backoff is NOT armed.
                 try:
-                    await asyncio.wait_for(semaphore.acquire(), timeout=30)
-                except asyncio.TimeoutError:
-                    logger.warning(f"http_semaphore_timeout: {key[0]}/{key[1]}/{key[2]} waited >30s for a download permit")
+                    result = await _download_single_flight(channel, post_id, file_unique_id, semaphore)
+                except DownloadAdmissionTimeout as e:
                     if not fut.done():
-                        fut.set_exception(DownloadAdmissionTimeout("download admission timed out"))
+                        fut.set_exception(e)
                     return
-                _sem_wait = time.monotonic() - _sem_wait_start
-                if _sem_wait > 0.5:
-                    logger.warning(f"diag_semaphore_wait: {key[0]}/{key[1]}/{key[2]} waited {_sem_wait:.3f}s for a download permit")
-                # Release the permit around the ACTUAL download only (success or failure).
-                try:
-                    _dl_start = time.monotonic()
-                    result = await download_media_file(channel, post_id, file_unique_id)
-                    _dl_elapsed = time.monotonic() - _dl_start
-                    logger.info(f"diag_download_timing: {key[0]}/{key[1]}/{key[2]} download_media_file took {_dl_elapsed:.3f}s (semaphore_wait={_sem_wait:.3f}s)")
-                    _clear_download_failure(key)
-                    if not fut.done():
-                        fut.set_result(result)
-                finally:
-                    semaphore.release()
+                _clear_download_failure(key)
+                if not fut.done():
+                    fut.set_result(result)
             except BaseException as e:  # noqa: BLE001 — must forward ANY failure to waiters
                 # Arm backoff for real download failures only, never for a shutdown-time
                 # cancel (BaseException that is not an Exception).
@@ -979,16 +2227,27 @@ async def _download_deduped(channel: Union[str, int], post_id: int, file_unique_
                 # get_media ALSO maps RPC-400 to 404, so caching it transient would flap 404<->503).
                 # Everything else (504 timeout, zero-size, RPC 5xx, other Exception) is
                 # 'transient' -> 503 + Retry-After. FloodWait is excluded above (never armed).
+                # Timeouts and flood waits also resize the background slots (see
+                # _AdaptiveDownloadSlots): the media DC they describe is shared.
+                if isinstance(e, errors.FloodWait):
+                    BACKGROUND_DOWNLOAD_SEMAPHORE.on_flood_wait()
+                elif isinstance(e, HTTPException) and e.status_code == 504:
+                    BACKGROUND_DOWNLOAD_SEMAPHORE.on_timeout()
                 if isinstance(e, Exception) and not isinstance(e, errors.FloodWait):
                     permanent = (isinstance(e, HTTPException) and e.status_code == 404) or (
                         isinstance(e, errors.RPCError) and getattr(e, "CODE", None) == 400
                     )
                     kind = "permanent" if permanent else "transient"
                     _record_download_failure(key, kind)
+                tee_error = e
                 if not fut.done():
                     fut.set_exception(e)
             finally:
                 _inflight.pop(key, None)
+                _inflight_priority.pop(key, None)
+                if tee_state is not None:
+                    _inflight_tees.pop(key, None)
+                    tee_state.finish(tee_error)
 
         task = asyncio.create_task(_runner())
         _inflight_tasks.add(task)
@@ -996,15 +2255,76 @@ async def _download_deduped(channel: Union[str, int], post_id: int, file_unique_
         # Retrieve the exception in a done-callback to silence "exception was never
         # retrieved" if every waiter disconnects before awaiting the Future.
         fut.add_done_callback(lambda f: f.cancelled() or f.exception())
+    elif interactive:
+        priority = _inflight_priority.get(key)
+        if priority is not None and not priority.interactive:
+            priority.interactive = True
+            logger.info(f"download_promoted: {key[0]}/{key[1]}/{key[2]} a reader joined a background download")
+    return fut
+
+
+def _media_waiter_timeout() -> float:
+    """Safety-net bound for a request waiting on a shared download (see _download_deduped)."""
+    return float(Config["media_download_timeout_max"]) + 120.0
+
+
+async def _download_deduped(channel: Union[str, int], post_id: int, file_unique_id: str,
+                            semaphore: asyncio.Semaphore) -> Union[str, None]:
+    """Deduplicate concurrent downloads of the same media by (channel, post_id, fid).
 
+    The first request for a key runs download_media_file in a DETACHED task and shares its
+    Future; concurrent requests await the same Future (bounded by wait_for). The detached
+    task sets the Future's result/exception (on success/failure) and its finally ALWAYS
+    pops the key — so both happen before the task ends: a completed Future never leaves the
+    key stuck, and a client disconnect (cancelling only the awaiting request coroutine) can
+    neither cancel the download nor hang other waiters.
+
+    The live-download permit (`semaphore`) is acquired INSIDE the detached runner, so ONE
+    live download holds exactly ONE permit regardless of how many requests wait on the
+    shared Future — N concurrent requests for the same file no longer burn N permits. The
+    acquire is bounded (30s): on saturation the runner resolves the Future with a
+    DownloadAdmissionTimeout (server-busy, mapped to 503 by the caller) instead of hanging.
+    An admission timeout is NOT a download failure, so it must NOT arm the backoff.
+    """
+    fut = _ensure_download(channel, post_id, file_unique_id, semaphore)
     # Waiter timeout: a generous safety net above the maximum per-download timeout (the
     # download is itself internally bounded), so a live download always completes first.
-    waiter_timeout = float(Config["media_download_timeout_max"]) + 120.0
+    waiter_timeout = _media_waiter_timeout()
     # shield so a timed-out / cancelled waiter does NOT cancel the shared Future that the
     # detached task owns and other waiters depend on.
     return await asyncio.wait_for(asyncio.shield(fut), timeout=waiter_timeout)
 
 
+# Telegram's answers to a stale file reference: the stored file_id is no longer usable and
+# the message has to be fetched again for a fresh one.
+_FILE_REFERENCE_ERRORS = (errors.FileReferenceExpired, errors.FileReferenceInvalid, errors.FileReferenceEmpty)
+
+
+async def _existing_cache_file(cache_path: str, media_key: tuple[str, int, str]) -> bool:
+    """True if a complete file is already cached at cache_path (and record the access).
+
+    A zero-size leftover is removed so the caller downloads it again. Single off-loop stat
+    instead of exists()+getsize() on the loop.
+    """
+    cache_size = await asyncio.to_thread(_stat_size_or_none, cache_path)
+    if cache_size is None:
+        return False
+    if cache_size == 0:
+        logger.warning(f"zero_size_cache_found: Found zero-size cached file: {cache_path}. Deleting and attempting redownload.")
+        try:
+            os.remove(cache_path)
+            logger.info(f"Removed zero-size cached file: {cache_path}")
+            await asyncio.to_thread(_update_cache_index_sync, (), [cache_path])
+        except OSError as e:
+            logger.error(f"cleanup_error: Failed to remove zero-size cached file {cache_path}: {e}")
+        return False
+    # Record into the accumulator instead of touching SQLite on the hot path; the
+    # background flush persists it. Key channel as str(channel) — see _access_updates.
+    logger.info(f"Found cached media file: {cache_path}")
+    _access_updates[media_key] = datetime.now().timestamp()
+    return True
+
+
 async def download_media_file(channel: Union[str, int], post_id: int, file_unique_id: str) -> Union[str, None]:
     """
     Download media file from Telegram and save to cache
@@ -1017,13 +2337,52 @@ async def download_media_file(channel: Union[str, int], post_id: int, file_uniqu
     # empty dir behind. Bare os.path.exists checks below are safe on a not-yet-created dir.
     post_dir = media_cache_path(str(channel), post_id)
 
+    # Blob store first: the same file already cached for ANOTHER post is linked in place,
+    # with no message RPC and no download. Only regular cached files are ever blobs, so a
+    # hit here is never a large (temp_) video.
+    if Config["media_blob_store"]:
+        cache_path = os.path.join(post_dir, file_unique_id)
+        if await asyncio.to_thread(_link_from_blob_sync, file_unique_id, cache_path):
+            logger.info(f"blob_cache_hit: {channel}/{post_id}/{file_unique_id} linked from the blob store")
+            await asyncio.to_thread(_update_cache_index_sync, [cache_path])
+            _access_updates[(str(channel), post_id, file_unique_id)] = datetime.now().timestamp()
+            return cache_path
+
+    # Stored file reference: the renderer recorded the file_id of this media with its row
+    # (rows exist only for media <=100MB, so this is never a large video). Download with it
+    # directly and re-fetch the message only once the reference has expired.
+    stored_file_id = None
+    try:
+        stored_file_id = await asyncio.to_thread(get_media_file_ref_sync, DB_PATH, str(channel), post_id, file_unique_id)
+    except Exception as e:
+        logger.warning(f"file_ref_lookup_failed: {channel}/{post_id}/{file_unique_id}: {e}")
+    if stored_file_id:
+        cache_path = os.path.join(post_dir, file_unique_id)
+        if await _existing_cache_file(cache_path, (str(channel), post_id, file_unique_id)):
+            return cache_path
+        try:
+            file_path = await _download_atomic(stored_file_id, cache_path, timeout=float(Config["media_download_timeout_min"]))
+        except _FILE_REFERENCE_ERRORS as e:
+            logger.info(f"file_reference_expired: {channel}/{post_id}/{file_unique_id} ({type(e).__name__}), re-fetching the message")
+        except asyncio.TimeoutError:
+            logger.error(f"Timeout downloading media {file_unique_id}")
+            raise HTTPException(status_code=504, detail="Download timeout")
+        else:
+            if Config["media_blob_store"]:
+                await asyncio.to_thread(_publish_blob_sync, file_unique_id, file_path)
+            logger.info(f"Downloaded media file {file_unique_id} to {cache_path} (stored file reference)")
+            return file_path
+
     # Convert numeric channel ID to int if needed
     channel_id: Union[str, int] = channel
     if isinstance(channel, str) and channel.startswith('-100'):
         channel_id = int(channel)
     
+    prefetched = _prefetched_messages.get()
+    message = prefetched.get((str(channel), post_id)) if prefetched else None
     try:
-        message = await client.safe_get_messages(channel_id, post_id)
+        if message is None:
+            message = await client.safe_get_messages(channel_id, post_id)
     except asyncio.TimeoutError:
         logger.error(f"Timeout getting messages for {channel}/{post_id}")
         raise HTTPException(status_code=504, detail="Request timeout")
@@ -1035,8 +2394,8 @@ async def download_media_file(channel: Union[str, int], post_id: int, file_uniqu
         # deleted post forever (mirrors the fid-not-found branch below). Canonical key form
         # (str(channel), post_id, file_unique_id).
         try:
-            await asyncio.to_thread(
-                remove_media_file_ids_sync,
+            await write_async(
+                _op_remove_media_file_ids,
                 DB_PATH, [(str(channel), post_id, file_unique_id)]
             )
             logger.info(f"Removed entry for deleted/empty post {channel}/{post_id}/{file_unique_id} from SQLite")
@@ -1092,33 +2451,20 @@ async def download_media_file(channel: Union[str, int], post_id: int, file_uniqu
         timeout = _media_download_timeout(file_size)
         logger.info(f"Downloading large video file {file_unique_id} to temporary path {temp_file_path} (timeout={timeout:.0f}s)")
         try:
-            file_path = await _download_atomic(file_id, temp_file_path, timeout)
+            if Config["media_resume_large_downloads"]:
+                file_path = await _download_resumable(file_id, temp_file_path, timeout, file_unique_id, file_size)
+            else:
+                file_path = await _download_atomic(file_id, temp_file_path, timeout)
         except asyncio.TimeoutError:
             logger.error(f"Timeout downloading large video {file_unique_id}")
             raise HTTPException(status_code=504, detail="Download timeout")
         logger.info(f"Downloaded large video file {file_unique_id} to temporary path {temp_file_path}")
         return file_path
 
-    # Normal caching flow. Single off-loop stat instead of exists()+getsize() on the loop.
+    # Normal caching flow.
     cache_path = os.path.join(post_dir, file_unique_id)
-    cache_size = await asyncio.to_thread(_stat_size_or_none, cache_path)
-    if cache_size is not None:
-        # Check if the cached file is zero size
-        if cache_size == 0:
-            logger.warning(f"zero_size_cache_found: Found zero-size cached file: {cache_path}. Deleting and attempting redownload.")
-            try:
-                os.remove(cache_path)
-                logger.info(f"Removed zero-size cached file: {cache_path}")
-            except OSError as e:
-                logger.error(f"cleanup_error: Failed to remove zero-size cached file {cache_path}: {e}")
-            # Do not raise error here, proceed to download below
-        else:
-            # File exists and is not zero size, record access timestamp and return.
-            # Record into the accumulator instead of touching SQLite on the hot path; the
-            # background flush persists it. Key channel as str(channel) — see _access_updates.
-            logger.info(f"Found cached media file: {cache_path}")
-            _access_updates[(str(channel), post_id, file_unique_id)] = datetime.now().timestamp()
-            return cache_path
+    if await _existing_cache_file(cache_path, (str(channel), post_id, file_unique_id)):
+        return cache_path
 
     file_id = await find_file_id_in_message(message, file_unique_id)
     if not file_id:
@@ -1160,8 +2506,8 @@ async def download_media_file(channel: Union[str, int], post_id: int, file_uniqu
 
         # Remove the invalid entry from the SQLite database
         try:
-            await asyncio.to_thread(
-                remove_media_file_ids_sync,
+            await write_async(
+                _op_remove_media_file_ids,
                 DB_PATH, [(str(channel), post_id, file_unique_id)]
             )
             logger.info(f"Removed invalid entry for {channel}/{post_id}/{file_unique_id} from SQLite")
@@ -1170,6 +2516,14 @@ async def download_media_file(channel: Union[str, int], post_id: int, file_uniqu
 
         raise HTTPException(status_code=404, detail="File not found in message")
 
+    if file_id != stored_file_id:
+        # Refresh the stored reference (first download of the row, or the old one expired).
+        try:
+            await write_async(_op_set_media_file_ref, DB_PATH, str(channel), post_id, file_unique_id,
+                              file_id, file_dc_id(file_id))
+        except Exception as e:
+            logger.warning(f"file_ref_store_failed: {channel}/{post_id}/{file_unique_id}: {e}")
+
     # Download through a unique `.part.` file and atomically publish to the final cache
     # path. _download_atomic owns the zero-size check, the race-loser cleanup, and the
     # rename-only-if-absent logic, keeping the "final name = complete file" invariant.
@@ -1179,108 +2533,168 @@ async def download_media_file(channel: Union[str, int], post_id: int, file_uniqu
         logger.error(f"Timeout downloading media {file_unique_id}")
         raise HTTPException(status_code=504, detail="Download timeout")
 
+    if Config["media_blob_store"]:
+        await asyncio.to_thread(_publish_blob_sync, file_unique_id, file_path)
     logger.info(f"Downloaded media file {file_unique_id} to {cache_path}")
     return file_path
 
 
-def remove_old_cached_files_sync(media_files: list, cache_dir: str) -> tuple[list, int]:
+def _remove_expired_cache_file_sync(cache_path: str) -> bool:
+    """Remove one expired cached file and its emptied post/channel dirs.
+
+    Returns False when the file was already gone. Removal errors propagate to the caller,
+    which keeps the row so the next sweep retries.
     """
-    Remove files that haven't been accessed for more than 20 days
-    Returns tuple of (updated media files list, number of removed files)
+    if not os.path.exists(cache_path):
+        return False
+    os.remove(cache_path)
+    # try to remove empty parent directories
+    post_dir = os.path.dirname(cache_path)
+    channel_dir = os.path.dirname(post_dir)
+    if not os.listdir(post_dir):
+        os.rmdir(post_dir)
+    if not os.listdir(channel_dir):
+        os.rmdir(channel_dir)
+    return True
+
+
+def expire_cached_files_sync(db_path: str, cache_dir: str, cutoff: float) -> tuple[int, int]:
+    """Remove cached files whose row was last used before `cutoff`, and purge those rows.
+
+    Pages through `added < cutoff` (indexed) in _SWEEP_BATCH_ROWS batches, so a sweep reads
+    only the rows that actually expired instead of the whole table. Each batch is deleted
+    with the `added <= snapshot` guard, so a row re-rendered while its batch was being
+    processed survives. A row whose file could not be removed is kept and skipped by the
+    keyset cursor, so the next sweep retries it.
+
+    Returns (rows purged, files removed from disk).
     """
-    current_time = datetime.now().timestamp()
-    updated_media_files = []
-    files_removed = 0
-
-    for file_data in media_files:
-        try:
-            channel = file_data.get('channel')
-            post_id = file_data.get('post_id')
-            file_unique_id = file_data.get('file_unique_id')
-            
-            if not all([channel, post_id, file_unique_id]):
-                continue
-
-            last_access_time = file_data.get('added', 0)
-            days_since_access = (current_time - last_access_time) / (24 * 3600)
-
-            if days_since_access > 20:
-                cache_path = os.path.join(cache_dir, str(channel), str(post_id), file_unique_id)
-                
-                if os.path.exists(cache_path):
-                    try:
-                        os.remove(cache_path)
-                        # try to remove empty parent directories
-                        post_dir = os.path.dirname(cache_path)
-                        channel_dir = os.path.dirname(post_dir)
-                        if not os.listdir(post_dir):
-                            os.rmdir(post_dir)
-                        if not os.listdir(channel_dir):
-                            os.rmdir(channel_dir)
-                            
-                        files_removed += 1
-                        logger.info(f"Removed old cached file: {cache_path}, last access {days_since_access:.1f} days ago")
-                    except Exception as e:
-                        logger.error(f"Failed to remove cached file {cache_path}: {str(e)}")
-                        updated_media_files.append(file_data)
+    purged = files_removed = 0
+    after = None
+    now = datetime.now().timestamp()
+    while True:
+        rows = get_expired_media_file_ids_sync(db_path, cutoff, _SWEEP_BATCH_ROWS, after)
+        if not rows:
+            break
+        after = (rows[-1]['added'], rows[-1]['rowid'])
+        removed_entries = []
+        removed_paths = []
+        for row in rows:
+            cache_path = os.path.join(cache_dir, str(row['channel']), str(row['post_id']), str(row['file_unique_id']))
+            try:
+                if _remove_expired_cache_file_sync(cache_path):
+                    files_removed += 1 + _drop_orphan_blob_sync(str(row['file_unique_id']))
+                    removed_paths.append(cache_path)
+                    logger.info(f"Removed old cached file: {cache_path}, "
+                                f"last access {(now - row['added']) / 86400:.1f} days ago")
+            except Exception as e:
+                logger.error(f"Failed to remove cached file {cache_path}: {str(e)}")
                 continue
+            removed_entries.append((row['channel'], row['post_id'], row['file_unique_id'], row['added']))
+        remove_media_file_ids_if_unchanged_sync(db_path, removed_entries)
+        _update_cache_index_sync((), removed_paths, cache_dir)
+        purged += len(removed_entries)
+        if len(rows) < _SWEEP_BATCH_ROWS:
+            break
+    return purged, files_removed
+
+
+# Idle time after which a file without a SQLite row of its own is expired, by index kind.
+# Resumable partials (+ sidecar) are kept across failed attempts, so they get a much longer
+# window; the Range part cache is refreshed on every ranged serve, so it goes like temp_*.
+# A preview is cheap to re-render and lives as long as an unused original would.
+_UNTRACKED_MAX_AGE = {"temp": 3600, "part": 3600, "chunks": 3600, "resume": RESUME_PARTIAL_MAX_AGE,
+                      "preview": MEDIA_CACHE_MAX_AGE_DAYS * 86400,
+                      # Normally unlinked by its holder; only a crashed process leaves one.
+                      "lock": RESUME_PARTIAL_MAX_AGE}
+
+
+def _expire_untracked_file_sync(cache_dir: str, file_path: str, kind: str, now: float) -> tuple[str, tuple | None]:
+    """Apply the idle-time rule to one untracked cache file.
+
+    Returns (outcome, dropped_key): outcome is "removed", "fresh" (still in use) or "gone"
+    (already missing); dropped_key is the (channel, post_id, fid) of a removed temp_* large
+    video, whose row the caller drops as well.
+    """
+    try:
+        file_mod_time = os.path.getmtime(file_path)
+    except FileNotFoundError:
+        return "gone", None
+    if now - file_mod_time <= _UNTRACKED_MAX_AGE[kind]:
+        return "fresh", None
+    dropped_key = None
+    if kind == "temp":
+        # Extract channel/post/file_id from path and name
+        parts = os.path.relpath(os.path.dirname(file_path), cache_dir).split(os.sep)
+        if len(parts) != 2:
+            logger.warning(f"Unexpected path depth for large-video temp file, skipping: {file_path}")
+            return "fresh", None
+        dropped_key = (parts[0], int(parts[1]), os.path.basename(file_path)[5:])  # strip 'temp_'
+    os.remove(file_path)
+    if kind == "resume":
+        logger.info(f"Removed abandoned resumable partial: {file_path}")
+    elif kind == "chunks":
+        logger.info(f"Removed idle large-video part cache file: {file_path}")
+    elif kind == "temp":
+        logger.info(f"Removed temporary large video file: {file_path}")
+    elif kind == "preview":
+        logger.info(f"Removed idle media preview: {file_path}")
+    elif kind == "lock":
+        logger.info(f"Removed leftover download lock file: {file_path}")
+    else:
+        # Race-condition temp file — just delete from disk, no SQLite entry to remove
+        logger.info(f"Removed stale race-condition temp file: {file_path}")
+    return "removed", dropped_key
 
-            updated_media_files.append(file_data)
 
-        except Exception as e:
-            logger.error(f"Error processing cache entry {file_data}: {str(e)}")
-            continue
+def sweep_indexed_untracked_sync(db_path: str, cache_dir: str) -> tuple[int, set]:
+    """Expire stale temp/partial/part-cache files found through the on-disk index.
 
-    # Clean up temporary files: "temp_"-prefixed (large videos) and ".tmp."-suffixed (race-condition downloads)
-    temp_threshold = 3600  # 1 hour in seconds
-    for root, _, files in os.walk(cache_dir):
-        for file in files:
-            is_large_video_temp = file.startswith("temp_")
-            # Match the partial-download suffixes: the new `.part.{32 hex}` and the legacy
-            # `.tmp.{32 hex}` (old stubs may still be on disk after the rename to .part.).
-            is_race_temp = bool(re.match(r'^.+\.(part|tmp)\.[0-9a-f]{32}$', file))
-            if not (is_large_video_temp or is_race_temp):
-                continue
-            file_path = os.path.join(root, file)
+    Only rows whose RECORDED mtime is past the kind's idle window are looked at. The
+    recorded mtime never runs ahead of the real one, so a candidate is confirmed with one
+    stat: a file still in use gets its row refreshed (and leaves the candidate set), a file
+    already gone just loses its row. At most _SWEEP_BATCH_ROWS candidates per idle window
+    per pass. Returns (files removed, keys of the removed temp_* large videos), the latter
+    so the caller drops their rows as well.
+    """
+    files_removed = 0
+    dropped_keys = set()
+    now = time.time()
+    refreshed, gone = [], []
+    windows: dict[int, tuple] = {}
+    for kind, max_age in _UNTRACKED_MAX_AGE.items():
+        windows[max_age] = windows.get(max_age, ()) + (kind,)
+    for max_age, kinds in windows.items():
+        for row in get_stale_cache_files_sync(db_path, kinds, now - max_age, _SWEEP_BATCH_ROWS):
+            file_path = os.path.join(cache_dir, row['path'])
             try:
-                file_mod_time = os.path.getmtime(file_path)
-                if time.time() - file_mod_time > temp_threshold:
-                    if is_large_video_temp and not is_race_temp:
-                        # Extract channel/post/file_id from path and name
-                        rel_path = os.path.relpath(os.path.dirname(file_path), cache_dir)
-                        parts = rel_path.split(os.sep)
-                        if len(parts) != 2:
-                            logger.warning(f"Unexpected path depth for large-video temp file, skipping: {file_path}")
-                            continue
-                        channel, post_id = parts
-                        file_unique_id = file[5:]  # Remove 'temp_' prefix
-                        # Remove file
-                        os.remove(file_path)
-                        files_removed += 1
-                        logger.info(f"Removed temporary large video file: {file_path}")
-                        # Also remove the temporary file entry from the in-memory list
-                        updated_media_files = [
-                            f for f in updated_media_files
-                            if not (f.get('channel') == channel and
-                                f.get('post_id') == int(post_id) and
-                                f.get('file_unique_id') == file_unique_id)
-                        ]
-                    elif is_race_temp:
-                        # Race-condition temp file — just delete from disk, no SQLite entry to remove
-                        os.remove(file_path)
-                        files_removed += 1
-                        logger.info(f"Removed stale race-condition temp file: {file_path}")
+                outcome, dropped_key = _expire_untracked_file_sync(cache_dir, file_path, row['kind'], now)
             except Exception as e:
                 logger.error(f"Failed to remove temporary file {file_path}: {str(e)}")
-
-    # Remove empty post-/channel- directories. A permanently-dead file that never downloads
-    # (backoff-skipped forever) can leave an empty dir behind now that makedirs is lazy, and
-    # empty dirs pile up and slow the sweeper's os.walk and calculate_cache_stats. Walk
-    # bottom-up so an emptied post dir lets its (now-empty) channel dir go in the same pass;
-    # rmdir only ever removes an EMPTY dir, so a dir holding a live file is left untouched.
-    # OSError is swallowed: a non-empty dir is legitimate, and a race with a concurrent fresh
-    # mkdir/download (rmdir vs mkdir) must never crash the sweep — _download_atomic recreates
-    # the dir on demand.
+                continue
+            if outcome == "fresh":
+                refreshed.append(file_path)
+                continue
+            gone.append(file_path)
+            if outcome == "removed":
+                files_removed += 1
+            if dropped_key:
+                dropped_keys.add(dropped_key)
+    _update_cache_index_sync(refreshed, gone, cache_dir)
+    return files_removed, dropped_keys
+
+
+def _remove_empty_dirs_sync(cache_dir: str) -> None:
+    """Remove empty post-/channel- directories under the cache root.
+
+    A permanently-dead file that never downloads (backoff-skipped forever) can leave an
+    empty dir behind now that makedirs is lazy, and empty dirs pile up and slow the cache
+    walks. Walk bottom-up so an emptied post dir lets its (now-empty) channel dir go in the
+    same pass; rmdir only ever removes an EMPTY dir, so a dir holding a live file is left
+    untouched. OSError is swallowed: a non-empty dir
+    is legitimate, and a race with a concurrent fresh mkdir/download (rmdir vs mkdir) must
+    never crash the sweep — _download_atomic recreates the dir on demand.
+    """
     for root, _dirs, _files in os.walk(cache_dir, topdown=False):
         if os.path.abspath(root) == os.path.abspath(cache_dir):
             continue  # never remove the cache root itself
@@ -1290,18 +2704,114 @@ def remove_old_cached_files_sync(media_files: list, cache_dir: str) -> tuple[lis
         except OSError:
             pass
 
-    return updated_media_files, files_removed
 
+def _enforce_cache_budget_sync(db_path: str, cache_dir: str, max_bytes: int, channel_max_bytes: int,
+                               total: int, channel_bytes: dict) -> list:
+    """Evict least-recently-used cached files until the cache fits its byte budget.
+
+    total / channel_bytes: the budgeted bytes from the index aggregates (get_cache_stats_sync
+    final_bytes / channel_final_bytes), so sizing the cache takes no stat. Candidates are
+    paged from the index in LRU order (get_budget_cache_files_sync) only until the cache
+    fits, and once the total fits only over-quota channels are paged. Recency is the row's
+    `added` (refreshed by renders and by the flushed cache-hit access times). The total
+    budget counts each inode once — blob-store hardlinks of one file cost their bytes once
+    and only free them when the last location goes — while a channel quota counts every file
+    the channel references. Untracked files (temp_* large videos, part caches, previews) have
+    their own idle windows and are not budgeted here.
+
+    Returns the evicted entries; the caller purges their rows, so the background worker
+    does not immediately fetch them back.
+    """
+    channel_bytes = dict(channel_bytes)
+    start_total = total
+    evicted = []
+    evicted_paths = []
+    inode_evicted: dict[str, int] = {}
+    after = None
+
+    while True:
+        over_total = bool(max_bytes) and total > max_bytes
+        over_channels = [channel for channel, size in channel_bytes.items()
+                         if channel_max_bytes and size > channel_max_bytes]
+        if not (over_total or over_channels):
+            break
+        page = get_budget_cache_files_sync(db_path, after, _SWEEP_BATCH_ROWS,
+                                           None if over_total else over_channels)
+        if not page:
+            break
+        after = (page[-1]['added'], page[-1]['row'])
+        for entry in page:
+            channel = str(entry['channel'])
+            over_total = bool(max_bytes) and total > max_bytes
+            over_channel = bool(channel_max_bytes) and channel_bytes.get(channel, 0) > channel_max_bytes
+            if not (over_total or over_channel):
+                continue
+            path = os.path.join(cache_dir, entry['path'])
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass  # already gone behind the index's back: nothing to free, drop it all the same
+            except OSError as e:
+                logger.error(f"cache_budget: failed to evict {path}: {e}")
+                continue
+            evicted.append(entry)
+            evicted_paths.append(path)
+            _drop_orphan_blob_sync(str(entry['file_unique_id']))
+            channel_bytes[channel] = channel_bytes.get(channel, 0) - entry['size']
+            inode_evicted[entry['inode']] = inode_evicted.get(entry['inode'], 0) + 1
+            if inode_evicted[entry['inode']] >= entry['final_refs']:
+                total -= entry['size']
+            logger.debug(f"cache_budget: evicted {path} ({entry['size']} bytes, "
+                         f"last used {datetime.fromtimestamp(entry['added'] or 0).isoformat()})")
+
+    _update_cache_index_sync((), evicted_paths, cache_dir)
+    if evicted:
+        logger.info(f"cache_budget: evicted {len(evicted)} files, {start_total / 1048576:.1f}MB -> {total / 1048576:.1f}MB "
+                    f"(budget {max_bytes / 1048576:.0f}MB, channel quota {channel_max_bytes / 1048576:.0f}MB)")
+    return evicted
+
+
+def _note_feed_poll(channel: str) -> None:
+    """Count a poll of `channel`'s feed towards its download priority (decayed, see _feed_popularity)."""
+    key = canonical_channel_key(channel)
+    now = time.monotonic()
+    _feed_polls[key] = (_feed_popularity(key, now) + 1.0, now)
+    _feed_polls.move_to_end(key)
+    while len(_feed_polls) > _FEED_POLLS_MAX:
+        _feed_polls.popitem(last=False)
 
-async def download_new_files(media_files: list, cache_dir: str) -> None:
+
+def _feed_popularity(channel: str, now: float | None = None) -> float:
+    """Feed polls of `channel`, each worth half as much per _FEED_POLL_HALF_LIFE since it happened."""
+    entry = _feed_polls.get(channel)
+    if entry is None:
+        return 0.0
+    count, last = entry
+    now = time.monotonic() if now is None else now
+    return count * 0.5 ** (max(0.0, now - last) / _FEED_POLL_HALF_LIFE)
+
+
+def _download_priority(channel: str, added: float) -> float:
+    """Queue priority of a media row: its recency (`added`, when a feed last showed the post)
+    plus _FEED_POPULARITY_WEIGHT seconds per doubling of the channel's feed polls."""
+    return added + _FEED_POPULARITY_WEIGHT * math.log2(1.0 + _feed_popularity(str(channel)))
+
+
+async def download_new_files(media_files: list, cache_dir: str) -> list:
     """
     Queue files that are not in cache yet for background download
+    Returns the (channel, post_id, file_unique_id) keys found already on disk
+
+    Missing files go to the persistent download queue with their current priority (see
+    _download_priority); a file already queued just takes the new priority.
     """
+    present = []
     if not media_files:
         logger.info("No media files found for download")
-        return
+        return present
 
-    files_queued = 0
+    now = datetime.now().timestamp()
+    entries = []
     for file_data in media_files:
         try:
             channel = file_data.get('channel')
@@ -1329,45 +2839,154 @@ async def download_new_files(media_files: list, cache_dir: str) -> None:
             # Skip if temp file exists (large videos)
             temp_path = os.path.join(post_dir, f"temp_{file_unique_id}")
             if os.path.exists(temp_path):
+                present.append((channel, post_id, file_unique_id))
                 continue
                 
             cache_path = os.path.join(post_dir, file_unique_id)
-            if not os.path.exists(cache_path):
-                # Skip files already queued/in-flight so a slow-draining queue (FloodWait)
-                # isn't refilled with duplicates on every sweep. Same key shape as the
-                # worker's bg_key. No await between this check and the add -> race-free.
-                key = (str(channel), int(post_id), file_unique_id)
-                if key in _queued_media:
-                    continue
-                try:
-                    # put_nowait so a full queue raises QueueFull instead of blocking
-                    # cache_media_files (and thus the sweeper) forever. `await put()`
-                    # never raises QueueFull, which made the except below dead code.
-                    _queued_media.add(key)
-                    download_queue.put_nowait((channel, post_id, file_unique_id))
-                    files_queued += 1
-                    logger.debug(f"Queued for background download: {channel}/{post_id}/{file_unique_id}")
-                except asyncio.QueueFull:
-                    _queued_media.discard(key)
-                    logger.warning(f"Download queue is full, skipping {channel}/{post_id}/{file_unique_id}")
-                    break
+            if os.path.exists(cache_path):
+                present.append((channel, post_id, file_unique_id))
+            else:
+                # Same key shape as the worker's: the queue's primary key dedupes a file
+                # that every sweep finds missing again.
+                priority = _download_priority(str(channel), file_data.get('added') or now)
+                entries.append((str(channel), int(post_id), file_unique_id, priority, now))
         
         except Exception as e:
             logger.error(f"Failed to queue download for {channel}/{post_id}/{file_unique_id}: {str(e)}")
             continue
 
-    if files_queued > 0:
-        logger.info(f"Queued {files_queued} files for background download")
+    if entries:
+        dropped = await write_async(_op_enqueue_downloads, DB_PATH, entries, _DOWNLOAD_QUEUE_MAX)
+        _download_queue_ready.set()
+        logger.info(f"Queued {len(entries)} files for background download")
+        if dropped:
+            logger.info(f"download_queue: dropped {dropped} lowest-priority entries over the {_DOWNLOAD_QUEUE_MAX} cap")
+    return present
 
 
-async def background_download_worker():
-    """Worker that processes downloads from queue"""
-    while True:
-        # get() is OUTSIDE the try so task_done() in finally always balances exactly one
-        # successful get(). Cancellation propagates cleanly here (nothing to unbalance).
-        item = await download_queue.get()
-        channel, post_id, file_unique_id = item
-        bg_key = (str(channel), int(post_id), file_unique_id)
+async def queue_pending_downloads(cache_dir: str) -> int:
+    """Queue background downloads for rows not yet seen on disk (on_disk = 0).
+
+    First drops queued downloads whose row is gone or already on disk, then pages through
+    the pending rows newest-first and hands each page to download_new_files; rows whose file
+    turns out to be on disk already are flagged on_disk = 1, so later sweeps do not look at
+    them again. At most _DOWNLOAD_QUEUE_MAX rows are looked at per pass. Returns the number
+    of rows flagged as on disk.
+    """
+    try:
+        stale = await write_async(_op_prune_download_queue, DB_PATH)
+        if stale:
+            logger.info(f"download_queue: pruned {stale} entries no longer pending")
+    except Exception as e:
+        logger.warning(f"download_queue: prune failed: {e}")
+    confirmed = 0
+    scanned = 0
+    after = None
+    while scanned < _DOWNLOAD_QUEUE_MAX:
+        rows = await asyncio.to_thread(get_pending_media_file_ids_sync, DB_PATH, _SWEEP_BATCH_ROWS, after)
+        if not rows:
+            break
+        scanned += len(rows)
+        after = (rows[-1]['added'], rows[-1]['rowid'])
+        present = await download_new_files(rows, cache_dir)
+        if present:
+            await write_async(_op_set_media_on_disk_bulk, DB_PATH, present)
+            confirmed += len(present)
+        if len(rows) < _SWEEP_BATCH_ROWS:
+            break
+    return confirmed
+
+
+_render_queue_tasks: set[asyncio.Task] = set()
+
+
+def _queue_rendered_media(keys: list) -> None:
+    """Queue media a render has just seen for the first time (post_parser's new-media hook).
+
+    Fresh posts used to wait for the next cache sweep (up to cache_sweep_interval) before
+    their media was queued, so the reader's first view of each image was a cold /media
+    miss. Keys already downloading (_inflight) or in backoff are skipped; the queue's
+    primary key dedupes the rest against what is already queued. Fire-and-forget like
+    _drop_media_row: the render does not wait for the queue write; skipped when no loop is
+    running (the next sweep queues them).
+    """
+    try:
+        loop = asyncio.get_running_loop()
+    except RuntimeError:
+        return
+    now = datetime.now().timestamp()
+    entries = [
+        (str(channel), int(post_id), file_unique_id, _download_priority(str(channel), now), now)
+        for channel, post_id, file_unique_id in keys
+        if (str(channel), int(post_id), file_unique_id) not in _inflight
+        and _download_backoff_remaining((str(channel), int(post_id), file_unique_id)) <= 0
+    ]
+    if not entries:
+        return
+
+    async def _enqueue():
+        try:
+            await write_async(_op_enqueue_downloads, DB_PATH, entries, _DOWNLOAD_QUEUE_MAX)
+        except Exception as e:
+            logger.warning(f"render_prefetch: failed to queue {len(entries)} new files: {e}")
+            return
+        _download_queue_ready.set()
+        logger.info(f"render_prefetch: queued {len(entries)} newly seen files for download")
+
+    task = loop.create_task(_enqueue())
+    _render_queue_tasks.add(task)
+    task.add_done_callback(_render_queue_tasks.discard)
+
+
+async def _prefetch_channel_messages(channel: str, items: list) -> dict:
+    """Resolve the messages a channel's batch needs with ONE get_messages(chat, ids) call.
+
+    Only items without a stored file reference need their message (see download_media_file);
+    a single such item is left to download_media_file's own fetch. Returns
+    {(channel, post_id): message}. A failed lookup returns {} so every item falls back to
+    its own fetch; a FloodWait propagates, the throttle applies to the whole batch.
+    """
+    if len(items) < 2:
+        return {}
+
+    def _needing_message():
+        return sorted({int(post_id) for _channel, post_id, fid in items
+                       if not get_media_file_ref_sync(DB_PATH, channel, int(post_id), fid)})
+
+    try:
+        post_ids = await asyncio.to_thread(_needing_message)
+    except Exception as e:
+        logger.warning(f"bg_prefetch_ref_lookup_failed: {channel}: {e}")
+        post_ids = sorted({int(post_id) for _channel, post_id, _fid in items})
+    if len(post_ids) < 2:
+        return {}
+    channel_id: Union[str, int] = int(channel) if channel.startswith('-100') else channel
+    try:
+        messages = await client.safe_get_messages(channel_id, post_ids)
+    except errors.FloodWait:
+        raise
+    except Exception as e:
+        logger.warning(f"bg_prefetch_failed: {channel} ({len(post_ids)} messages): {e}")
+        return {}
+    logger.info(f"bg_prefetch: resolved {len(post_ids)} messages of {channel} in one call")
+    return {(channel, m.id): m for m in (messages or []) if m is not None}
+
+
+async def _background_download(item: tuple, gate: asyncio.Semaphore, flood: dict) -> bool:
+    """Download one queued item of a batch; a FloodWait stops the rest of the batch.
+
+    Returns False when the item stays queued (flood wait), True once it is done with —
+    downloaded, failed (the negative cache owns the retry) or refused admission.
+    """
+    channel, post_id, file_unique_id = item
+    async with gate:
+        if flood["wait"]:
+            logger.info(f"bg_download_skipped: {channel}/{post_id}/{file_unique_id} stays queued (flood wait)")
+            return False
+        if _download_backoff_remaining((str(channel), int(post_id), file_unique_id)) > 0:
+            # Failed since it was queued (e.g. by a live request): the sweep re-queues it
+            # once the backoff has expired.
+            return True
         logger.info(f"Background download: {channel}/{post_id}/{file_unique_id}")
         try:
             # Route through _download_deduped so a live request already downloading THIS file
@@ -1378,69 +2997,159 @@ async def background_download_worker():
             # success clear are owned by _download_deduped's runner — the worker must NOT
             # record/clear here, or a real failure would double-increment the counter.
             await _download_deduped(channel, post_id, file_unique_id, BACKGROUND_DOWNLOAD_SEMAPHORE)
-            await asyncio.sleep(2)
         except errors.FloodWait as e:
             # Must be caught BEFORE the generic Exception (FloodWait subclasses RPCError),
             # otherwise the worker would hammer Telegram while under a flood wait. A flood
             # wait is a global throttle, not a per-file fault, so it does NOT arm backoff
             # (the runner excludes it too); the worker sleeps the WHOLE queue to stop hammering.
-            logger.warning(f"bg_download_floodwait: {channel}/{post_id}/{file_unique_id} sleeping {e.value}s")
-            await asyncio.sleep(min(int(e.value) + 5, 900))
+            logger.warning(f"bg_download_floodwait: {channel}/{post_id}/{file_unique_id} flood wait {e.value}s, pausing the worker")
+            flood["wait"] = max(flood["wait"], int(e.value))
+            return False
         except DownloadAdmissionTimeout:
-            # The background semaphore was saturated — a server-load signal, not a file fault
-            # (the runner did NOT arm backoff). Leave the item for a later sweep to re-queue.
-            logger.warning(f"bg_download_admission_timeout: {channel}/{post_id}/{file_unique_id} left for a later sweep")
+            # The background slots were saturated — a server-load signal, not a file fault
+            # (the runner did NOT arm backoff). The item stays queued for a later batch.
+            logger.warning(f"bg_download_admission_timeout: {channel}/{post_id}/{file_unique_id} stays queued")
+            return False
         except Exception as e:
             # The runner already classified and negative-cached this failure; only log here.
             logger.error(f"Background download error for {channel}/{post_id}/{file_unique_id}: {e}")
-        finally:
-            # Free the dedup slot so this file can be re-enqueued by a later sweep if it is
-            # still missing (e.g. the download failed or was throttled). No await here, so the
-            # discard and task_done() happen atomically w.r.t. download_new_files.
-            _queued_media.discard(bg_key)
-            download_queue.task_done()
+        return True
+
+
+async def _next_download_batch() -> list:
+    """Wait for and return the _BG_BATCH_MAX highest-priority queued downloads."""
+    while True:
+        # Clear BEFORE reading: an enqueue committed after the read sets the event again,
+        # so no wakeup is lost between an empty read and the wait.
+        _download_queue_ready.clear()
+        rows = await asyncio.to_thread(get_download_queue_sync, DB_PATH, _BG_BATCH_MAX)
+        if rows:
+            return [(r['channel'], r['post_id'], r['file_unique_id']) for r in rows]
+        await _download_queue_ready.wait()
+
+
+async def background_download_worker():
+    """Worker that processes the persistent download queue in channel-grouped batches.
+
+    Takes the _BG_BATCH_MAX highest-priority queued items at once. Per channel, the
+    messages the items need are resolved with one get_messages call (handed to
+    download_media_file through _prefetched_messages) and the files are downloaded as many
+    at a time as the adaptive background slots allow. An item leaves the queue once it has
+    been attempted; the items a FloodWait stopped stay queued for the next batch. The pause
+    between batches shrinks as the slots grow (see _AdaptiveDownloadSlots.pause).
+    """
+    global _download_queue_ready
+    _download_queue_ready = asyncio.Event()  # bound to this worker's loop
+    while True:
+        batch = await _next_download_batch()
+        flood = {"wait": 0}
+        done = []
+        by_channel: dict[str, list] = {}
+        for item in batch:
+            by_channel.setdefault(str(item[0]), []).append(item)
+        # Snapshot of the current slot count: no more runners wait on a permit than it grants.
+        gate = asyncio.Semaphore(BACKGROUND_DOWNLOAD_SEMAPHORE.slots)
+        for channel, items in by_channel.items():
+            if flood["wait"]:
+                break
+            try:
+                messages = await _prefetch_channel_messages(channel, items)
+            except errors.FloodWait as e:
+                logger.warning(f"bg_prefetch_floodwait: {channel} sleeping {e.value}s")
+                BACKGROUND_DOWNLOAD_SEMAPHORE.on_flood_wait()
+                flood["wait"] = int(e.value)
+                break
+            token = _prefetched_messages.set(messages)
+            try:
+                results = await asyncio.gather(*(_background_download(item, gate, flood) for item in items))
+            finally:
+                _prefetched_messages.reset(token)
+            done.extend(item for item, finished in zip(items, results) if finished)
+        if done:
+            await write_async(_op_dequeue_downloads, DB_PATH, done)
+        if flood["wait"]:
+            await asyncio.sleep(min(flood["wait"] + 5, 900))
+        else:
+            await asyncio.sleep(BACKGROUND_DOWNLOAD_SEMAPHORE.pause())
+
+async def _enforce_cache_budget_db() -> int:
+    """Run the LRU byte-budget pass over the cache index and purge the evicted rows.
+
+    Only runs when MEDIA_CACHE_MAX_MB / MEDIA_CACHE_CHANNEL_MAX_MB is set. The index
+    aggregates of the budgeted (final) files are read first and the per-file pass is skipped
+    while they fit, whatever the untracked temp/part/preview files weigh. Returns the number
+    of files evicted.
+    """
+    max_bytes = Config["media_cache_max_mb"] * 1024 * 1024
+    channel_max_bytes = Config["media_cache_channel_max_mb"] * 1024 * 1024
+    if not (max_bytes or channel_max_bytes):
+        return 0
+    stats = await asyncio.to_thread(get_cache_stats_sync, DB_PATH)
+    if ((not max_bytes or stats["final_bytes"] <= max_bytes)
+            and (not channel_max_bytes or all(size <= channel_max_bytes for size in stats["channel_final_bytes"].values()))):
+        return 0
+    evicted = await asyncio.to_thread(
+        _enforce_cache_budget_sync, DB_PATH, MEDIA_CACHE_DIR, max_bytes, channel_max_bytes,
+        stats["final_bytes"], stats["channel_final_bytes"]
+    )
+    if evicted:
+        # Same `added <= snapshot` guard as the age pass: a row re-rendered meanwhile stays.
+        await write_async(_op_remove_media_file_ids_if_unchanged, DB_PATH,
+                          [(e['channel'], e['post_id'], e['file_unique_id'], e['added']) for e in evicted])
+    return len(evicted)
+
 
 async def cache_media_files() -> None:
-    """Background task for cache management: removes old files and downloads new ones"""
+    """Background task for cache management: removes old files and downloads new ones
+
+    Each pass is incremental: expired rows are paged out of SQLite through the `added`
+    index, download candidates are the on_disk = 0 rows and stale temp/partial files come
+    from the on-disk file index, so a pass costs what changed rather than the table or tree
+    size. The tree is walked once, at startup, to reconcile that index with the disk.
+    """
     delay = Config["cache_sweep_interval"]
+    try:
+        indexed = await asyncio.to_thread(reconcile_cache_index_sync, MEDIA_CACHE_DIR)
+        logger.info(f"cache_index: reconciled {indexed} files on disk")
+    except Exception as e:
+        logger.error(f"cache_index: startup reconcile failed: {e}")
     while True:
         try:
-            # Load all media file ID records from SQLite
-            media_files = await asyncio.to_thread(get_all_media_file_ids_sync, DB_PATH)
+            # Persist pending cache-hit access times first, so the expiry and the LRU budget
+            # pass below see the real recency of files that were only served since the last flush.
+            try:
+                await _flush_access_updates()
+            except Exception as e:
+                logger.warning(f"cache_sweep: access-time flush failed, sweeping with stored times: {e}")
 
             cache_dir = MEDIA_CACHE_DIR
-            updated_media_files, files_removed = await asyncio.to_thread(remove_old_cached_files_sync, media_files, cache_dir)
-
+            cutoff = datetime.now().timestamp() - MEDIA_CACHE_MAX_AGE_DAYS * 24 * 3600
+            files_removed = 0
             try:
-                # Compute the DB diff UNCONDITIONALLY (not only when files_removed > 0):
-                # remove_old_cached_files_sync drops an entry older than 20 days from the
-                # surviving list even when its file was already gone from disk (that branch
-                # does NOT bump files_removed). If we only purged when a real file was removed,
-                # such a fileless-but-expired row would stay in SQLite forever. The surviving
-                # set reflects what is actually left after the sweep; removed_entries are the
-                # rows present in the OLD set but not in the surviving set.
-                updated_set = {
-                    (r['channel'], r['post_id'], r['file_unique_id'])
-                    for r in updated_media_files
-                }
-                # Carry the SNAPSHOTTED `added` into each removal tuple so the DELETE can be
-                # guarded (added <= snapshot). A row re-upserted by a live render DURING the
-                # long disk walk has a newer `added` and must survive — otherwise we would
-                # delete a just-rendered file and force a spurious re-download. See
-                # remove_media_file_ids_if_unchanged_sync.
-                removed_entries = [
-                    (r['channel'], r['post_id'], r['file_unique_id'], r['added'])
-                    for r in media_files
-                    if (r['channel'], r['post_id'], r['file_unique_id']) not in updated_set
-                ]
-                if removed_entries:
-                    await asyncio.to_thread(remove_media_file_ids_if_unchanged_sync, DB_PATH, removed_entries)
-                    logger.info(f"cache_sweep: purged {len(removed_entries)} entries "
-                                f"({files_removed} files removed from disk)")
+                # An expired row is purged even when its file was already gone from disk
+                # (nothing removed), so a fileless-but-expired row never lingers in SQLite.
+                # The DELETE is guarded (added <= snapshot): a row re-rendered during the
+                # pass survives instead of forcing a spurious re-download.
+                purged, files_removed = await asyncio.to_thread(expire_cached_files_sync, DB_PATH, cache_dir, cutoff)
+                if purged:
+                    logger.info(f"cache_sweep: purged {purged} entries ({files_removed} files removed from disk)")
             except Exception as e:
                 logger.error(f"Failed to remove old entries from SQLite: {str(e)}")
 
-            await download_new_files(updated_media_files, cache_dir)
+            try:
+                files_removed += await _enforce_cache_budget_db()
+            except Exception as e:
+                logger.error(f"cache_budget: pass failed: {str(e)}")
+
+            try:
+                temp_removed, dropped_keys = await asyncio.to_thread(sweep_indexed_untracked_sync, DB_PATH, cache_dir)
+                if dropped_keys:
+                    await write_async(_op_remove_media_file_ids, DB_PATH, list(dropped_keys))
+                files_removed += temp_removed
+            except Exception as e:
+                logger.error(f"cache_sweep: temp-file sweep failed: {str(e)}")
+
+            await queue_pending_downloads(cache_dir)
 
             # Age-sweep the history/chatinfo cache once per pass (dead channels, orphaned
             # uuid tmp files). MUST run off-loop via to_thread (blocking filesystem walk).
@@ -1457,58 +3166,31 @@ def calculate_cache_stats() -> dict[str, Any]:
     """
     Calculate cache statistics including file count, total size in MB, and time difference in days.
     Returns a dictionary with keys: 'cache_files_count', 'cache_total_size_mb', 'cache_time_diff_days', 'channels'.
-    """
-    base_cache_dir = MEDIA_CACHE_DIR
-    cache_files_count = 0
-    cache_total_size_bytes = 0
-    channels_stats = {}
-    
-    if os.path.isdir(base_cache_dir):
-        # Recursively walk through all subdirectories
-        for root, _, files in os.walk(base_cache_dir):
-            for current_file in files:
-                file_path = os.path.join(root, current_file)
-                file_size = os.path.getsize(file_path)
-                cache_files_count += 1
-                cache_total_size_bytes += file_size
-                
-                # Calculate per-channel statistics
-                rel_path = os.path.relpath(root, base_cache_dir)
-                channel = rel_path.split(os.sep, maxsplit=1)[0]  # First directory is channel
-                
-                if channel not in channels_stats:
-                    channels_stats[channel] = {
-                        'files_count': 0,
-                        'size_mb': 0.0
-                    }
-                
-                channels_stats[channel]['files_count'] += 1
-                channels_stats[channel]['size_mb'] = round(
-                    channels_stats[channel]['size_mb'] + (file_size / (1024 * 1024)), 2
-                )
-                    
-        cache_total_size_mb = round(cache_total_size_bytes / (1024 * 1024), 2)  # rounded size in MB
-    else:
-        cache_files_count = 0
-        cache_total_size_mb = 0
 
-    cache_times = []
+    Reads the aggregates the on-disk file index keeps up to date (see
+    file_io._init_cache_index) and the indexed min/max of `added`: a few rows, whatever the
+    cache size. Blob-store hardlinks share one inode, so their bytes count once in the
+    total; per-channel figures still show what each channel references.
+    """
     try:
-        media_files = get_all_media_file_ids_sync(DB_PATH)
-        for entry in media_files:
-            if "added" in entry:
-                cache_times.append(entry["added"])
+        stats = get_cache_stats_sync(DB_PATH)
     except Exception as e:
-        logger.error(f"Error reading media file IDs from SQLite: {str(e)}")
-    if cache_times:
-        cache_time_diff_seconds = max(cache_times) - min(cache_times)
+        logger.error(f"Error reading cache statistics from SQLite: {str(e)}")
+        return {"cache_files_count": 0, "cache_total_size_mb": 0, "cache_time_diff_days": 0, "channels": {}}
+
+    channels_stats = {
+        channel: {'files_count': count, 'size_mb': round(size / (1024 * 1024), 2)}
+        for channel, (count, size) in stats["channels"].items()
+    }
+    if stats["added_min"] is not None:
+        cache_time_diff_seconds = stats["added_max"] - stats["added_min"]
         cache_time_diff_days = round(cache_time_diff_seconds / 86400, 2)  # rounded to two decimals
     else:
         cache_time_diff_days = 0
 
     return {
-        "cache_files_count": cache_files_count,
-        "cache_total_size_mb": cache_total_size_mb,
+        "cache_files_count": stats["files_count"],
+        "cache_total_size_mb": round(stats["size_bytes"] / (1024 * 1024), 2),  # rounded size in MB
         "cache_time_diff_days": cache_time_diff_days,
         "channels": channels_stats
     }
@@ -1750,6 +3432,11 @@ async def health_check(request: Request, token: str | None = None) -> Response:
             # instead of being silently dropped (issue #60). A non-zero, growing value
             # flags a render regression that would otherwise be invisible.
             "render_failed": get_render_failed_count(),
+            # Rendered-fragment cache of feed posts (entries, hits, misses since start).
+            "feed_fragment_cache": get_fragment_cache_stats(),
+            # Whole-feed output cache (FEED_OUTPUT_CACHE_MB).
+            "feed_output_cache_entries": len(_feed_outputs),
+            "feed_output_cache_bytes": _feed_outputs_size,
             # Rich Messages parse-degradation counters (Kurigram 2.2.24, #83/#84), same
             # pattern as render_failed. A non-zero/growing value flags total rich
             # degradation invisible to the reader; rich_part_seen signals phase-3 activation.
@@ -1763,6 +3450,15 @@ async def health_check(request: Request, token: str | None = None) -> Response:
             # a DC/throttle problem that would otherwise only show as silently-persistent plaques.
             "rich_part_fetch_attempts": get_rich_part_fetch_attempt_count(),
             "rich_part_fetch_failed": get_rich_part_fetch_failed_count(),
+            # Current AIMD-sized background download concurrency (1..ceiling).
+            "bg_download_slots": BACKGROUND_DOWNLOAD_SEMAPHORE.slots,
+            # Small hot media held in the RAM tier (files, bytes of MEDIA_RAM_TIER_MB).
+            "media_ram_tier_files": len(_media_bytes),
+            "media_ram_tier_bytes": _media_bytes_size,
+            # MEDIA_BANDWIDTH_KBPS shaping: seconds each class spent waiting for tokens, and
+            # bytes the background fill borrowed from the idle interactive reserve.
+            "media_bandwidth_wait_seconds": {k: round(v, 1) for k, v in client.bandwidth.waited_seconds.items()},
+            "media_bandwidth_borrowed_bytes": client.bandwidth.borrowed_bytes,
             "config": config_info,
             **cache_stats
         }
@@ -1798,6 +3494,16 @@ async def get_media(channel: str, post_id: int, file_unique_id: str, request: Re
             # Pre-download cache check: serve already-cached files without acquiring a
             # download permit or touching Telegram. The permit now lives inside
             # _download_deduped's runner, so this handler never holds one.
+            media_key = (fs_channel, post_id, file_unique_id)
+            # Hot hit: the metadata index knows the published file, so neither the stat
+            # below nor the one in prepare_file_response is needed.
+            hot = _media_meta_lookup(media_key)
+            if hot is not None:
+                logger.info(f"pre_semaphore_cache_hit: {fs_channel}/{post_id}/{file_unique_id} (indexed)")
+                if not os.path.basename(hot.path).startswith("temp_"):
+                    _access_updates[media_key] = datetime.now().timestamp()
+                return await prepare_file_response(hot.path, request=request, media_key=media_key)
+
             cache_path = media_cache_path(fs_channel, post_id, file_unique_id)
             # ONE off-loop stat (exists()+getsize() collapsed) — also closes the TOCTOU where
             # a file swept between exists() and getsize() would raise into a generic 500; a
@@ -1841,6 +3547,25 @@ async def get_media(channel: str, post_id: int, file_unique_id: str, request: Re
                 return Response(status_code=503, content="Media temporarily unavailable, retry later",
                                 headers={"Retry-After": str(int(backoff_remaining) + 1)})
 
+            # Range-on-demand: a Range request on a large video fetches only the parts it
+            # covers. None means "not a large video / not a single range" -> normal path.
+            range_header = request.headers.get("range")
+            if Config["media_large_video_ranges"] and range_header:
+                ranged = await _large_video_range_response(fs_channel, post_id, file_unique_id, range_header)
+                if ranged is not None:
+                    return ranged
+
+            # Tee mode: a plain GET joins (or starts) a pass-through download and gets the
+            # bytes as they arrive. A Range request can't be answered from a growing file, so
+            # it takes the normal path below and waits for the complete file.
+            if Config["media_stream_passthrough"] and "range" not in request.headers:
+                _ensure_download(fs_channel, post_id, file_unique_id, HTTP_DOWNLOAD_SEMAPHORE, tee=True)
+                tee = _inflight_tees.get((fs_channel, post_id, file_unique_id))
+                if tee is not None:
+                    streamed = await _passthrough_response(tee, (fs_channel, post_id, file_unique_id))
+                    if streamed is not None:
+                        return streamed
+
             # The live-download permit is acquired INSIDE _download_deduped's runner, so ONE
             # live download holds ONE permit no matter how many requests await the shared
             # Future. A saturated semaphore surfaces as DownloadAdmissionTimeout (-> 503
@@ -1908,6 +3633,185 @@ async def get_media(channel: str, post_id: int, file_unique_id: str, request: Re
     logger.error(f"get_media reached unexpected state for {channel}/{post_id}/{file_unique_id}")
     raise HTTPException(status_code=500, detail="Internal server error: Unexpected state reached in media handling.")
 
+# --------------------------------------------------------------------------- #
+# Media previews (resized derivatives for feed list views)
+#
+# /media/{channel}/{post_id}/{fid}/{preset}/{digest} serves a JPEG that fits the preset's
+# box instead of the full-resolution original; the digest signs the path up to the preset
+# with the same scheme as the original URL. Image presets are rendered from the cached
+# original (downloaded through the normal deduped path on a miss); poster presets from the
+# largest Telegram thumbnail of a video, so a feed <video> shows a still without pulling
+# the video. The rendered file is cached next to the original (see media_preview).
+# --------------------------------------------------------------------------- #
+
+# (channel, post_id, fid, preset) -> the task rendering that preview, so concurrent
+# requests for one cold preview share a single download + render.
+_preview_tasks: dict[tuple[str, int, str, str], asyncio.Task] = {}
+# The sweeper expires a preview by mtime (see _UNTRACKED_MAX_AGE), so a served preview gets
+# its mtime refreshed once it is older than this. Debounced like TEMP_MTIME_REFRESH_INTERVAL,
+# since the mtime is also the preview's ETag; far below the 20-day expiry window.
+PREVIEW_MTIME_REFRESH_INTERVAL = 86400  # seconds
+
+_THUMB_MEDIA_ATTRS = ('video', 'animation', 'video_note', 'live_photo', 'document')
+
+
+def _largest_thumb(message: Message, file_unique_id: str):
+    """The biggest Telegram thumbnail of the media `file_unique_id` in `message`, or None."""
+    for attr in _THUMB_MEDIA_ATTRS:
+        media_obj = getattr(message, attr, None)
+        if media_obj is None or getattr(media_obj, 'file_unique_id', None) != file_unique_id:
+            continue
+        thumbs = [t for t in (getattr(media_obj, 'thumbs', None) or []) if getattr(t, 'file_id', None)]
+        if thumbs:
+            return max(thumbs, key=lambda t: (t.width or 0) * (t.height or 0))
+    return None
+
+
+async def _preview_source(media_key: tuple[str, int, str]) -> str:
+    """Path of the cached original for media_key, downloading it on a miss."""
+    channel, post_id, file_unique_id = media_key
+    hot = _media_meta_lookup(media_key)
+    if hot is not None:
+        return hot.path
+    cache_path = media_cache_path(channel, post_id, file_unique_id)
+    cache_size = await asyncio.to_thread(_stat_size_or_none, cache_path)
+    if cache_size:
+        _access_updates[media_key] = datetime.now().timestamp()
+        return cache_path
+    if _download_backoff_remaining(media_key) > 0:
+        raise HTTPException(status_code=404, detail="File not found")
+    file_path = await _download_deduped(channel, post_id, file_unique_id, HTTP_DOWNLOAD_SEMAPHORE)
+    if not file_path:
+        raise HTTPException(status_code=404, detail="File not found")
+    return file_path
+
+
+async def _render_poster(media_key: tuple[str, int, str], preset: str, preview_path: str) -> None:
+    """Render a poster preview from the video's largest Telegram thumbnail.
+
+    The get_messages + thumbnail download pair is a live Telegram fetch like an original's:
+    it holds a HTTP_DOWNLOAD_SEMAPHORE permit, and a failure arms the download backoff for
+    the (media_key, preset) pair, keyed by the preview's file name, so a reader retrying a
+    broken poster does not hammer Telegram.
+    """
+    channel, post_id, file_unique_id = media_key
+    backoff_key = (channel, post_id, media_preview.preview_name(file_unique_id, preset))
+    if _download_backoff_remaining(backoff_key) > 0:
+        raise HTTPException(status_code=404, detail="No preview available")
+    channel_id: Union[str, int] = int(channel) if channel.startswith('-100') else channel
+    thumb_path = f"{preview_path}.part.{uuid.uuid4().hex}"
+    try:
+        await asyncio.wait_for(HTTP_DOWNLOAD_SEMAPHORE.acquire(), timeout=30)
+    except asyncio.TimeoutError:
+        raise DownloadAdmissionTimeout("download admission timed out")
+    try:
+        message = await client.safe_get_messages(channel_id, post_id)
+        thumb = _largest_thumb(message, file_unique_id) if message is not None else None
+        if thumb is None:
+            _record_download_failure(backoff_key, "permanent")
+            raise HTTPException(status_code=404, detail="No preview available")
+        await asyncio.to_thread(os.makedirs, os.path.dirname(thumb_path), exist_ok=True)
+        await client.safe_download_media(thumb.file_id, thumb_path, timeout=float(Config["media_download_timeout_min"]))
+    except HTTPException:
+        raise
+    except Exception:
+        _record_download_failure(backoff_key, "transient")
+        await asyncio.to_thread(_remove_quietly, thumb_path)
+        raise
+    finally:
+        HTTP_DOWNLOAD_SEMAPHORE.release()
+    try:
+        await asyncio.to_thread(media_preview.render_preview, thumb_path, preview_path, preset)
+    finally:
+        await asyncio.to_thread(_remove_quietly, thumb_path)
+
+
+async def _build_preview(media_key: tuple[str, int, str], preset: str, preview_path: str) -> os.stat_result:
+    if preset in media_preview.POSTER_PRESETS:
+        await _render_poster(media_key, preset, preview_path)
+    else:
+        source = await _preview_source(media_key)
+        await asyncio.to_thread(media_preview.render_preview, source, preview_path, preset)
+    await asyncio.to_thread(_update_cache_index_sync, [preview_path])
+    logger.info(f"media_preview_rendered: {'/'.join(map(str, media_key))} preset={preset}")
+    return await asyncio.to_thread(os.stat, preview_path)
+
+
+def _refresh_preview_mtime_sync(preview_path: str, st: os.stat_result) -> os.stat_result:
+    """Touch a served preview so the sweeper keeps it; return the stat to serve it with."""
+    try:
+        os.utime(preview_path, None)
+        return os.stat(preview_path)
+    except OSError as e:
+        logger.debug(f"Failed to refresh mtime for {preview_path}: {e}")
+        return st
+
+
+async def _ensure_preview(media_key: tuple[str, int, str], preset: str, preview_path: str) -> os.stat_result:
+    """Render the preview once for all concurrent requests and return its stat."""
+    key = (*media_key, preset)
+    task = _preview_tasks.get(key)
+    if task is None:
+        task = asyncio.get_running_loop().create_task(_build_preview(media_key, preset, preview_path))
+        _preview_tasks[key] = task
+
+        def _done(t: asyncio.Task) -> None:
+            _preview_tasks.pop(key, None)
+            if not t.cancelled():
+                t.exception()  # retrieved: every waiter may have gone away
+
+        task.add_done_callback(_done)
+    return await asyncio.shield(task)
+
+
+@app.get("/media/{channel}/{post_id}/{file_unique_id}/{preset}/{digest}", response_model=None)
+async def get_media_preview(channel: str, post_id: int, file_unique_id: str, preset: str, digest: str,
+                            exp: int | None = None) -> Response:
+    url = f"{channel}/{post_id}/{file_unique_id}/{preset}"
+    verified = verify_media_digest(url, digest) if exp is None else verify_media_digest(url, digest, exp)
+    if not verified:
+        logger.warning(f"Invalid media digest for {url} (presented digest {digest} rejected)")
+        raise HTTPException(status_code=403, detail="Invalid URL signature")
+    if preset not in media_preview.PRESETS:
+        raise HTTPException(status_code=404, detail="Unknown preview preset")
+
+    fs_channel = canonical_channel_key(channel)
+    media_key = (fs_channel, post_id, file_unique_id)
+    preview_path = media_cache_path(fs_channel, post_id, media_preview.preview_name(file_unique_id, preset))
+    try:
+        try:
+            stat_result = await asyncio.to_thread(os.stat, preview_path)
+        except FileNotFoundError:
+            stat_result = await _ensure_preview(media_key, preset, preview_path)
+        else:
+            if time.time() - stat_result.st_mtime > PREVIEW_MTIME_REFRESH_INTERVAL:
+                stat_result = await asyncio.to_thread(_refresh_preview_mtime_sync, preview_path, stat_result)
+    except HTTPException:
+        raise
+    except ZeroSizeFileError:
+        return Response(status_code=503, content="Preview source was empty, please retry", headers={"Retry-After": "10"})
+    except DownloadAdmissionTimeout:
+        return Response(status_code=503, content="Server busy, please retry", headers={"Retry-After": "30"})
+    except asyncio.TimeoutError:
+        return Response(status_code=504, content="Download timeout", headers={"Retry-After": "10"})
+    except errors.FloodWait as e:
+        retry_after = min(int(e.value) + random.randint(1, 30), 300)
+        return Response(status_code=429, content="Telegram flood wait", headers={"Retry-After": str(retry_after)})
+    except errors.RPCError as e:
+        if getattr(e, "CODE", None) == 400:
+            raise HTTPException(status_code=404, detail="File not found in Telegram") from e
+        return Response(status_code=503, content="Telegram temporarily unavailable, retry later",
+                        headers={"Retry-After": "60"})
+    except OSError as e:
+        # Not an image (PIL.UnidentifiedImageError) or unreadable: there is no preview to
+        # give, the reader falls back to nothing rather than to the full original.
+        logger.warning(f"media_preview_failed: {url}: {e}")
+        raise HTTPException(status_code=404, detail="No preview available") from e
+    except Exception as e:
+        logger.error(f"Failed to get media preview for {url}: {e}")
+        raise HTTPException(status_code=500, detail="Failed to get media preview") from e
+    return _cached_file_response(preview_path, stat_result, "image/jpeg")
+
 # --------------------------------------------------------------------------- #
 # Conditional GET for feeds (issue #62)
 #
@@ -1916,7 +3820,8 @@ async def get_media(channel: str, post_id: int, file_unique_id: str, request: Re
 # saving the response bandwidth and the reader-side parse. The server still renders
 # the feed to derive the ETag — the issue mandates the ETag be a sha256 of the
 # ACTUAL serialized body (a content signature), so it stays in lock-step with what
-# we would have sent; the win is on the wire and in the reader, not on the render.
+# we would have sent; the win is on the wire and in the reader. The whole-feed output
+# cache below spares the render too while the history snapshot is unchanged.
 # --------------------------------------------------------------------------- #
 
 # Cache-Control uses `private` on purpose: the feed URL carries an auth token and must
@@ -1997,10 +3902,8 @@ def _feed_not_modified(request: Request, etag: str, last_modified: str | None) -
     return False
 
 
-def _build_feed_response(request: Request, body: str, media_type: str) -> Response:
+def _feed_response(request: Request, body: str, media_type: str, etag: str, last_modified: str | None) -> Response:
     """Attach ETag/Last-Modified/Cache-Control and short-circuit to 304 when unchanged."""
-    etag = _feed_etag(body)
-    last_modified = _feed_last_modified(body)
     headers = {
         "ETag": etag,
         "Cache-Control": f"private, max-age={RSS_CACHE_MAX_AGE}",
@@ -2013,6 +3916,77 @@ def _build_feed_response(request: Request, body: str, media_type: str) -> Respon
     return Response(content=body, media_type=media_type, headers=headers)
 
 
+# --------------------------------------------------------------------------- #
+# Whole-feed output cache
+#
+# Between two refreshes of a channel's history snapshot a feed URL renders to the same
+# document. The rendered body is kept with its ETag and Last-Modified, keyed by the
+# request's parameters and tagged with the snapshot it was built from
+# (tg_cache.history_snapshot_token) and the render settings. While both still match, a
+# poll is answered from the entry, 304 or the stored body, without reading history or
+# rendering anything. A body is stored only if the snapshot token was the same before
+# and after its render, so an entry never names a snapshot it was not built from.
+# Byte-budgeted LRU; Config feed_output_cache_mb (FEED_OUTPUT_CACHE_MB), 0 disables.
+# --------------------------------------------------------------------------- #
+class _FeedOutput(NamedTuple):
+    body: str
+    media_type: str
+    etag: str
+    last_modified: str | None
+    snapshot: tuple
+    fingerprint: tuple
+
+
+_FEED_OUTPUT_BUDGET = Config["feed_output_cache_mb"] * 1024 * 1024
+_feed_outputs: "OrderedDict[tuple, _FeedOutput]" = OrderedDict()
+_feed_outputs_size = 0
+
+
+def _feed_fingerprint() -> tuple:
+    return (render_fingerprint(Config['media_feed_previews']), Config['time_based_merge'])
+
+
+def _feed_snapshot(channel: str, output_type: str, limit: int) -> tuple | None:
+    if _FEED_OUTPUT_BUDGET <= 0 or output_type not in ('rss', 'html'):
+        return None
+    return history_snapshot_token(channel, feed_history_limit(output_type, limit))
+
+
+def _feed_output_lookup(feed_key: tuple) -> _FeedOutput | None:
+    """The cached output of `feed_key` if its snapshot and render settings are current."""
+    entry = _feed_outputs.get(feed_key)
+    if entry is None:
+        return None
+    if entry.snapshot != _feed_snapshot(feed_key[0], feed_key[1], feed_key[2]) or entry.fingerprint != _feed_fingerprint():
+        _drop_feed_output(feed_key)
+        return None
+    _feed_outputs.move_to_end(feed_key)
+    return entry
+
+
+def _drop_feed_output(feed_key: tuple) -> None:
+    global _feed_outputs_size
+    entry = _feed_outputs.pop(feed_key, None)
+    if entry is not None:
+        _feed_outputs_size -= len(entry.body)
+
+
+def _respond_and_cache_feed(request: Request, feed_key: tuple, snapshot: tuple | None,
+                            body: str, media_type: str) -> Response:
+    """Build the feed response and keep the output if `snapshot` is still the current one."""
+    global _feed_outputs_size
+    etag = _feed_etag(body)
+    last_modified = _feed_last_modified(body)
+    if snapshot is not None and len(body) <= _FEED_OUTPUT_BUDGET \
+            and snapshot == _feed_snapshot(feed_key[0], feed_key[1], feed_key[2]):
+        _drop_feed_output(feed_key)
+        _feed_outputs[feed_key] = _FeedOutput(body, media_type, etag, last_modified, snapshot, _feed_fingerprint())
+        _feed_outputs_size += len(body)
+        while _feed_outputs_size > _FEED_OUTPUT_BUDGET:
+            _drop_feed_output(next(iter(_feed_outputs)))
+    return _feed_response(request, body, media_type, etag, last_modified)
+
+
 @app.get("/rss/{channel}", response_class=Response)
 @app.get("/rss/{channel}/{token}", response_class=Response)
 async def get_rss_feed(channel: str,
@@ -2025,10 +3999,18 @@ async def get_rss_feed(channel: str,
                         merge_seconds: int = 5,
                         ) -> Response:
     _enforce_token(request, token, "RSS endpoint")
+    _note_feed_poll(channel)
         
     try:
         start_time = time.time()
 
+        feed_key = (channel, output_type, limit, exclude_flags, exclude_text, merge_seconds)
+        cached = _feed_output_lookup(feed_key)
+        if cached is not None:
+            logger.info(f"feed_output_cache_hit: channel {channel}, output_type {output_type}")
+            return _feed_response(request, cached.body, cached.media_type, cached.etag, cached.last_modified)
+        snapshot = _feed_snapshot(channel, output_type, limit)
+
         if output_type == 'rss':
             rss_content = await generate_channel_rss(channel,
                                                     client=client.client, 
@@ -2038,7 +4020,7 @@ async def get_rss_feed(channel: str,
                                                     merge_seconds=merge_seconds)
             elapsed_time = time.time() - start_time
             logger.info(f"rss_generation_timing: channel {channel}, generated in {elapsed_time:.3f} seconds")
-            return _build_feed_response(request, rss_content, "application/xml")
+            return _respond_and_cache_feed(request, feed_key, snapshot, rss_content, "application/xml")
         elif output_type == 'html':
             rss_content = await generate_channel_html(channel,
                                                     client=client.client, 
@@ -2048,7 +4030,7 @@ async def get_rss_feed(channel: str,
                                                     merge_seconds=merge_seconds)
             elapsed_time = time.time() - start_time
             logger.info(f"html_generation_timing: channel {channel}, generated in {elapsed_time:.3f} seconds")
-            return _build_feed_response(request, rss_content, "text/html")
+            return _respond_and_cache_feed(request, feed_key, snapshot, rss_content, "text/html")
         else:
             raise HTTPException(status_code=400, detail=f"invalid_output_type: {output_type}")
     except ValueError as e:
@@ -82,6 +82,12 @@ def get_settings() -> dict[str, Any]:
         print(f"API_PORT must be a valid integer, got: {os.getenv('API_PORT')!r}", flush=True)
         sys.exit(1)
 
+    # Reverse-proxy offload of cached media: "" (off), "nginx" or "sendfile"
+    media_accel_redirect = os.getenv("MEDIA_ACCEL_REDIRECT", "").strip().lower()
+    if media_accel_redirect not in ("", "nginx", "sendfile"):
+        print(f"MEDIA_ACCEL_REDIRECT must be empty, 'nginx' or 'sendfile', got: {media_accel_redirect!r}", flush=True)
+        sys.exit(1)
+
     # Local helper to parse int env vars with a default and exit on a bad value
     def _parse_int_env(name: str, default: int, minimum: int = 1) -> int:
         raw = os.getenv(name)
@@ -97,6 +103,18 @@ def get_settings() -> dict[str, Any]:
             sys.exit(1)
         return value
 
+    # Share (%) of MEDIA_BANDWIDTH_KBPS reserved for downloads a reader is waiting on
+    media_bandwidth_interactive_pct = _parse_int_env("MEDIA_BANDWIDTH_INTERACTIVE_PCT", 50, minimum=0)
+    if media_bandwidth_interactive_pct > 100:
+        print(f"MEDIA_BANDWIDTH_INTERACTIVE_PCT must be <= 100, got: {media_bandwidth_interactive_pct}", flush=True)
+        sys.exit(1)
+
+    # Background download batch size; one get_messages call resolves at most 100 ids
+    media_bg_batch_max = _parse_int_env("MEDIA_BG_BATCH_MAX", 50)
+    if media_bg_batch_max > 100:
+        print(f"MEDIA_BG_BATCH_MAX must be <= 100, got: {media_bg_batch_max}", flush=True)
+        sys.exit(1)
+
     return {
         "tg_api_id": tg_api_id_int,
         "tg_api_hash": tg_api_hash,
@@ -146,6 +164,25 @@ def get_settings() -> dict[str, Any]:
         # the 60s floor is rejected at startup (_parse_int_env exits) so a misconfiguration
         # can never turn the sweeper into a hot loop.
         "cache_sweep_interval": _parse_int_env("CACHE_SWEEP_INTERVAL", 900, minimum=60),
+        # Cached /media files whose path, stat and MIME type are kept in memory (LRU), so a
+        # repeat hit is answered without a stat or a MIME lookup. 0 disables the index.
+        "media_meta_cache_entries": _parse_int_env("MEDIA_META_CACHE_ENTRIES", 20000, minimum=0),
+        # RAM tier: hot cached media up to MEDIA_RAM_TIER_FILE_KB each is served from memory,
+        # within a MEDIA_RAM_TIER_MB byte budget (LRU). 0 in either disables the tier.
+        "media_ram_tier_file_kb": _parse_int_env("MEDIA_RAM_TIER_FILE_KB", 64, minimum=0),
+        "media_ram_tier_mb": _parse_int_env("MEDIA_RAM_TIER_MB", 32, minimum=0),
+        # Download-queue items the background worker takes per batch; their messages are
+        # resolved with one get_messages call per channel (Telegram caps that at 100 ids).
+        "media_bg_batch_max": media_bg_batch_max,
+        # Rows kept in the persistent background download queue; the lowest-priority ones
+        # beyond it are dropped (the next sweep re-queues what is still missing).
+        "media_download_queue_max": _parse_int_env("MEDIA_DOWNLOAD_QUEUE_MAX", 5000),
+        # Priority bonus, in seconds of post recency, per doubling of a channel's feed poll
+        # count: media of feeds that are actually read is cached first. 0 = newest first only.
+        "media_queue_popularity_weight": _parse_int_env("MEDIA_QUEUE_POPULARITY_WEIGHT", 6 * 3600, minimum=0),
+        # Rows per SQLite page in the incremental cache sweep (expired rows, not-yet-on-disk
+        # rows, stale index entries): bounds the memory and the write transaction of a pass.
+        "media_sweep_batch_rows": _parse_int_env("MEDIA_SWEEP_BATCH_ROWS", 500),
         # Size of the asyncio default ThreadPoolExecutor. SQLite/python-magic/pickle/os.walk
         # all run via asyncio.to_thread; the interpreter default (min(32, cpu+4)) is only 5-6
         # on a 1-2 CPU container, which starves those under load. 32 gives ample headroom.
@@ -156,11 +193,78 @@ def get_settings() -> dict[str, Any]:
         # only a blast-radius limiter — the real cure for a zombie media connection is the
         # download-timeout-triggered restart below.
         "tg_max_concurrent_transmissions": _parse_int_env("TG_MAX_CONCURRENT_TRANSMISSIONS", 3),
+        # Transmissions of the above the adaptive background download slots never take, so
+        # a cache run always leaves room for downloads a reader is waiting on.
+        "media_bg_interactive_reserve": _parse_int_env("MEDIA_BG_INTERACTIVE_RESERVE", 1, minimum=0),
         # After this many CONSECUTIVE media-download timeouts, force an in-process client
         # restart to rebuild the (zombie) media-DC connection. Any successful download
         # resets the streak, so this only fires on a genuine death loop, not on the odd
         # slow large-video timeout. The watchdog cannot catch this — it probes the main DC.
         "media_timeout_restart_threshold": _parse_int_env("MEDIA_TIMEOUT_RESTART_THRESHOLD", 5),
+        # Interval (seconds) of the media-DC keep-alive. Every pass makes sure an
+        # export-authorized media session exists for each DC our downloads were served from
+        # and pings it, so the first /media miss after an idle period (or after a
+        # _restart_client, which tears all media sessions down) does not pay for the
+        # connect + auth.ExportAuthorization/ImportAuthorization round-trips. 0 disables it.
+        "media_keepalive_interval": _parse_int_env("MEDIA_KEEPALIVE_INTERVAL", 240, minimum=0),
+        # Token-bucket cap (KB/s) on media-DC download traffic, paid per received chunk.
+        # MEDIA_BANDWIDTH_INTERACTIVE_PCT of it is reserved for /media downloads a reader is
+        # waiting on; the background cache fill gets the rest and borrows the reserve only
+        # while no reader download is running, so a cache run can't starve a reader. 0 = off.
+        "media_bandwidth_kbps": _parse_int_env("MEDIA_BANDWIDTH_KBPS", 0, minimum=0),
+        "media_bandwidth_interactive_pct": media_bandwidth_interactive_pct,
+        # Tee mode for cold /media misses: the download is streamed chunk by chunk into its
+        # .part file and the bytes are sent to every waiting reader as they arrive, instead of
+        # after the whole file landed. Only plain (non-Range) GETs are streamed — a Range
+        # request still waits for the complete file and gets FileResponse's 206 handling.
+        "media_stream_passthrough": os.getenv("MEDIA_STREAM_PASSTHROUGH", "False").strip() in ["True", "true"],
+        # Range-on-demand for >100MB videos: a Range request is answered from a sparse on-disk
+        # cache of Telegram's 1 MiB file parts, fetching only the parts it covers, instead of
+        # downloading the whole video into temp_<fid> first. Seeking costs only what is watched.
+        "media_large_video_ranges": os.getenv("MEDIA_LARGE_VIDEO_RANGES", "False").strip() in ["True", "true"],
+        # Parts fetched per Telegram round-trip when a Range request needs a missing part:
+        # readahead for the sequential reads a playing video makes.
+        "media_range_fetch_chunks": _parse_int_env("MEDIA_RANGE_FETCH_CHUNKS", 4),
+        # A >100MB video downloads into a stable temp_<fid>.resume partial with a progress
+        # sidecar instead of a throwaway .part, so a timeout / restart / crash resumes from the
+        # last complete 1 MiB part on the next request instead of starting over from byte 0.
+        # Opt-in: the partial (up to the video's full size) stays on disk for up to 24h.
+        "media_resume_large_downloads": os.getenv("MEDIA_RESUME_LARGE_DOWNLOADS", "False").strip() in ["True", "true"],
+        # Content-addressed blob store: every cached file is also hardlinked as
+        # data/blobs/<fid[:2]>/<file_unique_id> (file_unique_id is globally unique in Telegram),
+        # so the same file forwarded/cross-posted into another post is linked from the blob
+        # instead of downloaded and stored again. Hardlinks need blobs/ and cache/ on one FS,
+        # so it is opt-in.
+        "media_blob_store": os.getenv("MEDIA_BLOB_STORE", "False").strip() in ["True", "true"],
+        # Feeds (RSS and /html) reference resized previews instead of the originals: photos
+        # as an 800px JPEG, videos as <video preload="none"> with a poster cut from
+        # Telegram's own thumbnail. The single-post page keeps the originals either way.
+        "media_feed_previews": os.getenv("MEDIA_FEED_PREVIEWS", "False").strip() in ["True", "true"],
+        # Rendered + sanitized feed posts kept in memory (LRU, entries) and reused while the
+        # post's messages and the render settings are unchanged, so a feed poll renders only
+        # new or edited posts. 0 disables the cache.
+        "feed_fragment_cache_size": _parse_int_env("FEED_FRAGMENT_CACHE_SIZE", 5000, minimum=0),
+        # Worker processes that render feeds served from the history cache, so concurrent
+        # polls use several cores instead of sharing one under the GIL. 0 renders in a
+        # thread of the server process, as before.
+        "feed_render_processes": _parse_int_env("FEED_RENDER_PROCESSES", 0, minimum=0),
+        # Memory budget (MB) for whole rendered feeds kept with their ETag/Last-Modified, so a
+        # poll of an unchanged history snapshot is answered without rendering. 0 disables.
+        "feed_output_cache_mb": _parse_int_env("FEED_OUTPUT_CACHE_MB", 32, minimum=0),
+        # Cached media bodies are handed to the reverse proxy instead of being streamed by
+        # uvicorn: the request is validated and the headers built as always, then the
+        # response carries an internal redirect — "nginx" sends X-Accel-Redirect to
+        # <MEDIA_ACCEL_PREFIX>/<path under data/cache>, "sendfile" sends X-Sendfile with the
+        # absolute file path (lighttpd, Apache mod_xsendfile). See docs/nginx-accel-redirect.conf.
+        "media_accel_redirect": media_accel_redirect,
+        "media_accel_prefix": os.getenv("MEDIA_ACCEL_PREFIX", "/_media_cache").strip() or "/_media_cache",
+        # Byte budget (MB) for the tracked media cache, enforced on every cache sweep: when the
+        # cached files exceed it, the least-recently-used ones (by the access/render time in
+        # media_file_ids.added) are evicted until it fits. 0 = no budget (only the 20-day age
+        # rule). The optional per-channel quota (MB, 0 = none) caps each channel the same way,
+        # so one video-heavy channel cannot push everyone else's media out.
+        "media_cache_max_mb": _parse_int_env("MEDIA_CACHE_MAX_MB", 0, minimum=0),
+        "media_cache_channel_max_mb": _parse_int_env("MEDIA_CACHE_CHANNEL_MAX_MB", 0, minimum=0),
         # A post replying to a NEIGHBOURING post of its own channel quotes it in full, so two
         # adjacent feed entries read as half the same text — Telegram itself only shows a short
         # preview there. Such a quote is cut to this many VISIBLE characters (200 ≈ the preview
@@ -4,10 +4,16 @@
 # flake8: noqa
 # pylint: disable=missing-function-docstring
 
+import asyncio
 import os
+import queue
 import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
 from contextlib import contextmanager
-from typing import List
+from typing import Callable, List
 
 # Path to SQLite database file
 DB_PATH = os.path.join(os.path.abspath("./data"), "media_file_ids.db")
@@ -23,7 +29,11 @@ def _open_db(db_path: str) -> sqlite3.Connection:
 
 @contextmanager
 def _db_connection(db_path: str):
-    """Context manager that opens a WAL-mode SQLite connection and ensures it is closed."""
+    """Context manager that opens a WAL-mode SQLite connection and ensures it is closed.
+
+    Only for one-off schema work (init_db_sync); regular writes go through the writer
+    thread and reads through _read_connection.
+    """
     conn = _open_db(db_path)
     try:
         yield conn
@@ -35,6 +45,193 @@ def _db_connection(db_path: str):
         conn.close()
 
 
+def _pin_db(db_path: str) -> int | None:
+    """Open an fd on the database file so its inode cannot be reused while we hold it."""
+    try:
+        return os.open(db_path, os.O_RDONLY)
+    except OSError:
+        return None
+
+
+def _is_current(db_path: str, pin: int | None) -> bool:
+    """True while `db_path` is still the file `pin` was opened on (not replaced/removed)."""
+    if pin is None:
+        return False
+    try:
+        return os.stat(db_path).st_ino == os.fstat(pin).st_ino
+    except OSError:
+        return False
+
+
+def _close_pinned(conn: sqlite3.Connection, pin: int | None) -> None:
+    conn.close()
+    if pin is not None:
+        os.close(pin)
+
+
+# --------------------------------------------------------------------------- #
+# Writes: one long-lived writer thread per database file. It owns one connection and
+# drains a queue of write operations, committing everything that arrived within
+# _WRITE_BATCH_WINDOW (at most _WRITE_BATCH_MAX operations) as ONE transaction, so a feed
+# burst of upserts / MIME updates / access flushes costs one fsync instead of a connect +
+# PRAGMAs + commit each, and writers never contend for the database lock among
+# themselves. Each operation runs under its own SAVEPOINT: a failing one is rolled back
+# and reports its exception without taking the rest of the batch down.
+# --------------------------------------------------------------------------- #
+_WRITE_BATCH_MAX = 256
+_WRITE_BATCH_WINDOW = 0.002  # seconds to wait for more operations after the first
+_WRITER_IDLE_EXIT = 60.0     # an idle writer closes its connection and its thread exits
+
+
+class _Writer:
+    """The writer thread + queue of one database file."""
+
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        self.ops: "queue.Queue[tuple]" = queue.Queue()
+        self.thread: threading.Thread | None = None
+
+    def _connection(self, conn, pin):
+        # Reopen if the database file was replaced or removed under us (tests, restores):
+        # a connection to the old inode would keep writing into a deleted file.
+        if conn is not None and _is_current(self.db_path, pin):
+            return conn, pin
+        if conn is not None:
+            _close_pinned(conn, pin)
+        conn = _open_db(self.db_path)
+        conn.isolation_level = None  # explicit BEGIN/COMMIT below
+        return conn, _pin_db(self.db_path)
+
+    def _run(self) -> None:
+        conn, pin = None, None
+        try:
+            while True:
+                try:
+                    batch = [self.ops.get(timeout=_WRITER_IDLE_EXIT)]
+                except queue.Empty:
+                    with _writers_lock:
+                        if self.ops.empty():
+                            self.thread = None
+                            return
+                    continue
+                deadline = time.monotonic() + _WRITE_BATCH_WINDOW
+                while len(batch) < _WRITE_BATCH_MAX:
+                    try:
+                        batch.append(self.ops.get(timeout=max(0.0, deadline - time.monotonic())))
+                    except queue.Empty:
+                        break
+                try:
+                    conn, pin = self._connection(conn, pin)
+                except Exception as e:
+                    for fut, _op, _args, _kwargs in batch:
+                        if fut.set_running_or_notify_cancel():
+                            fut.set_exception(e)
+                    continue
+                self._commit(conn, batch)
+        finally:
+            if conn is not None:
+                _close_pinned(conn, pin)
+
+    @staticmethod
+    def _commit(conn: sqlite3.Connection, batch: list) -> None:
+        results = []
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            for fut, op, args, kwargs in batch:
+                if not fut.set_running_or_notify_cancel():
+                    continue
+                conn.execute("SAVEPOINT op")
+                try:
+                    result = op(conn, *args, **kwargs)
+                except Exception as e:
+                    conn.execute("ROLLBACK TO op")
+                    conn.execute("RELEASE op")
+                    fut.set_exception(e)
+                    continue
+                conn.execute("RELEASE op")
+                results.append((fut, result))
+            conn.execute("COMMIT")
+        except Exception as e:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            for fut, _result in results:
+                fut.set_exception(e)
+            for fut, *_rest in batch:
+                if not fut.done():
+                    fut.set_exception(e)
+            return
+        for fut, result in results:
+            fut.set_result(result)
+
+
+_writers: dict[str, _Writer] = {}
+_writers_lock = threading.Lock()
+
+
+def submit_write(db_path: str, op: Callable, *args, **kwargs) -> Future:
+    """Queue `op(conn, *args, **kwargs)` on the writer thread of `db_path`.
+
+    Returns a concurrent.futures.Future resolved once the transaction holding the operation
+    has committed; async code awaits it via write_async.
+    """
+    fut: Future = Future()
+    with _writers_lock:
+        writer = _writers.get(db_path)
+        if writer is None:
+            writer = _writers[db_path] = _Writer(db_path)
+        writer.ops.put((fut, op, args, kwargs))
+        if writer.thread is None:
+            writer.thread = threading.Thread(target=writer._run, name="sqlite-writer", daemon=True)
+            writer.thread.start()
+    return fut
+
+
+async def write_async(op: Callable, db_path: str, *args, **kwargs):
+    """Run the writer operation `op(conn, *args)` from async code, awaiting its future directly.
+
+    No pool thread is held while the write waits for its batch to commit. Like a to_thread
+    call, a write already queued still happens if the awaiting task is cancelled.
+    """
+    return await asyncio.shield(asyncio.wrap_future(submit_write(db_path, op, *args, **kwargs)))
+
+
+# --------------------------------------------------------------------------- #
+# Reads: WAL readers never block the writer, so each thread keeps a few persistent
+# connections (one per database file, LRU-capped) instead of connecting per query.
+# --------------------------------------------------------------------------- #
+_READ_CONNECTIONS_PER_THREAD = 4
+_read_local = threading.local()
+
+
+@contextmanager
+def _read_connection(db_path: str):
+    """Yield this thread's persistent read connection to `db_path` (rows are sqlite3.Row)."""
+    conns = getattr(_read_local, "conns", None)
+    if conns is None:
+        conns = _read_local.conns = OrderedDict()
+    cached = conns.pop(db_path, None)
+    if cached is not None and not _is_current(db_path, cached[1]):
+        _close_pinned(*cached)  # the file was replaced: never read a stale inode
+        cached = None
+    if cached is None:
+        conn = _open_db(db_path)
+        conn.isolation_level = None  # autocommit: no read transaction left open between calls
+        conn.row_factory = sqlite3.Row
+        cached = (conn, _pin_db(db_path))
+    try:
+        yield cached[0]
+    except sqlite3.Error:
+        _close_pinned(*cached)  # do not reuse a connection in an unknown state
+        raise
+    except BaseException:
+        conns[db_path] = cached
+        raise
+    conns[db_path] = cached
+    while len(conns) > _READ_CONNECTIONS_PER_THREAD:
+        _path, old = conns.popitem(last=False)
+        _close_pinned(*old)
+
+
 def init_db_sync(db_path: str) -> None:
     """Create the media_file_ids table if it does not exist."""
     with _db_connection(db_path) as conn:
@@ -55,45 +252,263 @@ def init_db_sync(db_path: str) -> None:
         except sqlite3.OperationalError as e:
             if "duplicate column name" not in str(e):
                 raise  # Re-raise any OperationalError that is not "duplicate column name"
+        # on_disk: 1 once the sweeper has seen the cached file, so the download pass only looks
+        # at rows that are not on disk yet instead of stat()ing the whole table every sweep.
+        # Existing rows start at 0 and are confirmed (one stat each) by the first sweep.
+        try:
+            conn.execute("ALTER TABLE media_file_ids ADD COLUMN on_disk INTEGER NOT NULL DEFAULT 0")
+        except sqlite3.OperationalError as e:
+            if "duplicate column name" not in str(e):
+                raise
+        # file_id / dc_id: the Telegram file reference seen by the renderer, so a download can
+        # skip re-fetching the message (see api_server.download_media_file).
+        for column in ("file_id TEXT", "dc_id INTEGER"):
+            try:
+                conn.execute(f"ALTER TABLE media_file_ids ADD COLUMN {column}")
+            except sqlite3.OperationalError as e:
+                if "duplicate column name" not in str(e):
+                    raise
+        # The sweeper pages through `added < cutoff` and through the not-yet-on-disk rows;
+        # both are index range scans, so a sweep costs what changed, not the table size.
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_media_file_ids_added ON media_file_ids (added)")
+        conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_media_file_ids_pending ON media_file_ids (added) WHERE on_disk = 0"
+        )
+        # The download negative cache (api_server._download_failures), written behind so a
+        # restart does not forget which files are dead. retry_at is wall-clock time.
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS download_failures (
+                channel        TEXT    NOT NULL,
+                post_id        INTEGER NOT NULL,
+                file_unique_id TEXT    NOT NULL,
+                fails          INTEGER NOT NULL,
+                retry_at       REAL    NOT NULL,
+                kind           TEXT    NOT NULL,
+                updated        REAL    NOT NULL,
+                PRIMARY KEY (channel, post_id, file_unique_id)
+            )
+            """
+        )
+        # The background download queue (api_server.background_download_worker): one row per
+        # file still to fetch, highest priority first, so the queue survives a restart.
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS download_queue (
+                channel        TEXT    NOT NULL,
+                post_id        INTEGER NOT NULL,
+                file_unique_id TEXT    NOT NULL,
+                priority       REAL    NOT NULL,
+                queued         REAL    NOT NULL,
+                PRIMARY KEY (channel, post_id, file_unique_id)
+            )
+            """
+        )
+        conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_download_queue_priority ON download_queue (priority DESC, post_id DESC)"
+        )
+        _init_cache_index(conn)
+
+
+def _init_cache_index(conn: sqlite3.Connection) -> None:
+    """Create the on-disk file index (cache_files) and its trigger-maintained aggregates.
+
+    cache_files has one row per file under the media cache dir (path relative to it), with
+    its channel, kind (final / temp / part / resume / chunks / preview / lock), size, inode and mtime. The
+    triggers keep per-channel counts, the deduplicated total (hardlinks of one inode cost
+    their bytes once) and the global counters up to date on every insert/delete, so /health
+    reads a handful of rows instead of walking the tree. The bytes of `final` files (the
+    only kind the byte budget evicts) are kept alongside, per channel and deduplicated, so
+    the budget pass is sized without reading cache_files. Updates are done as DELETE +
+    INSERT (never INSERT OR REPLACE: REPLACE skips delete triggers).
+    """
+    conn.executescript(
+        """
+        CREATE TABLE IF NOT EXISTS cache_files (
+            path    TEXT    PRIMARY KEY,
+            channel TEXT    NOT NULL,
+            kind    TEXT    NOT NULL,
+            size    INTEGER NOT NULL,
+            inode   TEXT    NOT NULL,
+            mtime   REAL    NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS idx_cache_files_kind_mtime ON cache_files (kind, mtime);
+        CREATE TABLE IF NOT EXISTS cache_channel_stats (
+            channel     TEXT    PRIMARY KEY,
+            files_count INTEGER NOT NULL,
+            size_bytes  INTEGER NOT NULL,
+            final_bytes INTEGER NOT NULL DEFAULT 0
+        );
+        CREATE TABLE IF NOT EXISTS cache_inodes (
+            inode      TEXT    PRIMARY KEY,
+            size       INTEGER NOT NULL,
+            refs       INTEGER NOT NULL,
+            final_refs INTEGER NOT NULL DEFAULT 0
+        );
+        CREATE TABLE IF NOT EXISTS cache_totals (
+            id          INTEGER PRIMARY KEY CHECK (id = 1),
+            files_count INTEGER NOT NULL,
+            size_bytes  INTEGER NOT NULL,
+            final_bytes INTEGER NOT NULL DEFAULT 0
+        );
+        INSERT OR IGNORE INTO cache_totals (id, files_count, size_bytes) VALUES (1, 0, 0);
+        """
+    )
+    # final_bytes / final_refs were added after the index shipped: add them to an existing
+    # index and recompute the aggregates once (idempotent migration).
+    migrated = False
+    for table, column in (("cache_channel_stats", "final_bytes"), ("cache_inodes", "final_refs"),
+                          ("cache_totals", "final_bytes")):
+        try:
+            conn.execute(f"ALTER TABLE {table} ADD COLUMN {column} INTEGER NOT NULL DEFAULT 0")
+            migrated = True
+        except sqlite3.OperationalError as e:
+            if "duplicate column name" not in str(e):
+                raise
+    # Recreated every start, so an index from before final_bytes gets the current triggers.
+    conn.executescript(
+        """
+        DROP TRIGGER IF EXISTS cache_files_after_insert;
+        CREATE TRIGGER cache_files_after_insert AFTER INSERT ON cache_files
+        BEGIN
+            INSERT INTO cache_channel_stats (channel, files_count, size_bytes, final_bytes)
+                VALUES (NEW.channel, 1, NEW.size, CASE WHEN NEW.kind = 'final' THEN NEW.size ELSE 0 END)
+                ON CONFLICT(channel) DO UPDATE SET files_count = files_count + 1,
+                                                   size_bytes = size_bytes + NEW.size,
+                                                   final_bytes = final_bytes + excluded.final_bytes;
+            UPDATE cache_totals SET
+                files_count = files_count + 1,
+                size_bytes = size_bytes + CASE
+                    WHEN EXISTS (SELECT 1 FROM cache_inodes WHERE inode = NEW.inode) THEN 0
+                    ELSE NEW.size END,
+                final_bytes = final_bytes + CASE
+                    WHEN NEW.kind <> 'final' THEN 0
+                    WHEN EXISTS (SELECT 1 FROM cache_inodes WHERE inode = NEW.inode AND final_refs > 0) THEN 0
+                    ELSE NEW.size END;
+            INSERT INTO cache_inodes (inode, size, refs, final_refs)
+                VALUES (NEW.inode, NEW.size, 1, NEW.kind = 'final')
+                ON CONFLICT(inode) DO UPDATE SET refs = refs + 1, final_refs = final_refs + excluded.final_refs;
+        END;
+
+        DROP TRIGGER IF EXISTS cache_files_after_delete;
+        CREATE TRIGGER cache_files_after_delete AFTER DELETE ON cache_files
+        BEGIN
+            UPDATE cache_channel_stats SET files_count = files_count - 1,
+                                           size_bytes = size_bytes - OLD.size,
+                                           final_bytes = final_bytes - CASE
+                                               WHEN OLD.kind = 'final' THEN OLD.size ELSE 0 END
+                WHERE channel = OLD.channel;
+            DELETE FROM cache_channel_stats WHERE channel = OLD.channel AND files_count <= 0;
+            UPDATE cache_inodes SET refs = refs - 1, final_refs = final_refs - (OLD.kind = 'final')
+                WHERE inode = OLD.inode;
+            UPDATE cache_totals SET
+                files_count = files_count - 1,
+                size_bytes = size_bytes - COALESCE(
+                    (SELECT size FROM cache_inodes WHERE inode = OLD.inode AND refs <= 0), 0),
+                final_bytes = final_bytes - CASE
+                    WHEN OLD.kind <> 'final' THEN 0
+                    ELSE COALESCE((SELECT size FROM cache_inodes WHERE inode = OLD.inode AND final_refs <= 0), 0) END;
+            DELETE FROM cache_inodes WHERE inode = OLD.inode AND refs <= 0;
+        END;
+        """
+    )
+    if migrated:
+        _recompute_cache_aggregates(conn)
+
+
+def _recompute_cache_aggregates(conn: sqlite3.Connection) -> None:
+    """Rebuild the trigger-maintained aggregates of cache_files from scratch."""
+    # Separate execute() calls rather than executescript(), which would COMMIT first and
+    # split a rebuild into several transactions.
+    conn.execute("DELETE FROM cache_channel_stats")
+    conn.execute(
+        """INSERT INTO cache_channel_stats (channel, files_count, size_bytes, final_bytes)
+           SELECT channel, COUNT(*), SUM(size), SUM(CASE WHEN kind = 'final' THEN size ELSE 0 END)
+           FROM cache_files GROUP BY channel"""
+    )
+    conn.execute("DELETE FROM cache_inodes")
+    conn.execute(
+        """INSERT INTO cache_inodes (inode, size, refs, final_refs)
+           SELECT inode, MAX(size), COUNT(*), SUM(kind = 'final') FROM cache_files GROUP BY inode"""
+    )
+    conn.execute(
+        """UPDATE cache_totals SET
+               files_count = (SELECT COUNT(*) FROM cache_files),
+               size_bytes = (SELECT COALESCE(SUM(size), 0) FROM cache_inodes),
+               final_bytes = (SELECT COALESCE(SUM(size), 0) FROM cache_inodes WHERE final_refs > 0)"""
+    )
+
+
+def _op_upsert_media_file_id(conn: sqlite3.Connection, channel: str, post_id: int, file_unique_id: str, added: float) -> None:
+    conn.execute(
+        """INSERT INTO media_file_ids (channel, post_id, file_unique_id, added)
+           VALUES (?, ?, ?, ?)
+           ON CONFLICT(channel, post_id, file_unique_id)
+           DO UPDATE SET added = excluded.added""",
+        (channel, post_id, file_unique_id, added),
+    )
 
 
 def upsert_media_file_id_sync(db_path: str, channel: str, post_id: int, file_unique_id: str, added: float) -> None:
     """Insert or replace a single media file ID record."""
-    with _db_connection(db_path) as conn:
-        conn.execute(
-            """INSERT INTO media_file_ids (channel, post_id, file_unique_id, added)
-               VALUES (?, ?, ?, ?)
-               ON CONFLICT(channel, post_id, file_unique_id)
-               DO UPDATE SET added = excluded.added""",
-            (channel, post_id, file_unique_id, added),
-        )
+    submit_write(db_path, _op_upsert_media_file_id, channel, post_id, file_unique_id, added).result()
 
 
-def upsert_media_file_ids_bulk_sync(db_path: str, entries: List[tuple]) -> None:
+def _op_upsert_media_file_ids_bulk(conn: sqlite3.Connection, entries: List[tuple]) -> List[tuple]:
+    if not entries:
+        return []
+    new_keys = [
+        key for key in dict.fromkeys(tuple(entry[:3]) for entry in entries)
+        if conn.execute(
+            "SELECT 1 FROM media_file_ids WHERE channel = ? AND post_id = ? AND file_unique_id = ?", key
+        ).fetchone() is None
+    ]
+    conn.executemany(
+        """INSERT INTO media_file_ids (channel, post_id, file_unique_id, added, file_id, dc_id)
+           VALUES (?, ?, ?, ?, ?, ?)
+           ON CONFLICT(channel, post_id, file_unique_id)
+           DO UPDATE SET added = excluded.added,
+                         file_id = COALESCE(excluded.file_id, file_id),
+                         dc_id = COALESCE(excluded.dc_id, dc_id)""",
+        [tuple(entry) + (None, None) if len(entry) == 4 else tuple(entry) for entry in entries],
+    )
+    return new_keys
+
+
+def upsert_media_file_ids_bulk_sync(db_path: str, entries: List[tuple]) -> List[tuple]:
     """Insert or replace multiple media file ID records in a single transaction.
 
-    entries: iterable of (channel, post_id, file_unique_id, added) tuples.
+    entries: iterable of (channel, post_id, file_unique_id, added) tuples, optionally
+    extended with (file_id, dc_id). A record without a file reference (a render from the
+    message cache) keeps the one already stored.
     Uses executemany for batched upserts (one connection, one commit).
+    Returns the (channel, post_id, file_unique_id) keys that were not in the table before.
     """
-    if not entries:
-        return
-    with _db_connection(db_path) as conn:
-        conn.executemany(
-            """INSERT INTO media_file_ids (channel, post_id, file_unique_id, added)
-               VALUES (?, ?, ?, ?)
-               ON CONFLICT(channel, post_id, file_unique_id)
-               DO UPDATE SET added = excluded.added""",
-            entries,
-        )
+    return submit_write(db_path, _op_upsert_media_file_ids_bulk, entries).result()
+
+
+def _op_update_media_file_access(conn: sqlite3.Connection, channel: str, post_id: int, file_unique_id: str, added: float) -> None:
+    conn.execute(
+        "UPDATE media_file_ids SET added = ? WHERE channel = ? AND post_id = ? AND file_unique_id = ?",
+        (added, channel, post_id, file_unique_id),
+    )
 
 
 def update_media_file_access_sync(db_path: str, channel: str, post_id: int, file_unique_id: str, added: float) -> None:
     """Update the access timestamp for an existing media file ID record."""
-    with _db_connection(db_path) as conn:
-        conn.execute(
-            "UPDATE media_file_ids SET added = ? WHERE channel = ? AND post_id = ? AND file_unique_id = ?",
-            (added, channel, post_id, file_unique_id),
-        )
+    submit_write(db_path, _op_update_media_file_access, channel, post_id, file_unique_id, added).result()
+
+
+def _op_update_media_file_access_bulk(conn: sqlite3.Connection, entries: List[tuple]) -> None:
+    if not entries:
+        return
+    conn.executemany(
+        "UPDATE media_file_ids SET added = ? WHERE channel = ? AND post_id = ? AND file_unique_id = ?",
+        # Reorder each (channel, post_id, file_unique_id, added) tuple to match the
+        # UPDATE's placeholder order (added first, then the WHERE key columns).
+        [(added, channel, post_id, file_unique_id)
+         for (channel, post_id, file_unique_id, added) in entries],
+    )
 
 
 def update_media_file_access_bulk_sync(db_path: str, entries: List[tuple]) -> None:
@@ -105,39 +520,101 @@ def update_media_file_access_bulk_sync(db_path: str, entries: List[tuple]) -> No
     Rows that do not exist are simply not matched by the WHERE clause (no-op), mirroring
     the single-row update_media_file_access_sync. An empty batch is a no-op.
     """
-    if not entries:
-        return
-    with _db_connection(db_path) as conn:
-        conn.executemany(
-            "UPDATE media_file_ids SET added = ? WHERE channel = ? AND post_id = ? AND file_unique_id = ?",
-            # Reorder each (channel, post_id, file_unique_id, added) tuple to match the
-            # UPDATE's placeholder order (added first, then the WHERE key columns).
-            [(added, channel, post_id, file_unique_id)
-             for (channel, post_id, file_unique_id, added) in entries],
-        )
+    submit_write(db_path, _op_update_media_file_access_bulk, entries).result()
 
 
 def get_all_media_file_ids_sync(db_path: str) -> List[dict]:
     """Return all rows from media_file_ids as a list of dicts.
 
-    Loads the ENTIRE media_file_ids table into memory. This runs on every cache sweep
-    and on /health; it is an accepted cost up to ~100k rows (a few MB of dicts), well
-    within the expected working set. Revisit (stream/paginate) only past that scale.
+    Loads the ENTIRE media_file_ids table into memory, so it is meant for tooling and
+    tests: the cache sweep pages through get_expired_media_file_ids_sync and
+    get_pending_media_file_ids_sync, and /health reads get_cache_stats_sync.
     """
-    with _db_connection(db_path) as conn:
-        conn.row_factory = sqlite3.Row
+    with _read_connection(db_path) as conn:
         cursor = conn.execute("SELECT channel, post_id, file_unique_id, added FROM media_file_ids")
         rows = cursor.fetchall()
     return [dict(row) for row in rows]
 
 
+def get_expired_media_file_ids_sync(db_path: str, cutoff: float, limit: int,
+                                    after: tuple | None = None) -> List[dict]:
+    """Return up to `limit` rows with `added < cutoff`, oldest first.
+
+    Keyset pagination: pass the (added, rowid) of the last row of the previous page as
+    `after` to get the next one. Unlike OFFSET this stays an index range scan, and rows the
+    caller chose to keep (e.g. a file that could not be removed) are not returned again.
+    """
+    with _read_connection(db_path) as conn:
+        if after is None:
+            cursor = conn.execute(
+                """SELECT rowid, channel, post_id, file_unique_id, added FROM media_file_ids
+                   WHERE added < ? ORDER BY added, rowid LIMIT ?""",
+                (cutoff, limit),
+            )
+        else:
+            cursor = conn.execute(
+                """SELECT rowid, channel, post_id, file_unique_id, added FROM media_file_ids
+                   WHERE added < ? AND (added, rowid) > (?, ?) ORDER BY added, rowid LIMIT ?""",
+                (cutoff, after[0], after[1], limit),
+            )
+        rows = cursor.fetchall()
+    return [dict(row) for row in rows]
+
+
+def get_pending_media_file_ids_sync(db_path: str, limit: int, after: tuple | None = None) -> List[dict]:
+    """Return up to `limit` rows not yet seen on disk (on_disk = 0), newest first.
+
+    Same keyset pagination as get_expired_media_file_ids_sync, descending: `after` is the
+    (added, rowid) of the last row of the previous page.
+    """
+    with _read_connection(db_path) as conn:
+        if after is None:
+            cursor = conn.execute(
+                """SELECT rowid, channel, post_id, file_unique_id, added FROM media_file_ids
+                   WHERE on_disk = 0 ORDER BY added DESC, rowid DESC LIMIT ?""",
+                (limit,),
+            )
+        else:
+            cursor = conn.execute(
+                """SELECT rowid, channel, post_id, file_unique_id, added FROM media_file_ids
+                   WHERE on_disk = 0 AND (added, rowid) < (?, ?) ORDER BY added DESC, rowid DESC LIMIT ?""",
+                (after[0], after[1], limit),
+            )
+        rows = cursor.fetchall()
+    return [dict(row) for row in rows]
+
+
+def _op_set_media_on_disk_bulk(conn: sqlite3.Connection, entries: List[tuple], on_disk: bool = True) -> None:
+    if not entries:
+        return
+    conn.executemany(
+        "UPDATE media_file_ids SET on_disk = ? WHERE channel = ? AND post_id = ? AND file_unique_id = ?",
+        [(int(on_disk), channel, post_id, file_unique_id) for (channel, post_id, file_unique_id) in entries],
+    )
+
+
+def set_media_on_disk_bulk_sync(db_path: str, entries: List[tuple], on_disk: bool = True) -> None:
+    """Set the on_disk flag for (channel, post_id, file_unique_id) tuples in one transaction."""
+    submit_write(db_path, _op_set_media_on_disk_bulk, entries, on_disk).result()
+
+
+def _op_remove_media_file_ids(conn: sqlite3.Connection, entries: List[tuple]) -> None:
+    conn.executemany(
+        "DELETE FROM media_file_ids WHERE channel = ? AND post_id = ? AND file_unique_id = ?",
+        entries,
+    )
+
+
 def remove_media_file_ids_sync(db_path: str, entries: List[tuple]) -> None:
     """Remove media file ID records identified by (channel, post_id, file_unique_id) tuples."""
-    with _db_connection(db_path) as conn:
-        conn.executemany(
-            "DELETE FROM media_file_ids WHERE channel = ? AND post_id = ? AND file_unique_id = ?",
-            entries,
-        )
+    submit_write(db_path, _op_remove_media_file_ids, entries).result()
+
+
+def _op_remove_media_file_ids_if_unchanged(conn: sqlite3.Connection, entries: List[tuple]) -> None:
+    conn.executemany(
+        "DELETE FROM media_file_ids WHERE channel = ? AND post_id = ? AND file_unique_id = ? AND added <= ?",
+        entries,
+    )
 
 
 def remove_media_file_ids_if_unchanged_sync(db_path: str, entries: List[tuple]) -> None:
@@ -150,16 +627,160 @@ def remove_media_file_ids_if_unchanged_sync(db_path: str, entries: List[tuple])
     dropping a freshly-rendered row (and triggering a spurious media re-download).
     Uses executemany (one connection, one commit), mirroring remove_media_file_ids_sync.
     """
-    with _db_connection(db_path) as conn:
-        conn.executemany(
-            "DELETE FROM media_file_ids WHERE channel = ? AND post_id = ? AND file_unique_id = ? AND added <= ?",
-            entries,
+    submit_write(db_path, _op_remove_media_file_ids_if_unchanged, entries).result()
+
+
+def _clear_on_disk(conn: sqlite3.Connection, paths: List[str]) -> None:
+    """Reset on_disk for the media rows whose cached file is among the removed `paths`.
+
+    A cached file lives at <channel>/<post_id>/<file_unique_id> (a large video at
+    .../temp_<file_unique_id>); any other name matches no row. Without this a row whose
+    file went away while the row survived would never be queued for download again.
+    """
+    keys = []
+    for path in paths:
+        parts = path.split(os.sep)
+        if len(parts) != 3 or not parts[1].isdigit():
+            continue
+        name = parts[2][5:] if parts[2].startswith("temp_") else parts[2]
+        keys.append((parts[0], int(parts[1]), name))
+    conn.executemany(
+        """UPDATE media_file_ids SET on_disk = 0
+           WHERE channel = ? AND post_id = ? AND file_unique_id = ? AND on_disk = 1""",
+        keys,
+    )
+
+
+def _op_record_cache_files(conn: sqlite3.Connection, add: List[tuple], remove: List[str] = ()) -> None:
+    if not add and not remove:
+        return
+    conn.executemany(
+        "DELETE FROM cache_files WHERE path = ?",
+        [(path,) for path in remove] + [(entry[0],) for entry in add],
+    )
+    conn.executemany(
+        "INSERT INTO cache_files (path, channel, kind, size, inode, mtime) VALUES (?, ?, ?, ?, ?, ?)",
+        add,
+    )
+    _clear_on_disk(conn, list(remove))
+
+
+def record_cache_files_sync(db_path: str, add: List[tuple], remove: List[str] = ()) -> None:
+    """Update the on-disk file index in one transaction.
+
+    add: (path, channel, kind, size, inode, mtime) tuples; an existing row for the path is
+    replaced. remove: paths (relative to the cache dir) that are gone from disk; a media
+    row whose cached file is among them is flagged on_disk = 0 again.
+    """
+    submit_write(db_path, _op_record_cache_files, add, remove).result()
+
+
+def get_stale_cache_files_sync(db_path: str, kinds: tuple, older_than: float, limit: int) -> List[dict]:
+    """Return up to `limit` indexed files of the given kinds whose recorded mtime < older_than."""
+    placeholders = ", ".join("?" for _ in kinds)
+    with _read_connection(db_path) as conn:
+        cursor = conn.execute(
+            f"""SELECT path, channel, kind, size, mtime FROM cache_files
+                WHERE kind IN ({placeholders}) AND mtime < ? ORDER BY kind, mtime LIMIT ?""",
+            (*kinds, older_than, limit),
         )
+        rows = cursor.fetchall()
+    return [dict(row) for row in rows]
+
+
+def get_cache_stats_sync(db_path: str) -> dict:
+    """Read the cache aggregates maintained by the cache_files triggers.
+
+    Returns {"files_count", "size_bytes", "channels": {channel: (files_count, size_bytes)},
+    "final_bytes", "channel_final_bytes": {channel: final_bytes}, "added_min", "added_max"};
+    the final_* figures only count `final` files (what the byte budget covers) and the
+    `added` range comes from the media_file_ids index.
+    """
+    with _read_connection(db_path) as conn:
+        files_count, size_bytes, final_bytes = conn.execute(
+            "SELECT files_count, size_bytes, final_bytes FROM cache_totals WHERE id = 1"
+        ).fetchone() or (0, 0, 0)
+        channels = {}
+        channel_final_bytes = {}
+        for channel, count, size, final in conn.execute(
+            "SELECT channel, files_count, size_bytes, final_bytes FROM cache_channel_stats"
+        ):
+            channels[channel] = (count, size)
+            channel_final_bytes[channel] = final
+        added_min, added_max = conn.execute("SELECT MIN(added), MAX(added) FROM media_file_ids").fetchone()
+    return {
+        "files_count": files_count,
+        "size_bytes": size_bytes,
+        "channels": channels,
+        "final_bytes": final_bytes,
+        "channel_final_bytes": channel_final_bytes,
+        "added_min": added_min,
+        "added_max": added_max,
+    }
+
+
+def get_budget_cache_files_sync(db_path: str, after: tuple | None, limit: int,
+                                channels: List[str] | None = None) -> List[dict]:
+    """Return the next page of indexed files of media rows, least recently used first, for the byte budget.
+
+    Rows: channel, post_id, file_unique_id, added (the row's recency), row (its rowid), path,
+    size, inode and final_refs (how many indexed final files share the inode). Pages follow
+    (added, row) after `after`, the last row of the previous page (None for the first page),
+    so a pass reads only as many rows as it evicts; `channels` limits them to those channels.
+    Only a file at <channel>/<post_id>/<file_unique_id> belongs to a row: temp_* videos,
+    partials and previews expire by their own idle windows. Sizes come from the index, so
+    a file just published counts before the sweeper has flagged its row on_disk.
+    """
+    after_added, after_row = after if after is not None else (float("-inf"), 0)
+    channel_filter = ""
+    if channels is not None:
+        channel_filter = f"AND m.channel IN ({', '.join('?' * len(channels))})"
+    with _read_connection(db_path) as conn:
+        # media_file_ids is walked through its `added` index; CROSS JOIN keeps it outer, so
+        # each row is one cache_files and one cache_inodes PK lookup.
+        cursor = conn.execute(
+            f"""SELECT m.channel, m.post_id, m.file_unique_id, m.added, m.rowid AS row,
+                       c.path, c.size, c.inode, i.final_refs
+                FROM media_file_ids m CROSS JOIN cache_files c CROSS JOIN cache_inodes i
+                WHERE m.added >= ? AND (m.added > ? OR m.rowid > ?) {channel_filter}
+                  AND c.path = m.channel || ? || m.post_id || ? || m.file_unique_id
+                  AND i.inode = c.inode
+                ORDER BY m.added, m.rowid LIMIT ?""",
+            (after_added, after_added, after_row, *(channels or ()), os.sep, os.sep, limit),
+        )
+        rows = cursor.fetchall()
+    return [dict(row) for row in rows]
+
+
+def _op_rebuild_cache_index(conn: sqlite3.Connection, entries: List[tuple], started: float) -> None:
+    seen = {entry[0] for entry in entries}
+    stale = [
+        (path,) for (path, mtime) in conn.execute("SELECT path, mtime FROM cache_files")
+        if path not in seen and mtime < started
+    ]
+    conn.executemany("DELETE FROM cache_files WHERE path = ?", stale + [(entry[0],) for entry in entries])
+    _clear_on_disk(conn, [path for (path,) in stale])
+    conn.executemany(
+        "INSERT INTO cache_files (path, channel, kind, size, inode, mtime) VALUES (?, ?, ?, ?, ?, ?)",
+        entries,
+    )
+    _recompute_cache_aggregates(conn)
+
+
+def rebuild_cache_index_sync(db_path: str, entries: List[tuple], started: float) -> None:
+    """Reconcile the on-disk file index with a full walk of the cache dir.
+
+    entries: (path, channel, kind, size, inode, mtime) for every file the walk found.
+    Rows the walk did not see are dropped unless they were recorded after `started` (a
+    file published while the walk ran). The aggregates are then recomputed from scratch, so
+    any drift (files removed behind the index's back) is healed.
+    """
+    submit_write(db_path, _op_rebuild_cache_index, entries, started).result()
 
 
 def get_mime_type_sync(db_path: str, channel: str, post_id: int, file_unique_id: str) -> str | None:
     """Return the cached MIME type for a given media key, or None if not stored yet."""
-    with _db_connection(db_path) as conn:
+    with _read_connection(db_path) as conn:
         cursor = conn.execute(
             "SELECT mime_type FROM media_file_ids WHERE channel = ? AND post_id = ? AND file_unique_id = ?",
             (channel, post_id, file_unique_id),
@@ -170,12 +791,147 @@ def get_mime_type_sync(db_path: str, channel: str, post_id: int, file_unique_id:
     return row[0]  # May be None if the column value was never set
 
 
+def _op_set_mime_type(conn: sqlite3.Connection, channel: str, post_id: int, file_unique_id: str, mime_type: str) -> None:
+    conn.execute(
+        "UPDATE media_file_ids SET mime_type = ? WHERE channel = ? AND post_id = ? AND file_unique_id = ?",
+        (mime_type, channel, post_id, file_unique_id),
+    )
+
+
 def set_mime_type_sync(db_path: str, channel: str, post_id: int, file_unique_id: str, mime_type: str) -> None:
     """Persist a detected MIME type for an existing media file ID record."""
-    with _db_connection(db_path) as conn:
-        conn.execute(
-            "UPDATE media_file_ids SET mime_type = ? WHERE channel = ? AND post_id = ? AND file_unique_id = ?",
-            (mime_type, channel, post_id, file_unique_id),
+    submit_write(db_path, _op_set_mime_type, channel, post_id, file_unique_id, mime_type).result()
+
+
+def _op_set_media_file_ref(conn: sqlite3.Connection, channel: str, post_id: int, file_unique_id: str, file_id: str | None, dc_id: int | None) -> None:
+    conn.execute(
+        "UPDATE media_file_ids SET file_id = ?, dc_id = ? WHERE channel = ? AND post_id = ? AND file_unique_id = ?",
+        (file_id, dc_id, channel, post_id, file_unique_id),
+    )
+
+
+def set_media_file_ref_sync(db_path: str, channel: str, post_id: int, file_unique_id: str, file_id: str | None, dc_id: int | None) -> None:
+    """Store (or, with file_id=None, forget) the file reference of an existing record."""
+    submit_write(db_path, _op_set_media_file_ref, channel, post_id, file_unique_id, file_id, dc_id).result()
+
+
+def get_media_file_ref_sync(db_path: str, channel: str, post_id: int, file_unique_id: str) -> str | None:
+    """Return the stored Telegram file_id for a media key, or None if none is known."""
+    with _read_connection(db_path) as conn:
+        row = conn.execute(
+            "SELECT file_id FROM media_file_ids WHERE channel = ? AND post_id = ? AND file_unique_id = ?",
+            (channel, post_id, file_unique_id),
+        ).fetchone()
+    return row[0] if row is not None else None
+
+
+def get_media_dc_ids_sync(db_path: str) -> List[int]:
+    """Return every DC id a stored file reference lives on (the media DCs worth keeping warm)."""
+    with _read_connection(db_path) as conn:
+        rows = conn.execute("SELECT DISTINCT dc_id FROM media_file_ids WHERE dc_id IS NOT NULL").fetchall()
+    return [row[0] for row in rows]
+
+
+def _op_save_download_failures(conn: sqlite3.Connection, upserts: List[tuple], removes: List[tuple], clear: bool = False) -> None:
+    if clear:
+        conn.execute("DELETE FROM download_failures")
+    conn.executemany(
+        "DELETE FROM download_failures WHERE channel = ? AND post_id = ? AND file_unique_id = ?",
+        removes,
+    )
+    conn.executemany(
+        """INSERT INTO download_failures (channel, post_id, file_unique_id, fails, retry_at, kind, updated)
+           VALUES (?, ?, ?, ?, ?, ?, ?)
+           ON CONFLICT(channel, post_id, file_unique_id)
+           DO UPDATE SET fails = excluded.fails, retry_at = excluded.retry_at,
+                         kind = excluded.kind, updated = excluded.updated""",
+        upserts,
+    )
+
+
+def save_download_failures_sync(db_path: str, upserts: List[tuple], removes: List[tuple], clear: bool = False) -> None:
+    """Apply a write-behind batch of the download negative cache.
+
+    upserts: (channel, post_id, file_unique_id, fails, retry_at, kind, updated) tuples.
+    removes: (channel, post_id, file_unique_id) tuples of recovered or evicted keys.
+    clear: drop every stored failure first (the verified self-heal restart).
+    """
+    submit_write(db_path, _op_save_download_failures, upserts, removes, clear).result()
+
+
+def load_download_failures_sync(db_path: str, limit: int) -> List[dict]:
+    """Return the `limit` most recently updated stored failures, oldest first."""
+    with _read_connection(db_path) as conn:
+        cursor = conn.execute(
+            """SELECT * FROM (SELECT channel, post_id, file_unique_id, fails, retry_at, kind, updated
+                              FROM download_failures ORDER BY updated DESC LIMIT ?)
+               ORDER BY updated""",
+            (limit,),
+        )
+        rows = cursor.fetchall()
+    return [dict(row) for row in rows]
+
+
+def _op_enqueue_downloads(conn: sqlite3.Connection, entries: List[tuple], max_rows: int) -> int:
+    conn.executemany(
+        """INSERT INTO download_queue (channel, post_id, file_unique_id, priority, queued)
+           VALUES (?, ?, ?, ?, ?)
+           ON CONFLICT(channel, post_id, file_unique_id)
+           DO UPDATE SET priority = excluded.priority""",
+        entries,
+    )
+    cursor = conn.execute(
+        """DELETE FROM download_queue WHERE rowid IN (
+               SELECT rowid FROM download_queue ORDER BY priority DESC, post_id DESC LIMIT -1 OFFSET ?)""",
+        (max_rows,),
+    )
+    return cursor.rowcount
+
+
+def enqueue_downloads_sync(db_path: str, entries: List[tuple], max_rows: int) -> int:
+    """Add or re-prioritise queued downloads, then trim the queue to `max_rows`.
+
+    entries: (channel, post_id, file_unique_id, priority, queued) tuples. A key already
+    queued only takes the new priority. The lowest-priority rows beyond `max_rows` are
+    dropped (a later sweep re-queues them if they still matter). Returns the rows dropped.
+    """
+    return submit_write(db_path, _op_enqueue_downloads, entries, max_rows).result()
+
+
+def get_download_queue_sync(db_path: str, limit: int) -> List[dict]:
+    """Return the `limit` highest-priority queued downloads."""
+    with _read_connection(db_path) as conn:
+        cursor = conn.execute(
+            """SELECT channel, post_id, file_unique_id, priority FROM download_queue
+               ORDER BY priority DESC, post_id DESC LIMIT ?""",
+            (limit,),
         )
+        rows = cursor.fetchall()
+    return [dict(row) for row in rows]
+
+
+def _op_dequeue_downloads(conn: sqlite3.Connection, entries: List[tuple]) -> None:
+    conn.executemany(
+        "DELETE FROM download_queue WHERE channel = ? AND post_id = ? AND file_unique_id = ?",
+        entries,
+    )
+
+
+def dequeue_downloads_sync(db_path: str, entries: List[tuple]) -> None:
+    """Remove (channel, post_id, file_unique_id) keys from the download queue."""
+    submit_write(db_path, _op_dequeue_downloads, entries).result()
+
+
+def _op_prune_download_queue(conn: sqlite3.Connection) -> int:
+    cursor = conn.execute(
+        """DELETE FROM download_queue WHERE NOT EXISTS (
+               SELECT 1 FROM media_file_ids m
+               WHERE m.channel = download_queue.channel AND m.post_id = download_queue.post_id
+                 AND m.file_unique_id = download_queue.file_unique_id AND m.on_disk = 0)"""
+    )
+    return cursor.rowcount
 
 
+def prune_download_queue_sync(db_path: str) -> int:
+    """Drop queued downloads whose media row is gone or already on disk; returns the count."""
+    return submit_write(db_path, _op_prune_download_queue).result()
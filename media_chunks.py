@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# flake8: noqa
+# pylint: disable=missing-function-docstring
+
+"""Sparse on-disk chunk cache for Range access to large videos.
+
+A large video is addressed in Telegram's own 1 MiB get_file parts. Fetched parts are
+written in place into a sparse data file (``chunks_<fid>``) and recorded in a presence
+bitmap (``chunks_<fid>.map``, one bit per part), so a seeking player only ever pulls the
+parts it actually watches. All functions are blocking and meant for asyncio.to_thread.
+
+Crash safety: a part is written BEFORE its bit is set, and the bitmap is replaced
+atomically, so a set bit always means a complete part on disk. The worst a crash can do
+is lose a bit (the part is fetched again).
+
+Dependency-free (no project imports) so it stays usable from api_server and the sweeper.
+"""
+
+import os
+import uuid
+
+CHUNK_SIZE = 1024 * 1024  # Pyrogram get_file / stream_media part size
+CHUNK_FILE_PREFIX = "chunks_"
+MAP_SUFFIX = ".map"
+
+
+def chunk_count(file_size: int) -> int:
+    return (file_size + CHUNK_SIZE - 1) // CHUNK_SIZE
+
+
+def chunk_span(index: int, file_size: int) -> tuple[int, int]:
+    """(offset, length) of part `index` in a file of `file_size` bytes."""
+    start = index * CHUNK_SIZE
+    return start, max(0, min(CHUNK_SIZE, file_size - start))
+
+
+def parse_range(header: str, file_size: int) -> tuple[int, int] | None:
+    """Parse a SINGLE ``bytes=`` range into an inclusive (start, end) within the file.
+
+    Returns None for anything this cache does not answer (multi-range, other units,
+    malformed or unsatisfiable) — the caller then uses the normal full-file path, which
+    already produces the RFC 7233 400/416/multipart responses.
+    """
+    unit, _, spec = header.strip().partition("=")
+    if unit.strip().lower() != "bytes" or "," in spec or file_size <= 0:
+        return None
+    first, sep, last = spec.strip().partition("-")
+    if not sep:
+        return None
+    try:
+        if first == "":
+            suffix = int(last)
+            if suffix <= 0:
+                return None
+            return max(0, file_size - suffix), file_size - 1
+        start = int(first)
+        end = int(last) if last != "" else file_size - 1
+    except ValueError:
+        return None
+    if start < 0 or start > end or start >= file_size:
+        return None
+    return start, min(end, file_size - 1)
+
+
+class ChunkStore:
+    """One large video's sparse data file + presence bitmap."""
+
+    def __init__(self, post_dir: str, file_unique_id: str, file_size: int):
+        self.data_path = os.path.join(post_dir, f"{CHUNK_FILE_PREFIX}{file_unique_id}")
+        self.map_path = self.data_path + MAP_SUFFIX
+        self.file_size = file_size
+        self.bitmap = bytearray((chunk_count(file_size) + 7) // 8)
+
+    def load(self) -> "ChunkStore":
+        """(Re)read the bitmap from disk; a missing or foreign-sized map means nothing cached."""
+        try:
+            with open(self.map_path, "rb") as f:
+                raw = f.read()
+        except FileNotFoundError:
+            return self
+        if len(raw) == len(self.bitmap) and os.path.exists(self.data_path):
+            self.bitmap[:] = raw
+        return self
+
+    def has(self, index: int) -> bool:
+        return bool(self.bitmap[index >> 3] & (1 << (index & 7)))
+
+    def missing_run(self, index: int, limit: int) -> int:
+        """Length of the run of absent parts starting at `index` (at most `limit`)."""
+        total = chunk_count(self.file_size)
+        n = 0
+        while n < limit and index + n < total and not self.has(index + n):
+            n += 1
+        return n
+
+    def read(self, index: int, start: int = 0, end: int | None = None) -> bytes:
+        """Bytes [start, end) of a cached part (default: the whole part)."""
+        offset, length = chunk_span(index, self.file_size)
+        end = length if end is None else end
+        with open(self.data_path, "rb") as f:
+            return os.pread(f.fileno(), end - start, offset + start)
+
+    def write(self, index: int, data: bytes) -> None:
+        """Store a fetched part and mark it present. Raises ValueError on a short part."""
+        offset, length = chunk_span(index, self.file_size)
+        if len(data) != length:
+            raise ValueError(f"part {index} of {self.data_path}: got {len(data)} bytes, expected {length}")
+        os.makedirs(os.path.dirname(self.data_path), exist_ok=True)
+        fd = os.open(self.data_path, os.O_WRONLY | os.O_CREAT, 0o644)
+        try:
+            os.pwrite(fd, data, offset)
+        finally:
+            os.close(fd)
+        self.bitmap[index >> 3] |= 1 << (index & 7)
+        tmp = f"{self.map_path}.{uuid.uuid4().hex}"
+        with open(tmp, "wb") as f:
+            f.write(self.bitmap)
+        os.replace(tmp, self.map_path)
+
+    def touch(self) -> None:
+        for path in (self.data_path, self.map_path):
+            try:
+                os.utime(path, None)
+            except OSError:
+                pass
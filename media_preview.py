@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# flake8: noqa
+# pylint: disable=missing-function-docstring
+
+"""Resized JPEG derivatives ("previews") of cached media for feed list views.
+
+A preview is the source image scaled down to fit its preset's box and recompressed as a
+progressive JPEG. It is stored next to the original in the same post dir, as
+``<fid>.preview-<preset>.jpg`` — file_unique_ids never contain a dot, so the marker cannot
+collide with an original's name. Image presets are rendered from the cached original;
+poster presets from the largest of the video's own Telegram ``thumbs`` (the caller
+downloads that thumbnail), so a feed never pulls a whole video just to show a frame.
+
+All functions are blocking and meant for asyncio.to_thread. Dependency-free apart from
+Pillow (no project imports), like media_chunks.
+"""
+
+import os
+import uuid
+
+from PIL import Image, ImageOps
+
+PREVIEW_MARKER = ".preview-"
+
+# preset -> (longest edge in px, JPEG quality). 'feed' is sized for a reader's article
+# column, 'thumb' for list/grid views; 'poster' is the still shown on a feed <video>.
+PRESETS: dict[str, tuple[int, int]] = {
+    "feed": (800, 82),
+    "thumb": (320, 75),
+    "poster": (800, 82),
+}
+# Presets rendered from the media's Telegram thumbnail instead of the original file.
+POSTER_PRESETS = frozenset({"poster"})
+
+
+def preview_name(file_unique_id: str, preset: str) -> str:
+    return f"{file_unique_id}{PREVIEW_MARKER}{preset}.jpg"
+
+
+def is_preview_name(name: str) -> bool:
+    return PREVIEW_MARKER in name
+
+
+def render_preview(src_path: str, dst_path: str, preset: str) -> int:
+    """Write the `preset` derivative of the image at `src_path` to `dst_path`.
+
+    The JPEG is written to a unique ``.part.<hex>`` partial and published with os.replace,
+    so a file at `dst_path` is always complete (the sweeper expires stale partials).
+    Animated sources contribute their first frame; transparency is flattened onto white.
+    Returns the size of the published file. Raises PIL.UnidentifiedImageError (an OSError)
+    when the source is not an image.
+    """
+    edge, quality = PRESETS[preset]
+    part_path = f"{dst_path}.part.{uuid.uuid4().hex}"
+    try:
+        with Image.open(src_path) as source:
+            source.draft("RGB", (edge, edge))  # JPEG: decode at a reduced scale, much cheaper
+            image = ImageOps.exif_transpose(source)
+            image.thumbnail((edge, edge), Image.Resampling.LANCZOS)
+            if image.mode in ("RGBA", "LA", "P"):
+                image = image.convert("RGBA")
+                flat = Image.new("RGB", image.size, (255, 255, 255))
+                flat.paste(image, mask=image.getchannel("A"))
+                image = flat
+            elif image.mode not in ("RGB", "L"):
+                image = image.convert("RGB")
+            image.save(part_path, "JPEG", quality=quality, optimize=True, progressive=True)
+        os.replace(part_path, dst_path)
+    finally:
+        try:
+            os.remove(part_path)
+        except FileNotFoundError:
+            pass
+    return os.path.getsize(dst_path)
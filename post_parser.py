@@ -22,8 +22,9 @@ from pyrogram.enums import MessageMediaType
 from sanitizer import sanitize_html
 import rich_tree
 from config import get_settings
-from file_io import upsert_media_file_ids_bulk_sync, DB_PATH
+from file_io import _op_upsert_media_file_ids_bulk, write_async, DB_PATH
 from url_signer import generate_media_digest, media_url_expiry
+from tg_file_id import file_dc_id
 
 Config = get_settings()
 
@@ -376,6 +377,18 @@ MEDIA_SOURCES: Dict[Any, Callable[[Message], Tuple[Any, Optional[str]]]] = {
 }
 
 
+def _selected_media_object(message):
+    """The media object MEDIA_SOURCES selects for `message`, or None (e.g. paid media)."""
+    selector = MEDIA_SOURCES.get(message.media)
+    return selector(message)[0] if selector is not None else None
+
+
+def _too_large_to_cache(media_obj) -> bool:
+    """Media over 100MB is never cached (registry §3.13)."""
+    file_size = getattr(media_obj, 'file_size', None)
+    return isinstance(file_size, int) and file_size > 100 * 1024 * 1024
+
+
 # Inline media-sizing style literals, named so the renderers below read as intent
 # rather than magic numbers. Values are substituted verbatim into the style strings,
 # so the emitted bytes are unchanged.
@@ -404,6 +417,7 @@ class RenderCtx:
     mime: Optional[str] = None      # audio/voice <source> type; default chosen by media type
     file_name: Optional[str] = None  # document file name — only the 'file' renderer uses it
     file_size: Optional[int] = None  # document size in bytes — only the 'file' renderer uses it
+    poster: Optional[str] = None    # preview still for a feed <video> — only 'video_400' uses it
 
 
 # Renderers return list[str] so the byte structure of the '\n'.join in
@@ -419,6 +433,10 @@ def _render_img_400(ctx: 'RenderCtx') -> List[str]:
 
 
 def _render_video_400(ctx: 'RenderCtx') -> List[str]:
+    if ctx.poster:
+        # Feed preview: show the poster and fetch nothing of the video until it is played.
+        return [f'<video controls preload="none" poster="{ctx.poster}" src="{ctx.url}" style="max-width:100%; width:auto;'
+                f'height:auto; max-height:{MEDIA_MAX_HEIGHT_PX};"></video>']
     return [f'<video controls src="{ctx.url}" style="max-width:100%; width:auto;'
             f'height:auto; max-height:{MEDIA_MAX_HEIGHT_PX};"></video>']
 
@@ -519,15 +537,36 @@ RENDERERS: Dict[str, Callable[['RenderCtx'], List[str]]] = {
 #https://t.me/ni404head/1283 file
 #http://127.0.0.1:8000/rss/-1002069358234 channel with numeric ID
 
+# Called with the media keys a render saw for the first time (see set_new_media_callback).
+_new_media_callback: Optional[Callable[[List[tuple]], None]] = None
+
+
+def set_new_media_callback(callback: Optional[Callable[[List[tuple]], None]]) -> None:
+    """Register the hook that gets newly persisted (channel, post_id, file_unique_id) keys.
+
+    api_server uses it to queue fresh media for download right after the render, instead
+    of on the next cache sweep. A plain hook so this module never imports api_server. The
+    callback is synchronous and must not block; its errors never fail a render.
+    """
+    global _new_media_callback
+    _new_media_callback = callback
+
+
 class PostParser:
-    def __init__(self, client):
+    def __init__(self, client, media_previews: bool = False):
         self.client = client
+        # Feed renders (MEDIA_FEED_PREVIEWS) point photos and video posters at resized
+        # /media previews; the single-post page keeps the originals.
+        self.media_previews = media_previews
         # Media file-id records collected during rendering. _save_media_file_ids
         # appends (channel, post_id, file_unique_id, ts) tuples here instead of
         # touching asyncio/DB directly (see 4.2). A fresh PostParser is created per
         # request and rendering runs in a single thread, so this list is thread-safe.
-        # The caller flushes it once via upsert_media_file_ids_bulk_sync after render.
+        # The caller flushes it once via the upsert_media_file_ids_bulk write after render.
         self._pending_media_ids: List[tuple] = []
+        # (channel, post_id, file_unique_id) -> (file_id, dc_id) of live media objects,
+        # merged into the upsert so a download can skip re-fetching the message.
+        self._pending_file_refs: Dict[tuple, tuple] = {}
 
     @staticmethod
     def get_all_possible_flags() -> List[str]:
@@ -1580,17 +1619,22 @@ class PostParser:
         html_body = '\n'.join(content_body)
         return html_body
 
-    def _build_media_url(self, channel_username: str, post_id: int, file_unique_id: str) -> Optional[str]:
+    def _build_media_url(self, channel_username: str, post_id: int, file_unique_id: str,
+                         preset: Optional[str] = None) -> Optional[str]:
         """Build a signed /media URL for a media object, or None if the channel is unknown.
 
         Single source of truth for the media URL shape: used both by the regular media
         renderer (below) and as the ``url_builder`` handed to rich_tree.render_html so a
-        rich photo/video/audio resolves through the exact same /media pipeline.
+        rich photo/video/audio resolves through the exact same /media pipeline. A
+        ``preset`` (see media_preview.PRESETS) addresses the resized preview instead; the
+        preset is part of the signed path.
         """
         if not channel_username:
             return None
         base_url = Config['pyrogram_bridge_url']
         file = f"{channel_username}/{post_id}/{file_unique_id}"
+        if preset:
+            file = f"{file}/{preset}"
         exp = media_url_expiry()
         digest = generate_media_digest(file, exp)
         url = f"{base_url}/media/{file}/{digest}"
@@ -1655,6 +1699,10 @@ class PostParser:
                     renderer = RENDERERS.get(kind) if kind else None
                     if renderer is not None:
                         ctx = RenderCtx(url=url)
+                        if self.media_previews and kind == 'img_400':
+                            ctx.url = self._build_media_url(channel_username, message.id, file_unique_id, 'feed')
+                        elif self.media_previews and kind == 'video_400':
+                            ctx.poster = self._build_media_url(channel_username, message.id, file_unique_id, 'poster')
                         if kind in ('pdf', 'file'):
                             if channel_username.startswith('-100'):
                                 ctx.tg_link = f"https://t.me/c/{channel_username[4:]}/{message.id}"
@@ -1692,7 +1740,6 @@ class PostParser:
 
 
     def _format_webpage(self, webpage, message) -> Union[str, None]:
-        base_url = Config['pyrogram_bridge_url']
         try:
             # Check if this is a Telegram message link
             is_telegram_message = getattr(webpage, "type", "") == "telegram_message"
@@ -1739,12 +1786,8 @@ class PostParser:
                     channel_username = self.get_channel_username(message)
                     # Guard: skip photo if channel_username is unavailable to avoid broken URLs
                     if channel_username:
-                        file = f"{channel_username}/{message.id}/{file_unique_id}"
-                        exp = media_url_expiry()
-                        digest = generate_media_digest(file, exp)
-                        url = f"{base_url}/media/{file}/{digest}"
-                        if exp is not None:
-                            url = f"{url}?exp={exp}"
+                        url = self._build_media_url(channel_username, message.id, file_unique_id,
+                                                    'thumb' if self.media_previews else None)
                         html_parts.append(f'<div class="webpage-photo" style="margin-top:10px;">')
                         html_parts.append(f'<a href="{webpage.url}" target="_blank">')
                         html_parts.append(f'<img src="{url}" style="max-width:100%; width:auto;'
@@ -2021,19 +2064,31 @@ class PostParser:
         """Persist media file-id records collected during rendering with ONE bulk upsert.
 
         Called by the caller (get_post / rss_generator) after rendering completes.
-        Runs the blocking SQLite write in a thread. No-op when nothing was collected.
+        Hands the write to the SQLite writer thread. No-op when nothing was collected.
+        Keys the table did not have yet go to the new-media callback (see
+        set_new_media_callback).
         """
         entries = self._pending_media_ids
         if not entries:
             return
+        refs = self._pending_file_refs
+        if refs:
+            entries = [entry + refs[entry[:3]] if entry[:3] in refs else entry for entry in entries]
         try:
-            await asyncio.to_thread(upsert_media_file_ids_bulk_sync, DB_PATH, entries)
+            new_keys = await write_async(_op_upsert_media_file_ids_bulk, DB_PATH, entries)
             logger.debug(f"persist_media_file_ids_bulk: upserted {len(entries)} records")
         except Exception as e:
             logger.error(f"file_id_bulk_save_error: error bulk-upserting {len(entries)} records, error {str(e)}")
+            new_keys = None
         finally:
             # Clear regardless of outcome so a retry does not double-persist a stale batch.
             self._pending_media_ids = []
+            self._pending_file_refs = {}
+        if new_keys and _new_media_callback is not None:
+            try:
+                _new_media_callback(new_keys)
+            except Exception as e:
+                logger.error(f"new_media_callback_error: {len(new_keys)} keys, error {str(e)}")
 
     def _save_media_file_ids(self, message: Message) -> None:
         """Collect a media file-id record for later bulk persistence.
@@ -2052,14 +2107,12 @@ class PostParser:
                 # Object selection goes through the single MEDIA_SOURCES table instead
                 # of the old truthy-attribute if/elif ladder. paid_media has no table
                 # entry and is deliberately NOT collected (paid content).
-                selector = MEDIA_SOURCES.get(message.media)
-                selected_obj = selector(message)[0] if selector is not None else None
+                selected_obj = _selected_media_object(message)
 
                 # Registry §3.13: the ">100MB don't cache" rule applies to ANY selected
                 # media object, not just message.video (the old code guarded only the
                 # video type here, plus the newer live_photo/story/poll sources).
-                file_size = getattr(selected_obj, 'file_size', None)
-                if isinstance(file_size, int) and file_size > 100 * 1024 * 1024:
+                if _too_large_to_cache(selected_obj):
                     return
 
                 file_unique_id = getattr(selected_obj, 'file_unique_id', '') or ''
@@ -2068,6 +2121,7 @@ class PostParser:
                     added_ts = datetime.now().timestamp()
                     # Thread-safe: just append; the caller persists the batch.
                     self._pending_media_ids.append((channel_username, message.id, file_unique_id, added_ts))
+                    self._note_file_ref(channel_username, message.id, selected_obj)
 
             # Rich media (Kurigram 2.2.24, #85): photos/videos/audio embedded in rich blocks.
             # Collected via the tree (works for both live and restored CachedMessage). The >100MB
@@ -2086,6 +2140,37 @@ class PostParser:
         except Exception as e:
             logger.error(f"file_id_collection_error: message_id {message.id}, error {str(e)}")
 
+    def _note_file_ref(self, channel_username: str, message_id: int, selected_obj) -> None:
+        """Keep the file reference of a live media object for the bulk persist.
+
+        A live object carries its file_id; a message-cache snapshot does not.
+        """
+        file_unique_id = getattr(selected_obj, 'file_unique_id', '') or ''
+        file_id = getattr(selected_obj, 'file_id', None)
+        if file_unique_id and isinstance(file_id, str) and file_id:
+            self._pending_file_refs[(channel_username, message_id, file_unique_id)] = (
+                file_id, file_dc_id(file_id))
+
+    def collect_file_refs(self, messages: List[Message]) -> None:
+        """Collect the file references of messages whose post is not rendered again.
+
+        A post served from the rendered-fragment cache skips _save_media_file_ids, but its
+        live messages may carry a newer file_id than the render that was cached. Runs in
+        the render thread, like _save_media_file_ids.
+        """
+        for message in messages:
+            try:
+                if not message.media:
+                    continue
+                selected_obj = _selected_media_object(message)
+                if _too_large_to_cache(selected_obj):
+                    continue
+                channel_username = self.get_channel_username(message)
+                if channel_username:
+                    self._note_file_ref(channel_username, message.id, selected_obj)
+            except Exception as e:
+                logger.error(f"file_ref_collection_error: message_id {message.id}, error {str(e)}")
+
     def get_channel_username(self, message: Message) -> Union[str, None]:
         """Extract channel username or ID from message"""
         chat = message.chat if hasattr(message, 'chat') else message
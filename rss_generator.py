@@ -11,9 +11,15 @@
 
 import logging
 import asyncio
+import hashlib
+import json
+import multiprocessing
 import re
 import threading
 import time
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 from dataclasses import dataclass
 from datetime import datetime, timezone
 from typing import Optional
@@ -22,7 +28,9 @@ from pyrogram import errors, Client
 from pyrogram.types import Message
 from post_parser import PostParser, _wrap_post_html
 from config import get_settings
+from message_snapshot import snapshot_message, restore_messages
 from sanitizer import sanitize_html
+from url_signer import KeyManager, SCOPE_PREFIX, media_url_expiry
 
 Config = get_settings()
 
@@ -97,10 +105,10 @@ _render_failed_lock = threading.Lock()
 _render_failed_count = 0
 
 
-def _record_render_failure():
+def _record_render_failure(count: int = 1):
     global _render_failed_count
     with _render_failed_lock:
-        _render_failed_count += 1
+        _render_failed_count += count
 
 
 def get_render_failed_count() -> int:
@@ -210,6 +218,96 @@ def _stable_guid_basis(group: list[Message]) -> tuple[str, object]:
     return ("msg", min(m.id for m in group))
 
 
+# --------------------------------------------------------------------------- #
+# Rendered-fragment cache
+# --------------------------------------------------------------------------- #
+# Most posts of a feed are byte-identical to the previous poll, yet every poll rendered
+# and sanitized all of them. A group's rendered + sanitized post dict is kept in a bounded
+# LRU keyed by the channel, the message ids, a hash of the messages' snapshots (text,
+# media, reactions, views, reply target, ... — everything the renderer reads) and a
+# fingerprint of the render config, so only new or changed posts are rendered. The media
+# file-id records a render collects are kept with the entry and replayed on a hit: they
+# refresh media_file_ids.added (the cache sweeper's LRU clock) like a real render does.
+# File references are not kept: the key does not cover file_id, so a hit collects them
+# from the group's live messages instead.
+class _FragmentCache:
+    def __init__(self, size: int):
+        self.size = size
+        self._entries: "OrderedDict[tuple, tuple[dict, list[tuple]]]" = OrderedDict()
+        # Renders of different feeds run concurrently in worker threads.
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: tuple) -> "tuple[dict, list[tuple]] | None":
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def put(self, key: tuple, post: dict, media_ids: list[tuple]) -> None:
+        with self._lock:
+            self._entries[key] = (post, media_ids)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.size:
+                self._entries.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+_fragments = _FragmentCache(Config['feed_fragment_cache_size'])
+_FRAGMENT_HIT = object()  # '_fragment' marker of a post served from the cache
+
+
+def get_fragment_cache_stats() -> dict:
+    """Fragment-cache size and hit/miss counters since process start (for /health)."""
+    return {"entries": len(_fragments), "hits": _fragments.hits, "misses": _fragments.misses}
+
+
+def render_fingerprint(media_previews: bool) -> str:
+    """Hash of every setting that changes a rendered post without changing its messages.
+
+    A media URL minted with MEDIA_URL_TTL_DAYS carries an expiry; it is bucketed by the
+    hour so a cached post's URLs are at most an hour older than freshly minted ones.
+    """
+    exp = media_url_expiry()
+    signing_key = hashlib.sha256(KeyManager.get_or_create_signing_key().encode('utf-8')).hexdigest()
+    basis = [
+        Config['show_post_flags'], Config['show_bridge_link'], Config['pyrogram_bridge_url'],
+        Config['token'] if Config['show_bridge_link'] else None,
+        Config['reply_quote_truncate_chars'], Config['reply_quote_truncate_distance'],
+        media_previews, SCOPE_PREFIX, signing_key,
+        exp // 3600 if exp is not None else None,
+    ]
+    return hashlib.sha256(json.dumps(basis).encode('utf-8')).hexdigest()
+
+
+def _fragment_key(channel: str | int, group: list[Message], fingerprint: str) -> tuple | None:
+    """Cache key of a message group's rendered post; None if the group can't be hashed."""
+    try:
+        # A history-cache hit restores CachedMessage objects that keep their snapshot.
+        snapshots = [getattr(m, '_snapshot', None) or snapshot_message(m) for m in group]
+        content = hashlib.sha256(json.dumps(snapshots, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+    except Exception as e:
+        logger.debug(f"fragment_key_error: channel {channel}, error {str(e)}")
+        return None
+    return (str(channel), tuple(m.id for m in group), content, fingerprint)
+
+
+def feed_history_limit(output_type: str, limit: int) -> int:
+    """History fetch size behind a feed of `limit` posts: RSS over-fetches twice the limit."""
+    return limit * 2 if output_type == 'rss' else limit
+
+
 @dataclass
 class PreparedFeed:
     """Output of _prepare_feed_posts — everything both formatters need after
@@ -360,7 +458,8 @@ def _create_messages_groups(messages: list[Message], group_ids: dict[int, str |
 def _render_messages_groups(messages_groups: list[list[Message]],
                                     post_parser: PostParser,
                                     exclude_flags: str | None = None,
-                                    exclude_text: str | None = None):
+                                    exclude_text: str | None = None,
+                                    fragment_scope: tuple[str | int, str] | None = None):
     """
     Render message groups into HTML format
     Plain synchronous function (contains no await): runs inside the render thread.
@@ -369,12 +468,26 @@ def _render_messages_groups(messages_groups: list[list[Message]],
         post_parser: PostParser instance
         exclude_flags: Comma-separated list of flags to exclude
         exclude_text: Text to exclude from posts (comma-separated phrases)
+        fragment_scope: (channel, render fingerprint) to serve unchanged groups from the
+            fragment cache. Each post then carries a '_fragment' entry for
+            _render_pipeline: _FRAGMENT_HIT (already sanitized) or what to cache once
+            it is sanitized.
     Returns:
         List of rendered posts
     """
     rendered_posts = []
     
     for group in messages_groups:
+        key = _fragment_key(fragment_scope[0], group, fragment_scope[1]) if fragment_scope else None
+        cached = _fragments.get(key) if key is not None else None
+        if cached is not None:
+            post, media_ids = cached
+            added_ts = datetime.now().timestamp()
+            post_parser._pending_media_ids.extend(entry[:3] + (added_ts,) for entry in media_ids)
+            post_parser.collect_file_refs(group)
+            rendered_posts.append(dict(post, flags=list(post['flags']), _fragment=_FRAGMENT_HIT))
+            continue
+        collected = len(post_parser._pending_media_ids)
         try:
             if len(group) == 1: # Single message - simple case
                 one_message = group[0]
@@ -433,7 +546,10 @@ def _render_messages_groups(messages_groups: list[list[Message]],
                     'author': main_message['author'],
                     'flags': merged_flags
                 })
-                
+
+            if key is not None:
+                rendered_posts[-1]['_fragment'] = (key, post_parser._pending_media_ids[collected:])
+
         except Exception as e:
             # Issue #60: a post whose render raises must NOT disappear silently from the
             # feed (indistinguishable from "nothing was posted"). Emit a degraded
@@ -488,9 +604,10 @@ def _render_pipeline(messages: list[Message],
     """
     Full synchronous feed render pipeline (grouping + trimming + rendering + sanitize).
 
-    Runs entirely in a worker thread via a single asyncio.to_thread call. It contains
-    NO await, NO asyncio primitives, NO create_task/get_running_loop — all the CPU-heavy
-    work (grouping, rendering, bleach) happens here off the event loop.
+    Runs entirely in a worker thread via a single asyncio.to_thread call, or in a render
+    worker process (_render_snapshots). It contains NO await, NO asyncio primitives, NO
+    create_task/get_running_loop — all the CPU-heavy work (grouping, rendering, bleach)
+    happens here off the event loop.
     Media file-id records are accumulated on post_parser._pending_media_ids and flushed
     by the caller after this returns.
 
@@ -509,7 +626,8 @@ def _render_pipeline(messages: list[Message],
         message_groups = _create_messages_groups(messages)
     # Trim groups if they exceed the requested limit (slice is a no-op when shorter).
     message_groups = message_groups[:limit]
-    posts = _render_messages_groups(message_groups, post_parser, exclude_flags, exclude_text)
+    fragment_scope = (channel, render_fingerprint(post_parser.media_previews)) if _fragments.size > 0 else None
+    posts = _render_messages_groups(message_groups, post_parser, exclude_flags, exclude_text, fragment_scope)
     # Sanitize each surviving (post-filter) post exactly once, here in the worker
     # thread — no per-post thread hop / per-post CSSSanitizer anymore. Per-post
     # granularity means a failed post is html.escape()d in isolation instead of the
@@ -517,11 +635,132 @@ def _render_pipeline(messages: list[Message],
     # OWN post rather than swallowing the following ones (registry §3.4). sanitize_html
     # is fail-closed (registry §3.2). For the HTML path the <hr> divider is joined in
     # the formatter AFTER this, so it survives sanitize (registry §3.3).
+    # A post served from the fragment cache was sanitized when it was cached.
     for post in posts:
+        fragment = post.pop('_fragment', None)
+        if fragment is _FRAGMENT_HIT:
+            continue
         post['html'] = sanitize_html(
             post['html'],
             log_context=f"channel {channel}, message_id {post['message_id']}",
         )
+        if fragment is not None:
+            key, media_ids = fragment
+            _fragments.put(key, dict(post, flags=list(post['flags'])), media_ids)
+    return posts
+
+
+# --------------------------------------------------------------------------- #
+# Process-pool render mode (FEED_RENDER_PROCESSES).
+# --------------------------------------------------------------------------- #
+# forkserver: workers are forked from a dedicated server process, never from this one,
+# which runs the event loop, the io threadpool and Pyrogram's threads (forking those can
+# leave a lock held forever in the child). The server's default preload is the parent's
+# __main__, in production api_server.py (which builds the TelegramClient), so
+# _render_pool_context has it preload this module instead; api_server's launcher also
+# drops its __file__, which a worker's spawn preparation would otherwise re-run. Tests
+# switch to "fork" so workers see the mocked config.
+_RENDER_POOL_START_METHOD = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+_render_pool: ProcessPoolExecutor | None = None
+
+
+def _render_worker_init() -> None:
+    """Warm a render worker up before its first feed: logging, and the sanitizer's
+    lazily built bleach/nh3 state, so the first real render does not pay for them."""
+    from config import setup_logging
+    setup_logging(Config['log_level'])
+    sanitize_html('<p><a href="https://t.me">warm-up</a></p>', log_context="render_worker_warmup")
+
+
+def _render_snapshots(snapshots: list[dict],
+                      media_previews: bool,
+                      limit: int,
+                      exclude_flags: str | None,
+                      exclude_text: str | None,
+                      merge_seconds: int,
+                      time_based_merge: bool,
+                      channel: str | int):
+    """Worker side of the process-pool mode: _render_pipeline on restored snapshots.
+
+    Returns the posts plus what the server's PostParser would otherwise have collected:
+    the media file-id records, the file refs and the number of degraded posts. The
+    fragment cache used is the worker's own.
+    """
+    post_parser = PostParser(None, media_previews=media_previews)
+    failed_before = get_render_failed_count()
+    posts = _render_pipeline(restore_messages(snapshots), post_parser, limit,
+                             exclude_flags, exclude_text, merge_seconds, time_based_merge, channel)
+    return (posts, post_parser._pending_media_ids, post_parser._pending_file_refs,
+            get_render_failed_count() - failed_before)
+
+
+def _render_pool_context() -> multiprocessing.context.BaseContext:
+    """The multiprocessing context the render workers are started with.
+
+    A forkserver preloads only rss_generator, so each worker is forked with the renderer
+    and its imports already loaded rather than with the server's __main__.
+    """
+    ctx = multiprocessing.get_context(_RENDER_POOL_START_METHOD)
+    if _RENDER_POOL_START_METHOD == "forkserver":
+        ctx.set_forkserver_preload(["rss_generator"])
+    return ctx
+
+
+def _get_render_pool() -> ProcessPoolExecutor | None:
+    """The render process pool, created on first use; None when FEED_RENDER_PROCESSES is 0."""
+    global _render_pool
+    if Config['feed_render_processes'] <= 0:
+        return None
+    if _render_pool is None:
+        _render_pool = ProcessPoolExecutor(
+            max_workers=Config['feed_render_processes'],
+            mp_context=_render_pool_context(),
+            initializer=_render_worker_init,
+        )
+        logger.info(f"render_pool_started: {Config['feed_render_processes']} workers, start method {_RENDER_POOL_START_METHOD}")
+    return _render_pool
+
+
+def shutdown_render_pool() -> None:
+    """Stop the render workers (server shutdown); the next render starts a new pool."""
+    global _render_pool
+    pool, _render_pool = _render_pool, None
+    if pool is not None:
+        pool.shutdown(wait=False, cancel_futures=True)
+
+
+async def _render_in_pool(pool: ProcessPoolExecutor,
+                          messages: list[Message],
+                          post_parser: PostParser,
+                          limit: int,
+                          exclude_flags: str | None,
+                          exclude_text: str | None,
+                          merge_seconds: int,
+                          time_based_merge: bool,
+                          channel: str | int):
+    """Render restored history-cache messages in a worker process.
+
+    Only their snapshot dicts cross the process boundary (pickled by the executor's own
+    thread, not on the event loop). Returns None if the pool broke (a worker was killed);
+    the pool is discarded so the next render starts a fresh one, and the caller renders
+    this feed in a thread instead.
+    """
+    snapshots = [m._snapshot for m in messages]
+    loop = asyncio.get_running_loop()
+    try:
+        posts, media_ids, file_refs, failed = await loop.run_in_executor(
+            pool, _render_snapshots, snapshots, post_parser.media_previews, limit,
+            exclude_flags, exclude_text, merge_seconds, time_based_merge, channel,
+        )
+    except BrokenProcessPool as e:
+        logger.error(f"render_pool_broken: channel {channel}, error {str(e)}, rendering in a thread and restarting the pool")
+        if _render_pool is pool:
+            shutdown_render_pool()
+        return None
+    post_parser._pending_media_ids.extend(media_ids)
+    post_parser._pending_file_refs.update(file_refs)
+    if failed:
+        _record_render_failure(failed)
     return posts
 
 
@@ -552,7 +791,7 @@ async def _prepare_feed_posts(channel: str | int,
     if limit > 200:
         raise ValueError(f"limit cannot exceed 200, got {limit}")
 
-    post_parser = PostParser(client=client)
+    post_parser = PostParser(client=client, media_previews=Config['media_feed_previews'])
 
     # 2) Resolve the chat. NOTE: keep `from tg_cache import ...` INSIDE this function —
     # feed tests monkeypatch tg_cache and rely on late name resolution.
@@ -600,14 +839,25 @@ async def _prepare_feed_posts(channel: str | int,
 
     # 4) Process messages into groups and render them. The whole grouping/trimming/
     # rendering pipeline is CPU-heavy (per-message rendering) and contains no
-    # await, so run it in ONE worker thread to keep the event loop responsive.
+    # await, so run it in ONE worker thread to keep the event loop responsive — or, with
+    # FEED_RENDER_PROCESSES, in a worker process. Only a history-cache hit goes to the
+    # pool: live Messages carry file refs and objects a snapshot does not keep.
     processing_start_time = time.time()
     try:
-        posts = await asyncio.to_thread(
-            _render_pipeline, messages, post_parser, limit,
-            exclude_flags, exclude_text, merge_seconds, Config['time_based_merge'],
-            channel,
-        )
+        posts = None
+        pool = _get_render_pool()
+        if pool is not None and all(getattr(m, '_snapshot', None) is not None for m in messages):
+            posts = await _render_in_pool(
+                pool, messages, post_parser, limit,
+                exclude_flags, exclude_text, merge_seconds, Config['time_based_merge'],
+                channel,
+            )
+        if posts is None:
+            posts = await asyncio.to_thread(
+                _render_pipeline, messages, post_parser, limit,
+                exclude_flags, exclude_text, merge_seconds, Config['time_based_merge'],
+                channel,
+            )
     finally:
         # Persist media file-ids collected during rendering with a single bulk upsert —
         # in a finally so a partial render still records what it collected (the flush is
@@ -649,7 +899,7 @@ async def generate_channel_rss(channel: str | int,
         prepared = await _prepare_feed_posts(
             channel, client,
             limit=limit, exclude_flags=exclude_flags, exclude_text=exclude_text,
-            merge_seconds=merge_seconds, history_limit=limit * 2,
+            merge_seconds=merge_seconds, history_limit=feed_history_limit('rss', limit),
             log_prefix="rss",
         )
 
@@ -776,7 +1026,7 @@ async def generate_channel_html(channel: str | int,
         prepared = await _prepare_feed_posts(
             channel, client,
             limit=limit, exclude_flags=exclude_flags, exclude_text=exclude_text,
-            merge_seconds=merge_seconds, history_limit=limit,
+            merge_seconds=merge_seconds, history_limit=feed_history_limit('html', limit),
             log_prefix="html",
         )
 
@@ -48,6 +48,7 @@ ALLOWED_TAGS = ['p', 'a', 'b', 'i', 'strong', 'em', 's', 'del',
 # Identical in all three former copies — moved here as-is. nh3 wants per-tag sets.
 # The td/th colspan/rowspan, details 'open' and span 'id' entries were added for the
 # rich renderer (#85); `id` is additionally range-restricted by _attribute_filter below.
+# video poster/preload carry feed previews (MEDIA_FEED_PREVIEWS); poster is scheme-filtered like src.
 ALLOWED_ATTRIBUTES = {
     # '*' = attributes allowed on EVERY tag. Empty by design: nh3/ammonia otherwise
     # defaults generic attributes to {lang, title}, but bleach did NOT allow them
@@ -56,7 +57,7 @@ ALLOWED_ATTRIBUTES = {
     '*': set(),
     'a': {'href', 'title', 'target'},
     'img': {'src', 'alt', 'style'},
-    'video': {'controls', 'src', 'style'},
+    'video': {'controls', 'src', 'style', 'poster', 'preload'},
     'audio': {'controls', 'style'},
     'source': {'src', 'type'},
     'div': {'class', 'style'},
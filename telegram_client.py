@@ -20,10 +20,12 @@ from typing import Any, NamedTuple, Optional
 asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
 
 from pyrogram import Client, raw, errors, types
+from tg_file_id import file_dc_id
 from pyrogram.handlers import DisconnectHandler
 from config import get_settings
 
 import kurigram_compat
+import tg_bandwidth
 # Install the defensive Rich* parse wrappers BEFORE any Client is created / any message is
 # parsed (phase 1 of the Rich Messages epic, #83/#84). No-op on a Kurigram without Rich*
 # classes, so a rollback to 2.2.23 does not crash-loop the container.
@@ -159,6 +161,26 @@ async def safe_get_rich_message(client: Client, chat_id, msg_id,
         return RichFetchResult(None, "error")
 
 
+# Pyrogram's get_file / stream_media chunk size; stream_media offsets count whole chunks.
+STREAM_CHUNK_SIZE = 1024 * 1024
+
+
+def _write_flush(f, chunk: bytes) -> None:
+    """Write a chunk and push it to the OS so a reader on another fd sees it immediately."""
+    f.write(chunk)
+    f.flush()
+
+
+def _open_for_resume(file_name: str, resume_from: int):
+    """Open a download target: truncated to `resume_from` bytes and positioned at its end."""
+    if resume_from <= 0:
+        return open(file_name, "wb")
+    f = open(file_name, "r+b")
+    f.truncate(resume_from)
+    f.seek(resume_from)
+    return f
+
+
 class TelegramClient:
     def __init__(self):
         self._ensure_session_directory()
@@ -197,6 +219,18 @@ class TelegramClient:
         self._wd_fallback_count = 0       # SIGTERM fallbacks after a failed in-process restart
         self._wd_flap_trigger_count = 0   # times the disconnect-flap threshold was reached
         self._wd_last_ok_monotonic = None # monotonic timestamp of the last successful probe
+        # Media-DC keep-alive. DC ids are learned from the file_ids of past downloads; the
+        # loop keeps an export-authorized media session warm for each of them so a cold
+        # /media miss pays only for the transfer, not for the connect + auth handshake.
+        self.media_keepalive_interval = settings["media_keepalive_interval"]
+        self._media_dc_ids: set[int] = set()
+        self._media_keepalive_task = None
+        self._media_rewarm_task = None      # strong ref to the post-restart re-warm task
+        # Media-DC bandwidth shaping (MEDIA_BANDWIDTH_KBPS): every streamed chunk is paid
+        # for in its download's class, interactive or background (see tg_bandwidth).
+        self.bandwidth = tg_bandwidth.BandwidthShaper(
+            settings["media_bandwidth_kbps"] * 1024, settings["media_bandwidth_interactive_pct"]
+        )
         self._setup_connection_handlers()
 
     def _ensure_session_directory(self):
@@ -387,8 +421,14 @@ class TelegramClient:
                     self._on_restart_verified()
                 except Exception as cbe:
                     logger.warning(f"recovery: restart-verified callback raised {type(cbe).__name__}: {cbe}")
+            # The restart stopped every media session: re-warm the known media DCs right
+            # away (detached, so a slow DC cannot hold up recovery) instead of letting the
+            # next reader /media miss pay for the handshake.
+            if verify_ok and self._media_dc_ids:
+                self._media_rewarm_task = asyncio.create_task(self.warm_media_sessions())
             # Re-arm the watchdog in case it had previously crashed (self-healing).
             self._start_watchdog()
+            self._start_media_keepalive()
         except asyncio.CancelledError:
             raise
         except Exception as e:
@@ -411,6 +451,7 @@ class TelegramClient:
                 self._disconnect_times.clear()
                 logger.info("connection_handler: connection established")
             self._start_watchdog()
+            self._start_media_keepalive()
         except Exception as e:
             logger.error(f"Failed to start Telegram client: {str(e)}")
             raise
@@ -439,6 +480,87 @@ class TelegramClient:
             return None
         return time.monotonic() - self._wd_last_ok_monotonic
 
+    def _start_media_keepalive(self):
+        """Starts the media-DC keep-alive task (idempotent; disabled by interval 0)."""
+        if self.media_keepalive_interval <= 0:
+            return
+        if self._media_keepalive_task is not None and not self._media_keepalive_task.done():
+            return
+        self._media_keepalive_task = asyncio.create_task(self._media_keepalive_loop())
+
+    def note_media_dc(self, file_id: str) -> None:
+        """Remember the DC a downloaded file lives on so the keep-alive keeps it warm.
+
+        The DC id is decoded locally from the file_id string (no RPC). An undecodable id is
+        ignored: the keep-alive is an optimisation and must never fail a download.
+        """
+        dc_id = file_dc_id(file_id)
+        if dc_id and dc_id not in self._media_dc_ids:
+            self._media_dc_ids.add(dc_id)
+            logger.info(f"media_keepalive: learned media DC {dc_id} (known={sorted(self._media_dc_ids)})")
+
+    def note_media_dcs(self, dc_ids) -> None:
+        """Remember DCs already known to hold media (e.g. the stored file references' DCs).
+
+        Seeds the keep-alive at startup, so it covers those DCs from its first pass instead
+        of only once a download of this run has learned them again.
+        """
+        learned = {dc_id for dc_id in dc_ids if dc_id} - self._media_dc_ids
+        if learned:
+            self._media_dc_ids.update(learned)
+            logger.info(f"media_keepalive: loaded media DCs {sorted(learned)} (known={sorted(self._media_dc_ids)})")
+
+    async def warm_media_sessions(self) -> None:
+        """Make sure a live, authorized media session exists for every known media DC.
+
+        get_session(dc, is_media=True) returns the cached session or creates one (connect +
+        export/import authorization for a foreign DC) — exactly the work the first download
+        would otherwise do. The session is then pinged under a short timeout; a session that
+        does not answer is a zombie, so it is dropped from Pyrogram's media-session map and
+        stopped, and the next pass (or download) rebuilds it. Never raises.
+        """
+        for dc_id in sorted(self._media_dc_ids):
+            if self._shutting_down or self._restarting:
+                return
+            started = time.monotonic()
+            try:
+                session = await asyncio.wait_for(
+                    self.client.get_session(dc_id, is_media=True), timeout=self.watchdog_timeout
+                )
+                await asyncio.wait_for(
+                    session.invoke(raw.functions.Ping(ping_id=int(time.time() * 1000))),
+                    timeout=self.watchdog_timeout,
+                )
+                logger.debug(f"media_keepalive: DC {dc_id} warm ({(time.monotonic() - started) * 1000:.0f}ms)")
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning(f"media_keepalive: DC {dc_id} warm-up failed ({type(e).__name__}: {e}); dropping its media session")
+                stale = self.client.media_sessions.pop(dc_id, None)
+                if stale is not None:
+                    try:
+                        await asyncio.wait_for(stale.stop(), timeout=self.watchdog_timeout)
+                    except Exception as se:
+                        logger.debug(f"media_keepalive: stopping stale DC {dc_id} session raised {type(se).__name__}: {se}")
+
+    async def _media_keepalive_loop(self):
+        """Periodically re-warm the media sessions (see warm_media_sessions)."""
+        logger.info(f"media_keepalive: started (interval={self.media_keepalive_interval}s)")
+        try:
+            while True:
+                await asyncio.sleep(self.media_keepalive_interval)
+                if self._shutting_down:
+                    break
+                if self._restarting or not self.client.is_connected:
+                    logger.debug("media_keepalive: skip pass (restart in progress or not connected)")
+                    continue
+                await self.warm_media_sessions()
+        except asyncio.CancelledError:
+            logger.info("media_keepalive: stopped")
+            raise
+        except Exception as e:
+            logger.critical(f"media_keepalive: loop crashed unexpectedly ({type(e).__name__}: {e}); media sessions are no longer pre-warmed until next start")
+
     def note_download_ok(self) -> None:
         """Reset the media-download timeout streak after any successful download."""
         if self._download_timeout_streak:
@@ -493,7 +615,13 @@ class TelegramClient:
         `timeout` bounds each download attempt; for large videos the caller scales it
         with file size (see api_server._media_download_timeout). A timeout cancels the
         underlying download (freeing the Pyrogram transmission slot); a streak of timeouts
-        escalates to a connection-rebuilding restart via note_download_timeout()."""
+        escalates to a connection-rebuilding restart via note_download_timeout().
+
+        With bandwidth shaping on, the file is fetched through safe_stream_media instead,
+        so every chunk is paid for (download_media gives no per-chunk hook)."""
+        if self.bandwidth.enabled:
+            return await self.safe_stream_media(file_id, file_name, lambda _chunk: None,
+                                                max_retries=max_retries, timeout=timeout)
         for attempt in range(max_retries):
             try:
                 result = await asyncio.wait_for(
@@ -501,6 +629,7 @@ class TelegramClient:
                     timeout=timeout
                 )
                 self.note_download_ok()
+                self.note_media_dc(file_id)
                 return result
             except asyncio.TimeoutError:
                 # Hung download: the wait_for above already cancelled it and released the
@@ -520,17 +649,105 @@ class TelegramClient:
                     continue
                 raise
 
+    async def safe_stream_media(self, file_id, file_name, on_chunk, max_retries=2, timeout: float = 120.0,
+                                resume_from: int = 0):
+        """Download `file_id` into `file_name` chunk by chunk via stream_media (tee mode).
+
+        Same contract as safe_download_media (per-attempt `timeout`, timeout streak, DC
+        learning, KeyError auth retry) but every 1 MiB chunk is flushed to `file_name` and
+        then reported through `on_chunk(chunk)`, so readers can serve the bytes while the
+        rest is still in flight. A retry resumes at the first missing chunk instead of
+        rewriting the file: bytes already handed to readers never change.
+
+        `resume_from` (a multiple of STREAM_CHUNK_SIZE) keeps that many bytes of an existing
+        `file_name` from an earlier attempt and continues after them.
+
+        Each chunk is paid for with the bandwidth shaper before the next one is requested;
+        time spent waiting for tokens extends the attempt's deadline, since throttling is
+        not a stalled connection and must not feed the timeout streak.
+        """
+        if resume_from % STREAM_CHUNK_SIZE:
+            raise ValueError(f"resume_from={resume_from} is not aligned to {STREAM_CHUNK_SIZE}")
+        written = resume_from
+        f = await asyncio.to_thread(_open_for_resume, file_name, resume_from)
+        try:
+            for attempt in range(max_retries):
+                async def _stream():
+                    nonlocal written
+                    async with asyncio.timeout(timeout) as deadline:
+                        with self.bandwidth.stream():
+                            async for chunk in self.client.stream_media(file_id, offset=written // STREAM_CHUNK_SIZE):
+                                await asyncio.to_thread(_write_flush, f, chunk)
+                                written += len(chunk)
+                                on_chunk(chunk)
+                                await self._pay_for_chunk(chunk, deadline)
+                try:
+                    await _stream()
+                    self.note_download_ok()
+                    self.note_media_dc(file_id)
+                    return file_name
+                except asyncio.TimeoutError:
+                    self.note_download_timeout()
+                    raise
+                except Exception as e:
+                    # Streak-neutral, exactly like safe_download_media.
+                    if isinstance(e, KeyError) and attempt < max_retries - 1:
+                        logger.warning(f"Stream auth error on attempt {attempt + 1} at byte {written}, retrying...")
+                        await asyncio.sleep(5)
+                        continue
+                    raise
+        finally:
+            await asyncio.to_thread(f.close)
+
+    async def safe_get_chunks(self, file_id, offset: int, limit: int, timeout: float = 120.0) -> list:
+        """Fetch `limit` consecutive 1 MiB parts of `file_id` starting at part `offset`.
+
+        Used for Range-on-demand access to large videos: only the parts a player asks for
+        are pulled. Bounded by `timeout` and counted toward the timeout streak exactly like
+        safe_download_media; non-timeout errors propagate streak-neutral. Shaped like
+        safe_stream_media.
+        """
+        async def _collect():
+            parts = []
+            async with asyncio.timeout(timeout) as deadline:
+                with self.bandwidth.stream():
+                    async for chunk in self.client.stream_media(file_id, limit=limit, offset=offset):
+                        parts.append(chunk)
+                        await self._pay_for_chunk(chunk, deadline)
+            return parts
+        try:
+            parts = await _collect()
+        except asyncio.TimeoutError:
+            self.note_download_timeout()
+            raise
+        self.note_download_ok()
+        self.note_media_dc(file_id)
+        return parts
+
+    async def _pay_for_chunk(self, chunk: bytes, deadline: asyncio.Timeout) -> None:
+        """Charge a received chunk to the bandwidth shaper with `deadline` paused meanwhile."""
+        if not self.bandwidth.enabled:
+            return
+        loop = asyncio.get_running_loop()
+        remaining = deadline.when() - loop.time()
+        deadline.reschedule(None)
+        await self.bandwidth.consume(len(chunk))
+        deadline.reschedule(loop.time() + remaining)
+
     async def stop(self):
         # Suppress disconnect handling during intentional shutdown
         # (client.stop() dispatches the DisconnectHandler).
         self._shutting_down = True
-        if self._watchdog_task is not None:
-            self._watchdog_task.cancel()
+        for attr in ("_watchdog_task", "_media_keepalive_task", "_media_rewarm_task"):
+            task = getattr(self, attr)
+            if task is None:
+                continue
+            task.cancel()
             try:
-                await self._watchdog_task
+                await task
             except asyncio.CancelledError:
                 pass
-            self._watchdog_task = None
+            setattr(self, attr, None)
         if self.client.is_connected:
             try:
                 await self.client.stop()
@@ -28,7 +28,7 @@ import pytest
 
 @pytest.fixture(autouse=True)
 def _reset_media_mime_cache():
-    """Clear the process-lifetime MIME dict before each test (issue #26).
+    """Clear the process-lifetime MIME dict, media metadata index, RAM tier and feed outputs before each test (issue #26).
 
     ``api_server._mime_types`` persists for the whole process, so an entry populated by one
     test would otherwise leak into another and mask a get/magic call the next test asserts on.
@@ -36,6 +36,45 @@ def _reset_media_mime_cache():
     try:
         import api_server
         api_server._mime_types.clear()
+        api_server._media_meta.clear()
+        api_server._media_bytes.clear()
+        api_server._media_bytes_size = 0
+        api_server._feed_outputs.clear()
+        api_server._feed_outputs_size = 0
     except Exception:
         pass
     yield
+
+
+@pytest.fixture(autouse=True)
+def _reset_fragment_cache():
+    """Start every test with an empty rendered-fragment cache, so no test is served posts another rendered."""
+    try:
+        import rss_generator
+        rss_generator._fragments.clear()
+    except Exception:
+        pass
+    yield
+
+
+@pytest.fixture
+def fake_writes(monkeypatch):
+    """Route chosen SQLite writer ops of a module to fakes with the public `(db_path, *args)` signature.
+
+    Application code hands writes to the writer thread as `write_async(_op_x, db_path, *args)`;
+    `fake_writes(module, {file_io._op_x: fake})` patches that module's write_async so `fake`
+    runs in a worker thread instead. Any other op still goes to the real writer.
+    """
+    import asyncio
+
+    def install(module, fakes):
+        real = module.write_async
+
+        async def write_async(op, db_path, *args, **kwargs):
+            fake = fakes.get(op)
+            if fake is None:
+                return await real(op, db_path, *args, **kwargs)
+            return await asyncio.to_thread(fake, db_path, *args, **kwargs)
+
+        monkeypatch.setattr(module, "write_async", write_async)
+    return install
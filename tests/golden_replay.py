@@ -89,9 +89,12 @@ def pin_environment(monkeypatch):
     monkeypatch.setitem(post_parser.Config, "time_based_merge", True)
 
     # No media-id DB side effect outside tests/ (byte-neutral for the feed, but the write
-    # to ./data/media_file_ids.db is a forbidden side effect). upsert is imported INTO the
-    # post_parser namespace, so patch it there.
-    monkeypatch.setattr(post_parser, "upsert_media_file_ids_bulk_sync", lambda *a, **k: None)
+    # to ./data/media_file_ids.db is a forbidden side effect). write_async is imported INTO
+    # the post_parser namespace, so patch it there.
+    async def _no_media_id_writes(op, db_path, *args, **kwargs):
+        return None
+
+    monkeypatch.setattr(post_parser, "write_async", _no_media_id_writes)
 
 
 # --------------------------------------------------------------------------- #
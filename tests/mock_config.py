@@ -39,8 +39,32 @@ def get_settings():
         "media_download_min_speed": 256 * 1024,
         "io_thread_pool_size": 32,
         "tg_max_concurrent_transmissions": 3,
+        "media_bg_interactive_reserve": 1,
         "media_timeout_restart_threshold": 5,
+        "media_keepalive_interval": 240,
+        "media_bandwidth_kbps": 0,
+        "media_bandwidth_interactive_pct": 50,
+        "media_stream_passthrough": False,
+        "media_large_video_ranges": False,
+        "media_range_fetch_chunks": 4,
+        "media_feed_previews": False,
+        "feed_fragment_cache_size": 5000,
+        "feed_render_processes": 0,
+        "feed_output_cache_mb": 32,
+        "media_accel_redirect": "",
+        "media_accel_prefix": "/_media_cache",
+        "media_resume_large_downloads": False,
+        "media_blob_store": False,
+        "media_cache_max_mb": 0,
+        "media_cache_channel_max_mb": 0,
         "cache_sweep_interval": 900,
+        "media_meta_cache_entries": 20000,
+        "media_ram_tier_file_kb": 64,
+        "media_ram_tier_mb": 32,
+        "media_bg_batch_max": 50,
+        "media_download_queue_max": 5000,
+        "media_queue_popularity_weight": 6 * 3600,
+        "media_sweep_batch_rows": 500,
         "reply_quote_truncate_chars": 200,
         "reply_quote_truncate_distance": 2,
     }
@@ -0,0 +1,121 @@
+# flake8: noqa
+# pylint: disable=protected-access, missing-function-docstring, redefined-outer-name, line-too-long
+# pylance: disable=reportMissingImports, reportMissingModuleSource
+"""
+Tests for handing cached media bodies to the reverse proxy (MEDIA_ACCEL_REDIRECT).
+
+Every cached media byte used to be streamed by FileResponse through the event loop. With
+MEDIA_ACCEL_REDIRECT the request is validated exactly as before, but the response carries
+X-Accel-Redirect (nginx) or X-Sendfile and an empty body; the proxy sends the file. A stub
+proxy below plays nginx's part: it swallows the upstream body and serves the file the
+internal URI points at, keeping the upstream headers.
+"""
+import os
+from urllib.parse import unquote
+
+import pytest
+from fastapi import FastAPI, Request
+from fastapi.responses import FileResponse
+from fastapi.testclient import TestClient
+
+import api_server
+
+BODY = bytes(range(256)) * 8
+
+
+def _stub_nginx(app, prefix, root):
+    """ASGI wrapper that resolves X-Accel-Redirect like an nginx `internal` alias would."""
+    async def proxy(scope, receive, send):
+        upstream = {}
+
+        async def capture(message):
+            if message["type"] == "http.response.start":
+                upstream["headers"] = message["headers"]
+
+        await app(scope, receive, capture)
+        headers = {k.decode().lower(): v.decode() for k, v in upstream["headers"]}
+        target = headers.get("x-accel-redirect")
+        if target is None or not target.startswith(prefix + "/"):
+            raise AssertionError(f"no internal redirect in {headers}")
+        path = os.path.join(root, unquote(target[len(prefix) + 1:]))
+        served = FileResponse(path, media_type=headers["content-type"],
+                              headers={k: headers[k] for k in ("content-disposition", "cache-control", "x-content-type-options")})
+        await served(scope, receive, send)
+
+    return proxy
+
+
+@pytest.fixture
+def cached_file(monkeypatch, tmp_path):
+    monkeypatch.setattr(api_server, "MEDIA_CACHE_DIR", str(tmp_path / "cache"))
+    path = api_server.media_cache_path("chan", 7, "AgADfid")
+    os.makedirs(os.path.dirname(path))
+    with open(path, "wb") as f:
+        f.write(BODY)
+    monkeypatch.setattr(api_server.magic_mime, "from_file", lambda _p: "image/png")
+    return path
+
+
+def _app(file_path):
+    app = FastAPI()
+
+    @app.get("/media")
+    async def _serve(request: Request):
+        return await api_server.prepare_file_response(file_path, request=request)
+
+    return app
+
+
+def test_nginx_mode_returns_only_headers(cached_file, monkeypatch):
+    monkeypatch.setitem(api_server.Config, "media_accel_redirect", "nginx")
+
+    resp = TestClient(_app(cached_file)).get("/media")
+
+    assert resp.status_code == 200 and resp.content == b""
+    assert resp.headers["x-accel-redirect"] == "/_media_cache/chan/7/AgADfid"
+    assert resp.headers["content-type"] == "image/png"
+    assert resp.headers["content-disposition"] == 'inline; filename="AgADfid"'
+    assert resp.headers["x-content-type-options"] == "nosniff"
+
+
+def test_stub_proxy_serves_the_file_with_ranges(cached_file, monkeypatch):
+    monkeypatch.setitem(api_server.Config, "media_accel_redirect", "nginx")
+    monkeypatch.setitem(api_server.Config, "media_accel_prefix", "/internal/")
+    client = TestClient(_stub_nginx(_app(cached_file), "/internal", api_server.MEDIA_CACHE_DIR))
+
+    full = client.get("/media")
+    part = client.get("/media", headers={"Range": "bytes=0-99"})
+
+    assert full.status_code == 200 and full.content == BODY
+    assert full.headers["content-type"] == "image/png"
+    assert part.status_code == 206 and part.content == BODY[:100]
+
+
+def test_sendfile_mode_points_at_the_absolute_path(cached_file, monkeypatch):
+    monkeypatch.setitem(api_server.Config, "media_accel_redirect", "sendfile")
+
+    resp = TestClient(_app(cached_file)).get("/media")
+
+    assert resp.headers["x-sendfile"] == os.path.abspath(cached_file)
+    assert resp.content == b""
+
+
+def test_unsafe_types_stay_neutralized(cached_file, monkeypatch):
+    monkeypatch.setitem(api_server.Config, "media_accel_redirect", "nginx")
+    monkeypatch.setattr(api_server.magic_mime, "from_file", lambda _p: "text/html")
+
+    resp = TestClient(_app(cached_file)).get("/media")
+
+    assert resp.headers["content-type"] == "application/octet-stream"
+    assert resp.headers["content-disposition"].startswith("attachment;")
+
+
+def test_files_outside_the_cache_and_the_default_mode_use_fileresponse(cached_file, monkeypatch, tmp_path):
+    outside = tmp_path / "elsewhere"
+    outside.write_bytes(BODY)
+    monkeypatch.setitem(api_server.Config, "media_accel_redirect", "nginx")
+    assert TestClient(_app(str(outside))).get("/media").content == BODY
+
+    monkeypatch.setitem(api_server.Config, "media_accel_redirect", "")
+    resp = TestClient(_app(cached_file)).get("/media")
+    assert resp.content == BODY and "x-accel-redirect" not in resp.headers
@@ -0,0 +1,105 @@
+# flake8: noqa
+# pylint: disable=protected-access, missing-function-docstring, redefined-outer-name, line-too-long
+# pylance: disable=reportMissingImports, reportMissingModuleSource
+"""
+Tests for the AIMD-sized background download slots.
+
+BACKGROUND_DOWNLOAD_SEMAPHORE was a fixed asyncio.Semaphore(2) and the worker paused a
+fixed 2s per batch. It is now an _AdaptiveDownloadSlots: healthy transfers add slots up to
+the ceiling (which leaves interactive transmissions free), a download timeout halves them
+and a FloodWait drops them to one; the batch pause shrinks as the slots grow.
+"""
+import asyncio
+
+import pytest
+from fastapi import HTTPException
+from pyrogram import errors
+
+import api_server
+
+MB = 1024 * 1024
+
+
+def test_healthy_transfers_grow_additively_up_to_the_ceiling():
+    slots = api_server._AdaptiveDownloadSlots(1, 4)
+    for _ in range(2):
+        slots.on_transfer(4 * MB, 1.0)
+    assert slots.slots == 2  # +1 after one window of 1 transfer, then +1/2 per transfer
+    for _ in range(20):
+        slots.on_transfer(4 * MB, 1.0)
+    assert slots.slots == 4
+    assert slots.pause() == api_server._BG_PAUSE_MIN
+
+
+def test_a_slow_transfer_holds_the_slots():
+    slots = api_server._AdaptiveDownloadSlots(2, 4)
+    slots.on_transfer(4 * MB, 1.0)
+    limit = slots.limit
+    slots.on_transfer(4 * MB, 10.0)  # a tenth of the running rate
+    assert slots.limit == limit
+
+
+def test_timeouts_halve_and_flood_wait_drops_to_one():
+    slots = api_server._AdaptiveDownloadSlots(4, 4)
+    slots.on_timeout()
+    assert slots.slots == 2
+    slots.on_timeout()
+    slots.on_timeout()
+    assert slots.slots == 1  # never below one slot
+    slots = api_server._AdaptiveDownloadSlots(4, 4)
+    slots.on_flood_wait()
+    assert slots.slots == 1 and slots.pause() == api_server._BG_PAUSE_MAX
+
+
+@pytest.mark.asyncio
+async def test_permits_follow_the_limit():
+    slots = api_server._AdaptiveDownloadSlots(1, 2)
+    await slots.acquire()
+    waiter = asyncio.create_task(slots.acquire())
+    await asyncio.sleep(0)
+    assert not waiter.done()
+
+    slots.on_transfer(1024, 0.1)  # the limit grows to 2: the waiter gets its permit
+    await asyncio.wait_for(waiter, timeout=1)
+    assert slots.active == 2
+
+    slots.on_timeout()  # back to 1: both holders finish, only then is a new permit free
+    slots.release()
+    blocked = asyncio.create_task(slots.acquire())
+    await asyncio.sleep(0)
+    assert not blocked.done()
+    slots.release()
+    await asyncio.wait_for(blocked, timeout=1)
+    assert slots.active == 1
+
+
+@pytest.mark.asyncio
+async def test_cancelled_waiter_leaves_no_permit_behind():
+    slots = api_server._AdaptiveDownloadSlots(1, 1)
+    await slots.acquire()
+    with pytest.raises(asyncio.TimeoutError):
+        await asyncio.wait_for(slots.acquire(), timeout=0.01)
+    slots.release()
+    assert slots.active == 0 and not slots._waiters
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("error, expected", [
+    (HTTPException(status_code=504, detail="Download timeout"), 1),
+    (errors.FloodWait(value=3), 1),
+    (RuntimeError("other"), 2),
+])
+async def test_runner_reports_timeouts_and_flood_waits(monkeypatch, tmp_path, error, expected):
+    slots = api_server._AdaptiveDownloadSlots(2, 2)
+    monkeypatch.setattr(api_server, "BACKGROUND_DOWNLOAD_SEMAPHORE", slots)
+    monkeypatch.setattr(api_server, "MEDIA_CACHE_DIR", str(tmp_path / "cache"))
+    monkeypatch.setattr(api_server, "_record_download_failure", lambda *a, **k: None)
+
+    async def failing(*_a):
+        raise error
+
+    monkeypatch.setattr(api_server, "download_media_file", failing)
+    with pytest.raises(type(error)):
+        await api_server._download_deduped("slots", 1, "fid", slots)
+
+    assert slots.slots == expected and slots.active == 0
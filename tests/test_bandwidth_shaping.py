@@ -0,0 +1,144 @@
+# flake8: noqa
+# pylint: disable=protected-access, missing-function-docstring, redefined-outer-name, line-too-long
+# pylance: disable=reportMissingImports, reportMissingModuleSource
+"""
+Tests for media-DC bandwidth shaping (MEDIA_BANDWIDTH_KBPS).
+
+A background caching run of a video-heavy channel used to take the whole media-DC link,
+and a reader's cold /media miss then crawled into its timeout. Downloads now stream chunk
+by chunk through a token bucket split into an interactive reserve and a background share:
+the background fill borrows the reserve only while no reader download is running, a
+reader joining a background download promotes it, and time spent waiting for tokens never
+counts toward the download timeout.
+"""
+import asyncio
+import time
+from types import SimpleNamespace
+
+import pytest
+
+import api_server
+import tg_bandwidth
+from telegram_client import TelegramClient
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """Virtual time for the shaper: sleeping advances the clock instantly."""
+    now = [1000.0]
+
+    async def fake_sleep(seconds):
+        now[0] += seconds
+
+    monkeypatch.setattr(tg_bandwidth, "time", SimpleNamespace(monotonic=lambda: now[0]))
+    monkeypatch.setattr(tg_bandwidth, "asyncio", SimpleNamespace(sleep=fake_sleep))
+    return now
+
+
+def _shaper():
+    return tg_bandwidth.BandwidthShaper(1000, 50)  # 500 B/s interactive reserve, 500 B/s background
+
+
+BACKGROUND = tg_bandwidth.DownloadPriority(interactive=False)
+
+
+@pytest.mark.asyncio
+async def test_disabled_shaper_never_waits():
+    shaper = tg_bandwidth.BandwidthShaper(0, 50)
+    assert not shaper.enabled
+    await shaper.consume(10 ** 9, BACKGROUND)
+    assert shaper.waited_seconds == {"interactive": 0.0, "background": 0.0}
+
+
+@pytest.mark.asyncio
+async def test_background_borrows_the_idle_interactive_reserve(clock):
+    shaper = _shaper()
+    with shaper.stream(BACKGROUND):
+        await shaper.consume(600, BACKGROUND)   # its own share, into debt
+        await shaper.consume(500, BACKGROUND)   # borrowed: no reader is downloading
+    assert clock[0] == 1000.0 and shaper.borrowed_bytes == 500
+
+
+@pytest.mark.asyncio
+async def test_background_is_held_to_its_share_while_a_reader_downloads(clock):
+    shaper = _shaper()
+    reader = tg_bandwidth.DownloadPriority(interactive=True)
+    with shaper.stream(reader), shaper.stream(BACKGROUND):
+        await shaper.consume(1500, BACKGROUND)   # debt of 1000 B at 500 B/s
+        await shaper.consume(500, BACKGROUND)
+        assert clock[0] == pytest.approx(1002.0)
+        await shaper.consume(500, reader)        # the reserve was never touched
+        assert clock[0] == pytest.approx(1002.0)
+    assert shaper.borrowed_bytes == 0
+
+
+@pytest.mark.asyncio
+async def test_reader_spends_its_reserve_then_background_tokens(clock):
+    shaper = _shaper()
+    reader = tg_bandwidth.DownloadPriority(interactive=True)
+    await shaper.consume(600, reader)   # reserve, into debt
+    await shaper.consume(600, reader)   # unused background tokens
+    assert clock[0] == 1000.0
+    await shaper.consume(100, reader)   # both in debt now
+    assert clock[0] > 1000.0
+    assert shaper.waited_seconds["interactive"] > 0 and shaper.waited_seconds["background"] == 0
+
+
+def _client_with_chunks(monkeypatch, chunks, rate):
+    c = TelegramClient()
+    c.bandwidth = tg_bandwidth.BandwidthShaper(rate, 50)
+
+    async def fake_stream_media(file_id, offset=0, limit=0):
+        for chunk in chunks[offset:]:
+            yield chunk
+
+    async def no_download_media(*a, **kw):
+        raise AssertionError("shaped downloads must stream chunk by chunk")
+
+    monkeypatch.setattr(c.client, "stream_media", fake_stream_media)
+    monkeypatch.setattr(c.client, "download_media", no_download_media)
+    return c
+
+
+@pytest.mark.asyncio
+async def test_waiting_for_tokens_does_not_count_toward_the_timeout(monkeypatch, tmp_path):
+    chunks = [bytes([i]) * 4000 for i in range(10)]
+    c = _client_with_chunks(monkeypatch, chunks, 20000)  # 40 KB: ~1s at 20 KB/s less the 20 KB burst
+    target = str(tmp_path / "file")
+    token = tg_bandwidth.current_priority.set(BACKGROUND)
+    try:
+        started = time.monotonic()
+        assert await c.safe_download_media("fid", target, timeout=0.3) == target
+    finally:
+        tg_bandwidth.current_priority.reset(token)
+
+    assert time.monotonic() - started > 0.3
+    assert open(target, "rb").read() == b"".join(chunks)
+    assert c._download_timeout_streak == 0 and c.bandwidth.waited_seconds["background"] > 0
+
+
+@pytest.mark.asyncio
+async def test_reader_joining_a_background_download_promotes_it(monkeypatch, tmp_path):
+    monkeypatch.setattr(api_server, "MEDIA_CACHE_DIR", str(tmp_path / "cache"))
+    release = asyncio.Event()
+    seen = []
+
+    async def fake_dl(channel, post_id, fid):
+        priority = tg_bandwidth.current_priority.get()
+        seen.append(priority.interactive)
+        await release.wait()
+        seen.append(priority.interactive)
+        return "path"
+
+    monkeypatch.setattr(api_server, "download_media_file", fake_dl)
+    key = ("chan", 9, "AgADfid")
+
+    fut = api_server._ensure_download(*key, api_server.BACKGROUND_DOWNLOAD_SEMAPHORE)
+    while not seen:
+        await asyncio.sleep(0.01)
+    assert api_server._ensure_download(*key, api_server.HTTP_DOWNLOAD_SEMAPHORE) is fut
+    release.set()
+
+    assert await fut == "path"
+    assert seen == [False, True]
+    assert key not in api_server._inflight_priority
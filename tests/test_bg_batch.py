@@ -0,0 +1,105 @@
+# flake8: noqa
+# pylint: disable=protected-access, missing-function-docstring, redefined-outer-name, line-too-long
+# pylance: disable=reportMissingImports, reportMissingModuleSource
+"""
+Tests for channel-grouped batches in background_download_worker.
+
+The worker used to take one queue item at a time, sleep 2s and let download_media_file run
+its own get_messages per file. It now drains a batch, resolves each channel's messages with
+one get_messages(chat, ids) call and downloads the files with bounded parallelism.
+"""
+import asyncio
+import os
+from types import SimpleNamespace
+
+import pytest
+from pyrogram.enums import MessageMediaType
+
+import api_server
+from file_io import enqueue_downloads_sync, get_download_queue_sync, init_db_sync, upsert_media_file_ids_bulk_sync
+
+
+@pytest.fixture
+def env(tmp_path, monkeypatch):
+    monkeypatch.setattr(api_server, "MEDIA_CACHE_DIR", str(tmp_path / "cache"))
+    monkeypatch.setattr(api_server, "DB_PATH", str(tmp_path / "media.db"))
+    init_db_sync(api_server.DB_PATH)
+    calls = {"get_messages": [], "downloads": []}
+
+    async def fake_get(channel_id, ids):
+        calls["get_messages"].append((channel_id, ids))
+        if isinstance(ids, list):
+            return [SimpleNamespace(id=i, media=MessageMediaType.PHOTO, video=None, empty=False) for i in ids]
+        return SimpleNamespace(id=ids, media=MessageMediaType.PHOTO, video=None, empty=False)
+
+    async def fake_find(message, fid):
+        return f"file-id-{fid}"
+
+    async def fake_dl(file_id, file_name, timeout=None, **kw):
+        calls["downloads"].append(file_id)
+        with open(file_name, "wb") as f:
+            f.write(b"x")
+        return file_name
+
+    real_sleep = asyncio.sleep
+
+    async def fast_sleep(delay=0, *a, **kw):
+        await real_sleep(0)
+
+    monkeypatch.setattr(api_server.client, "safe_get_messages", fake_get)
+    monkeypatch.setattr(api_server, "find_file_id_in_message", fake_find)
+    monkeypatch.setattr(api_server.client, "safe_download_media", fake_dl)
+    monkeypatch.setattr(api_server.asyncio, "sleep", fast_sleep)
+    return calls
+
+
+async def _drained():
+    while get_download_queue_sync(api_server.DB_PATH, 1):
+        await asyncio.sleep(0.01)
+
+
+async def _run_worker(items):
+    enqueue_downloads_sync(api_server.DB_PATH, [(*item, 1.0, 1.0) for item in items], 100)
+    worker = asyncio.create_task(api_server.background_download_worker())
+    try:
+        await asyncio.wait_for(_drained(), timeout=5)
+    finally:
+        worker.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await worker
+
+
+@pytest.mark.asyncio
+async def test_one_get_messages_per_channel_batch(env):
+    await _run_worker([("chan", i, f"f{i}") for i in (3, 1, 2)] + [("other", 7, "g7"), ("other", 8, "g8")])
+
+    assert sorted(env["get_messages"]) == [("chan", [1, 2, 3]), ("other", [7, 8])]
+    assert sorted(env["downloads"]) == ["file-id-f1", "file-id-f2", "file-id-f3", "file-id-g7", "file-id-g8"]
+    assert os.path.exists(api_server.media_cache_path("chan", 2, "f2"))
+
+
+@pytest.mark.asyncio
+async def test_items_with_stored_references_need_no_messages(env):
+    upsert_media_file_ids_bulk_sync(api_server.DB_PATH, [("chan", 1, "f1", 1.0, "ref-1", None),
+                                                         ("chan", 2, "f2", 1.0, "ref-2", None)])
+
+    await _run_worker([("chan", 1, "f1"), ("chan", 2, "f2")])
+
+    assert env["get_messages"] == []
+    assert sorted(env["downloads"]) == ["ref-1", "ref-2"]
+
+
+@pytest.mark.asyncio
+async def test_failed_prefetch_falls_back_to_per_item_fetch(env, monkeypatch):
+    async def flaky_get(channel_id, ids):
+        env["get_messages"].append((channel_id, ids))
+        if isinstance(ids, list):
+            raise RuntimeError("bulk lookup failed")
+        return SimpleNamespace(id=ids, media=MessageMediaType.PHOTO, video=None, empty=False)
+
+    monkeypatch.setattr(api_server.client, "safe_get_messages", flaky_get)
+
+    await _run_worker([("chan", 1, "f1"), ("chan", 2, "f2")])
+
+    assert sorted(env["get_messages"], key=str) == sorted([("chan", [1, 2]), ("chan", 1), ("chan", 2)], key=str)
+    assert len(env["downloads"]) == 2
@@ -0,0 +1,175 @@
+# flake8: noqa
+# pylint: disable=protected-access, missing-function-docstring, redefined-outer-name, line-too-long
+# pylance: disable=reportMissingImports, reportMissingModuleSource
+"""
+Tests for the byte-budgeted LRU eviction of the media cache.
+
+Only files unused for 20 days used to be evicted, so disk usage was unbounded. With
+MEDIA_CACHE_MAX_MB (total) and/or MEDIA_CACHE_CHANNEL_MAX_MB (per channel) set, each sweep
+evicts the least-recently-used files (media_file_ids.added) until the cache fits; evicted
+rows are purged from SQLite so they are not re-queued. The pass is sized from the cache
+index aggregates of the budgeted (final) files rather than a stat per file, is skipped
+while they fit however much untracked temp/part/preview data there is, and pages its LRU
+candidates out of SQLite only until the cache fits.
+"""
+import os
+import sqlite3
+import time
+
+import pytest
+
+import api_server
+from file_io import init_db_sync, upsert_media_file_ids_bulk_sync, get_all_media_file_ids_sync
+
+MB = 1024 * 1024
+
+
+def _put(cache_dir, channel, post_id, fid, size_mb, age_s):
+    path = os.path.join(cache_dir, channel, str(post_id), fid)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "wb") as f:
+        f.write(b"x" * (size_mb * MB))
+    return _row(channel, post_id, fid, age_s, path)
+
+
+def _row(channel, post_id, fid, age_s, path=None):
+    """Record the row (and its published file, if any) the way the renderer and a download would.
+
+    The row is deliberately left on_disk = 0: a file counts from the moment it is indexed,
+    not only once a sweep has flagged it.
+    """
+    upsert_media_file_ids_bulk_sync(api_server.DB_PATH, [(channel, post_id, fid, time.time() - age_s)])
+    if path is not None:
+        api_server._update_cache_index_sync([path])
+    return fid
+
+
+@pytest.fixture
+def cache_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(api_server, "MEDIA_CACHE_DIR", str(tmp_path / "cache"))
+    monkeypatch.setattr(api_server, "DB_PATH", str(tmp_path / "media.db"))
+    init_db_sync(api_server.DB_PATH)
+    return str(tmp_path / "cache")
+
+
+def _survivors():
+    return sorted(r["file_unique_id"] for r in get_all_media_file_ids_sync(api_server.DB_PATH))
+
+
+@pytest.mark.asyncio
+async def test_total_budget_evicts_coldest_first(cache_dir, monkeypatch):
+    monkeypatch.setitem(api_server.Config, "media_cache_max_mb", 3)
+    _put(cache_dir, "a", 1, "oldest", 1, 5000)
+    _put(cache_dir, "a", 2, "old", 1, 4000)
+    _put(cache_dir, "b", 3, "warm", 1, 3000)
+    _put(cache_dir, "b", 4, "hot", 1, 10)
+    removed = await api_server._enforce_cache_budget_db()
+    assert removed == 1
+    assert _survivors() == ["hot", "old", "warm"]
+    assert not os.path.exists(os.path.join(cache_dir, "a", "1", "oldest"))
+
+
+@pytest.mark.asyncio
+async def test_channel_quota_only_trims_the_heavy_channel(cache_dir, monkeypatch):
+    monkeypatch.setitem(api_server.Config, "media_cache_channel_max_mb", 2)
+    _put(cache_dir, "light", 1, "l_old", 1, 9000)  # oldest overall, but its channel fits
+    _put(cache_dir, "heavy", 1, "h1", 1, 5000)
+    _put(cache_dir, "heavy", 2, "h2", 1, 4000)
+    _put(cache_dir, "heavy", 3, "h3", 1, 10)
+    removed = await api_server._enforce_cache_budget_db()
+    assert removed == 1
+    assert _survivors() == ["h2", "h3", "l_old"]
+
+
+@pytest.mark.asyncio
+async def test_no_budget_keeps_everything(cache_dir):
+    for i in range(1, 4):
+        _put(cache_dir, "a", i, f"f{i}", 1, 100 * i)
+    removed = await api_server._enforce_cache_budget_db()
+    assert removed == 0 and len(_survivors()) == 3
+
+
+@pytest.mark.asyncio
+async def test_hardlinked_copies_count_once_against_the_total(cache_dir, monkeypatch):
+    """Two locations of one blob cost 1 MB, so they fit a 2 MB budget next to another file."""
+    monkeypatch.setitem(api_server.Config, "media_cache_max_mb", 2)
+    _put(cache_dir, "a", 1, "AgADshared", 1, 5000)
+    _put(cache_dir, "c", 9, "other", 1, 100)
+    second = os.path.join(cache_dir, "b", "2", "AgADshared")
+    os.makedirs(os.path.dirname(second))
+    os.link(os.path.join(cache_dir, "a", "1", "AgADshared"), second)
+    _row("b", 2, "AgADshared", 4000, second)
+
+    removed = await api_server._enforce_cache_budget_db()
+
+    assert removed == 0 and len(get_all_media_file_ids_sync(api_server.DB_PATH)) == 3
+
+
+@pytest.mark.asyncio
+async def test_missing_files_are_kept_for_the_download_pass(cache_dir, monkeypatch):
+    monkeypatch.setitem(api_server.Config, "media_cache_max_mb", 1)
+    _row("a", 1, "not_yet", 0)
+    removed = await api_server._enforce_cache_budget_db()
+    assert removed == 0 and _survivors() == ["not_yet"]
+
+
+@pytest.mark.asyncio
+async def test_a_cache_within_budget_is_not_sized_file_by_file(cache_dir, monkeypatch):
+    monkeypatch.setitem(api_server.Config, "media_cache_max_mb", 3)
+    monkeypatch.setitem(api_server.Config, "media_cache_channel_max_mb", 2)
+    _put(cache_dir, "a", 1, "f1", 1, 100)
+    _put(cache_dir, "b", 2, "f2", 1, 100)
+
+    def no_pass(*args):
+        raise AssertionError("per-file budget pass ran")
+
+    monkeypatch.setattr(api_server, "get_budget_cache_files_sync", no_pass)
+    assert await api_server._enforce_cache_budget_db() == 0
+
+
+def test_budget_join_looks_up_each_row_by_path(cache_dir):
+    with sqlite3.connect(api_server.DB_PATH) as conn:
+        plan = " ".join(r[-1] for r in conn.execute(
+            "EXPLAIN QUERY PLAN SELECT c.size FROM media_file_ids m CROSS JOIN cache_files c "
+            "WHERE c.path = m.channel || '/' || m.post_id || '/' || m.file_unique_id"))
+    assert "SEARCH c USING INDEX sqlite_autoindex_cache_files_1" in plan
+
+
+@pytest.mark.asyncio
+async def test_untracked_files_do_not_trigger_the_pass(cache_dir, monkeypatch):
+    """A large temp_* video is not budgeted, so it must not make every sweep page the index."""
+    monkeypatch.setitem(api_server.Config, "media_cache_max_mb", 2)
+    monkeypatch.setitem(api_server.Config, "media_cache_channel_max_mb", 2)
+    _put(cache_dir, "a", 1, "f1", 1, 100)
+    temp = os.path.join(cache_dir, "a", "2", "temp_big")
+    os.makedirs(os.path.dirname(temp))
+    with open(temp, "wb") as f:
+        f.write(b"x" * (3 * MB))
+    api_server._update_cache_index_sync([temp])
+
+    def no_pass(*args):
+        raise AssertionError("per-file budget pass ran")
+
+    monkeypatch.setattr(api_server, "get_budget_cache_files_sync", no_pass)
+    assert await api_server._enforce_cache_budget_db() == 0
+    assert os.path.exists(temp)
+
+
+@pytest.mark.asyncio
+async def test_candidates_are_paged_until_the_cache_fits(cache_dir, monkeypatch):
+    monkeypatch.setitem(api_server.Config, "media_cache_max_mb", 2)
+    monkeypatch.setattr(api_server, "_SWEEP_BATCH_ROWS", 1)
+    for i in range(1, 6):
+        _put(cache_dir, "a", i, f"f{i}", 1, 1000 * (6 - i))  # f1 is the coldest
+    pages = []
+    real_page = api_server.get_budget_cache_files_sync
+
+    def counting_page(*args):
+        pages.append(args)
+        return real_page(*args)
+
+    monkeypatch.setattr(api_server, "get_budget_cache_files_sync", counting_page)
+    removed = await api_server._enforce_cache_budget_db()
+
+    assert removed == 3 and _survivors() == ["f4", "f5"]
+    assert len(pages) == 3  # the two warm rows were never read
@@ -0,0 +1,214 @@
+# flake8: noqa
+# pylint: disable=protected-access, missing-function-docstring, redefined-outer-name, line-too-long
+# pylance: disable=reportMissingImports, reportMissingModuleSource
+"""
+Tests for the on-disk file index (SQLite cache_files) behind /health and the temp sweep.
+
+calculate_cache_stats used to os.walk + stat every cached file and load the whole media
+table on each /health probe, and the sweeper walked the tree for temp/partial files. Files
+are now recorded (path, channel, kind, size, inode) when published and dropped when
+removed; triggers keep the aggregates /health reads, the temp sweep queries the index, and
+one walk at startup reconciles the index with the disk.
+"""
+import os
+import sqlite3
+import time
+from concurrent.futures import Future
+
+import pytest
+
+import api_server
+import file_io
+from file_io import init_db_sync, get_cache_stats_sync, upsert_media_file_ids_bulk_sync
+
+MB = 1024 * 1024
+
+
+@pytest.fixture
+def index_env(tmp_path, monkeypatch):
+    db = str(tmp_path / "media.db")
+    init_db_sync(db)
+    cache_dir = str(tmp_path / "cache")
+    monkeypatch.setattr(api_server, "DB_PATH", db)
+    monkeypatch.setattr(api_server, "MEDIA_CACHE_DIR", cache_dir)
+    return db, cache_dir
+
+
+def _write(cache_dir, rel, size=MB, age_s=0):
+    path = os.path.join(cache_dir, rel)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "wb") as f:
+        f.write(b"x" * size)
+    if age_s:
+        os.utime(path, (time.time() - age_s, time.time() - age_s))
+    return path
+
+
+def _indexed(db):
+    with sqlite3.connect(db) as conn:
+        return {path: kind for path, kind in conn.execute("SELECT path, kind FROM cache_files")}
+
+
+def test_aggregates_follow_publish_and_removal(index_env):
+    db, cache_dir = index_env
+    a = _write(cache_dir, "chan_a/1/AgADone")
+    b = _write(cache_dir, "chan_b/2/AgADtwo", size=2 * MB)
+    shared = os.path.join(cache_dir, "chan_b/3/AgADone")
+    os.makedirs(os.path.dirname(shared))
+    os.link(a, shared)  # a blob-store style hardlink of the same bytes
+    api_server._update_cache_index_sync([a, b, shared])
+    upsert_media_file_ids_bulk_sync(db, [("chan_a", 1, "AgADone", 1000.0), ("chan_b", 2, "AgADtwo", 1000.0 + 2 * 86400)])
+
+    stats = api_server.calculate_cache_stats()
+    assert stats["cache_files_count"] == 3
+    assert stats["cache_total_size_mb"] == 3.0  # the hardlink costs its bytes once
+    assert stats["channels"] == {"chan_a": {"files_count": 1, "size_mb": 1.0},
+                                 "chan_b": {"files_count": 2, "size_mb": 3.0}}
+    assert stats["cache_time_diff_days"] == 2.0
+
+    os.remove(a)
+    api_server._update_cache_index_sync((), [a])
+    stats = api_server.calculate_cache_stats()
+    assert stats["cache_total_size_mb"] == 3.0  # still held by chan_b's link
+    assert "chan_a" not in stats["channels"]
+
+    os.remove(shared)
+    api_server._update_cache_index_sync((), [shared])
+    assert get_cache_stats_sync(db)["size_bytes"] == 2 * MB
+
+
+def test_final_bytes_leave_untracked_kinds_out(index_env):
+    db, cache_dir = index_env
+    a = _write(cache_dir, "chan_a/1/AgADone")
+    shared = os.path.join(cache_dir, "chan_b/3/AgADone")
+    os.makedirs(os.path.dirname(shared))
+    os.link(a, shared)
+    temp = _write(cache_dir, "chan_a/2/temp_AgADbig", size=3 * MB)
+    api_server._update_cache_index_sync([a, shared, temp])
+
+    stats = get_cache_stats_sync(db)
+    assert (stats["size_bytes"], stats["final_bytes"]) == (4 * MB, MB)
+    assert stats["channel_final_bytes"] == {"chan_a": MB, "chan_b": MB}
+
+    os.remove(a)
+    api_server._update_cache_index_sync((), [a])
+    assert get_cache_stats_sync(db)["final_bytes"] == MB  # still held by chan_b's link
+    os.remove(shared)
+    api_server._update_cache_index_sync((), [shared])
+    assert get_cache_stats_sync(db)["final_bytes"] == 0
+
+
+def test_an_index_from_before_final_bytes_is_migrated(tmp_path):
+    db = str(tmp_path / "media.db")
+    with sqlite3.connect(db) as conn:
+        conn.executescript(
+            """
+            CREATE TABLE cache_files (path TEXT PRIMARY KEY, channel TEXT NOT NULL, kind TEXT NOT NULL,
+                                      size INTEGER NOT NULL, inode TEXT NOT NULL, mtime REAL NOT NULL);
+            CREATE TABLE cache_channel_stats (channel TEXT PRIMARY KEY, files_count INTEGER NOT NULL,
+                                              size_bytes INTEGER NOT NULL);
+            CREATE TABLE cache_inodes (inode TEXT PRIMARY KEY, size INTEGER NOT NULL, refs INTEGER NOT NULL);
+            CREATE TABLE cache_totals (id INTEGER PRIMARY KEY CHECK (id = 1), files_count INTEGER NOT NULL,
+                                       size_bytes INTEGER NOT NULL);
+            INSERT INTO cache_files VALUES ('a/1/f', 'a', 'final', 5, '1:1', 1.0), ('a/2/temp_g', 'a', 'temp', 7, '1:2', 1.0);
+            INSERT INTO cache_channel_stats VALUES ('a', 2, 12);
+            INSERT INTO cache_inodes VALUES ('1:1', 5, 1), ('1:2', 7, 1);
+            INSERT INTO cache_totals VALUES (1, 2, 12);
+            """
+        )
+    init_db_sync(db)
+
+    stats = get_cache_stats_sync(db)
+    assert (stats["files_count"], stats["size_bytes"], stats["final_bytes"]) == (2, 12, 5)
+    assert stats["channel_final_bytes"] == {"a": 5}
+
+
+def test_stats_never_walk_the_tree(index_env, monkeypatch):
+    _, cache_dir = index_env
+    api_server._update_cache_index_sync([_write(cache_dir, "c/1/f")])
+
+    def no_walk(*a, **kw):
+        raise AssertionError("calculate_cache_stats must not walk the cache dir")
+
+    monkeypatch.setattr(api_server.os, "walk", no_walk)
+    assert api_server.calculate_cache_stats()["cache_files_count"] == 1
+
+
+def test_kinds_are_classified():
+    kind = api_server._cache_file_kind
+    assert kind("AgADfid") == "final"
+    assert kind("temp_AgADfid") == "temp"
+    assert kind("AgADfid.part." + "a" * 32) == "part"
+    assert kind("temp_AgADfid.part." + "b" * 32) == "part"
+    assert kind("temp_AgADfid.resume.json") == "resume"
+    assert kind("chunks_AgADfid.map") == "chunks"
+
+
+def test_indexed_sweep_expires_only_stale_untracked_files(index_env):
+    db, cache_dir = index_env
+    stale_temp = _write(cache_dir, "c/1/temp_bigvid", age_s=2 * 3600)
+    stale_part = _write(cache_dir, "c/1/AgADx.part." + "c" * 32, age_s=2 * 3600)
+    resume = _write(cache_dir, "c/1/temp_v2.resume", age_s=2 * 3600)  # within its 24h window
+    final = _write(cache_dir, "c/2/AgADold", age_s=30 * 86400)  # has a row: not this sweep's job
+    vanished = _write(cache_dir, "c/3/temp_gone", age_s=2 * 3600)
+    api_server._update_cache_index_sync([stale_temp, stale_part, resume, final, vanished])
+    os.remove(vanished)
+    upsert_media_file_ids_bulk_sync(db, [("c", 1, "bigvid", time.time())])
+
+    removed, dropped = api_server.sweep_indexed_untracked_sync(db, cache_dir)
+
+    assert removed == 2
+    assert dropped == {("c", 1, "bigvid")}
+    assert not os.path.exists(stale_temp) and not os.path.exists(stale_part)
+    assert os.path.exists(resume) and os.path.exists(final)
+    assert set(_indexed(db)) == {os.path.join("c", "1", "temp_v2.resume"), os.path.join("c", "2", "AgADold")}
+
+
+def test_touched_file_is_refreshed_not_removed(index_env):
+    db, cache_dir = index_env
+    chunk = _write(cache_dir, "c/1/chunks_vid", age_s=2 * 3600)
+    api_server._update_cache_index_sync([chunk])
+    os.utime(chunk, None)  # a ranged serve touched it after it was indexed
+
+    assert api_server.sweep_indexed_untracked_sync(db, cache_dir) == (0, set())
+    assert os.path.exists(chunk)
+    with sqlite3.connect(db) as conn:
+        (mtime,) = conn.execute("SELECT mtime FROM cache_files").fetchone()
+    assert mtime > time.time() - 60  # out of the candidate set until it idles again
+
+
+def test_startup_reconcile_indexes_disk_and_drops_ghost_rows(index_env):
+    db, cache_dir = index_env
+    ghost = _write(cache_dir, "old/1/AgADghost")
+    api_server._update_cache_index_sync([ghost])
+    os.remove(ghost)  # removed behind the index's back
+    os.makedirs(os.path.join(cache_dir, "old", "1"), exist_ok=True)
+    _write(cache_dir, "c/1/AgADkept", size=2 * MB)
+    _write(cache_dir, "c/1/temp_leftover")
+
+    assert api_server.reconcile_cache_index_sync(cache_dir) == 2
+
+    assert _indexed(db) == {os.path.join("c", "1", "AgADkept"): "final",
+                            os.path.join("c", "1", "temp_leftover"): "temp"}
+    stats = get_cache_stats_sync(db)
+    assert (stats["files_count"], stats["size_bytes"]) == (2, 3 * MB)
+    assert not os.path.exists(os.path.join(cache_dir, "old"))  # empty dirs went too
+
+
+
+def test_unwaited_update_is_queued_without_blocking(index_env, monkeypatch):
+    db, cache_dir = index_env
+    part = _write(cache_dir, "chan/1/temp_AgADbig.resume")
+    queued = []
+
+    def never_committed(db_path, op, *args):
+        queued.append((op, args))
+        return Future()
+
+    monkeypatch.setattr(api_server, "submit_write", never_committed)
+
+    api_server._update_cache_index_sync([part], wait=False)  # returns although nothing committed
+
+    (op, (add, remove)), = queued
+    assert op is file_io._op_record_cache_files
+    assert [(row[0], row[2]) for row in add] == [("chan/1/temp_AgADbig.resume", "resume")] and remove == []
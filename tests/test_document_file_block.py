@@ -18,6 +18,7 @@ import pytest
 
 from pyrogram.enums import MessageMediaType
 
+import file_io
 import post_parser
 from post_parser import (
     PostParser, RENDERERS, RenderCtx,
@@ -43,11 +44,11 @@ def _pinned_signing_key(monkeypatch):
 
 
 @pytest.fixture(autouse=True)
-def _no_media_id_db(monkeypatch):
+def _no_media_id_db(monkeypatch, fake_writes):
     # get_post flushes collected media ids into ./data/media_file_ids.db — a
     # forbidden side effect in tests. The upsert is imported INTO the post_parser
     # namespace, so patch it there (mirrors tests/golden_replay.pin_environment).
-    monkeypatch.setattr(post_parser, "upsert_media_file_ids_bulk_sync", lambda *a, **k: None)
+    fake_writes(post_parser, {file_io._op_upsert_media_file_ids_bulk: lambda *a, **k: None})
 
 
 @pytest.fixture
@@ -0,0 +1,93 @@
+# flake8: noqa
+# pylint: disable=protected-access, missing-function-docstring, redefined-outer-name, line-too-long
+# pylance: disable=reportMissingImports, reportMissingModuleSource
+"""
+Tests for the persisted download negative cache.
+
+_download_failures lived only in memory, so every deploy or crash forgot which files are
+dead and re-attempted all of them. Changes are now written behind to the download_failures
+table (deadlines as wall-clock time) and reloaded in lifespan; the verified self-heal
+clear-all also clears the stored copy.
+"""
+import pytest
+
+import api_server
+from file_io import init_db_sync, load_download_failures_sync
+
+DEAD = ("chanP", 1, "fid_dead")
+FLAKY = ("chanP", 2, "fid_flaky")
+
+
+@pytest.fixture
+def db(tmp_path, monkeypatch):
+    path = str(tmp_path / "media.db")
+    init_db_sync(path)
+    monkeypatch.setattr(api_server, "DB_PATH", path)
+    monkeypatch.setattr(api_server, "_download_failures", api_server.OrderedDict())
+    monkeypatch.setattr(api_server, "_failures_dirty", set())
+    monkeypatch.setattr(api_server, "_failures_clear_pending", False)
+    return path
+
+
+def _restart():
+    """Simulate a new process: the in-memory cache starts empty."""
+    api_server._download_failures.clear()
+    api_server._failures_dirty.clear()
+
+
+@pytest.mark.asyncio
+async def test_failures_survive_a_restart(db):
+    api_server._record_download_failure(DEAD, "permanent")
+    api_server._record_download_failure(DEAD, "permanent")
+    api_server._record_download_failure(FLAKY)
+    remaining = api_server._download_backoff_remaining(DEAD)
+    await api_server._flush_download_failures()
+    assert not api_server._failures_dirty
+
+    _restart()
+    assert await api_server._load_download_failures() == 2
+
+    assert api_server._download_failures[DEAD][0] == 2
+    assert api_server._download_failure_kind(DEAD) == "permanent"
+    assert api_server._download_failure_kind(FLAKY) == "transient"
+    assert api_server._download_backoff_remaining(DEAD) == pytest.approx(remaining, abs=2)
+    assert list(api_server._download_failures)[-1] == FLAKY  # LRU order restored
+
+
+@pytest.mark.asyncio
+async def test_recovered_and_evicted_keys_are_deleted(db, monkeypatch):
+    monkeypatch.setattr(api_server, "_DOWNLOAD_FAILURES_MAX", 1)
+    api_server._record_download_failure(DEAD)
+    await api_server._flush_download_failures()
+    api_server._record_download_failure(FLAKY)  # evicts DEAD
+    await api_server._flush_download_failures()
+    assert [r["file_unique_id"] for r in load_download_failures_sync(db, 10)] == ["fid_flaky"]
+
+    api_server._clear_download_failure(FLAKY)
+    await api_server._flush_download_failures()
+    assert load_download_failures_sync(db, 10) == []
+
+
+@pytest.mark.asyncio
+async def test_verified_restart_clears_the_stored_copy(db):
+    api_server._record_download_failure(DEAD)
+    await api_server._flush_download_failures()
+
+    api_server._clear_all_download_failures()
+    api_server._record_download_failure(FLAKY)  # a fresh failure after the heal is kept
+    await api_server._flush_download_failures()
+
+    assert [r["file_unique_id"] for r in load_download_failures_sync(db, 10)] == ["fid_flaky"]
+
+
+@pytest.mark.asyncio
+async def test_failed_flush_requeues_the_batch(db, monkeypatch):
+    api_server._record_download_failure(DEAD)
+
+    async def broken(*a, **kw):
+        raise RuntimeError("disk full")
+
+    monkeypatch.setattr(api_server, "write_async", broken)
+    with pytest.raises(RuntimeError):
+        await api_server._flush_download_failures()
+    assert api_server._failures_dirty == {DEAD}
@@ -0,0 +1,132 @@
+# flake8: noqa
+# pylint: disable=protected-access, missing-function-docstring, redefined-outer-name, line-too-long
+# pylance: disable=reportMissingImports, reportMissingModuleSource
+"""
+Tests for cross-process download deduplication.
+
+_inflight only deduplicated downloads inside one process, so several bridge processes
+sharing a cache dir each fetched the same file from Telegram. A download now holds an
+flock on `<fid>.lock` in its post dir; another process finding the lock held polls for
+the published file instead of downloading, and takes over if the holder gives up. A
+second open file description stands in for the other process below (flock conflicts
+between descriptions even within one process). Waiting for another process holds no
+download permit and is capped at the longest download timeout.
+"""
+import asyncio
+import fcntl
+import os
+
+import pytest
+
+import api_server
+
+KEY = ("chan", 5, "AgADfid")
+
+
+@pytest.fixture
+def cache(monkeypatch, tmp_path):
+    monkeypatch.setattr(api_server, "MEDIA_CACHE_DIR", str(tmp_path / "cache"))
+    monkeypatch.setattr(api_server, "_DOWNLOAD_LOCK_POLL", 0.01)
+    calls = []
+
+    async def fake_dl(channel, post_id, fid):
+        calls.append(fid)
+        path = api_server.media_cache_path(channel, post_id, fid)
+        with open(path, "wb") as f:
+            f.write(b"media")
+        return path
+
+    monkeypatch.setattr(api_server, "download_media_file", fake_dl)
+    return calls
+
+
+def _lock_path():
+    return api_server.media_cache_path(*KEY[:2], KEY[2] + api_server.DOWNLOAD_LOCK_SUFFIX)
+
+
+def _hold_lock():
+    """Lock the key the way another bridge process would."""
+    os.makedirs(os.path.dirname(_lock_path()), exist_ok=True)
+    fd = os.open(_lock_path(), os.O_RDWR | os.O_CREAT)
+    fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    return fd
+
+
+@pytest.mark.asyncio
+async def test_download_runs_under_the_lock_and_removes_it(cache):
+    path = await api_server._download_single_flight(*KEY, asyncio.Semaphore(1))
+
+    assert cache == [KEY[2]]
+    assert os.listdir(os.path.dirname(path)) == [KEY[2]]
+
+
+@pytest.mark.asyncio
+async def test_waiter_picks_up_the_file_published_by_the_holder(cache):
+    fd = _hold_lock()
+    try:
+        waiter = asyncio.create_task(api_server._download_single_flight(*KEY, asyncio.Semaphore(1)))
+        await asyncio.sleep(0.05)
+        assert not waiter.done()
+        with open(api_server.media_cache_path(*KEY), "wb") as f:
+            f.write(b"theirs")
+
+        path = await asyncio.wait_for(waiter, 2)
+    finally:
+        os.close(fd)
+
+    assert path == api_server.media_cache_path(*KEY) and cache == []
+
+
+@pytest.mark.asyncio
+async def test_waiter_takes_over_when_the_holder_gives_up(cache):
+    fd = _hold_lock()
+    waiter = asyncio.create_task(api_server._download_single_flight(*KEY, asyncio.Semaphore(1)))
+    await asyncio.sleep(0.05)
+    os.remove(_lock_path())  # holder failed: it unlinks, then unlocks
+    os.close(fd)
+
+    await asyncio.wait_for(waiter, 2)
+
+    assert cache == [KEY[2]]
+
+
+@pytest.mark.asyncio
+async def test_waiting_for_another_process_holds_no_permit(cache):
+    permit = asyncio.Semaphore(1)
+    fd = _hold_lock()
+    try:
+        waiter = asyncio.create_task(api_server._download_single_flight(*KEY, permit))
+        await asyncio.sleep(0.05)
+        other = await asyncio.wait_for(api_server._download_single_flight("chan", 6, "AgADother", permit), 2)
+        assert other.endswith("AgADother") and not waiter.done()
+    finally:
+        waiter.cancel()
+        os.close(fd)
+
+
+@pytest.mark.asyncio
+async def test_wait_is_capped_at_the_longest_download_timeout(cache, monkeypatch):
+    monkeypatch.setitem(api_server.Config, "media_download_timeout_max", 0.05)
+    fd = _hold_lock()
+    try:
+        path = await asyncio.wait_for(api_server._download_single_flight(*KEY, asyncio.Semaphore(1)), 2)
+    finally:
+        os.close(fd)
+
+    assert path == api_server.media_cache_path(*KEY) and cache == [KEY[2]]
+
+
+@pytest.mark.asyncio
+async def test_file_published_before_the_lock_is_not_downloaded_again(cache):
+    os.makedirs(api_server.media_cache_path(*KEY[:2]))
+    with open(api_server.media_cache_path(*KEY[:2], f"temp_{KEY[2]}"), "wb") as f:
+        f.write(b"large video")
+
+    path = await api_server._download_single_flight(*KEY, asyncio.Semaphore(1))
+
+    assert path.endswith(f"temp_{KEY[2]}") and cache == []
+
+
+def test_lock_files_are_their_own_cache_kind():
+    assert api_server._cache_file_kind(KEY[2] + api_server.DOWNLOAD_LOCK_SUFFIX) == "lock"
+    assert api_server._UNTRACKED_MAX_AGE["lock"] == api_server.RESUME_PARTIAL_MAX_AGE
@@ -0,0 +1,76 @@
+# flake8: noqa
+# pylint: disable=protected-access, missing-function-docstring, redefined-outer-name, line-too-long
+# pylance: disable=reportMissingImports, reportMissingModuleSource
+"""
+Tests for MIME detection at download time.
+
+The MIME type used to be detected lazily on the first serve: a python-magic read of the
+whole file in a thread plus a type-cache UPDATE. _download_atomic now sniffs the first
+bytes of the finished partial before the rename and records the type in the in-memory
+cache and the media row, so the first serve skips both.
+"""
+import os
+
+import pytest
+from fastapi import FastAPI, Request
+from fastapi.testclient import TestClient
+
+import api_server
+import file_io
+from file_io import get_mime_type_sync, init_db_sync, upsert_media_file_id_sync
+
+PNG = b"\x89PNG\r\n\x1a\n\x00\x00\x00\rIHDR\x00\x00\x00\x01\x00\x00\x00\x01\x08\x02\x00\x00\x00" + b"\x00" * 48
+KEY = ("chan", 3, "AgADpng")
+
+
+@pytest.fixture
+def env(monkeypatch, tmp_path):
+    monkeypatch.setattr(api_server, "MEDIA_CACHE_DIR", str(tmp_path / "cache"))
+    monkeypatch.setattr(api_server, "DB_PATH", str(tmp_path / "media.db"))
+    init_db_sync(api_server.DB_PATH)
+    upsert_media_file_id_sync(api_server.DB_PATH, *KEY, 0.0)
+
+    async def fake_dl(file_id, file_name, timeout=None, **kw):
+        with open(file_name, "wb") as f:
+            f.write(PNG)
+        return file_name
+
+    monkeypatch.setattr(api_server.client, "safe_download_media", fake_dl)
+
+
+@pytest.mark.asyncio
+async def test_download_records_sniffed_type(env):
+    path = await api_server._download_atomic("file-id", api_server.media_cache_path(*KEY), 10.0)
+
+    assert os.path.getsize(path) == len(PNG)
+    assert api_server._mime_types[KEY] == "image/png"
+    assert get_mime_type_sync(api_server.DB_PATH, *KEY) == "image/png"
+    assert api_server._media_meta[KEY].mime == "image/png"
+
+
+@pytest.mark.asyncio
+async def test_first_serve_after_download_skips_magic(env, monkeypatch, fake_writes):
+    path = await api_server._download_atomic("file-id", api_server.media_cache_path(*KEY), 10.0)
+    api_server._media_meta.clear()  # force the regular serve path
+    calls = []
+    monkeypatch.setattr(api_server.magic_mime, "from_file", lambda p: calls.append(p) or "x/y")
+    fake_writes(api_server, {file_io._op_set_mime_type: lambda *a: calls.append(a)})
+
+    app = FastAPI()
+
+    @app.get("/f")
+    async def _serve(request: Request):
+        return await api_server.prepare_file_response(path, request=request, media_key=KEY)
+
+    r = TestClient(app).get("/f")
+
+    assert r.status_code == 200 and r.headers["content-type"] == "image/png"
+    assert calls == []
+
+
+def test_sniff_prefers_the_buffered_head(tmp_path):
+    path = tmp_path / "f.part"
+    path.write_bytes(b"not an image at all")
+    size, mime = api_server._stat_and_sniff_sync(str(path), head=PNG)
+    assert size == 19 and mime == "image/png"
+    assert api_server._stat_and_sniff_sync(str(tmp_path / "missing")) == (None, None)
@@ -0,0 +1,86 @@
+# flake8: noqa
+# pylint: disable=protected-access, missing-function-docstring, redefined-outer-name, line-too-long
+# pylance: disable=reportMissingImports, reportMissingModuleSource
+"""
+Tests for the persistent, priority-ordered background download queue.
+
+download_queue used to be an in-memory FIFO of 100 items, filled in table order, lost on
+restart and silently refusing new items once full. Queued downloads now live in the
+download_queue table, keyed by media key and ordered by post recency plus the channel's
+feed popularity; the worker always takes the highest-priority items first.
+"""
+import time
+
+import pytest
+
+import api_server
+from file_io import (enqueue_downloads_sync, get_download_queue_sync, init_db_sync,
+                     remove_media_file_ids_sync, set_media_on_disk_bulk_sync, upsert_media_file_ids_bulk_sync)
+
+
+@pytest.fixture
+def db(tmp_path, monkeypatch):
+    path = str(tmp_path / "media.db")
+    init_db_sync(path)
+    monkeypatch.setattr(api_server, "DB_PATH", path)
+    monkeypatch.setattr(api_server, "_feed_polls", api_server.OrderedDict())
+    return path
+
+
+def _queued(db):
+    return [(r["channel"], r["post_id"]) for r in get_download_queue_sync(db, 100)]
+
+
+@pytest.mark.asyncio
+async def test_popular_feeds_outrank_newer_posts_of_unread_channels(db, tmp_path):
+    now = time.time()
+    for _ in range(31):  # log2(32) = 5 doublings = 30h of recency
+        api_server._note_feed_poll("Popular")
+    rows = [{"channel": "abandoned", "post_id": 9, "file_unique_id": "a", "added": now},
+            {"channel": "popular", "post_id": 1, "file_unique_id": "p1", "added": now - 86400},
+            {"channel": "popular", "post_id": 2, "file_unique_id": "p2", "added": now - 3600}]
+
+    await api_server.download_new_files(rows, str(tmp_path / "cache"))
+
+    assert _queued(db) == [("popular", 2), ("popular", 1), ("abandoned", 9)]
+
+
+def test_feed_popularity_decays(monkeypatch):
+    monkeypatch.setattr(api_server, "_feed_polls", api_server.OrderedDict())
+    api_server._note_feed_poll("@Chan")
+    api_server._note_feed_poll("chan")
+    later = time.monotonic() + api_server._FEED_POLL_HALF_LIFE
+    assert api_server._feed_popularity("chan", later) == pytest.approx(1.0, rel=1e-3)
+    assert api_server._feed_popularity("unknown") == 0.0
+
+
+def test_requeue_updates_priority_and_the_cap_drops_the_lowest(db):
+    enqueue_downloads_sync(db, [("c", 1, "f", 10.0, 1.0), ("c", 2, "f", 20.0, 1.0)], 10)
+    enqueue_downloads_sync(db, [("c", 1, "f", 30.0, 2.0)], 10)  # same key: one row, new priority
+    assert _queued(db) == [("c", 1), ("c", 2)]
+
+    assert enqueue_downloads_sync(db, [("c", 3, "f", 25.0, 3.0)], 2) == 1
+    assert _queued(db) == [("c", 1), ("c", 3)]
+
+
+@pytest.mark.asyncio
+async def test_sweep_prunes_entries_that_are_no_longer_pending(db, tmp_path):
+    now = time.time()
+    upsert_media_file_ids_bulk_sync(db, [("c", 1, "gone", now), ("c", 2, "done", now), ("c", 3, "need", now)])
+    enqueue_downloads_sync(db, [("c", 1, "gone", 1.0, 1.0), ("c", 2, "done", 2.0, 1.0), ("c", 4, "orphan", 3.0, 1.0)], 10)
+    remove_media_file_ids_sync(db, [("c", 1, "gone")])
+    set_media_on_disk_bulk_sync(db, [("c", 2, "done")])
+
+    await api_server.queue_pending_downloads(str(tmp_path / "cache"))
+
+    assert _queued(db) == [("c", 3)]
+
+
+def test_queue_survives_a_restart(tmp_path):
+    path = str(tmp_path / "media.db")
+    init_db_sync(path)
+    enqueue_downloads_sync(path, [("c", 1, "f", 1.0, 1.0)], 10)
+
+    init_db_sync(path)  # a new process re-runs the schema setup
+
+    assert [r["file_unique_id"] for r in get_download_queue_sync(path, 10)] == ["f"]
@@ -0,0 +1,116 @@
+# flake8: noqa
+# pylint: disable=protected-access, missing-function-docstring, redefined-outer-name, line-too-long
+# pylance: disable=reportMissingImports, reportMissingModuleSource
+"""
+Tests for the rendered-fragment cache of feed posts.
+
+Every feed poll, history-cache hit or not, ran process_message, the footer and
+sanitize_html for every post although almost all of them were unchanged since the
+previous poll. _render_pipeline now keeps each group's rendered, sanitized post keyed by
+its messages' snapshot hash and a render-config fingerprint, renders only new or changed
+groups, and replays the cached media file-id records so the media stay fresh for the
+cache sweeper. File references are collected from the live messages on a hit, since the
+cache key does not cover them.
+"""
+from datetime import datetime
+from types import SimpleNamespace
+
+import pytest
+from pyrogram.enums import MessageMediaType
+
+import rss_generator
+from post_parser import PostParser
+
+
+class _Str(str):
+    @property
+    def html(self):
+        return str(self)
+
+
+def _message(mid, text, photo=None):
+    m = SimpleNamespace(
+        id=mid, date=datetime(2024, 1, 1, 12, mid), text=_Str(text), caption=None, media=None,
+        web_page=None, poll=None, service=None, forward_origin=None, reply_to_message=None,
+        reply_to_message_id=None, sender_chat=None, from_user=None, reactions=None, views=100,
+        media_group_id=None, show_caption_above_media=False,
+        chat=SimpleNamespace(id=-1001234567890, username="testchan"),
+    )
+    for attr in ("photo", "video", "document", "audio", "voice", "video_note", "animation", "sticker"):
+        setattr(m, attr, None)
+    if photo:
+        m.text, m.caption, m.media = None, _Str(text), MessageMediaType.PHOTO
+        m.photo = SimpleNamespace(file_unique_id=photo, file_id=f"id-{photo}", file_size=1000)
+    return m
+
+
+@pytest.fixture
+def renders(monkeypatch):
+    calls = []
+    original = PostParser.process_message
+
+    def counting(self, message, include_raw=False, sanitize=True):
+        calls.append(message.id)
+        return original(self, message, include_raw=include_raw, sanitize=sanitize)
+
+    monkeypatch.setattr(PostParser, "process_message", counting)
+    return calls
+
+
+def _render(messages, parser=None):
+    parser = parser or PostParser(None)
+    posts = rss_generator._render_pipeline(messages, parser, 20, None, None, 5, False, "testchan")
+    return posts, parser
+
+
+def test_unchanged_posts_are_served_from_the_cache(renders):
+    messages = [_message(1, "first"), _message(2, "second <script>x</script>", photo="AgADp")]
+    first, parser1 = _render(messages)
+    renders.clear()
+    messages[1].photo.file_id = "id-fresh"  # a refreshed file reference; the snapshot has no file_id
+
+    second, parser2 = _render(messages)
+
+    assert renders == []
+    assert second == first and "<script>" not in second[0]['html']
+    assert [e[:3] for e in parser2._pending_media_ids] == [e[:3] for e in parser1._pending_media_ids] == [("testchan", 2, "AgADp")]
+    assert parser1._pending_file_refs == {("testchan", 2, "AgADp"): ("id-AgADp", None)}
+    assert parser2._pending_file_refs == {("testchan", 2, "AgADp"): ("id-fresh", None)}
+    assert rss_generator.get_fragment_cache_stats()["hits"] >= 2
+
+
+def test_only_the_edited_post_is_rendered_again(renders):
+    messages = [_message(1, "first"), _message(2, "second")]
+    _render(messages)
+    renders.clear()
+
+    messages[1].text = _Str("second, edited")
+    posts, _ = _render(messages)
+
+    assert renders == [2]
+    assert "second, edited" in posts[0]['html']
+
+
+@pytest.mark.parametrize("setting, value", [("show_post_flags", False), ("pyrogram_bridge_url", "https://other.example")])
+def test_render_settings_are_part_of_the_key(renders, monkeypatch, setting, value):
+    messages = [_message(1, "first")]
+    _render(messages)
+    renders.clear()
+
+    monkeypatch.setitem(rss_generator.Config, setting, value)
+    _render(messages)
+
+    assert renders == [1]
+
+
+def test_degraded_posts_and_a_disabled_cache_always_render(renders, monkeypatch):
+    original = PostParser.process_message
+    failing = lambda self, message, **kw: (_ for _ in ()).throw(RuntimeError("boom")) if message.id == 1 else original(self, message, **kw)
+    monkeypatch.setattr(PostParser, "process_message", failing)
+    _render([_message(1, "first")])
+    monkeypatch.setattr(PostParser, "process_message", original)
+    assert len(rss_generator._fragments) == 0
+
+    monkeypatch.setattr(rss_generator._fragments, "size", 0)
+    _render([_message(2, "second")])
+    assert len(rss_generator._fragments) == 0
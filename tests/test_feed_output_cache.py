@@ -0,0 +1,106 @@
+# flake8: noqa
+# pylint: disable=protected-access, missing-function-docstring, redefined-outer-name, line-too-long
+# pylance: disable=reportMissingImports, reportMissingModuleSource
+"""
+Tests for the whole-feed output cache.
+
+get_rss_feed rendered the full document, hashed it for the ETag and scanned it for
+Last-Modified on every poll, only to answer 304 most of the time. The rendered body is
+now kept with its validators per request parameters and tagged with the history snapshot
+it came from; while that snapshot (and the render settings) are unchanged a poll is
+answered from the entry without reading history or rendering.
+"""
+from datetime import datetime
+from types import SimpleNamespace
+
+import pytest
+from fastapi.testclient import TestClient
+
+import api_server
+import rss_generator
+import tg_cache
+
+TOKEN = api_server.Config["token"]
+BODY = ('<rss version="2.0"><channel><lastBuildDate>x</lastBuildDate>'
+        '<item><pubDate>Wed, 01 Jan 2020 00:00:00 +0000</pubDate></item></channel></rss>')
+
+
+def _snapshot(channel="chan", limit=100, text="hello", count=1):
+    messages = [SimpleNamespace(id=i, date=datetime(2020, 1, 1), text=text) for i in range(1, count + 1)]
+    tg_cache._save_history_to_cache(channel, messages, limit)
+
+
+@pytest.fixture
+def feed(monkeypatch, tmp_path):
+    monkeypatch.setattr(tg_cache, "CACHE_DIR", str(tmp_path / "tgcache"))
+    monkeypatch.setattr(tg_cache, "_history_meta", {})
+    monkeypatch.setattr(api_server, "client", SimpleNamespace(client=object()))
+    renders = []
+
+    async def fake_rss(channel, **kwargs):
+        renders.append(channel)
+        return BODY
+
+    monkeypatch.setattr(api_server, "generate_channel_rss", fake_rss)
+    return renders, TestClient(api_server.app)
+
+
+URL = f"/rss/chan/{TOKEN}?limit=50"  # an RSS feed of 50 posts reads a 100-message history
+
+
+def test_unchanged_snapshot_is_answered_without_rendering(feed):
+    renders, client = feed
+    _snapshot()
+    first = client.get(URL)
+
+    not_modified = client.get(URL, headers={"If-None-Match": first.headers["etag"]})
+    again = client.get(URL)
+
+    assert renders == ["chan"]
+    assert not_modified.status_code == 304 and not_modified.headers["etag"] == first.headers["etag"]
+    assert again.status_code == 200 and again.text == BODY
+    assert again.headers["last-modified"] == first.headers["last-modified"]
+
+
+def test_a_new_snapshot_or_other_parameters_render_again(feed):
+    renders, client = feed
+    _snapshot()
+    client.get(URL)
+
+    client.get(URL + "&exclude_flags=video")
+    _snapshot(text="new post")
+    client.get(URL)
+
+    assert renders == ["chan"] * 3
+
+
+def test_render_settings_change_invalidates(feed, monkeypatch):
+    renders, client = feed
+    _snapshot()
+    client.get(URL)
+
+    monkeypatch.setitem(rss_generator.Config, "show_post_flags", not rss_generator.Config["show_post_flags"])
+    client.get(URL)
+
+    assert len(renders) == 2
+
+
+def test_without_a_known_snapshot_nothing_is_cached(feed):
+    renders, client = feed
+    client.get(URL)
+    client.get(URL)
+    assert len(renders) == 2 and not api_server._feed_outputs
+
+
+def test_snapshot_token_follows_freshness_limit_and_file_identity(feed):
+    _snapshot(limit=2, count=2)
+    token = tg_cache.history_snapshot_token("Chan", 2)
+
+    assert token is not None
+    assert tg_cache.history_snapshot_token("chan", 3) is None        # the cached fetch is too short
+    assert tg_cache.history_snapshot_token("chan", 2, max_age_hours=0) is None
+
+    tg_cache._history_meta.clear()                                    # e.g. after a restart
+    assert tg_cache.history_snapshot_token("chan", 2) is None
+    assert tg_cache._get_history_from_cache("chan", 2) is not None  # a read learns the file again
+    assert tg_cache.history_snapshot_token("chan", 2) == token
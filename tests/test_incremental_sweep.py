@@ -0,0 +1,181 @@
+# flake8: noqa
+# pylint: disable=protected-access, missing-function-docstring, redefined-outer-name, line-too-long
+# pylance: disable=reportMissingImports, reportMissingModuleSource
+"""
+Tests for the SQL-driven incremental cache sweep.
+
+Every sweep used to load the whole media_file_ids table, stat every row's file and walk
+the whole cache tree. The sweeper now pages through `added < cutoff` via an index in
+bounded batches, takes download candidates from the on_disk = 0 rows only (flagging the
+ones it finds on disk), and walks the tree for untracked files at most once an hour.
+"""
+import os
+import sqlite3
+import time
+
+import pytest
+
+import api_server
+from file_io import (init_db_sync, upsert_media_file_ids_bulk_sync, get_all_media_file_ids_sync,
+                     get_expired_media_file_ids_sync, get_pending_media_file_ids_sync,
+                     get_download_queue_sync, set_media_on_disk_bulk_sync)
+
+DAY = 86400
+
+
+@pytest.fixture
+def sweep_env(tmp_path, monkeypatch):
+    db = str(tmp_path / "sweep.db")
+    init_db_sync(db)
+    cache_dir = str(tmp_path / "cache")
+    monkeypatch.setattr(api_server, "DB_PATH", db)
+    monkeypatch.setattr(api_server, "MEDIA_CACHE_DIR", cache_dir)
+    return db, cache_dir
+
+
+def _put(cache_dir, channel, post_id, fid):
+    path = os.path.join(cache_dir, channel, str(post_id), fid)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "wb") as f:
+        f.write(b"x")
+    return path
+
+
+def _on_disk(db):
+    with sqlite3.connect(db) as conn:
+        return dict(((r[0], r[1], r[2]), r[3]) for r in conn.execute(
+            "SELECT channel, post_id, file_unique_id, on_disk FROM media_file_ids"))
+
+
+def test_sweep_queries_use_the_indexes(sweep_env):
+    db, _ = sweep_env
+    with sqlite3.connect(db) as conn:
+        expired = " ".join(r[-1] for r in conn.execute(
+            "EXPLAIN QUERY PLAN SELECT rowid FROM media_file_ids WHERE added < 1 ORDER BY added, rowid"))
+        pending = " ".join(r[-1] for r in conn.execute(
+            "EXPLAIN QUERY PLAN SELECT rowid FROM media_file_ids WHERE on_disk = 0 ORDER BY added DESC, rowid DESC"))
+    assert "idx_media_file_ids_added" in expired
+    assert "idx_media_file_ids_pending" in pending
+
+
+def test_expired_pages_cover_every_row_once(sweep_env):
+    db, _ = sweep_env
+    now = time.time()
+    upsert_media_file_ids_bulk_sync(db, [("c", i, f"f{i}", now - 30 * DAY + i) for i in range(7)]
+                                    + [("c", 100, "fresh", now)])
+    seen, after = [], None
+    while True:
+        page = get_expired_media_file_ids_sync(db, now - 20 * DAY, 3, after)
+        if not page:
+            break
+        seen += [r["file_unique_id"] for r in page]
+        after = (page[-1]["added"], page[-1]["rowid"])
+    assert seen == [f"f{i}" for i in range(7)]
+
+
+def test_expire_removes_files_in_batches_and_keeps_fresh_rows(sweep_env, monkeypatch):
+    db, cache_dir = sweep_env
+    monkeypatch.setattr(api_server, "_SWEEP_BATCH_ROWS", 2)
+    now = time.time()
+    upsert_media_file_ids_bulk_sync(db, [("old", i, f"o{i}", now - 25 * DAY) for i in range(5)]
+                                    + [("new", 1, "n1", now)])
+    paths = [_put(cache_dir, "old", i, f"o{i}") for i in range(3)]  # two expired rows have no file
+    keep = _put(cache_dir, "new", 1, "n1")
+
+    purged, removed = api_server.expire_cached_files_sync(db, cache_dir, now - 20 * DAY)
+
+    assert (purged, removed) == (5, 3)
+    assert not any(os.path.exists(p) for p in paths) and os.path.exists(keep)
+    assert [r["file_unique_id"] for r in get_all_media_file_ids_sync(db)] == ["n1"]
+
+
+def test_expire_spares_a_row_touched_after_the_snapshot(sweep_env, monkeypatch):
+    db, cache_dir = sweep_env
+    now = time.time()
+    upsert_media_file_ids_bulk_sync(db, [("c", 1, "f", now - 25 * DAY)])
+    real_remove = api_server.remove_media_file_ids_if_unchanged_sync
+
+    def render_then_remove(db_path, entries):
+        upsert_media_file_ids_bulk_sync(db_path, [("c", 1, "f", time.time())])  # a live render
+        real_remove(db_path, entries)
+
+    monkeypatch.setattr(api_server, "remove_media_file_ids_if_unchanged_sync", render_then_remove)
+    api_server.expire_cached_files_sync(db, cache_dir, now - 20 * DAY)
+    assert len(get_all_media_file_ids_sync(db)) == 1
+
+
+@pytest.mark.asyncio
+async def test_pending_pass_flags_present_files_and_queues_missing_ones(sweep_env):
+    db, cache_dir = sweep_env
+    now = time.time()
+    upsert_media_file_ids_bulk_sync(db, [("c", 1, "have", now), ("c", 2, "need", now - 10)])
+    _put(cache_dir, "c", 1, "have")
+
+    confirmed = await api_server.queue_pending_downloads(cache_dir)
+
+    assert confirmed == 1
+    assert _on_disk(db) == {("c", 1, "have"): 1, ("c", 2, "need"): 0}
+    assert [(r["channel"], r["post_id"], r["file_unique_id"]) for r in get_download_queue_sync(db, 10)] == [("c", 2, "need")]
+    assert [r["file_unique_id"] for r in get_pending_media_file_ids_sync(db, 10)] == ["need"]
+
+
+@pytest.mark.asyncio
+async def test_pending_pass_stops_at_the_queue_cap(sweep_env, monkeypatch):
+    db, cache_dir = sweep_env
+    monkeypatch.setattr(api_server, "_DOWNLOAD_QUEUE_MAX", 2)
+    monkeypatch.setattr(api_server, "_SWEEP_BATCH_ROWS", 2)
+    now = time.time()
+    upsert_media_file_ids_bulk_sync(db, [("c", i, f"f{i}", now - i) for i in range(1, 7)])
+    calls = []
+    real_get = api_server.get_pending_media_file_ids_sync
+
+    def counting_get(*args):
+        calls.append(args)
+        return real_get(*args)
+
+    monkeypatch.setattr(api_server, "get_pending_media_file_ids_sync", counting_get)
+    await api_server.queue_pending_downloads(cache_dir)
+
+    assert [r["post_id"] for r in get_download_queue_sync(db, 10)] == [1, 2]  # the newest rows
+    assert len(calls) == 1  # the rest of the table was never read
+
+
+def test_upsert_keeps_the_on_disk_flag(sweep_env):
+    db, _ = sweep_env
+    upsert_media_file_ids_bulk_sync(db, [("c", 1, "f", 1.0)])
+    set_media_on_disk_bulk_sync(db, [("c", 1, "f")])
+    upsert_media_file_ids_bulk_sync(db, [("c", 1, "f", 2.0)])
+    assert _on_disk(db) == {("c", 1, "f"): 1}
+
+
+@pytest.mark.asyncio
+async def test_removing_a_cached_file_clears_on_disk(sweep_env):
+    db, cache_dir = sweep_env
+    upsert_media_file_ids_bulk_sync(db, [("c", 1, "zero", 1.0), ("c", 2, "kept", 1.0)])
+    set_media_on_disk_bulk_sync(db, [("c", 1, "zero"), ("c", 2, "kept")])
+    path = _put(cache_dir, "c", 1, "zero")
+    open(path, "wb").close()  # a zero-size leftover, healed by the next request for it
+
+    assert not await api_server._existing_cache_file(path, ("c", 1, "zero"))
+
+    assert _on_disk(db) == {("c", 1, "zero"): 0, ("c", 2, "kept"): 1}
+    await api_server.queue_pending_downloads(cache_dir)
+    assert [r["file_unique_id"] for r in get_download_queue_sync(db, 10)] == ["zero"]
+
+
+def test_index_drift_heal_clears_on_disk(sweep_env):
+    db, cache_dir = sweep_env
+    upsert_media_file_ids_bulk_sync(db, [("c", 1, "vid", 1.0), ("c", 2, "pic", 1.0)])
+    set_media_on_disk_bulk_sync(db, [("c", 1, "vid"), ("c", 2, "pic")])
+    temp = _put(cache_dir, "c", 1, "temp_vid")
+    pic = _put(cache_dir, "c", 2, "pic")
+    api_server._update_cache_index_sync([temp, pic], (), cache_dir)
+    os.utime(temp, (1.0, 1.0))
+    api_server._update_cache_index_sync([temp], (), cache_dir)  # recorded as long idle
+    os.remove(temp)  # both removed behind the index's back
+    os.remove(pic)
+
+    api_server.sweep_indexed_untracked_sync(db, cache_dir)  # the stale temp_ row is found gone
+    assert _on_disk(db) == {("c", 1, "vid"): 0, ("c", 2, "pic"): 1}
+    api_server.reconcile_cache_index_sync(cache_dir)  # the startup walk misses the final file
+    assert _on_disk(db) == {("c", 1, "vid"): 0, ("c", 2, "pic"): 0}
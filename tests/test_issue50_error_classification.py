@@ -18,6 +18,13 @@ from fastapi import HTTPException
 from pyrogram import errors
 
 import api_server
+import file_io
+
+
+@pytest.fixture(autouse=True)
+def _tmp_media_cache(tmp_path, monkeypatch):
+    # Downloads now take a lock file inside the post dir; keep them out of ./data/cache.
+    monkeypatch.setattr(api_server, "MEDIA_CACHE_DIR", str(tmp_path / "cache"))
 
 
 # --------------------------------------------------------------------------- #
@@ -217,7 +224,7 @@ async def test_get_media_floodwait_precedes_rpcerror(monkeypatch, tmp_path):
 # download_media_file: the "deleted / empty post" branch removes the SQLite row.
 # --------------------------------------------------------------------------- #
 @pytest.mark.asyncio
-async def test_deleted_post_removes_db_row(monkeypatch, tmp_path):
+async def test_deleted_post_removes_db_row(monkeypatch, tmp_path, fake_writes):
     """A deleted/empty post (404) must drop its media row so the 60s sweep stops re-fetching it
     forever — mirroring the fid-not-found branch."""
     monkeypatch.setattr(api_server, "MEDIA_CACHE_DIR", str(tmp_path / "cache"))
@@ -233,7 +240,7 @@ async def test_deleted_post_removes_db_row(monkeypatch, tmp_path):
     def fake_remove(db_path, entries):
         removed.extend(entries)
 
-    monkeypatch.setattr(api_server, "remove_media_file_ids_sync", fake_remove)
+    fake_writes(api_server, {file_io._op_remove_media_file_ids: fake_remove})
 
     with pytest.raises(HTTPException) as ei:
         await api_server.download_media_file("DelChan", 77, "fid_del")
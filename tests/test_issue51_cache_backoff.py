@@ -24,13 +24,27 @@ from types import SimpleNamespace
 import pytest
 
 import api_server
-from file_io import init_db_sync, get_all_media_file_ids_sync
+from file_io import init_db_sync, get_all_media_file_ids_sync, enqueue_downloads_sync, get_download_queue_sync
+
+
+@pytest.fixture(autouse=True)
+def _tmp_media_cache(tmp_path, monkeypatch):
+    # Downloads now take a lock file inside the post dir; keep them out of ./data/cache.
+    monkeypatch.setattr(api_server, "MEDIA_CACHE_DIR", str(tmp_path / "cache"))
 
 
 class _StopLoop(Exception):
     """Sentinel to break an otherwise-infinite background loop after one iteration."""
 
 
+@pytest.fixture
+def queue_db(tmp_path, monkeypatch):
+    db = str(tmp_path / "queue.db")
+    init_db_sync(db)
+    monkeypatch.setattr(api_server, "DB_PATH", db)
+    return db
+
+
 # --------------------------------------------------------------------------- #
 # 1. Backoff cap >= sweep interval; a capped dead file is not re-queued next sweep
 # --------------------------------------------------------------------------- #
@@ -58,15 +72,12 @@ def test_capped_dead_file_backoff_exceeds_sweep_interval():
 
 
 @pytest.mark.asyncio
-async def test_capped_dead_file_not_requeued_on_sweep(tmp_path):
+async def test_capped_dead_file_not_requeued_on_sweep(tmp_path, queue_db):
     cache_dir = str(tmp_path / "cache")
     channel, post_id, fid = "i51chan", 2, "fid_skip"
     key = (channel, post_id, fid)
 
-    api_server._queued_media.clear()
     api_server._download_failures.pop(key, None)
-    while not api_server.download_queue.empty():
-        api_server.download_queue.get_nowait()
 
     # Drive the file's backoff to the cap.
     n_fail = int(math.log2(api_server._DOWNLOAD_BACKOFF_MAX / api_server._DOWNLOAD_BACKOFF_BASE)) + 4
@@ -77,11 +88,9 @@ async def test_capped_dead_file_not_requeued_on_sweep(tmp_path):
     await api_server.download_new_files(media_files, cache_dir)
 
     # Backoff is far above the sweep interval -> the dead file is NOT enqueued.
-    assert api_server.download_queue.qsize() == 0
-    assert key not in api_server._queued_media
+    assert get_download_queue_sync(queue_db, 10) == []
 
     api_server._clear_download_failure(key)
-    api_server._queued_media.clear()
 
 
 # --------------------------------------------------------------------------- #
@@ -135,12 +144,8 @@ def test_drop_media_row_no_running_loop_is_noop():
 #    keep its own failure accounting.
 # --------------------------------------------------------------------------- #
 @pytest.mark.asyncio
-async def test_worker_routes_through_deduped_with_bg_semaphore(monkeypatch):
-    api_server._queued_media.clear()
-    while not api_server.download_queue.empty():
-        api_server.download_queue.get_nowait()
-    api_server._queued_media.add(("wchan", 9, "wfid"))
-    api_server.download_queue.put_nowait(("wchan", 9, "wfid"))
+async def test_worker_routes_through_deduped_with_bg_semaphore(monkeypatch, queue_db):
+    enqueue_downloads_sync(queue_db, [("wchan", 9, "wfid", 1.0, 1.0)], 100)
 
     seen = {}
 
@@ -157,33 +162,22 @@ async def test_worker_routes_through_deduped_with_bg_semaphore(monkeypatch):
     monkeypatch.setattr(api_server, "_clear_download_failure", lambda *a, **k: clr.append(a))
 
     async def fake_sleep(_d):
-        return None
+        raise _StopLoop  # break the worker loop after its first batch
     monkeypatch.setattr(api_server.asyncio, "sleep", fake_sleep)
 
-    real_task_done = api_server.download_queue.task_done
-    def stop_task_done():
-        real_task_done()
-        raise _StopLoop
-    monkeypatch.setattr(api_server.download_queue, "task_done", stop_task_done)
-
     with pytest.raises(_StopLoop):
         await api_server.background_download_worker()
 
     assert seen["args"] == ("wchan", 9, "wfid")
     assert seen["sem"] is api_server.BACKGROUND_DOWNLOAD_SEMAPHORE  # background permit, per #49
     assert rec == [] and clr == []  # worker keeps NO own failure accounting
-    api_server._queued_media.clear()
 
 
 @pytest.mark.asyncio
-async def test_worker_does_not_record_failure_on_error(monkeypatch):
+async def test_worker_does_not_record_failure_on_error(monkeypatch, queue_db):
     """A failing background download is negative-cached by the runner, so the worker must not
     _record_download_failure again (that would double-increment the counter)."""
-    api_server._queued_media.clear()
-    while not api_server.download_queue.empty():
-        api_server.download_queue.get_nowait()
-    api_server._queued_media.add(("wchan", 10, "wfid"))
-    api_server.download_queue.put_nowait(("wchan", 10, "wfid"))
+    enqueue_downloads_sync(queue_db, [("wchan", 10, "wfid", 1.0, 1.0)], 100)
 
     async def boom(channel, post_id, fid, semaphore):
         raise RuntimeError("download blew up")
@@ -193,21 +187,14 @@ async def test_worker_does_not_record_failure_on_error(monkeypatch):
     monkeypatch.setattr(api_server, "_record_download_failure", lambda *a, **k: rec.append(a))
 
     async def fake_sleep(_d):
-        return None
+        raise _StopLoop  # break the worker loop after its first batch
     monkeypatch.setattr(api_server.asyncio, "sleep", fake_sleep)
 
-    real_task_done = api_server.download_queue.task_done
-    def stop_task_done():
-        real_task_done()
-        raise _StopLoop
-    monkeypatch.setattr(api_server.download_queue, "task_done", stop_task_done)
-
     with pytest.raises(_StopLoop):
         await api_server.background_download_worker()
 
     assert rec == []  # runner owns the accounting; the worker only logs
-    assert ("wchan", 10, "wfid") not in api_server._queued_media  # dedup slot freed
-    api_server._queued_media.clear()
+    assert get_download_queue_sync(queue_db, 10) == []  # attempted -> off the queue
 
 
 @pytest.mark.asyncio
@@ -251,26 +238,19 @@ async def test_live_and_background_share_one_download(monkeypatch):
 # 4. Lazy makedirs + empty-dir sweep
 # --------------------------------------------------------------------------- #
 @pytest.mark.asyncio
-async def test_download_new_files_creates_no_empty_dir(tmp_path):
+async def test_download_new_files_creates_no_empty_dir(tmp_path, queue_db):
     cache_dir = str(tmp_path / "cache")
     channel, post_id, fid = "nodir_chan", 3, "nodir_fid"
 
-    api_server._queued_media.clear()
     api_server._download_failures.pop((channel, post_id, fid), None)
-    while not api_server.download_queue.empty():
-        api_server.download_queue.get_nowait()
 
     media_files = [{"channel": channel, "post_id": post_id, "file_unique_id": fid}]
     await api_server.download_new_files(media_files, cache_dir)
 
     # The file is queued, but NO cache directory was created for it (lazy makedirs).
-    assert api_server.download_queue.qsize() == 1
+    assert len(get_download_queue_sync(queue_db, 10)) == 1
     assert not os.path.exists(os.path.join(cache_dir, channel, str(post_id)))
 
-    api_server._queued_media.clear()
-    while not api_server.download_queue.empty():
-        api_server.download_queue.get_nowait()
-
 
 @pytest.mark.asyncio
 async def test_download_atomic_creates_dir_lazily(tmp_path, monkeypatch):
@@ -289,7 +269,9 @@ async def test_download_atomic_creates_dir_lazily(tmp_path, monkeypatch):
         assert f.read() == b"DATA"
 
 
-def test_sweep_removes_empty_dirs_keeps_populated(tmp_path):
+def test_sweep_removes_empty_dirs_keeps_populated(tmp_path, monkeypatch):
+    monkeypatch.setattr(api_server, "DB_PATH", str(tmp_path / "media.db"))
+    init_db_sync(api_server.DB_PATH)
     cache_dir = str(tmp_path / "cache")
     # An empty post/channel dir (a dead file that never downloaded).
     empty_post = os.path.join(cache_dir, "deadchan", "1")
@@ -300,7 +282,7 @@ def test_sweep_removes_empty_dirs_keeps_populated(tmp_path):
     with open(os.path.join(live_post, "livefid"), "wb") as f:
         f.write(b"X")
 
-    updated, _removed = api_server.remove_old_cached_files_sync([], cache_dir)
+    api_server.reconcile_cache_index_sync(cache_dir)
 
     # Empty post and its now-empty channel dir are gone; the populated tree is untouched.
     assert not os.path.exists(os.path.join(cache_dir, "deadchan"))
@@ -319,5 +301,5 @@ def test_sweep_survives_rmdir_race(tmp_path, monkeypatch):
     monkeypatch.setattr(api_server.os, "rmdir", boom_rmdir)
 
     # Must not raise despite every rmdir failing.
-    updated, _removed = api_server.remove_old_cached_files_sync([], cache_dir)
-    assert updated == []
+    api_server._remove_empty_dirs_sync(cache_dir)
+    assert os.path.exists(os.path.join(cache_dir, "racechan", "9"))
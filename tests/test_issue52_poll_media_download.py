@@ -23,6 +23,7 @@ from fastapi import HTTPException
 from pyrogram.enums import MessageMediaType
 
 import api_server
+import file_io
 
 
 def _poll_message(post_id, *, description_media=None):
@@ -79,7 +80,7 @@ async def test_poll_with_description_media_downloads(monkeypatch, tmp_path):
 
 
 @pytest.mark.asyncio
-async def test_poll_without_media_404_and_removes_db_row(monkeypatch, tmp_path):
+async def test_poll_without_media_404_and_removes_db_row(monkeypatch, tmp_path, fake_writes):
     """A poll whose requested media is absent must NOT return a (None, False) 'success':
     it hits the standard fid-not-found branch -> 404 + SQLite row removal, so the background
     dribble stops on its own."""
@@ -98,7 +99,7 @@ async def test_poll_without_media_404_and_removes_db_row(monkeypatch, tmp_path):
     def fake_remove(db_path, entries):
         removed.extend(entries)
 
-    monkeypatch.setattr(api_server, "remove_media_file_ids_sync", fake_remove)
+    fake_writes(api_server, {file_io._op_remove_media_file_ids: fake_remove})
 
     # A poll without media must never attempt a download.
     async def fail_download_atomic(*a, **k):
@@ -26,6 +26,7 @@ from pyrogram import errors
 
 import rich_tree
 import tg_cache
+import file_io
 import message_snapshot as ms
 import telegram_client
 from telegram_client import RichFetchResult, safe_get_rich_message
@@ -290,7 +291,7 @@ async def test_z_sentinel_part_true_is_refetched_and_fixed(monkeypatch):
 # (е) /media download cascade + (ж) memo.
 # ======================================================================================
 @pytest.fixture
-def _dl_env(monkeypatch, tmp_path):
+def _dl_env(monkeypatch, tmp_path, fake_writes):
     import api_server
     api_server._rich_refetch_memo.clear()
     monkeypatch.setattr(api_server, "MEDIA_CACHE_DIR", str(tmp_path / "cache"))
@@ -300,7 +301,7 @@ def _dl_env(monkeypatch, tmp_path):
     def fake_remove(db_path, keys):
         removed.extend(keys)
 
-    monkeypatch.setattr(api_server, "remove_media_file_ids_sync", fake_remove)
+    fake_writes(api_server, {file_io._op_remove_media_file_ids: fake_remove})
     return api_server, removed
 
 
@@ -0,0 +1,124 @@
+# flake8: noqa
+# pylint: disable=protected-access, missing-function-docstring, redefined-outer-name, line-too-long
+# pylance: disable=reportMissingImports, reportMissingModuleSource
+"""
+Tests for the content-addressed media blob store (MEDIA_BLOB_STORE).
+
+The same Telegram file (same file_unique_id) reposted into several posts/channels used to
+be downloaded and stored once per <channel>/<post_id> location. Every cached file is now
+hardlinked into blobs/<fid[:2]>/<fid>; another location is linked from the blob with no
+RPC and no download, the sweeper drops a blob once nothing links to it, and /health counts
+shared bytes once.
+"""
+import os
+import time
+from types import SimpleNamespace
+
+import pytest
+from pyrogram.enums import MessageMediaType
+
+import api_server
+from file_io import init_db_sync, upsert_media_file_ids_bulk_sync
+
+PAYLOAD = b"P" * (1024 * 1024)
+
+
+@pytest.fixture
+def blob_env(monkeypatch, tmp_path):
+    monkeypatch.setitem(api_server.Config, "media_blob_store", True)
+    monkeypatch.setattr(api_server, "MEDIA_CACHE_DIR", str(tmp_path / "cache"))
+    monkeypatch.setattr(api_server, "DB_PATH", str(tmp_path / "media.db"))
+    init_db_sync(api_server.DB_PATH)
+    rpcs, downloads = [], []
+    msg = SimpleNamespace(media=MessageMediaType.PHOTO, video=None, empty=False)
+
+    async def fake_get(channel_id, post_id):
+        rpcs.append((channel_id, post_id))
+        return msg
+
+    async def fake_find(message, fid):
+        return "file-id"
+
+    async def fake_dl(file_id, file_name, timeout=None, **kw):
+        downloads.append(file_name)
+        with open(file_name, "wb") as f:
+            f.write(PAYLOAD)
+        return file_name
+
+    monkeypatch.setattr(api_server.client, "safe_get_messages", fake_get)
+    monkeypatch.setattr(api_server, "find_file_id_in_message", fake_find)
+    monkeypatch.setattr(api_server.client, "safe_download_media", fake_dl)
+    return rpcs, downloads
+
+
+@pytest.mark.asyncio
+async def test_repost_is_linked_from_blob_without_download(blob_env):
+    rpcs, downloads = blob_env
+    first = await api_server.download_media_file("chan_a", 1, "AgADfid")
+    blob = api_server.media_blob_path("AgADfid")
+    assert os.path.samefile(first, blob)
+
+    second = await api_server.download_media_file("chan_b", 77, "AgADfid")
+
+    assert second == api_server.media_cache_path("chan_b", 77, "AgADfid")
+    assert os.path.samefile(first, second)  # one inode, stored once
+    assert len(downloads) == 1 and rpcs == [("chan_a", 1)]  # the repost cost no RPC/download
+    assert os.stat(blob).st_nlink == 3
+
+
+@pytest.mark.asyncio
+async def test_store_is_off_unless_enabled(blob_env, monkeypatch):
+    _rpcs, downloads = blob_env
+    monkeypatch.setitem(api_server.Config, "media_blob_store", False)
+    await api_server.download_media_file("chan_a", 1, "AgADfid")
+    await api_server.download_media_file("chan_b", 77, "AgADfid")
+
+    assert len(downloads) == 2 and not os.path.exists(api_server.media_blob_path("AgADfid"))
+
+
+@pytest.mark.asyncio
+async def test_zero_size_location_is_not_served_from_blob(blob_env):
+    _, downloads = blob_env
+    await api_server.download_media_file("chan_a", 1, "AgADfid")
+    stub = api_server.media_cache_path("chan_b", 2, "AgADfid")
+    os.makedirs(os.path.dirname(stub))
+    open(stub, "wb").close()
+
+    path = await api_server.download_media_file("chan_b", 2, "AgADfid")
+
+    assert os.path.getsize(path) > 0
+    assert len(downloads) == 2  # the regular zero-size cleanup + re-download ran
+
+
+@pytest.mark.asyncio
+async def test_sweeper_keeps_shared_blob_and_drops_orphans(blob_env):
+    await api_server.download_media_file("chan_a", 1, "AgADfid")
+    await api_server.download_media_file("chan_b", 2, "AgADfid")
+    blob = api_server.media_blob_path("AgADfid")
+    old = time.time() - 30 * 86400
+    cutoff = time.time() - 20 * 86400
+    upsert_media_file_ids_bulk_sync(api_server.DB_PATH, [("chan_a", 1, "AgADfid", old), ("chan_b", 2, "AgADfid", time.time())])
+
+    api_server.expire_cached_files_sync(api_server.DB_PATH, api_server.MEDIA_CACHE_DIR, cutoff)
+    assert os.path.exists(blob)  # chan_b still links it
+
+    upsert_media_file_ids_bulk_sync(api_server.DB_PATH, [("chan_b", 2, "AgADfid", old)])
+    api_server.expire_cached_files_sync(api_server.DB_PATH, api_server.MEDIA_CACHE_DIR, cutoff)
+    assert not os.path.exists(blob)
+    assert not os.path.exists(os.path.dirname(blob))
+
+
+@pytest.mark.asyncio
+async def test_cache_stats_count_shared_bytes_once(blob_env):
+    await api_server.download_media_file("chan_a", 1, "AgADfid")
+    await api_server.download_media_file("chan_b", 2, "AgADfid")
+    stats = api_server.calculate_cache_stats()
+    assert stats["cache_files_count"] == 2
+    assert stats["channels"]["chan_a"]["files_count"] == 1
+    assert stats["cache_total_size_mb"] == 1.0  # two locations, one inode
+
+
+def test_blob_path_rejects_non_id_names():
+    assert api_server.media_blob_path("../etc") is None
+    assert api_server.media_blob_path("") is None
+    assert api_server.media_blob_path("AgAD_x-1").endswith(os.path.join("blobs", "Ag", "AgAD_x-1"))
@@ -0,0 +1,152 @@
+# flake8: noqa
+# pylint: disable=protected-access, missing-function-docstring, redefined-outer-name, line-too-long
+# pylance: disable=reportMissingImports, reportMissingModuleSource
+"""
+Tests for the media-DC keep-alive.
+
+A cold /media miss used to pay for the media-session handshake (connect +
+auth.ExportAuthorization/ImportAuthorization on a foreign DC) before the first byte, and
+every in-process restart tore all media sessions down again. The client now learns the DC of
+each successful download (and, at startup, the DCs of the stored file references), keeps an
+authorized media session warm for it, drops sessions that stop answering pings, and re-warms
+right after a verified restart.
+"""
+import asyncio
+
+import pytest
+from pyrogram.file_id import FileId, FileType
+
+from telegram_client import TelegramClient
+
+
+def _file_id_on_dc(dc_id: int) -> str:
+    return FileId(
+        file_type=FileType.DOCUMENT, dc_id=dc_id, media_id=1, access_hash=2, file_reference=b"",
+    ).encode()
+
+
+class _FakeSession:
+    def __init__(self, fail_ping=False):
+        self.fail_ping = fail_ping
+        self.pings = 0
+        self.stopped = False
+
+    async def invoke(self, query):
+        self.pings += 1
+        if self.fail_ping:
+            raise OSError("zombie media connection")
+        return query
+
+    async def stop(self):
+        self.stopped = True
+
+
+def _wire_sessions(monkeypatch, c, sessions):
+    """Route get_session(dc, is_media=True) through Pyrogram's media_sessions map, like the real one."""
+    calls = []
+
+    async def fake_get_session(dc_id, is_media=False, **_):
+        assert is_media
+        calls.append(dc_id)
+        c.client.media_sessions.setdefault(dc_id, sessions[dc_id])
+        return c.client.media_sessions[dc_id]
+
+    monkeypatch.setattr(c.client, "get_session", fake_get_session)
+    return calls
+
+
+def test_successful_download_learns_media_dc():
+    c = TelegramClient()
+    c.note_media_dc(_file_id_on_dc(4))
+    c.note_media_dc(_file_id_on_dc(4))
+    c.note_media_dc("not-a-file-id")  # undecodable ids are ignored, never raise
+    assert c._media_dc_ids == {4}
+
+
+def test_stored_media_dcs_seed_the_keepalive():
+    c = TelegramClient()
+    c.note_media_dc(_file_id_on_dc(4))
+    c.note_media_dcs([2, 4, None])
+    assert c._media_dc_ids == {2, 4}
+
+
+@pytest.mark.asyncio
+async def test_safe_download_records_dc(monkeypatch):
+    c = TelegramClient()
+
+    async def ok_download(file_id, file_name=None):
+        return file_name
+
+    monkeypatch.setattr(c.client, "download_media", ok_download)
+    await c.safe_download_media(_file_id_on_dc(5), "/tmp/x", max_retries=1, timeout=1.0)
+    assert c._media_dc_ids == {5}
+
+
+@pytest.mark.asyncio
+async def test_warm_creates_and_pings_each_known_dc(monkeypatch):
+    c = TelegramClient()
+    c._media_dc_ids = {2, 4}
+    sessions = {2: _FakeSession(), 4: _FakeSession()}
+    calls = _wire_sessions(monkeypatch, c, sessions)
+
+    await c.warm_media_sessions()
+
+    assert calls == [2, 4]
+    assert sessions[2].pings == 1 and sessions[4].pings == 1
+    assert set(c.client.media_sessions) == {2, 4}
+
+
+@pytest.mark.asyncio
+async def test_unresponsive_session_is_dropped(monkeypatch):
+    """A media session that does not answer the ping is a zombie: it is removed from the
+    media-session map and stopped so the next pass / download rebuilds it."""
+    c = TelegramClient()
+    c._media_dc_ids = {2, 4}
+    sessions = {2: _FakeSession(fail_ping=True), 4: _FakeSession()}
+    _wire_sessions(monkeypatch, c, sessions)
+
+    await c.warm_media_sessions()  # must not raise
+
+    assert 2 not in c.client.media_sessions and sessions[2].stopped
+    assert 4 in c.client.media_sessions and not sessions[4].stopped
+
+
+@pytest.mark.asyncio
+async def test_warm_is_skipped_during_restart(monkeypatch):
+    c = TelegramClient()
+    c._media_dc_ids = {2}
+    calls = _wire_sessions(monkeypatch, c, {2: _FakeSession()})
+    c._restarting = True
+    await c.warm_media_sessions()
+    assert calls == []
+
+
+@pytest.mark.asyncio
+async def test_verified_restart_rewarms_media_dcs(monkeypatch):
+    c = TelegramClient()
+    c._media_dc_ids = {4}
+    calls = _wire_sessions(monkeypatch, c, {4: _FakeSession()})
+    monkeypatch.setattr(c, "_start_watchdog", lambda: None)
+    monkeypatch.setattr(c, "_start_media_keepalive", lambda: None)
+    monkeypatch.setattr(c.client, "is_connected", True)
+
+    async def fake_client_restart():
+        return None
+
+    async def fake_get_me():
+        return type("Me", (), {"id": 42})()
+
+    monkeypatch.setattr(c.client, "restart", fake_client_restart)
+    monkeypatch.setattr(c.client, "get_me", fake_get_me)
+
+    await c._restart_client("test")
+    assert c._media_rewarm_task is not None
+    await c._media_rewarm_task
+    assert calls == [4]
+
+
+def test_keepalive_disabled_by_zero_interval():
+    c = TelegramClient()
+    c.media_keepalive_interval = 0
+    c._start_media_keepalive()
+    assert c._media_keepalive_task is None
@@ -0,0 +1,127 @@
+# flake8: noqa
+# pylint: disable=protected-access, missing-function-docstring, redefined-outer-name, line-too-long
+# pylance: disable=reportMissingImports, reportMissingModuleSource
+"""
+Tests for the hot in-memory media metadata index (_media_meta).
+
+A /media cache hit used to pay a stat in get_media, another in prepare_file_response and a
+MIME lookup before FileResponse. The index keeps path, stat and MIME per media key: it is
+filled at publish and first serve, forgotten by every removal, and a hot hit needs no
+thread-pool hop.
+"""
+import asyncio
+import os
+import time
+from types import SimpleNamespace
+
+import pytest
+from pyrogram.enums import MessageMediaType
+from starlette.requests import Request
+
+import api_server
+from file_io import init_db_sync, upsert_media_file_id_sync
+
+KEY = ("chan", 1, "AgADfid")
+
+
+def _request():
+    return Request({"type": "http", "method": "GET", "path": "/", "headers": []})
+
+
+@pytest.fixture
+def env(monkeypatch, tmp_path):
+    monkeypatch.setattr(api_server, "MEDIA_CACHE_DIR", str(tmp_path / "cache"))
+    monkeypatch.setattr(api_server, "DB_PATH", str(tmp_path / "media.db"))
+    init_db_sync(api_server.DB_PATH)
+    msg = SimpleNamespace(media=MessageMediaType.PHOTO, video=None, empty=False)
+
+    async def fake_get(channel_id, post_id):
+        return msg
+
+    async def fake_find(message, fid):
+        return "file-id"
+
+    async def fake_dl(file_id, file_name, timeout=None, **kw):
+        with open(file_name, "wb") as f:
+            f.write(b"\xff\xd8\xff" + b"x" * 100)
+        return file_name
+
+    monkeypatch.setattr(api_server.client, "safe_get_messages", fake_get)
+    monkeypatch.setattr(api_server, "find_file_id_in_message", fake_find)
+    monkeypatch.setattr(api_server.client, "safe_download_media", fake_dl)
+    monkeypatch.setattr(api_server, "verify_media_digest", lambda *a: True)
+    monkeypatch.setattr(api_server.magic_mime, "from_file", lambda _p: "image/jpeg")
+
+
+@pytest.mark.asyncio
+async def test_publish_indexes_and_hot_hit_needs_no_thread_hop(env, monkeypatch):
+    path = await api_server.download_media_file(*KEY)
+    meta = api_server._media_meta[KEY]
+    assert meta.path == path and meta.stat.st_size == 103 and meta.mime == "image/jpeg"
+
+    async def no_hop(*a, **kw):
+        raise AssertionError("hot hit must not use the thread pool")
+
+    monkeypatch.setattr(asyncio, "to_thread", no_hop)
+    hot = await api_server.get_media(*KEY, request=_request())
+    assert hot.media_type == "image/jpeg"
+    assert hot.headers["content-length"] == "103"
+    assert KEY in api_server._access_updates
+
+
+@pytest.mark.asyncio
+async def test_sweep_forgets_removed_files(env):
+    await api_server.download_media_file(*KEY)
+    await api_server.get_media(*KEY, request=_request())
+    upsert_media_file_id_sync(api_server.DB_PATH, *KEY, time.time() - 30 * 86400)
+
+    api_server.expire_cached_files_sync(api_server.DB_PATH, api_server.MEDIA_CACHE_DIR, time.time() - 86400)
+
+    assert KEY not in api_server._media_meta
+    assert api_server._media_meta_lookup(KEY) is None
+
+
+def test_stat_taken_before_a_removal_is_not_remembered(tmp_path):
+    path = tmp_path / "f"
+    path.write_bytes(b"x")
+    epoch = api_server._media_meta_epoch
+    api_server._forget_media_meta([KEY])  # a concurrent sweep removed something meanwhile
+    api_server._remember_media_meta(KEY, str(path), os.stat(path), "image/jpeg", epoch)
+    assert KEY not in api_server._media_meta
+
+
+def test_lru_bound_evicts_the_coldest_entry(tmp_path, monkeypatch):
+    monkeypatch.setattr(api_server, "_MEDIA_META_MAX", 2)
+    path = tmp_path / "f"
+    path.write_bytes(b"x")
+    st = os.stat(path)
+    epoch = api_server._media_meta_epoch
+    for i in range(3):
+        if i == 2:
+            assert api_server._media_meta_lookup(("c", 0, "f")) is not None  # touch the first
+        api_server._remember_media_meta(("c", i, "f"), str(path), st, "image/png", epoch)
+    assert list(api_server._media_meta) == [("c", 0, "f"), ("c", 2, "f")]
+
+
+def test_temp_file_due_for_keepalive_takes_the_slow_path(tmp_path):
+    cache_dir = str(tmp_path)
+    path = os.path.join(cache_dir, "chan", "1", "temp_AgADbig")
+    os.makedirs(os.path.dirname(path))
+    with open(path, "wb") as f:
+        f.write(b"x")
+    old = time.time() - api_server.TEMP_MTIME_REFRESH_INTERVAL - 10
+    os.utime(path, (old, old))
+    key = api_server._media_meta_key(cache_dir, path)
+    assert key == ("chan", 1, "AgADbig")
+
+    api_server._remember_media_meta(key, path, os.stat(path), "video/mp4", api_server._media_meta_epoch)
+
+    assert key in api_server._media_meta
+    assert api_server._media_meta_lookup(key) is None
+
+
+def test_only_final_and_temp_names_have_keys(tmp_path):
+    cache_dir = str(tmp_path)
+    assert api_server._media_meta_key(cache_dir, os.path.join(cache_dir, "c", "1", "fid")) == ("c", 1, "fid")
+    assert api_server._media_meta_key(cache_dir, os.path.join(cache_dir, "c", "1", "temp_fid.resume")) is None
+    assert api_server._media_meta_key(cache_dir, os.path.join(cache_dir, "c", "fid")) is None
@@ -0,0 +1,147 @@
+# flake8: noqa
+# pylint: disable=protected-access, missing-function-docstring, redefined-outer-name, line-too-long
+# pylance: disable=reportMissingImports, reportMissingModuleSource
+"""
+Tests for the cold-media pass-through (tee) mode (MEDIA_STREAM_PASSTHROUGH).
+
+A /media miss used to wait for the WHOLE file before the first byte went out. In tee mode
+the download is streamed chunk by chunk into its .part file and every waiter of the shared
+download reads the bytes as they land, while the file is still published atomically at
+the end. Range requests and downloads that finished before the first byte keep the normal
+FileResponse path.
+"""
+import asyncio
+import os
+import struct
+import zlib
+from types import SimpleNamespace
+
+import pytest
+from fastapi.responses import StreamingResponse
+
+import api_server
+
+
+_IHDR = b"IHDR" + struct.pack(">IIBBBBB", 1, 1, 8, 2, 0, 0, 0)
+PNG_HEAD = b"\x89PNG\r\n\x1a\n" + struct.pack(">I", 13) + _IHDR + struct.pack(">I", zlib.crc32(_IHDR))
+
+
+class _GatedStream:
+    """Fake Client.stream_media: yields each chunk only once the test releases it."""
+
+    def __init__(self, chunks):
+        self.chunks = chunks
+        self.gates = [asyncio.Event() for _ in chunks]
+        self.offsets = []
+
+    def __call__(self, file_id, limit=0, offset=0):
+        self.offsets.append(offset)
+
+        async def _gen():
+            for i in range(offset, len(self.chunks)):
+                await self.gates[i].wait()
+                yield self.chunks[i]
+        return _gen()
+
+
+@pytest.fixture
+def tee_env(monkeypatch, tmp_path):
+    monkeypatch.setattr(api_server, "MEDIA_CACHE_DIR", str(tmp_path / "cache"))
+    monkeypatch.setattr(api_server, "verify_media_digest", lambda url, digest: True)
+    monkeypatch.setitem(api_server.Config, "media_stream_passthrough", True)
+    stream = _GatedStream([PNG_HEAD, b"b" * 16, b"c" * 5])
+    monkeypatch.setattr(api_server.client.client, "stream_media", stream)
+
+    async def fake_download_media_file(channel, post_id, fid):
+        final = api_server.media_cache_path(str(channel), post_id, fid)
+        return await api_server._download_atomic("file-id", final, timeout=10.0)
+
+    monkeypatch.setattr(api_server, "download_media_file", fake_download_media_file)
+    yield stream
+    api_server._inflight.clear()
+    api_server._inflight_tees.clear()
+
+
+@pytest.mark.asyncio
+async def test_cold_miss_streams_before_download_completes(tee_env):
+    stream = tee_env
+    stream.gates[0].set()  # only the first chunk is available
+
+    resp = await api_server.get_media("teechan", 1, "fid_png", request=SimpleNamespace(headers={}), digest="x")
+    assert isinstance(resp, StreamingResponse)
+    assert resp.media_type == "image/png"
+    assert resp.headers["x-content-type-options"] == "nosniff"
+
+    body = resp.body_iterator
+    first = await body.__anext__()
+    assert first == stream.chunks[0]  # served while chunks 2..3 are still in flight
+    final = api_server.media_cache_path("teechan", 1, "fid_png")
+    assert not os.path.exists(final)
+
+    for gate in stream.gates[1:]:
+        gate.set()
+    rest = b"".join([chunk async for chunk in body])
+    assert first + rest == b"".join(stream.chunks)
+
+    await asyncio.gather(*api_server._inflight_tasks)
+    with open(final, "rb") as f:
+        assert f.read() == b"".join(stream.chunks)
+    assert [p for p in os.listdir(os.path.dirname(final)) if ".part." in p] == []
+
+
+@pytest.mark.asyncio
+async def test_second_reader_joins_the_same_stream(tee_env):
+    stream = tee_env
+    stream.gates[0].set()
+    req = SimpleNamespace(headers={})
+    r1 = await api_server.get_media("teechan", 2, "fid_png", request=req, digest="x")
+    r2 = await api_server.get_media("teechan", 2, "fid_png", request=req, digest="x")
+    assert isinstance(r1, StreamingResponse) and isinstance(r2, StreamingResponse)
+    assert stream.offsets == [0]  # one download for both readers
+
+    for gate in stream.gates:
+        gate.set()
+    b1 = b"".join([c async for c in r1.body_iterator])
+    b2 = b"".join([c async for c in r2.body_iterator])
+    assert b1 == b2 == b"".join(stream.chunks)
+
+
+@pytest.mark.asyncio
+async def test_range_request_waits_for_complete_file(tee_env, monkeypatch):
+    async def fake_download(file_id, file_name, timeout=None, **kw):
+        with open(file_name, "wb") as f:
+            f.write(PNG_HEAD)
+        return file_name
+
+    async def fake_prepare(file_path, request, media_key=None):
+        return file_path
+
+    monkeypatch.setattr(api_server.client, "safe_download_media", fake_download)
+    monkeypatch.setattr(api_server, "prepare_file_response", fake_prepare)
+    resp = await api_server.get_media("teechan", 3, "fid_png", request=SimpleNamespace(headers={"range": "bytes=0-3"}), digest="x")
+    assert resp == api_server.media_cache_path("teechan", 3, "fid_png")  # complete file, FileResponse path
+    assert tee_env.offsets == []  # stream_media never used
+
+
+@pytest.mark.asyncio
+async def test_failed_stream_aborts_body_and_cleans_partial(tee_env, monkeypatch):
+    stream = tee_env
+    stream.gates[0].set()
+
+    def failing_stream(file_id, limit=0, offset=0):
+        async def _gen():
+            yield stream.chunks[0]
+            raise OSError("media DC went away")
+        return _gen()
+
+    monkeypatch.setattr(api_server.client.client, "stream_media", failing_stream)
+    resp = await api_server.get_media("teechan", 4, "fid_png", request=SimpleNamespace(headers={}), digest="x")
+    if isinstance(resp, StreamingResponse):
+        with pytest.raises(OSError):
+            async for _ in resp.body_iterator:
+                pass
+    await asyncio.gather(*api_server._inflight_tasks, return_exceptions=True)
+    final = api_server.media_cache_path("teechan", 4, "fid_png")
+    assert not os.path.exists(final)
+    assert [p for p in os.listdir(os.path.dirname(final)) if ".part." in p] == []
+    api_server._clear_download_failure(("teechan", 4, "fid_png"))
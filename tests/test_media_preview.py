@@ -0,0 +1,190 @@
+# flake8: noqa
+# pylint: disable=protected-access, missing-function-docstring, redefined-outer-name, line-too-long
+# pylance: disable=reportMissingImports, reportMissingModuleSource
+"""
+Tests for resized media previews.
+
+Feeds referenced full-resolution photos and whole videos, so a reader's list view pulled
+megabytes per post. /media/{channel}/{post_id}/{fid}/{preset}/{digest} now serves a
+resized JPEG cached next to the original (video posters are cut from Telegram's own
+thumbnail), and with MEDIA_FEED_PREVIEWS the feed HTML points at it while the single-post
+page keeps the originals.
+"""
+import asyncio
+import os
+from collections import OrderedDict
+from types import SimpleNamespace
+
+import pytest
+from fastapi import HTTPException
+from PIL import Image
+from pyrogram.enums import MessageMediaType
+
+import api_server
+import media_preview
+import post_parser
+from file_io import init_db_sync
+from url_signer import generate_media_digest
+
+KEY = ("chan", 1, "AgADfid")
+
+
+def _image(path, size=(2000, 1000), mode="RGB"):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    Image.new(mode, size, (200, 10, 10, 128) if mode == "RGBA" else (200, 10, 10)).save(path, "PNG")
+
+
+@pytest.fixture
+def env(monkeypatch, tmp_path):
+    monkeypatch.setattr(api_server, "MEDIA_CACHE_DIR", str(tmp_path / "cache"))
+    monkeypatch.setattr(api_server, "DB_PATH", str(tmp_path / "media.db"))
+    init_db_sync(api_server.DB_PATH)
+    monkeypatch.setattr(api_server, "verify_media_digest", lambda *a: True)
+    calls = {"downloads": []}
+
+    async def fake_get(channel_id, post_id):
+        thumbs = [SimpleNamespace(file_id="small", width=90, height=50), SimpleNamespace(file_id="big", width=320, height=180)]
+        return SimpleNamespace(video=SimpleNamespace(file_unique_id=KEY[2], thumbs=thumbs), animation=None)
+
+    async def fake_dl(file_id, file_name, timeout=None, **kw):
+        calls["downloads"].append(file_id)
+        _image(file_name, (320, 180))
+        return file_name
+
+    monkeypatch.setattr(api_server.client, "safe_get_messages", fake_get)
+    monkeypatch.setattr(api_server.client, "safe_download_media", fake_dl)
+    return calls
+
+
+def test_render_fits_the_preset_and_flattens_transparency(tmp_path):
+    src, dst = str(tmp_path / "src"), str(tmp_path / media_preview.preview_name("fid", "thumb"))
+    _image(src, mode="RGBA")
+
+    media_preview.render_preview(src, dst, "thumb")
+
+    with Image.open(dst) as out:
+        assert out.format == "JPEG" and out.size == (320, 160) and out.mode == "RGB"
+    assert sorted(os.listdir(tmp_path)) == sorted(["src", os.path.basename(dst)])  # no partial left behind
+    assert api_server._cache_file_kind(os.path.basename(dst)) == "preview"
+
+
+@pytest.mark.asyncio
+async def test_image_preview_is_rendered_once_from_the_cached_original(env, monkeypatch):
+    _image(api_server.media_cache_path(*KEY))
+    renders = []
+    real_render = media_preview.render_preview
+    monkeypatch.setattr(media_preview, "render_preview", lambda *a: renders.append(a) or real_render(*a))
+
+    first, second = await asyncio.gather(api_server.get_media_preview(*KEY, "feed", "d"),
+                                         api_server.get_media_preview(*KEY, "feed", "d"))
+    again = await api_server.get_media_preview(*KEY, "feed", "d")
+
+    assert len(renders) == 1 and env["downloads"] == []
+    assert first.media_type == second.media_type == again.media_type == "image/jpeg"
+    with Image.open(first.path) as out:
+        assert out.size == (800, 400)
+    assert os.path.dirname(first.path) == api_server.media_cache_path("chan", 1)
+
+
+@pytest.mark.asyncio
+async def test_poster_comes_from_the_largest_telegram_thumbnail(env):
+    response = await api_server.get_media_preview(*KEY, "poster", "d")
+
+    assert env["downloads"] == ["big"]  # never the video itself
+    assert response.media_type == "image/jpeg"
+    assert not any(".part." in name for name in os.listdir(api_server.media_cache_path("chan", 1)))
+
+
+@pytest.mark.asyncio
+async def test_poster_fetch_holds_a_download_permit(env, monkeypatch):
+    sem = asyncio.Semaphore(1)
+    monkeypatch.setattr(api_server, "HTTP_DOWNLOAD_SEMAPHORE", sem)
+    held = []
+    real_get, real_dl = api_server.client.safe_get_messages, api_server.client.safe_download_media
+
+    async def get_holding(*a):
+        held.append(sem.locked())
+        return await real_get(*a)
+
+    async def dl_holding(*a, **kw):
+        held.append(sem.locked())
+        return await real_dl(*a, **kw)
+
+    monkeypatch.setattr(api_server.client, "safe_get_messages", get_holding)
+    monkeypatch.setattr(api_server.client, "safe_download_media", dl_holding)
+    await api_server.get_media_preview(*KEY, "poster", "d")
+
+    assert held == [True, True] and not sem.locked()
+
+
+@pytest.mark.asyncio
+async def test_a_failed_poster_backs_off_instead_of_refetching(env, monkeypatch):
+    monkeypatch.setattr(api_server, "_download_failures", OrderedDict())
+    monkeypatch.setattr(api_server, "_failures_dirty", set())
+    fetches = []
+
+    async def no_message(channel_id, post_id):
+        fetches.append(post_id)
+        return None
+
+    monkeypatch.setattr(api_server.client, "safe_get_messages", no_message)
+    for _ in range(2):
+        with pytest.raises(HTTPException) as exc:
+            await api_server.get_media_preview(*KEY, "poster", "d")
+        assert exc.value.status_code == 404
+
+    assert fetches == [1]
+    assert api_server._download_backoff_remaining(KEY) == 0  # the original is not held back
+
+
+@pytest.mark.asyncio
+async def test_serving_an_old_preview_keeps_it_from_expiring(env):
+    _image(api_server.media_cache_path(*KEY))
+    first = await api_server.get_media_preview(*KEY, "feed", "d")
+    old = os.path.getmtime(first.path) - (api_server.MEDIA_CACHE_MAX_AGE_DAYS + 1) * 86400
+    os.utime(first.path, (old, old))
+    api_server._update_cache_index_sync([first.path])  # indexed as idle past the expiry window
+
+    again = await api_server.get_media_preview(*KEY, "feed", "d")
+    api_server.sweep_indexed_untracked_sync(api_server.DB_PATH, api_server.MEDIA_CACHE_DIR)
+
+    assert os.path.exists(first.path) and os.path.getmtime(first.path) > old
+    assert again.status_code == 200
+
+
+@pytest.mark.asyncio
+async def test_bad_signature_and_unknown_preset_are_rejected(env, monkeypatch):
+    with pytest.raises(HTTPException) as exc:
+        await api_server.get_media_preview(*KEY, "huge", "d")
+    assert exc.value.status_code == 404
+
+    monkeypatch.setattr(api_server, "verify_media_digest", lambda *a: False)
+    with pytest.raises(HTTPException) as exc:
+        await api_server.get_media_preview(*KEY, "feed", "d")
+    assert exc.value.status_code == 403
+
+
+def test_preset_is_part_of_the_signed_path(monkeypatch):
+    monkeypatch.setattr(post_parser, "media_url_expiry", lambda: None)
+    url = post_parser.PostParser(None)._build_media_url("chan", 1, "fid", "feed")
+    assert url.endswith(f"/media/chan/1/fid/feed/{generate_media_digest('chan/1/fid/feed')}")
+
+
+@pytest.mark.parametrize("media, attr, previews, expected", [
+    (MessageMediaType.PHOTO, "photo", True, "/media/chan/1/fid/feed/"),
+    (MessageMediaType.VIDEO, "video", True, 'preload="none" poster='),
+    (MessageMediaType.PHOTO, "photo", False, "/media/chan/1/fid/"),
+])
+def test_feed_html_references_previews_only_when_enabled(monkeypatch, media, attr, previews, expected):
+    monkeypatch.setattr(post_parser.PostParser, "_save_media_file_ids", lambda self, m: None)
+    message = SimpleNamespace(id=1, media=media, web_page=None, text=None, caption=None,
+                              chat=SimpleNamespace(id=-100, username="chan", usernames=None),
+                              **{attr: SimpleNamespace(file_unique_id="fid")})
+    parser = post_parser.PostParser(None, media_previews=previews)
+    monkeypatch.setattr(parser, "_get_file_unique_id", lambda m: "fid")
+
+    html = parser._generate_html_media(message)
+
+    assert expected in html
+    if not previews:
+        assert "/feed/" not in html and "poster" not in html
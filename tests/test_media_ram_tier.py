@@ -0,0 +1,134 @@
+# flake8: noqa
+# pylint: disable=protected-access, missing-function-docstring, redefined-outer-name, line-too-long
+# pylance: disable=reportMissingImports, reportMissingModuleSource
+"""
+Tests for the RAM tier of small hot media.
+
+Every /media hit on a tiny sticker or photo still opened and read the file. Files up to
+MEDIA_RAM_TIER_FILE_KB are now loaded into a byte-budgeted LRU after their first hot hit
+and served from memory with FileResponse's own headers and Range handling; the sweeper's
+removals drop them together with their metadata.
+"""
+import os
+import time
+
+import pytest
+from fastapi import FastAPI, Request
+from fastapi.testclient import TestClient
+
+import api_server
+from file_io import init_db_sync
+
+KEY = ("chan", 3, "AgADsticker")
+BODY = bytes(range(256)) * 16  # 4 KiB
+
+
+@pytest.fixture
+def cached(monkeypatch, tmp_path):
+    monkeypatch.setattr(api_server, "MEDIA_CACHE_DIR", str(tmp_path / "cache"))
+    monkeypatch.setattr(api_server, "DB_PATH", str(tmp_path / "media.db"))
+    init_db_sync(api_server.DB_PATH)
+    path = api_server.media_cache_path(*KEY)
+    os.makedirs(os.path.dirname(path))
+    with open(path, "wb") as f:
+        f.write(BODY)
+    api_server._remember_mime(KEY, "image/webp")
+    api_server._update_cache_index_sync([path])  # published: indexed with its MIME type
+    return path
+
+
+def _client(path, key=KEY):
+    app = FastAPI()
+
+    @app.get("/m")
+    async def _serve(request: Request):
+        return await api_server.prepare_file_response(path, request=request, media_key=key)
+
+    return TestClient(app)
+
+
+def _wait_resident(key=KEY):
+    deadline = time.monotonic() + 2
+    while key not in api_server._media_bytes:
+        assert time.monotonic() < deadline, "RAM tier load did not finish"
+        time.sleep(0.01)
+
+
+def test_hot_file_is_served_from_memory_identically(cached, monkeypatch):
+    client = _client(cached)
+    from_disk = client.get("/m")
+    _wait_resident()
+
+    def no_open(*a, **kw):
+        raise AssertionError("a resident file must not be opened")
+
+    monkeypatch.setattr(api_server.FileResponse, "_handle_simple", no_open)
+    from_ram = client.get("/m")
+
+    assert from_ram.content == from_disk.content == BODY
+    for header in ("etag", "last-modified", "content-length", "content-type", "content-disposition", "cache-control"):
+        assert from_ram.headers[header] == from_disk.headers[header]
+
+
+def test_ranges_and_if_range_keep_their_semantics(cached, monkeypatch):
+    client = _client(cached)
+    with monkeypatch.context() as m:
+        m.setattr(api_server, "_MEDIA_RAM_BUDGET", 0)
+        multi_disk = client.get("/m", headers={"Range": "bytes=0-9,20-29"})
+    client.get("/m")
+    _wait_resident()
+    etag = client.get("/m").headers["etag"]
+
+    single = client.get("/m", headers={"Range": "bytes=100-199"})
+    suffix = client.get("/m", headers={"Range": "bytes=-10"})
+    stale = client.get("/m", headers={"Range": "bytes=0-9", "If-Range": '"other"'})
+    fresh = client.get("/m", headers={"Range": "bytes=0-9", "If-Range": etag})
+    multi = client.get("/m", headers={"Range": "bytes=0-9,20-29"})
+    past = client.get("/m", headers={"Range": "bytes=99999-"})
+
+    assert single.status_code == 206 and single.content == BODY[100:200]
+    assert single.headers["content-range"] == f"bytes 100-199/{len(BODY)}"
+    assert suffix.content == BODY[-10:]
+    assert stale.status_code == 200 and stale.content == BODY
+    assert fresh.status_code == 206 and fresh.content == BODY[:10]
+    assert multi.status_code == 206 and multi.headers["content-range"].startswith("multipart/byteranges")  # as FileResponse sets it
+    boundary = lambda r: r.headers["content-range"].split("boundary=")[1].encode()
+    assert multi.content.replace(boundary(multi), b"B") == multi_disk.content.replace(boundary(multi_disk), b"B")
+    assert multi.headers["content-length"] == multi_disk.headers["content-length"]
+    assert past.status_code == 416
+
+
+def test_sweeper_removal_drops_the_bytes(cached):
+    client = _client(cached)
+    client.get("/m")
+    _wait_resident()
+
+    api_server._update_cache_index_sync((), [cached])
+
+    assert KEY not in api_server._media_bytes and api_server._media_bytes_size == 0
+
+
+def test_large_files_stay_on_disk_and_the_budget_evicts_lru(cached, monkeypatch):
+    monkeypatch.setattr(api_server, "_MEDIA_RAM_FILE_MAX", len(BODY) - 1)
+    client = _client(cached)
+    client.get("/m")
+    client.get("/m")
+    assert not api_server._media_bytes and not api_server._media_bytes_loading
+
+    monkeypatch.setattr(api_server, "_MEDIA_RAM_FILE_MAX", len(BODY))
+    monkeypatch.setattr(api_server, "_MEDIA_RAM_BUDGET", len(BODY) + 1)
+    other = ("chan", 4, "AgADother")
+    other_path = api_server.media_cache_path(*other)
+    os.makedirs(os.path.dirname(other_path))
+    with open(other_path, "wb") as f:
+        f.write(BODY)
+    api_server._remember_mime(other, "image/webp")
+    api_server._update_cache_index_sync([other_path])
+
+    client.get("/m")
+    _wait_resident(KEY)
+    _client(other_path, other).get("/m")
+    _wait_resident(other)
+
+    assert list(api_server._media_bytes) == [other]
+    assert api_server._media_bytes_size == len(BODY)
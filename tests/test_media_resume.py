@@ -0,0 +1,169 @@
+# flake8: noqa
+# pylint: disable=protected-access, missing-function-docstring, redefined-outer-name, line-too-long
+# pylance: disable=reportMissingImports, reportMissingModuleSource
+"""
+Tests for resumable large-video downloads (MEDIA_RESUME_LARGE_DOWNLOADS).
+
+A timeout used to delete the unique .part of a >100MB video, so a download that reached 90%
+restarted from zero. Large videos now download into a stable temp_<fid>.resume partial with
+a progress sidecar; the next attempt continues from the last complete 1 MiB part and the
+file is still published by an atomic rename.
+"""
+import asyncio
+import json
+import os
+import time
+
+import pytest
+
+import api_server
+from file_io import init_db_sync
+from telegram_client import STREAM_CHUNK_SIZE
+
+
+SIZE = 3 * STREAM_CHUNK_SIZE + 10
+DATA = bytes(range(256)) * (SIZE // 256) + bytes(range(SIZE % 256))
+PARTS = [DATA[i:i + STREAM_CHUNK_SIZE] for i in range(0, SIZE, STREAM_CHUNK_SIZE)]
+
+
+class _FlakyStream:
+    """Fake Client.stream_media that hangs after `stall_after` parts on its first call."""
+
+    def __init__(self, stall_after=None):
+        self.stall_after = stall_after
+        self.offsets = []
+
+    def __call__(self, file_id, limit=0, offset=0):
+        self.offsets.append(offset)
+        stall = self.stall_after if len(self.offsets) == 1 else None
+
+        async def _gen():
+            for i in range(offset, len(PARTS)):
+                if stall is not None and i >= stall:
+                    await asyncio.sleep(3600)
+                yield PARTS[i]
+        return _gen()
+
+
+@pytest.fixture
+def final_path(tmp_path):
+    return str(tmp_path / "chan" / "1" / "temp_bigvid")
+
+
+def _read(path):
+    with open(path, "rb") as f:
+        return f.read()
+
+
+@pytest.mark.asyncio
+async def test_timeout_keeps_progress_and_next_attempt_resumes(monkeypatch, final_path):
+    stream = _FlakyStream(stall_after=2)
+    monkeypatch.setattr(api_server.client.client, "stream_media", stream)
+
+    with pytest.raises(asyncio.TimeoutError):
+        await api_server._download_resumable("file-id", final_path, 0.2, "bigvid", SIZE)
+    assert not os.path.exists(final_path)
+    with open(final_path + api_server.RESUME_META_SUFFIX) as f:
+        assert json.load(f)["bytes"] == 2 * STREAM_CHUNK_SIZE
+
+    out = await api_server._download_resumable("file-id", final_path, 10.0, "bigvid", SIZE)
+
+    assert out == final_path
+    assert stream.offsets == [0, 2]  # second attempt started at part 2, not byte 0
+    assert _read(final_path) == DATA
+    assert not os.path.exists(final_path + api_server.RESUME_SUFFIX)
+    assert not os.path.exists(final_path + api_server.RESUME_META_SUFFIX)
+
+
+@pytest.mark.asyncio
+async def test_progress_is_checkpointed_while_streaming(monkeypatch, final_path):
+    """A process killed mid-download (no except path runs) still leaves a usable sidecar."""
+    monkeypatch.setattr(api_server, "RESUME_CHECKPOINT_BYTES", STREAM_CHUNK_SIZE)
+    monkeypatch.setattr(api_server.client.client, "stream_media", _FlakyStream(stall_after=2))
+    attempt = asyncio.create_task(api_server._download_resumable("file-id", final_path, 10.0, "bigvid", SIZE))
+    meta_path = final_path + api_server.RESUME_META_SUFFIX
+    for _ in range(200):
+        await asyncio.sleep(0.01)
+        if os.path.exists(meta_path) and json.load(open(meta_path))["bytes"] > 0:
+            break
+
+    # Read what a restarted process would find, while the attempt is still running.
+    offset = api_server._resume_offset_sync(final_path + api_server.RESUME_SUFFIX, meta_path, "bigvid", SIZE)
+    attempt.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await attempt
+
+    assert offset in (STREAM_CHUNK_SIZE, 2 * STREAM_CHUNK_SIZE)  # a checkpoint may still be in flight
+
+
+@pytest.mark.asyncio
+async def test_foreign_sidecar_restarts_from_zero(monkeypatch, final_path):
+    os.makedirs(os.path.dirname(final_path))
+    with open(final_path + api_server.RESUME_SUFFIX, "wb") as f:
+        f.write(b"x" * (2 * STREAM_CHUNK_SIZE))
+    api_server._write_resume_meta_sync(final_path + api_server.RESUME_META_SUFFIX, "bigvid", SIZE + 1, 2 * STREAM_CHUNK_SIZE)
+    stream = _FlakyStream()
+    monkeypatch.setattr(api_server.client.client, "stream_media", stream)
+
+    await api_server._download_resumable("file-id", final_path, 10.0, "bigvid", SIZE)
+
+    assert stream.offsets == [0]
+    assert _read(final_path) == DATA
+
+
+@pytest.mark.asyncio
+async def test_sidecar_never_trusted_beyond_the_data_file(monkeypatch, final_path):
+    """After a hard crash the data file may be shorter than recorded: resume from what exists."""
+    os.makedirs(os.path.dirname(final_path))
+    with open(final_path + api_server.RESUME_SUFFIX, "wb") as f:
+        f.write(DATA[:STREAM_CHUNK_SIZE + 5])
+    api_server._write_resume_meta_sync(final_path + api_server.RESUME_META_SUFFIX, "bigvid", SIZE, 3 * STREAM_CHUNK_SIZE)
+    stream = _FlakyStream()
+    monkeypatch.setattr(api_server.client.client, "stream_media", stream)
+
+    await api_server._download_resumable("file-id", final_path, 10.0, "bigvid", SIZE)
+
+    assert stream.offsets == [1]
+    assert _read(final_path) == DATA
+
+
+@pytest.mark.asyncio
+async def test_wrong_final_size_is_discarded(monkeypatch, final_path):
+    monkeypatch.setattr(api_server.client.client, "stream_media", _FlakyStream())
+    with pytest.raises(api_server.ZeroSizeFileError):
+        await api_server._download_resumable("file-id", final_path, 10.0, "bigvid", SIZE + 1)
+    assert os.listdir(os.path.dirname(final_path)) == []
+
+
+@pytest.mark.asyncio
+async def test_concurrent_attempts_share_one_partial(monkeypatch, final_path):
+    stream = _FlakyStream()
+    monkeypatch.setattr(api_server.client.client, "stream_media", stream)
+    p1, p2 = await asyncio.gather(
+        api_server._download_resumable("file-id", final_path, 10.0, "bigvid", SIZE),
+        api_server._download_resumable("file-id", final_path, 10.0, "bigvid", SIZE),
+    )
+    assert p1 == p2 == final_path
+    assert stream.offsets == [0]  # the second attempt found the published file
+    assert _read(final_path) == DATA
+
+
+def test_sweeper_keeps_resume_partials_past_the_temp_window(tmp_path, monkeypatch):
+    cache_dir = tmp_path / "cache"
+    post = cache_dir / "chan" / "1"
+    post.mkdir(parents=True)
+    recent = post / "temp_a.resume"; recent.write_bytes(b"x")
+    recent_meta = post / "temp_a.resume.json"; recent_meta.write_text("{}")
+    abandoned = post / "temp_b.resume"; abandoned.write_bytes(b"x")
+    two_hours, two_days = time.time() - 2 * 3600, time.time() - 2 * 86400
+    for p in (recent, recent_meta):
+        os.utime(p, (two_hours, two_hours))
+    os.utime(abandoned, (two_days, two_days))
+
+    monkeypatch.setattr(api_server, "DB_PATH", str(tmp_path / "media.db"))
+    init_db_sync(api_server.DB_PATH)
+    api_server.reconcile_cache_index_sync(str(cache_dir))
+    api_server.sweep_indexed_untracked_sync(api_server.DB_PATH, str(cache_dir))
+
+    assert recent.exists() and recent_meta.exists()
+    assert not abandoned.exists()
@@ -9,8 +9,8 @@ Issue #25 (package D) regressions:
     Previously the DB diff ran only `if files_removed > 0`, so such a fileless-but-expired
     row stayed in the table forever.
   * Задание 14 — download_new_files must not re-enqueue an already-queued/in-flight file on
-    every sweep pass (dedup via the module-level _queued_media set), and the worker must free
-    the dedup slot in its finally so the file can be re-enqueued later.
+    every sweep pass (dedup by the persistent download queue's key), and the worker must
+    take a processed file off the queue so a later sweep can queue it again.
 """
 import sqlite3
 from datetime import datetime
@@ -18,7 +18,13 @@ from datetime import datetime
 import pytest
 
 import api_server
-from file_io import init_db_sync, get_all_media_file_ids_sync
+from file_io import init_db_sync, get_all_media_file_ids_sync, enqueue_downloads_sync, get_download_queue_sync
+
+
+@pytest.fixture(autouse=True)
+def _tmp_media_cache(tmp_path, monkeypatch):
+    # Downloads now take a lock file inside the post dir; keep them out of ./data/cache.
+    monkeypatch.setattr(api_server, "MEDIA_CACHE_DIR", str(tmp_path / "cache"))
 
 
 class _StopLoop(Exception):
@@ -35,8 +41,8 @@ async def test_expired_row_missing_file_purged_when_no_disk_removal(tmp_path, mo
     init_db_sync(db)
     monkeypatch.setattr(api_server, "DB_PATH", db)
 
-    # A row 21 days old whose cache file does NOT exist on disk. remove_old_cached_files_sync
-    # drops it from the surviving list without incrementing files_removed -> files_removed == 0.
+    # A row 21 days old whose cache file does NOT exist on disk. expire_cached_files_sync
+    # purges it without removing a file -> files_removed == 0.
     old_ts = datetime.now().timestamp() - 21 * 24 * 3600
     conn = sqlite3.connect(db)
     conn.execute(
@@ -65,56 +71,41 @@ async def test_expired_row_missing_file_purged_when_no_disk_removal(tmp_path, mo
 async def test_download_new_files_dedups_across_passes(tmp_path, monkeypatch):
     monkeypatch.chdir(tmp_path)
     cache_dir = str(tmp_path / "cache")
-
-    api_server._queued_media.clear()
-    while not api_server.download_queue.empty():
-        api_server.download_queue.get_nowait()
+    db = str(tmp_path / "queue.db")
+    init_db_sync(db)
+    monkeypatch.setattr(api_server, "DB_PATH", db)
 
     media_files = [{"channel": "dupchan", "post_id": 7, "file_unique_id": "dupfid"}]
 
     await api_server.download_new_files(media_files, cache_dir)
     await api_server.download_new_files(media_files, cache_dir)
 
-    assert api_server.download_queue.qsize() == 1
-    assert ("dupchan", 7, "dupfid") in api_server._queued_media
-
-    # Cleanup shared module state.
-    api_server._queued_media.clear()
-    while not api_server.download_queue.empty():
-        api_server.download_queue.get_nowait()
+    queued = get_download_queue_sync(db, 10)
+    assert [(r["channel"], r["post_id"], r["file_unique_id"]) for r in queued] == [("dupchan", 7, "dupfid")]
 
 
 # --------------------------------------------------------------------------- #
-# Задание 14 — the worker frees the dedup slot so the file can be re-enqueued later
+# Задание 14 — the worker takes a processed file off the queue so it can be re-enqueued later
 # --------------------------------------------------------------------------- #
 @pytest.mark.asyncio
-async def test_worker_clears_queued_key_after_processing(monkeypatch):
+async def test_worker_clears_queued_key_after_processing(tmp_path, monkeypatch):
     key = ("wchan", 3, "wfid")
-    api_server._queued_media.clear()
-    api_server._queued_media.add(key)
-    while not api_server.download_queue.empty():
-        api_server.download_queue.get_nowait()
-    api_server.download_queue.put_nowait(("wchan", 3, "wfid"))
+    db = str(tmp_path / "queue.db")
+    init_db_sync(db)
+    monkeypatch.setattr(api_server, "DB_PATH", db)
+    enqueue_downloads_sync(db, [(*key, 1.0, 1.0)], 100)
 
     async def fake_download(channel, post_id, file_unique_id):
         return ("/x", False)
     monkeypatch.setattr(api_server, "download_media_file", fake_download)
 
+    # Break the while-True worker loop after its first batch.
     async def fake_sleep(_delay):
-        return None
-    monkeypatch.setattr(api_server.asyncio, "sleep", fake_sleep)
-
-    # Break the while-True worker loop after it has run its finally exactly once.
-    real_task_done = api_server.download_queue.task_done
-    def stop_task_done():
-        real_task_done()
         raise _StopLoop
-    monkeypatch.setattr(api_server.download_queue, "task_done", stop_task_done)
+    monkeypatch.setattr(api_server.asyncio, "sleep", fake_sleep)
 
     with pytest.raises(_StopLoop):
         await api_server.background_download_worker()
 
-    # Slot freed -> a later sweep may re-enqueue the (still missing) file.
-    assert key not in api_server._queued_media
-
-    api_server._queued_media.clear()
+    # Off the queue -> a later sweep may re-enqueue the (still missing) file.
+    assert get_download_queue_sync(db, 10) == []
@@ -0,0 +1,72 @@
+# flake8: noqa
+# pylint: disable=protected-access, missing-function-docstring, redefined-outer-name, line-too-long
+# pylance: disable=reportMissingImports, reportMissingModuleSource
+"""
+Tests for render-triggered media prefetch.
+
+Media rows upserted after a feed render were only queued for download by the next cache
+sweep (up to cache_sweep_interval later), so a reader opening a fresh post hit a cold
+/media miss for every image. upsert_media_file_ids_bulk_sync now reports the keys it saw
+for the first time and post_parser hands them to api_server, which queues them at once.
+"""
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+from pyrogram.enums import MessageMediaType
+
+import api_server
+import post_parser
+from file_io import get_download_queue_sync, init_db_sync, upsert_media_file_ids_bulk_sync
+
+
+@pytest.fixture
+def db(tmp_path, monkeypatch):
+    path = str(tmp_path / "media.db")
+    init_db_sync(path)
+    monkeypatch.setattr(api_server, "DB_PATH", path)
+    monkeypatch.setattr(post_parser, "DB_PATH", path)
+    return path
+
+
+def _queued(db):
+    return sorted((r["channel"], r["post_id"], r["file_unique_id"]) for r in get_download_queue_sync(db, 100))
+
+
+def test_bulk_upsert_reports_only_new_keys(db):
+    assert upsert_media_file_ids_bulk_sync(db, [("c", 1, "a", 1.0), ("c", 1, "a", 2.0)]) == [("c", 1, "a")]
+    assert upsert_media_file_ids_bulk_sync(db, [("c", 1, "a", 3.0), ("c", 2, "b", 3.0)]) == [("c", 2, "b")]
+
+
+@pytest.mark.asyncio
+async def test_a_render_queues_its_new_media_at_once(db, monkeypatch):
+    monkeypatch.setattr(post_parser, "_new_media_callback", api_server._queue_rendered_media)
+    upsert_media_file_ids_bulk_sync(db, [("chan", 1, "seen", 1.0)])  # rendered before
+    parser = post_parser.PostParser(SimpleNamespace())
+    for post_id, fid in ((1, "seen"), (2, "fresh")):
+        parser._save_media_file_ids(SimpleNamespace(
+            id=post_id, media=MessageMediaType.PHOTO, chat=SimpleNamespace(id=-100, username="Chan", usernames=None),
+            photo=SimpleNamespace(file_unique_id=fid, file_id=None, file_size=10)))
+
+    await parser._flush_pending_media_ids()
+    await asyncio.gather(*api_server._render_queue_tasks)
+
+    assert _queued(db) == [("chan", 2, "fresh")]
+
+
+@pytest.mark.asyncio
+async def test_inflight_and_backed_off_keys_are_skipped(db, monkeypatch):
+    busy, dead, fresh = ("c", 1, "busy"), ("c", 2, "dead"), ("c", 3, "fresh")
+    monkeypatch.setitem(api_server._inflight, busy, asyncio.get_running_loop().create_future())
+    monkeypatch.setattr(api_server, "_download_failures", api_server.OrderedDict())
+    api_server._record_download_failure(dead)
+
+    api_server._queue_rendered_media([busy, dead, fresh])
+    await asyncio.gather(*api_server._render_queue_tasks)
+
+    assert _queued(db) == [fresh]
+
+
+def test_no_running_loop_is_a_noop(db):
+    api_server._queue_rendered_media([("c", 1, "f")])  # must not raise
+    assert _queued(db) == []
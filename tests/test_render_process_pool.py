@@ -0,0 +1,165 @@
+# flake8: noqa
+# pylint: disable=protected-access, missing-function-docstring, redefined-outer-name, line-too-long
+# pylance: disable=reportMissingImports, reportMissingModuleSource
+"""
+Tests for the process-pool render mode (FEED_RENDER_PROCESSES).
+
+_render_pipeline ran in one asyncio.to_thread call, so concurrent feed renders shared a
+single core under the GIL. With FEED_RENDER_PROCESSES a history-cache hit is rendered in
+a worker process instead: the restored messages' snapshot dicts go in, the rendered
+posts plus the media file-id records come back. The golden corpus, replayed as restored
+snapshots through real (forked) workers, must reproduce the goldens byte for byte, and so
+must a channel rendered by workers of the production forkserver context.
+"""
+import multiprocessing
+import multiprocessing.forkserver
+import os
+import textwrap
+
+import pytest
+
+import file_io
+import post_parser
+import rss_generator
+from message_snapshot import restore_messages, snapshot_messages
+from tests import golden_replay as gr
+
+
+@pytest.fixture
+def pool_env(monkeypatch):
+    gr.pin_environment(monkeypatch)
+    # Forked workers inherit the mocked config and the pins above.
+    monkeypatch.setattr(rss_generator, "_RENDER_POOL_START_METHOD", "fork")
+    monkeypatch.setitem(rss_generator.Config, "feed_render_processes", 2)
+    pooled = []
+    original = rss_generator._render_in_pool
+
+    async def spy(pool, messages, *args):
+        pooled.append(len(messages))
+        return await original(pool, messages, *args)
+
+    monkeypatch.setattr(rss_generator, "_render_in_pool", spy)
+    yield monkeypatch, pooled
+    pool = rss_generator._render_pool
+    rss_generator._render_pool = None
+    if pool is not None:
+        pool.shutdown(wait=True)
+
+
+# A forkserver worker is forked from a fresh interpreter, so it cannot inherit the mocked
+# config or the golden pins. The server imports rss_generator from its startup sys.path
+# (the working directory first); this `config` module, placed there, installs both before
+# rss_generator reads its settings.
+_WORKER_CONFIG = textwrap.dedent('''
+    import sys
+
+    import tests.mock_config as mock_config
+
+    sys.modules["config"] = mock_config
+    _get_settings = mock_config.get_settings
+    mock_config.get_settings = lambda: dict(_get_settings(), time_based_merge=True)
+
+    from tests import golden_replay as gr
+    from url_signer import KeyManager
+
+    KeyManager.signing_key = gr.GOLDEN_SIGNING_KEY
+''')
+
+
+@pytest.fixture
+def forkserver_env(monkeypatch, tmp_path):
+    if "forkserver" not in multiprocessing.get_all_start_methods():
+        pytest.skip("no forkserver start method on this platform")
+    (tmp_path / "config.py").write_text(_WORKER_CONFIG)
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setenv("PYTHONPATH", gr.ROOT)
+    gr.pin_environment(monkeypatch)
+    monkeypatch.setattr(rss_generator, "_RENDER_POOL_START_METHOD", "forkserver")
+    monkeypatch.setitem(rss_generator.Config, "feed_render_processes", 1)
+    multiprocessing.forkserver._forkserver._stop()  # started afresh with the path above
+    yield monkeypatch
+    pool = rss_generator._render_pool
+    rss_generator._render_pool = None
+    if pool is not None:
+        pool.shutdown(wait=True)
+    multiprocessing.forkserver._forkserver._stop()
+
+
+def _serve_restored(monkeypatch, channel):
+    """Replay `channel` the way a history-cache hit serves it: restored snapshots."""
+    gr.patch_tg_cache(monkeypatch, channel)
+    messages, _ = gr.load_recorded(channel)
+    restored = restore_messages(snapshot_messages(messages))
+
+    async def fake_get_chat_history(client, channel_id, limit=20):
+        return restored
+
+    monkeypatch.setattr("tg_cache.cached_get_chat_history", fake_get_chat_history)
+
+
+def _read_golden(channel, kind):
+    with open(gr.golden_path(channel, kind), encoding="utf-8") as f:
+        return f.read()
+
+
+@pytest.mark.parametrize("channel", gr.CORPUS_CHANNELS)
+def test_pool_render_reproduces_the_goldens(channel, pool_env):
+    monkeypatch, pooled = pool_env
+    _serve_restored(monkeypatch, channel)
+
+    rss = gr.capture_rss(channel)
+    html = gr.capture_html(channel)
+
+    assert len(pooled) == 2
+    assert gr.normalize_rss(rss) == gr.normalize_rss(_read_golden(channel, "rss"))
+    assert gr.normalize_html(html) == gr.normalize_html(_read_golden(channel, "html"))
+
+
+def test_forkserver_workers_reproduce_the_goldens(forkserver_env):
+    _serve_restored(forkserver_env, "embedoka")
+
+    html = gr.capture_html("embedoka")
+
+    assert rss_generator._render_pool._mp_context.get_start_method() == "forkserver"
+    assert gr.normalize_html(html) == gr.normalize_html(_read_golden("embedoka", "html"))
+
+
+def test_pool_hands_back_the_media_records(pool_env, fake_writes):
+    monkeypatch, pooled = pool_env
+    _serve_restored(monkeypatch, "bladerunnerblues")
+    flushed = []
+    fake_writes(post_parser, {file_io._op_upsert_media_file_ids_bulk: lambda path, entries: flushed.append([e[:3] for e in entries])})
+
+    gr.capture_html("bladerunnerblues")
+    monkeypatch.setitem(rss_generator.Config, "feed_render_processes", 0)
+    gr.capture_html("bladerunnerblues")
+
+    assert len(pooled) == 1
+    assert flushed[0] and flushed[0] == flushed[1]
+
+
+def test_live_messages_render_in_a_thread(pool_env):
+    monkeypatch, pooled = pool_env
+    gr.patch_tg_cache(monkeypatch, "embedoka")  # the recorded live Message objects
+
+    html = gr.capture_html("embedoka")
+
+    assert pooled == [] and rss_generator._render_pool is not None
+    assert html == _read_golden("embedoka", "html")
+
+
+def _die(*args):
+    os._exit(1)
+
+
+def test_broken_pool_falls_back_to_a_thread_and_restarts(pool_env):
+    monkeypatch, _ = pool_env
+    _serve_restored(monkeypatch, "embedoka")
+    monkeypatch.setattr(rss_generator, "_render_snapshots", _die)
+    failed = rss_generator.get_render_failed_count()
+
+    html = gr.capture_html("embedoka")
+
+    assert html == _read_golden("embedoka", "html")
+    assert rss_generator._render_pool is None
+    assert rss_generator.get_render_failed_count() == failed
@@ -0,0 +1,117 @@
+# flake8: noqa
+# pylint: disable=protected-access, missing-function-docstring, redefined-outer-name, line-too-long
+# pylance: disable=reportMissingImports, reportMissingModuleSource
+"""
+Tests for the SQLite writer thread and the persistent read connections in file_io.
+
+Every file_io call used to open a connection, set WAL + busy_timeout, run one statement
+and close. Writes now go to one writer thread per database that coalesces queued
+operations into transactions (each under its own SAVEPOINT) and resolves futures that
+async callers can await; reads reuse a per-thread connection.
+"""
+import asyncio
+import os
+import sqlite3
+import threading
+import time
+
+import pytest
+
+import file_io
+from file_io import (init_db_sync, upsert_media_file_id_sync, upsert_media_file_ids_bulk_sync,
+                     get_all_media_file_ids_sync, set_mime_type_sync, get_mime_type_sync)
+
+
+@pytest.fixture
+def db(tmp_path):
+    path = str(tmp_path / "media.db")
+    init_db_sync(path)
+    return path
+
+
+def test_concurrent_writes_are_coalesced_into_few_transactions(db, monkeypatch):
+    batches = []
+    real_commit = file_io._Writer._commit
+
+    def recording_commit(conn, batch):
+        batches.append(len(batch))
+        real_commit(conn, batch)
+
+    monkeypatch.setattr(file_io._Writer, "_commit", staticmethod(recording_commit))
+    monkeypatch.setattr(file_io, "_WRITE_BATCH_WINDOW", 0.05)
+    threads = [threading.Thread(target=upsert_media_file_id_sync, args=(db, "c", i, f"f{i}", float(i)))
+               for i in range(1, 41)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert len(get_all_media_file_ids_sync(db)) == 40
+    assert sum(batches) == 40 and len(batches) < 40
+
+
+def test_failing_operation_does_not_roll_back_its_batch(db, monkeypatch):
+    monkeypatch.setattr(file_io, "_WRITE_BATCH_WINDOW", 0.05)
+
+    def boom(conn):
+        conn.execute("INSERT INTO media_file_ids (channel, post_id, file_unique_id, added) VALUES ('c', 9, 'bad', 1)")
+        raise ValueError("boom")
+
+    good = file_io.submit_write(db, file_io._op_upsert_media_file_ids_bulk, [("c", 1, "ok", 1.0)])
+    bad = file_io.submit_write(db, boom)
+    with pytest.raises(ValueError):
+        bad.result()
+    good.result()
+    assert [r["file_unique_id"] for r in get_all_media_file_ids_sync(db)] == ["ok"]  # boom's insert rolled back
+
+
+@pytest.mark.asyncio
+async def test_write_async_awaits_the_commit(db):
+    upsert_media_file_id_sync(db, "c", 1, "f", 1.0)
+    await file_io.write_async(file_io._op_set_mime_type, db, "c", 1, "f", "image/png")
+    assert get_mime_type_sync(db, "c", 1, "f") == "image/png"
+
+
+@pytest.mark.asyncio
+async def test_write_async_runs_the_op_on_the_writer_thread(db):
+    seen = []
+    await file_io.write_async(lambda conn, x: seen.append((x, threading.current_thread().name)), db, 7)
+    assert seen == [(7, "sqlite-writer")]
+
+
+def test_reads_reuse_one_connection_per_thread(db, monkeypatch):
+    opened = []
+    real_open = file_io._open_db
+    monkeypatch.setattr(file_io, "_open_db", lambda p: opened.append(p) or real_open(p))
+    for _ in range(5):
+        get_all_media_file_ids_sync(db)
+    assert len(opened) <= 1
+
+
+def test_replaced_database_file_is_not_read_stale(tmp_path):
+    path = str(tmp_path / "media.db")
+    init_db_sync(path)
+    upsert_media_file_id_sync(path, "c", 1, "old", 1.0)
+    assert len(get_all_media_file_ids_sync(path)) == 1
+
+    os.remove(path)
+    for suffix in ("-wal", "-shm"):
+        if os.path.exists(path + suffix):
+            os.remove(path + suffix)
+    init_db_sync(path)
+    upsert_media_file_id_sync(path, "c", 2, "new", 2.0)
+
+    assert [r["file_unique_id"] for r in get_all_media_file_ids_sync(path)] == ["new"]
+
+
+def test_idle_writer_thread_exits_and_restarts(db, monkeypatch):
+    monkeypatch.setattr(file_io, "_WRITER_IDLE_EXIT", 0.05)
+    upsert_media_file_id_sync(db, "c", 1, "f", 1.0)
+    writer = file_io._writers[db]
+    deadline = time.monotonic() + 5
+    while writer.thread is not None and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert writer.thread is None
+
+    upsert_media_file_id_sync(db, "c", 2, "g", 2.0)  # a new thread picks the queue up again
+    assert len(get_all_media_file_ids_sync(db)) == 2
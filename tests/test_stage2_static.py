@@ -25,10 +25,17 @@ from types import SimpleNamespace
 import pytest
 
 import api_server
+from file_io import init_db_sync
 from pyrogram import errors
 from pyrogram.enums import MessageMediaType
 
 
+@pytest.fixture(autouse=True)
+def _tmp_media_cache(tmp_path, monkeypatch):
+    # Downloads now take a lock file inside the post dir; keep them out of ./data/cache.
+    monkeypatch.setattr(api_server, "MEDIA_CACHE_DIR", str(tmp_path / "cache"))
+
+
 def _part_files(dir_path):
     return [p for p in os.listdir(dir_path) if ".part." in p or ".tmp." in p]
 
@@ -436,7 +443,7 @@ async def test_non_temp_file_mtime_not_touched(tmp_path):
 # 2.1/2.4 — Sweeper cleans both `.part.` and legacy `.tmp.` stubs and stale temp_*,
 # but keeps fresh partials and ordinary cached files.
 # --------------------------------------------------------------------------- #
-def test_sweeper_cleans_part_and_tmp_not_fresh(tmp_path):
+def test_sweeper_cleans_part_and_tmp_not_fresh(tmp_path, monkeypatch):
     cache = tmp_path / "cache"
     post = cache / "chan" / "10"
     post.mkdir(parents=True)
@@ -450,7 +457,10 @@ def test_sweeper_cleans_part_and_tmp_not_fresh(tmp_path):
     fresh_part = post / f"file2.part.{hexid}"; fresh_part.write_bytes(b"x")  # fresh mtime
     normal = post / "realfile"; normal.write_bytes(b"x")  # not a temp file at all
 
-    _, removed = api_server.remove_old_cached_files_sync([], str(cache))
+    monkeypatch.setattr(api_server, "DB_PATH", str(tmp_path / "media.db"))
+    init_db_sync(api_server.DB_PATH)
+    api_server.reconcile_cache_index_sync(str(cache))
+    removed, _ = api_server.sweep_indexed_untracked_sync(api_server.DB_PATH, str(cache))
 
     assert not old_part.exists()      # new-suffix stub swept
     assert not old_tmp.exists()       # legacy-suffix stub swept (transition period)
@@ -46,6 +46,7 @@ from fastapi import FastAPI, Request
 from fastapi.testclient import TestClient
 
 import api_server
+import file_io
 
 
 # --------------------------------------------------------------------------- #
@@ -239,7 +240,7 @@ def test_served_file_not_deleted_after_response(tmp_path):
 # --------------------------------------------------------------------------- #
 # 3.1 (stage-2 preserved) — media_key MIME cache is consulted and populated.
 # --------------------------------------------------------------------------- #
-def test_media_key_mime_cache_hit_used(sample_file, monkeypatch):
+def test_media_key_mime_cache_hit_used(sample_file, monkeypatch, fake_writes):
     calls = {"get": 0, "set": 0, "magic": 0}
 
     def fake_get(db, ch, pid, fid):
@@ -254,7 +255,7 @@ def test_media_key_mime_cache_hit_used(sample_file, monkeypatch):
         return "application/octet-stream"
 
     monkeypatch.setattr(api_server, "get_mime_type_sync", fake_get)
-    monkeypatch.setattr(api_server, "set_mime_type_sync", fake_set)
+    fake_writes(api_server, {file_io._op_set_mime_type: fake_set})
     monkeypatch.setattr(api_server.magic_mime, "from_file", fake_magic)
 
     c = _make_client(sample_file, media_key=("chan", 42, "fid"))
@@ -267,7 +268,7 @@ def test_media_key_mime_cache_hit_used(sample_file, monkeypatch):
     assert r.headers["content-type"].startswith("video/mp4")
 
 
-def test_media_key_mime_cache_miss_populates(sample_file, monkeypatch):
+def test_media_key_mime_cache_miss_populates(sample_file, monkeypatch, fake_writes):
     written = {}
 
     def fake_get(db, ch, pid, fid):
@@ -280,7 +281,7 @@ def test_media_key_mime_cache_miss_populates(sample_file, monkeypatch):
         return "image/png"
 
     monkeypatch.setattr(api_server, "get_mime_type_sync", fake_get)
-    monkeypatch.setattr(api_server, "set_mime_type_sync", fake_set)
+    fake_writes(api_server, {file_io._op_set_mime_type: fake_set})
     monkeypatch.setattr(api_server.magic_mime, "from_file", fake_magic)
 
     c = _make_client(sample_file, media_key=("chan", 42, "fid"))
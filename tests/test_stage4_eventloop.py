@@ -27,6 +27,7 @@ import pytest
 
 from pyrogram.enums import MessageMediaType
 
+import file_io
 import post_parser as pp_module
 import rss_generator as rss_module
 from post_parser import PostParser
@@ -167,13 +168,13 @@ def test_render_path_has_no_asyncio_side_effects():
 
 
 @pytest.mark.asyncio
-async def test_media_ids_persisted_via_bulk_upsert(monkeypatch):
+async def test_media_ids_persisted_via_bulk_upsert(monkeypatch, fake_writes):
     calls = []
 
     def fake_bulk(db_path, entries):
         calls.append(list(entries))
 
-    monkeypatch.setattr(pp_module, "upsert_media_file_ids_bulk_sync", fake_bulk)
+    fake_writes(pp_module, {file_io._op_upsert_media_file_ids_bulk: fake_bulk})
 
     async def fake_get_chat(client, channel):
         return SimpleNamespace(title="Test", username="testchan", id=-1001234567890)
@@ -197,11 +198,10 @@ async def test_media_ids_persisted_via_bulk_upsert(monkeypatch):
 
 
 @pytest.mark.asyncio
-async def test_save_media_file_ids_only_appends(monkeypatch):
+async def test_save_media_file_ids_only_appends(monkeypatch, fake_writes):
     # Even with a running loop, _save_media_file_ids must not create tasks — just append.
     parser = PostParser(SimpleNamespace())
-    monkeypatch.setattr(pp_module, "upsert_media_file_ids_bulk_sync",
-                        lambda *a, **k: (_ for _ in ()).throw(AssertionError("must not be called directly")))
+    fake_writes(pp_module, {file_io._op_upsert_media_file_ids_bulk: lambda *a, **k: (_ for _ in ()).throw(AssertionError("must not be called directly"))})
     msg = make_message(3, media=MessageMediaType.PHOTO, photo_uid="uid_x")
     parser._save_media_file_ids(msg)
     assert parser._pending_media_ids == [("testchan", 3, "uid_x", parser._pending_media_ids[0][3])]
@@ -483,7 +483,7 @@ def test_bulk_upsert_media_file_ids_real_sql(tmp_path):
 # flushed (the flush is in a finally). Removing the finally must break this.
 # --------------------------------------------------------------------------- #
 @pytest.mark.asyncio
-async def test_pending_media_flushed_on_render_exception(monkeypatch):
+async def test_pending_media_flushed_on_render_exception(monkeypatch, fake_writes):
     async def fake_get_chat(client, channel):
         return SimpleNamespace(title="Test", username="testchan", id=-1001234567890)
 
@@ -503,9 +503,7 @@ async def test_pending_media_flushed_on_render_exception(monkeypatch):
     flushed = {}
     async def fake_bulk(db, entries):
         flushed["entries"] = list(entries)
-    monkeypatch.setattr("post_parser.upsert_media_file_ids_bulk_sync",
-                        lambda db, entries: flushed.__setitem__("entries", list(entries)),
-                        raising=False)
+    fake_writes(pp_module, {file_io._op_upsert_media_file_ids_bulk: lambda db, entries: flushed.__setitem__("entries", list(entries))})
 
     with pytest.raises(Exception):
         await generate_channel_rss("testchan", client=SimpleNamespace(), limit=5)
@@ -24,6 +24,7 @@ from types import SimpleNamespace
 import pytest
 
 import api_server
+import file_io
 from file_io import init_db_sync, update_media_file_access_bulk_sync
 
 
@@ -44,7 +45,7 @@ def _clean_accumulator():
 # 5.1 hot path: cache hit records into the accumulator, no synchronous SQLite.
 # --------------------------------------------------------------------------- #
 @pytest.mark.asyncio
-async def test_cache_hit_records_accumulator_no_sqlite(tmp_path, monkeypatch):
+async def test_cache_hit_records_accumulator_no_sqlite(tmp_path, monkeypatch, fake_writes):
     monkeypatch.chdir(tmp_path)
     monkeypatch.setattr(api_server, "MEDIA_CACHE_DIR", str(tmp_path / "data" / "cache"))
     channel, post_id, fid = "testchan", 5, "fidHIT"
@@ -58,8 +59,7 @@ async def test_cache_hit_records_accumulator_no_sqlite(tmp_path, monkeypatch):
 
     # Spy: the single-row synchronous updater must NOT be called on the hot path.
     called = []
-    monkeypatch.setattr(api_server, "update_media_file_access_sync",
-                        lambda *a, **k: called.append(a))
+    fake_writes(api_server, {file_io._op_update_media_file_access: lambda *a, **k: called.append(a)})
 
     path = await api_server.download_media_file(channel, post_id, fid)
 
@@ -75,7 +75,7 @@ async def test_cache_hit_records_accumulator_no_sqlite(tmp_path, monkeypatch):
 # so a regression re-introducing a per-hit write into THIS branch goes red.
 # --------------------------------------------------------------------------- #
 @pytest.mark.asyncio
-async def test_get_media_pre_semaphore_cache_hit_no_sqlite(tmp_path, monkeypatch):
+async def test_get_media_pre_semaphore_cache_hit_no_sqlite(tmp_path, monkeypatch, fake_writes):
     monkeypatch.chdir(tmp_path)
     monkeypatch.setattr(api_server, "MEDIA_CACHE_DIR", str(tmp_path / "data" / "cache"))
     channel, post_id, fid = "gmchan", 11, "fidGM"
@@ -93,8 +93,7 @@ async def test_get_media_pre_semaphore_cache_hit_no_sqlite(tmp_path, monkeypatch
 
     # Spy: the single-row synchronous updater must NOT be called on the hot path.
     called = []
-    monkeypatch.setattr(api_server, "update_media_file_access_sync",
-                        lambda *a, **k: called.append(a))
+    fake_writes(api_server, {file_io._op_update_media_file_access: lambda *a, **k: called.append(a)})
 
     resp = await api_server.get_media(channel, post_id, fid, request=object(), digest="x")
 
@@ -161,11 +160,10 @@ async def test_flush_writes_accumulated_timestamps(tmp_path, monkeypatch):
 
 
 @pytest.mark.asyncio
-async def test_flush_empty_is_noop(monkeypatch):
+async def test_flush_empty_is_noop(monkeypatch, fake_writes):
     api_server._access_updates = {}
     # Must not raise and must not touch the threadpool/DB.
-    monkeypatch.setattr(api_server, "update_media_file_access_bulk_sync",
-                        lambda *a, **k: pytest.fail("bulk sync should not run for an empty batch"))
+    fake_writes(api_server, {file_io._op_update_media_file_access_bulk: lambda *a, **k: pytest.fail("bulk sync should not run for an empty batch")})
     await api_server._flush_access_updates()
 
 
@@ -173,7 +171,7 @@ async def test_flush_empty_is_noop(monkeypatch):
 # 5.1 snapshot-then-clear: an update arriving DURING the flush is not lost.
 # --------------------------------------------------------------------------- #
 @pytest.mark.asyncio
-async def test_snapshot_then_clear_does_not_lose_late_update(tmp_path, monkeypatch):
+async def test_snapshot_then_clear_does_not_lose_late_update(tmp_path, monkeypatch, fake_writes):
     db = str(tmp_path / "race.db")
     init_db_sync(db)
     monkeypatch.setattr(api_server, "DB_PATH", db)
@@ -185,7 +183,7 @@ async def test_snapshot_then_clear_does_not_lose_late_update(tmp_path, monkeypat
         # already replaced the module dict with a fresh one, this write goes into the NEW dict.
         api_server._access_updates[late_key] = 999.0
 
-    monkeypatch.setattr(api_server, "update_media_file_access_bulk_sync", fake_bulk)
+    fake_writes(api_server, {file_io._op_update_media_file_access_bulk: fake_bulk})
 
     api_server._access_updates = {("chA", 1, "fA"): 111.0}
     await api_server._flush_access_updates()
@@ -199,7 +197,7 @@ async def test_snapshot_then_clear_does_not_lose_late_update(tmp_path, monkeypat
 # fresher write that arrived during the flush.
 # --------------------------------------------------------------------------- #
 @pytest.mark.asyncio
-async def test_failed_flush_requeues_batch_without_clobbering_fresh(tmp_path, monkeypatch):
+async def test_failed_flush_requeues_batch_without_clobbering_fresh(tmp_path, monkeypatch, fake_writes):
     db = str(tmp_path / "fail.db")
     init_db_sync(db)
     monkeypatch.setattr(api_server, "DB_PATH", db)
@@ -214,7 +212,7 @@ async def test_failed_flush_requeues_batch_without_clobbering_fresh(tmp_path, mo
         api_server._access_updates[fresh_key] = 999.0
         raise sqlite3.OperationalError("database is locked")
 
-    monkeypatch.setattr(api_server, "update_media_file_access_bulk_sync", fake_bulk)
+    fake_writes(api_server, {file_io._op_update_media_file_access_bulk: fake_bulk})
 
     api_server._access_updates = {stale_key: 1.0, fresh_key: 2.0}
     with pytest.raises(sqlite3.OperationalError):
@@ -38,6 +38,7 @@ from fastapi import FastAPI
 from fastapi.testclient import TestClient
 
 import api_server
+import file_io
 from pyrogram import errors
 from file_io import init_db_sync
 
@@ -71,14 +72,14 @@ def _seed_cache(tmp_path, channel, post_id, fid, body=BODY):
 # FileResponse (e.g. re-buffering the body, hand-rolling headers, dropping the media_key
 # path) or that breaks the digest gate wiring — the Range would stop being honored.
 # --------------------------------------------------------------------------- #
-def test_media_route_range_prefix_0_99(monkeypatch, tmp_path):
+def test_media_route_range_prefix_0_99(monkeypatch, tmp_path, fake_writes):
     monkeypatch.chdir(tmp_path)
     monkeypatch.setattr(api_server, "MEDIA_CACHE_DIR", str(tmp_path / "data" / "cache"))
     _seed_cache(tmp_path, "chan", 3, "fidR")
     monkeypatch.setattr(api_server, "verify_media_digest", lambda url, digest: True)
     # Keep the MIME path DB-free; the FileResponse/Range machinery is what we exercise.
     monkeypatch.setattr(api_server, "get_mime_type_sync", lambda *a, **k: None)
-    monkeypatch.setattr(api_server, "set_mime_type_sync", lambda *a, **k: None)
+    fake_writes(api_server, {file_io._op_set_mime_type: lambda *a, **k: None})
 
     c = TestClient(_media_app())
     r = c.get("/media/chan/3/fidR/anydigest", headers={"Range": "bytes=0-99"})
@@ -89,13 +90,13 @@ def test_media_route_range_prefix_0_99(monkeypatch, tmp_path):
     assert r.headers["accept-ranges"] == "bytes"
 
 
-def test_media_route_range_suffix_last_100(monkeypatch, tmp_path):
+def test_media_route_range_suffix_last_100(monkeypatch, tmp_path, fake_writes):
     monkeypatch.chdir(tmp_path)
     monkeypatch.setattr(api_server, "MEDIA_CACHE_DIR", str(tmp_path / "data" / "cache"))
     _seed_cache(tmp_path, "chan", 3, "fidS")
     monkeypatch.setattr(api_server, "verify_media_digest", lambda url, digest: True)
     monkeypatch.setattr(api_server, "get_mime_type_sync", lambda *a, **k: None)
-    monkeypatch.setattr(api_server, "set_mime_type_sync", lambda *a, **k: None)
+    fake_writes(api_server, {file_io._op_set_mime_type: lambda *a, **k: None})
 
     c = TestClient(_media_app())
     r = c.get("/media/chan/3/fidS/anydigest", headers={"Range": "bytes=-100"})
@@ -105,13 +106,13 @@ def test_media_route_range_suffix_last_100(monkeypatch, tmp_path):
     assert r.content == BODY[-100:]
 
 
-def test_media_route_range_unsatisfiable_416(monkeypatch, tmp_path):
+def test_media_route_range_unsatisfiable_416(monkeypatch, tmp_path, fake_writes):
     monkeypatch.chdir(tmp_path)
     monkeypatch.setattr(api_server, "MEDIA_CACHE_DIR", str(tmp_path / "data" / "cache"))
     _seed_cache(tmp_path, "chan", 3, "fidU")
     monkeypatch.setattr(api_server, "verify_media_digest", lambda url, digest: True)
     monkeypatch.setattr(api_server, "get_mime_type_sync", lambda *a, **k: None)
-    monkeypatch.setattr(api_server, "set_mime_type_sync", lambda *a, **k: None)
+    fake_writes(api_server, {file_io._op_set_mime_type: lambda *a, **k: None})
 
     c = TestClient(_media_app())
     r = c.get("/media/chan/3/fidU/anydigest", headers={"Range": "bytes=999999999-"})
@@ -297,14 +298,14 @@ async def test_get_media_request_cancel_does_not_stick_registry_or_hang_sibling(
 # Regression caught: dropping the temp_ fast-path re-couples every large-video re-serve to a
 # Telegram RPC + a scarce download permit.
 # --------------------------------------------------------------------------- #
-async def test_get_media_temp_cached_large_video_served_without_rpc_or_permit(monkeypatch, tmp_path):
+async def test_get_media_temp_cached_large_video_served_without_rpc_or_permit(monkeypatch, tmp_path, fake_writes):
     monkeypatch.chdir(tmp_path)
     monkeypatch.setattr(api_server, "MEDIA_CACHE_DIR", str(tmp_path / "data" / "cache"))
     api_server._inflight.clear()
     monkeypatch.setattr(api_server, "verify_media_digest", lambda url, digest: True)
     # Keep the MIME path DB-free; the fast-path (no RPC/permit) is what we exercise.
     monkeypatch.setattr(api_server, "get_mime_type_sync", lambda *a, **k: None)
-    monkeypatch.setattr(api_server, "set_mime_type_sync", lambda *a, **k: None)
+    fake_writes(api_server, {file_io._op_set_mime_type: lambda *a, **k: None})
 
     channel, post_id, fid = "chan", 11, "bigvid"
     # Seed ONLY the temp_<fid> file; the plain <fid> is absent (as for a large video).
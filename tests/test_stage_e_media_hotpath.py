@@ -8,7 +8,7 @@ Covers:
 - media_cache_path builds EXACTLY the pre-existing on-disk layout (path-format regression).
 - The in-memory _mime_types dict short-circuits the SQLite MIME read on a repeat hit
   (get_mime_type_sync not called a second time; no new SQLite connection opened).
-- _mime_types overflow (>= _MIME_CACHE_MAX) clears the dict without raising and repopulates.
+- _mime_types overflow (> _MIME_CACHE_MAX) evicts only the coldest key, without raising.
 """
 import os
 
@@ -131,9 +131,9 @@ def test_repeat_hit_opens_no_new_db_connection(tmp_path, sample_file, monkeypatc
 
 
 # --------------------------------------------------------------------------- #
-# Task 16 — overflow clears the dict without raising, then repopulates.
+# Task 16 — overflow evicts the least-recently-used key without raising.
 # --------------------------------------------------------------------------- #
-def test_mime_cache_overflow_clears_and_repopulates(sample_file, monkeypatch):
+def test_mime_cache_overflow_evicts_coldest_key(sample_file, monkeypatch):
     def fake_get(db, ch, pid, fid):
         return "text/plain"
 
@@ -149,14 +149,16 @@ def test_mime_cache_overflow_clears_and_repopulates(sample_file, monkeypatch):
     key = ("chanOverflow", 1, "fidOverflow")
     c = _make_client(sample_file, media_key=key)
 
-    r = c.get("/f")  # must clear-all on overflow, then insert the new key — no exception
+    r = c.get("/f")  # must evict the oldest key on overflow, then insert the new one — no exception
     assert r.status_code == 200
     # Issue #55: text/plain is not in the inline allowlist, so the RESPONSE is neutralized
     # to octet-stream — but the INTERNAL MIME cache still stores the sniffed "text/plain"
     # (asserted below), which is the invariant this test guards.
     assert r.headers["content-type"] == "application/octet-stream"
-    # Cleared then repopulated with just the one fresh key.
-    assert len(api_server._mime_types) == 1
+    # Still at the bound: only the coldest dummy entry made room for the fresh key.
+    assert len(api_server._mime_types) == api_server._MIME_CACHE_MAX
+    assert ("dummy", 0, "f") not in api_server._mime_types
+    assert ("dummy", 1, "f") in api_server._mime_types
     assert api_server._mime_types[key] == "text/plain"
 
     # The next request is now a clean dict hit.
@@ -170,7 +172,7 @@ def test_mime_cache_overflow_clears_and_repopulates(sample_file, monkeypatch):
 # The other stage-E tests all make SQLite HIT (get_mime_type_sync returns a value),
 # so the magic branch's dict-write (api_server.py:499) is never exercised there.
 # --------------------------------------------------------------------------- #
-def test_magic_cold_start_writes_through_to_sqlite_and_dict(sample_file, monkeypatch):
+def test_magic_cold_start_writes_through_to_sqlite_and_dict(sample_file, monkeypatch, fake_writes):
     key = ("chanMagic", 7, "fidMagic")
     # Dict must be empty for this key (dict-miss).
     api_server._mime_types.pop(key, None)
@@ -191,7 +193,7 @@ def test_magic_cold_start_writes_through_to_sqlite_and_dict(sample_file, monkeyp
         return "image/jpeg"
 
     monkeypatch.setattr(api_server, "get_mime_type_sync", fake_get)
-    monkeypatch.setattr(api_server, "set_mime_type_sync", fake_set)
+    fake_writes(api_server, {file_io._op_set_mime_type: fake_set})
     monkeypatch.setattr(api_server.magic_mime, "from_file", fake_magic)
 
     c = _make_client(sample_file, media_key=key)
@@ -0,0 +1,107 @@
+# flake8: noqa
+# pylint: disable=protected-access, missing-function-docstring, redefined-outer-name, line-too-long
+# pylance: disable=reportMissingImports, reportMissingModuleSource
+"""
+Tests for the Telegram file reference stored with each media row.
+
+download_media_file used to re-fetch the post with get_messages just to find the file_id
+for a file_unique_id the renderer had already seen. The renderer now records file_id and
+dc_id with the row; a download uses it directly and falls back to the message re-fetch only
+when Telegram reports the reference as expired.
+"""
+from types import SimpleNamespace
+
+import pytest
+from pyrogram import errors
+from pyrogram.enums import MessageMediaType
+
+import api_server
+import file_io
+import post_parser
+from file_io import get_media_dc_ids_sync, get_media_file_ref_sync, init_db_sync, upsert_media_file_ids_bulk_sync
+
+KEY = ("chan", 5, "AgADref")
+
+
+@pytest.fixture
+def db(tmp_path, monkeypatch):
+    path = str(tmp_path / "media.db")
+    init_db_sync(path)
+    monkeypatch.setattr(api_server, "DB_PATH", path)
+    monkeypatch.setattr(api_server, "MEDIA_CACHE_DIR", str(tmp_path / "cache"))
+    return path
+
+
+@pytest.fixture
+def tg(monkeypatch):
+    calls = {"get_messages": 0, "downloads": []}
+    msg = SimpleNamespace(media=MessageMediaType.PHOTO, video=None, empty=False)
+
+    async def fake_get(channel_id, post_id):
+        calls["get_messages"] += 1
+        return msg
+
+    async def fake_find(message, fid):
+        return "fresh-file-id"
+
+    async def fake_dl(file_id, file_name, timeout=None, **kw):
+        calls["downloads"].append(file_id)
+        if file_id == "stale-file-id":
+            raise errors.FileReferenceExpired()
+        with open(file_name, "wb") as f:
+            f.write(b"x" * 10)
+        return file_name
+
+    monkeypatch.setattr(api_server.client, "safe_get_messages", fake_get)
+    monkeypatch.setattr(api_server, "find_file_id_in_message", fake_find)
+    monkeypatch.setattr(api_server.client, "safe_download_media", fake_dl)
+    return calls
+
+
+def test_render_without_a_reference_keeps_the_stored_one(db):
+    upsert_media_file_ids_bulk_sync(db, [(*KEY, 1.0, "file-id", 2)])
+    upsert_media_file_ids_bulk_sync(db, [(*KEY, 2.0)])  # a render from the message cache
+    assert get_media_file_ref_sync(db, *KEY) == "file-id"
+
+
+@pytest.mark.asyncio
+async def test_renderer_records_the_file_reference(monkeypatch, fake_writes):
+    captured = []
+    fake_writes(post_parser, {file_io._op_upsert_media_file_ids_bulk: lambda db, entries: captured.extend(entries)})
+    parser = post_parser.PostParser(SimpleNamespace())
+    msg = SimpleNamespace(id=5, media=MessageMediaType.PHOTO, chat=SimpleNamespace(id=-100, username="Chan", usernames=None),
+                          photo=SimpleNamespace(file_unique_id="AgADref", file_id="live-file-id", file_size=10))
+
+    parser._save_media_file_ids(msg)
+    await parser._flush_pending_media_ids()
+
+    assert len(captured) == 1
+    assert captured[0][:3] == KEY and captured[0][4:] == ("live-file-id", None)
+    assert parser._pending_file_refs == {}
+
+
+@pytest.mark.asyncio
+async def test_stored_reference_skips_get_messages(db, tg):
+    upsert_media_file_ids_bulk_sync(db, [(*KEY, 1.0, "stored-file-id", None)])
+
+    path = await api_server.download_media_file(*KEY)
+
+    assert path == api_server.media_cache_path(*KEY)
+    assert tg["get_messages"] == 0 and tg["downloads"] == ["stored-file-id"]
+
+
+@pytest.mark.asyncio
+async def test_expired_reference_refetches_and_stores_the_fresh_one(db, tg):
+    upsert_media_file_ids_bulk_sync(db, [(*KEY, 1.0, "stale-file-id", None)])
+
+    path = await api_server.download_media_file(*KEY)
+
+    assert path == api_server.media_cache_path(*KEY)
+    assert tg["get_messages"] == 1 and tg["downloads"] == ["stale-file-id", "fresh-file-id"]
+    assert get_media_file_ref_sync(db, *KEY) == "fresh-file-id"
+
+
+def test_stored_reference_dcs_are_listed_for_the_keepalive(db):
+    upsert_media_file_ids_bulk_sync(db, [("chan", 1, "a", 1.0, "id-a", 4), ("chan", 2, "b", 1.0, "id-b", 4),
+                                         ("chan", 3, "c", 1.0, "id-c", 2), ("chan", 4, "d", 1.0)])
+    assert sorted(get_media_dc_ids_sync(db)) == [2, 4]
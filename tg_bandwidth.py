@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# flake8: noqa
+# pylint: disable=missing-function-docstring, missing-class-docstring, line-too-long
+
+"""Token-bucket shaping of media-DC download bandwidth (MEDIA_BANDWIDTH_KBPS).
+
+The configured rate is split into two buckets: an interactive reserve (a reader waiting on
+/media) and the background share (cache fill). A download pays for every chunk after it
+arrived, so the next chunk is requested only once its class's bucket is out of debt.
+Background downloads may borrow the interactive reserve while no interactive download is
+streaming; interactive downloads may spend whatever the background bucket holds. The
+moment a reader's download starts, background borrowing stops at its next chunk, so a
+cache fill can never eat the capacity a reader needs.
+
+A download's class is a mutable DownloadPriority bound to its task through
+`current_priority` (default: interactive), so a reader joining a background download that
+is already in flight promotes it in place. Single event loop; no locks needed.
+"""
+
+import asyncio
+import contextvars
+import time
+from contextlib import contextmanager
+
+# Upper bound on one sleep while waiting for tokens, so a waiter notices a class change
+# (a background download promoted, the last interactive stream ending) promptly.
+_MAX_WAIT = 0.25
+
+
+class DownloadPriority:
+    __slots__ = ("interactive",)
+
+    def __init__(self, interactive: bool = True):
+        self.interactive = interactive
+
+
+current_priority: "contextvars.ContextVar[DownloadPriority | None]" = contextvars.ContextVar("current_priority", default=None)
+
+
+class _TokenBucket:
+    """`rate` bytes/s, holding at most one second's worth; may go negative (debt)."""
+
+    def __init__(self, rate: float):
+        self.rate = rate
+        self.tokens = rate
+        self._stamp = time.monotonic()
+
+    def refill(self, now: float) -> None:
+        self.tokens = min(self.rate, self.tokens + (now - self._stamp) * self.rate)
+        self._stamp = now
+
+    def time_to_clear(self) -> float:
+        """Seconds until the bucket is out of debt (inf for a zero-rate bucket in debt)."""
+        if self.tokens >= 0:
+            return 0.0
+        return -self.tokens / self.rate if self.rate > 0 else float("inf")
+
+
+class BandwidthShaper:
+    def __init__(self, rate: int, interactive_pct: int):
+        """`rate` in bytes/s (0 disables shaping); `interactive_pct` of it is reserved for readers."""
+        self.enabled = rate > 0
+        self._interactive = _TokenBucket(rate * interactive_pct / 100)
+        self._background = _TokenBucket(rate - self._interactive.rate)
+        self._streams: set[DownloadPriority] = set()
+        # Cumulative counters for /health.
+        self.waited_seconds = {"interactive": 0.0, "background": 0.0}
+        self.borrowed_bytes = 0
+
+    def _interactive_streaming(self) -> bool:
+        return any(p.interactive for p in self._streams)
+
+    @contextmanager
+    def stream(self, priority: "DownloadPriority | None" = None):
+        """Register a running download so background borrowing can see interactive demand."""
+        priority = priority or current_priority.get() or DownloadPriority()
+        self._streams.add(priority)
+        try:
+            yield priority
+        finally:
+            self._streams.discard(priority)
+
+    def _try_take(self, nbytes: int, priority: DownloadPriority) -> bool:
+        now = time.monotonic()
+        self._interactive.refill(now)
+        self._background.refill(now)
+        if priority.interactive:
+            for bucket in (self._interactive, self._background):
+                if bucket.tokens >= 0:
+                    bucket.tokens -= nbytes
+                    return True
+            return False
+        if self._background.tokens >= 0:
+            self._background.tokens -= nbytes
+            return True
+        if self._interactive.tokens >= 0 and not self._interactive_streaming():
+            self._interactive.tokens -= nbytes
+            self.borrowed_bytes += nbytes
+            return True
+        return False
+
+    async def consume(self, nbytes: int, priority: "DownloadPriority | None" = None) -> None:
+        """Pay for `nbytes` just received, waiting until the caller's class may spend."""
+        if not self.enabled:
+            return
+        priority = priority or current_priority.get() or DownloadPriority()
+        started = None
+        while not self._try_take(nbytes, priority):
+            if started is None:
+                started = time.monotonic()
+            usable = [self._background]
+            if priority.interactive or not self._interactive_streaming():
+                usable.append(self._interactive)
+            wait = min(bucket.time_to_clear() for bucket in usable)
+            await asyncio.sleep(min(max(wait, 0.001), _MAX_WAIT))
+        if started is not None:
+            self.waited_seconds["interactive" if priority.interactive else "background"] += time.monotonic() - started
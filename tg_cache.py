@@ -68,13 +68,16 @@ def _cache_file_path(key: Union[str, int], suffix: str) -> str:
 # --------------------------------------------------------------------------- #
 # Generic JSON entry store.
 # --------------------------------------------------------------------------- #
-def _store_entry(path: str, payload: dict) -> None:
+def _store_entry(path: str, payload: dict) -> tuple[dict, os.stat_result]:
     """Atomically write {version, timestamp, jitter, **payload} as JSON to ``path``.
 
     The document is written to a unique '<path>.tmp.<uuid4>' and os.replace()d into place
     so a concurrent reader never observes a half-written file. The unique per-writer tmp
     name means two concurrent writers to the same path do not clobber each other's temp
     file. This writer's own tmp file is always removed in the finally block.
+
+    Returns the written entry and the stat of the file as published (taken before the
+    rename, so it describes this writer's file even if another one replaces it next).
     """
     tmp_path = f"{path}.tmp.{uuid.uuid4().hex}"
     entry = {
@@ -88,7 +91,9 @@ def _store_entry(path: str, payload: dict) -> None:
     try:
         with open(tmp_path, 'w', encoding='utf-8') as f:
             json.dump(entry, f)
+        st = os.stat(tmp_path)
         os.replace(tmp_path, path)
+        return entry, st
     finally:
         # Remove our own leftover tmp file if os.replace didn't consume it (e.g. it raised
         # or json.dump failed). Never touches another writer's uniquely-named tmp file.
@@ -132,18 +137,66 @@ def _load_entry(path: str, max_age_hours: float) -> Optional[dict]:
 # --------------------------------------------------------------------------- #
 # History cache.
 # --------------------------------------------------------------------------- #
+HISTORY_CACHE_TTL_HOURS = 8
+
+# What this process knows about each history file, by path:
+# (st_mtime_ns, st_size) -> (timestamp, jitter, cached_limit, message_count). Recorded on
+# every save and load, so history_snapshot_token can tell with one stat whether a request
+# would be served from the snapshot, and from which one, without parsing the file.
+_history_meta: dict[str, tuple[tuple[int, int], tuple[float, float, int, int]]] = {}
+
+
+def _remember_history_meta(path: str, st: os.stat_result, entry: dict) -> None:
+    _history_meta[path] = (
+        (st.st_mtime_ns, st.st_size),
+        (entry['timestamp'], entry.get('jitter', 1.0), entry.get('limit', 0), len(entry.get('messages') or ())),
+    )
+
+
+def _serves_limit(cached_limit: int, message_count: int, limit: int) -> bool:
+    """A snapshot serves `limit` if fetched with an equal-or-larger limit or the channel is exhausted."""
+    return cached_limit >= limit or message_count < cached_limit
+
+
+def history_snapshot_token(channel_id: Union[str, int], limit: int,
+                           max_age_hours: float = HISTORY_CACHE_TTL_HOURS) -> Optional[tuple]:
+    """Identity of the snapshot cached_get_chat_history would serve for (channel, limit).
+
+    None when the request would not be a fresh cache hit, or when this process has not
+    read or written the current file yet. Equal tokens mean the same snapshot file, so
+    anything derived from it is still valid. Costs one stat; safe on the event loop.
+    """
+    path = os.path.join(CACHE_DIR, f"{_safe_key(canonical_channel_key(channel_id))}.history.json")
+    known = _history_meta.get(path)
+    if known is None:
+        return None
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    identity, (timestamp, jitter, cached_limit, message_count) = known
+    if identity != (st.st_mtime_ns, st.st_size):
+        return None
+    if time.time() - timestamp > max_age_hours * 3600 * jitter:
+        return None
+    if not _serves_limit(cached_limit, message_count, limit):
+        return None
+    return (path,) + identity
+
+
 def _save_history_to_cache(channel_id: Union[str, int], messages: List[Message], limit: int) -> None:
     """Save message history (as JSON snapshots) to cache. Stores the fetch limit, not len()."""
     try:
         cache_file = _cache_file_path(channel_id, 'history.json')
         payload = {'limit': limit, 'messages': snapshot_messages(messages)}
-        _store_entry(cache_file, payload)
+        entry, st = _store_entry(cache_file, payload)
+        _remember_history_meta(cache_file, st, entry)
         logger.info(f"history_cache_saved: channel {channel_id}, limit {limit}, messages {len(messages)}, file {cache_file}")
     except Exception as e:
         logger.error(f"history_cache_save_error: channel {channel_id}, limit {limit}, error {str(e)}")
 
 
-def _get_history_from_cache(channel_id: Union[str, int], limit: int, max_age_hours: int = 8) -> Optional[List[Message]]:
+def _get_history_from_cache(channel_id: Union[str, int], limit: int, max_age_hours: int = HISTORY_CACHE_TTL_HOURS) -> Optional[List[Message]]:
     """
     Retrieve message history from cache if fresh and the cached fetch covers ``limit``.
 
@@ -154,16 +207,23 @@ def _get_history_from_cache(channel_id: Union[str, int], limit: int, max_age_hou
     """
     try:
         cache_file = _cache_file_path(channel_id, 'history.json')
+        try:
+            st_before = os.stat(cache_file)
+        except OSError:
+            st_before = None
         payload = _load_entry(cache_file, max_age_hours)
         if payload is None:
             logger.info(f"history_cache_miss: channel {channel_id}, limit {limit}")
             return None
+        st_after = os.stat(cache_file)
+        if st_before is not None and (st_before.st_mtime_ns, st_before.st_size) == (st_after.st_mtime_ns, st_after.st_size):
+            _remember_history_meta(cache_file, st_after, payload)  # not replaced while we read it
 
         cached_limit = payload.get('limit', 0)
         raw_messages = payload['messages']
         # Serve when fetched with an equal-or-larger limit, OR when the channel is exhausted
         # (fewer messages exist than asked -> cache holds entire recent history).
-        if cached_limit < limit and len(raw_messages) >= cached_limit:
+        if not _serves_limit(cached_limit, len(raw_messages), limit):
             logger.info(f"history_cache_limit_short: channel {channel_id}, cached limit {cached_limit}, requested {limit}")
             return None
 
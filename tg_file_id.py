@@ -0,0 +1,24 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# flake8: noqa
+# pylint: disable=missing-function-docstring
+
+"""Local decoding of Telegram file_ids.
+
+Kept apart from telegram_client so the renderer (post_parser, also imported by every
+render worker process) can read a file_id without importing the client module and its
+Pyrogram client / event-loop policy setup. pyrogram.file_id is a pure codec.
+"""
+
+from typing import Optional
+
+from pyrogram.file_id import FileId
+
+
+def file_dc_id(file_id: str) -> Optional[int]:
+    """DC id encoded in a file_id (decoded locally, no RPC); None if undecodable."""
+    try:
+        return FileId.decode(file_id).dc_id
+    except Exception:
+        return None